@@ -176,14 +176,33 @@ class GalvoWidget(QWidget):
         points_per_contour = int(self.points_per_contour_textbox.text())
         sampling_rate = int(self.sampling_rate_textbox.text())
 
-        contourScanningSignal = ProcessImage.mask_to_contourScanning_DAQsignals(
-            filled_mask,
-            OriginalImage,
-            scanning_voltage,
-            points_per_contour,
-            sampling_rate,
-            repeats=1,
-        )
+        if len(list_of_rois) > 1:
+            # All cells in one waveform, the galvos go from cell to cell.
+            filled_masks = [
+                polygon2mask((1000, 1000), (roi + 5) * 100).astype(int).transpose()
+                for roi in list_of_rois
+            ]
+            (
+                contourScanningSignal,
+                self.contour_schedule,
+            ) = ProcessImage.masks_to_scheduled_contourScanning_DAQsignals(
+                filled_masks,
+                np.zeros((1000, 1000)),
+                scanning_voltage,
+                sampling_rate,
+                repeats=1,
+            )
+            # One read for each round over all the cells.
+            points_per_contour = self.contour_schedule.round_sample_number
+        else:
+            contourScanningSignal = ProcessImage.mask_to_contourScanning_DAQsignals(
+                filled_mask,
+                OriginalImage,
+                scanning_voltage,
+                points_per_contour,
+                sampling_rate,
+                repeats=1,
+            )
 
         contourScanningSignal = np.vstack(
             (contourScanningSignal[0][0], contourScanningSignal[1][0])
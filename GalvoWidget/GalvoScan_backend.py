@@ -5,16 +5,11 @@ Created on Wed Aug 19 11:35:22 2020
 @author: xinmeng
 """
 
-import nidaqmx
-from nidaqmx.stream_readers import AnalogMultiChannelReader
-from nidaqmx.stream_writers import AnalogSingleChannelWriter
-from nidaqmx.constants import AcquisitionType, TaskMode
-from nidaqmx.stream_writers import AnalogMultiChannelWriter, DigitalMultiChannelWriter
-from nidaqmx.stream_readers import AnalogSingleChannelReader
 from PyQt5.QtCore import pyqtSignal, QThread
 import skimage.external.tifffile as skimtiff
 import time
 import os
+import threading
 import matplotlib.pyplot as plt
 
 # Ensure that the Widget can be run either independently or as part of Tupolev.
@@ -24,9 +19,26 @@ if __name__ == "__main__":
     os.chdir(dname + "/../")
 
 import numpy as np
-import NIDAQ.wavegenerator
+from concurrent.futures import CancelledError
+from NIDAQ.daqbackend import (
+    nidaqmx,
+    AcquisitionType,
+    TaskMode,
+    AnalogMultiChannelReader,
+    AnalogSingleChannelReader,
+    AnalogSingleChannelWriter,
+    AnalogMultiChannelWriter,
+    DigitalMultiChannelWriter,
+)
+from NIDAQ.DAQoperator import DAQmission
 from NIDAQ.wavegenerator import blockWave
-from NIDAQ.constants import MeasurementConstants
+from NIDAQ.rastercache import default_raster_cache
+from NIDAQ.rasterreconstruction import RasterReconstruction
+from GalvoWidget.galvolag import default_galvo_lag
+from GalvoWidget.sparseraster import SparseRaster, SparseReconstruction
+from GalvoWidget.zstackwaveform import ZStackWaveforms
+from NIDAQ.staticoutput import default_static_output
+from NIDAQ.constants import MeasurementConstants, NiDaqChannels
 
 from PI_ObjectiveMotor.focuser import PIMotor
 
@@ -40,6 +52,11 @@ class RasterScan:
         average_number=1,
         continuous=False,
         return_image=True,
+        bidirectional=False,
+        phase_offset=None,
+        bounding_boxes=None,
+        adaptive_averaging=None,
+        pmt_channels=None,
     ):
         """
         Object to run raster PMT scanning.
@@ -58,6 +75,26 @@ class RasterScan:
             Whether to do continuous scanning or not. The default is False.
         return_image : TYPE, optional
             Whether return the processed image. The default is True.
+        bidirectional : bool, optional
+            Scan the odd lines backwards with a triangle wave instead of
+            flying back. The default is False.
+        phase_offset : int, optional
+            Bidirectional only, number of samples the PMT signal lags behind
+            the galvo command. The default is None, from the galvo lag
+            calibration.
+        bounding_boxes : list of tuple, optional
+            (minr, minc, maxr, maxc) of the cells in pixels of the image, like
+            region.bbox of regionprops or the MaskRCNN rois. Only the parts of
+            the lines covering them are scanned, the rest of the image is 0,
+            see GalvoWidget.sparseraster. The default is None, the full field.
+        adaptive_averaging : AdaptiveAverager, optional
+            Average frames until its SNR or focus criterion is met instead of
+            average_number frames, see GalvoWidget.adaptiveaveraging. The
+            default is None, average_number frames.
+        pmt_channels : list of str, optional
+            Read-in channels of NiDaqChannels recorded at the same time, like
+            ["PMT", "PMT2"]. With more than one the image is (channels,
+            pixels, pixels). The default is None, ["PMT"].
 
         Returns
         -------
@@ -72,9 +109,46 @@ class RasterScan:
         self.pixel_number = pixel_number
         self.flag_continuous = continuous
         self.flag_return_image = return_image
+        self.bidirectional = bidirectional
+        self.adaptive_averaging = adaptive_averaging
+        if pmt_channels is None:
+            pmt_channels = ["PMT"]
+        self.pmt_channels = list(pmt_channels)
+        if self.adaptive_averaging is not None:
+            # One frame per read, the averager adds them up.
+            self.averagenum = 1
+
+        if bounding_boxes is not None:
+            if self.bidirectional == True:
+                raise ValueError("Sparse raster scans are unidirectional.")
+            # Only the lines and segments covering the cells, the pixels are
+            # read after the calibrated galvo lag.
+            self.raster = SparseRaster(
+                self.Daq_sample_rate,
+                self.edge_volt,
+                self.pixel_number,
+                bounding_boxes,
+                lag=default_galvo_lag.lag_samples(
+                    self.Daq_sample_rate, self.pixel_number, 2 * self.edge_volt
+                ),
+            )
+            print(
+                "Sparse raster: {:.1f}% of the pixels, {} samples per frame".format(
+                    100 * self.raster.coverage, self.raster.frame_sample_number
+                )
+            )
+            self.samples_X = self.raster.samples_X
+            self.samples_Y = self.raster.samples_Y
+            self.Totalscansamples = self.raster.frame_sample_number * self.averagenum
+            self.Galvo_samples = self.raster.galvo_samples(self.averagenum)
+            self.reconstruction = SparseReconstruction(
+                self.raster, self.averagenum, polarity=-1
+            )
+            return
 
-        # Generate galvo samples
-        self.samples_X, self.samples_Y = NIDAQ.wavegenerator.waveRecPic(
+        # Generate galvo samples, or get them from the cache if the same raster
+        # was made before.
+        self.raster = default_raster_cache.get(
             sampleRate=self.Daq_sample_rate,
             imAngle=0,
             voltXMin=-1 * self.edge_volt,
@@ -83,33 +157,63 @@ class RasterScan:
             voltYMax=self.edge_volt,
             xPixels=self.pixel_number,
             yPixels=self.pixel_number,
-            sawtooth=True,
+            sawtooth=not self.bidirectional,
         )
+        self.samples_X = self.raster.samples_X
+        self.samples_Y = self.raster.samples_Y
         # Calculate number of all samples to feed to daq.
         self.Totalscansamples = len(self.samples_X) * self.averagenum
         # Number of samples of each individual line of x scanning, including fly backs.
         # Devided by pixel number as it's repeated for each y line.
-        self.total_X_sample_number = int(len(self.samples_X) / self.pixel_number)
-
-        self.repeated_samples_X = np.tile(self.samples_X, self.averagenum)
-        self.repeated_samples_Y = np.tile(self.samples_Y, self.averagenum)
-
-        self.Galvo_samples = np.vstack(
-            (self.repeated_samples_X, self.repeated_samples_Y)
-        )
+        self.total_X_sample_number = self.raster.line_sample_number
+
+        self.Galvo_samples = self.raster.galvo_samples(self.averagenum)
+        if self.bidirectional == True:
+            # Only the linear part of the lines is read, no fly back to cut off.
+            if phase_offset is None:
+                phase_offset = default_galvo_lag.phase_offset(
+                    self.Daq_sample_rate,
+                    self.pixel_number,
+                    2 * self.edge_volt,
+                    self.total_X_sample_number,
+                )
+            self.reconstruction = RasterReconstruction.from_raster(
+                self.raster,
+                self.averagenum,
+                polarity=-1,
+                bidirectional=True,
+                phase_offset=phase_offset,
+            )
+        else:
+            # Cut off the flying back part, after the calibrated galvo lag.
+            self.reconstruction = RasterReconstruction.from_raster(
+                self.raster,
+                self.averagenum,
+                x_slice=default_galvo_lag.crop(
+                    self.Daq_sample_rate,
+                    self.pixel_number,
+                    2 * self.edge_volt,
+                    self.total_X_sample_number,
+                ),
+                polarity=-1,
+            )
 
     def run(self):
         """
         Starts writing a waveform continuously while reading
         the buffer periodically
         """
+        # Free the galvo channels if they are held open by single value writes.
+        default_static_output.release("/Dev1/ao0:1")
 
         with nidaqmx.Task() as slave_Task, nidaqmx.Task() as master_Task:
 
             slave_Task.ao_channels.add_ao_voltage_chan("/Dev1/ao0:1")
-            master_Task.ai_channels.add_ai_voltage_chan("/Dev1/ai0")
+            channel_LUT = NiDaqChannels().look_up_table
+            for channel in self.pmt_channels:
+                master_Task.ai_channels.add_ai_voltage_chan(channel_LUT[channel])
 
-            if self.flag_continuous == False:
+            if self.flag_continuous == False and self.adaptive_averaging is None:
                 # Timing of analog output channels
                 slave_Task.timing.cfg_samp_clk_timing(
                     rate=self.Daq_sample_rate,
@@ -139,7 +243,16 @@ class RasterScan:
                     samps_per_chan=self.Totalscansamples,
                 )
 
-            reader = AnalogSingleChannelReader(master_Task.in_stream)
+            if len(self.pmt_channels) == 1:
+                reader = AnalogSingleChannelReader(master_Task.in_stream)
+                output = np.zeros(self.Totalscansamples)
+                channel_number = None
+            else:
+                # All PMTs in one (channels, samples) array, reconstructed
+                # together.
+                reader = AnalogMultiChannelReader(master_Task.in_stream)
+                output = np.zeros((len(self.pmt_channels), self.Totalscansamples))
+                channel_number = len(self.pmt_channels)
             writer = AnalogMultiChannelWriter(slave_Task.out_stream)
 
             reader.auto_start = False
@@ -152,34 +265,40 @@ class RasterScan:
             This way the task will have to wait slightly longer for incoming samples. And leaves the buffer
             entirely clean. This way we always know the correct numpy size and are always left with an empty
             buffer (and the buffer will not slowly fill up)."""
-            output = np.zeros(self.Totalscansamples)
             slave_Task.start()  # Will wait for the readtask to start so it can use its clock
             master_Task.start()
 
+            if self.adaptive_averaging is not None:
+                # Frame by frame until the averager has enough.
+                frame = np.zeros(
+                    self.reconstruction.image_shape(channel_number=channel_number)
+                )
+                self.adaptive_averaging.start(frame.shape)
+                done = False
+                while done == False:
+                    reader.read_many_sample(
+                        data=output,
+                        number_of_samples_per_channel=self.Totalscansamples,
+                    )
+                    self.reconstruction.reconstruct_image(output, out=frame)
+                    done = self.adaptive_averaging.add(frame)
+                print("Raster scan: " + self.adaptive_averaging.summary())
+
+                if self.flag_return_image == True:
+                    self.image_PMT = self.data_PMT = self.adaptive_averaging.mean.copy()
+                    return self.image_PMT
+                return
+
             # while not self.isInterruptionRequested():
             reader.read_many_sample(
                 data=output, number_of_samples_per_channel=self.Totalscansamples
             )
 
-            Dataholder_average = np.mean(output.reshape(self.averagenum, -1), axis=0)
-
             if self.flag_return_image == True:
                 # Calculate the mean of average frames.
-                self.data_PMT = np.reshape(
-                    Dataholder_average, (self.pixel_number, self.total_X_sample_number)
-                )
-
-                # Cut off the flying back part.
-                if self.Daq_sample_rate == 500000:
-                    if self.pixel_number == 500:
-                        self.image_PMT = self.data_PMT[:, 50:550] * -1
-                    elif self.pixel_number == 256:
-                        self.image_PMT = self.data_PMT[:, 70:326] * -1
-                elif self.Daq_sample_rate == 250000:
-                    if self.pixel_number == 500:
-                        self.image_PMT = self.data_PMT[:, 25:525] * -1
-                    elif self.pixel_number == 256:
-                        self.image_PMT = self.data_PMT[:, 25:525] * -1
+                # The fly back is cut off in the reconstruction.
+                self.data_PMT = self.reconstruction.reconstruct_image(output)
+                self.image_PMT = self.data_PMT
 
                 return self.image_PMT
 
@@ -198,6 +317,9 @@ class PMT_zscan:
         },
         motor_handle=None,
         twophoton_handle=None,
+        hardware_timed=None,
+        settle_time=0.01,
+        pmt_channels=None,
         *args,
         **kwargs
     ):
@@ -219,6 +341,17 @@ class PMT_zscan:
             Handle to use objective motor. The default is None.
         twophoton_handle : TYPE, optional
             Handle to control two-photon laser. The default is None.
+        hardware_timed : str, optional
+            "staircase", "ramp" or "trigger", take the whole stack in one DAQ
+            run with the objective moved by the DAQ, see
+            GalvoWidget.zstackwaveform. The default is None, plane by plane
+            with the objective motor.
+        settle_time : float, optional
+            Seconds the objective gets before each plane when hardware timed.
+            The default is 0.01.
+        pmt_channels : list of str, optional
+            PMT read-in channels, the images of all of them are saved in one
+            file for each plane. The default is None, only "PMT".
         *args : TYPE
             DESCRIPTION.
         **kwargs : TYPE
@@ -232,6 +365,11 @@ class PMT_zscan:
 
         self.scanning_flag = True
         self.saving_dir = saving_dir
+        self.hardware_timed = hardware_timed
+        self.stack_mission = None
+        # Abort event of the hardware timed run, a stop before it starts
+        # still stops it.
+        self.stack_abort_event = threading.Event()
 
         if motor_handle == None:
             # Connect the objective if the handle is not provided.
@@ -265,23 +403,45 @@ class PMT_zscan:
             imaging_conditions["edge_volt"],
             imaging_conditions["pixel_number"],
             imaging_conditions["average_number"],
+            pmt_channels=pmt_channels,
         )
 
+        if self.hardware_timed is not None:
+            self.stack_waveforms = ZStackWaveforms(
+                self.RasterScanins.raster,
+                imaging_conditions["Daq_sample_rate"],
+                self.z_stack_positions,
+                imaging_conditions["average_number"],
+                mode=self.hardware_timed,
+                settle_time=settle_time,
+            )
+            print(
+                "Hardware timed z-stack, {} planes in {:.2f} s.".format(
+                    self.stack_waveforms.plane_number, self.stack_waveforms.duration
+                )
+            )
+
     def start_scan(self):
 
-        for self.each_pos_index in range(len(self.z_stack_positions)):
-            if self.scanning_flag == True:
-                # Go through each position and get image.
-                self.make_PMT_iamge(
-                    round(self.z_stack_positions[self.each_pos_index], 6)
-                )
-            else:
-                break
-            
+        if self.hardware_timed is not None:
+            self.make_PMT_stack()
+        else:
+            for self.each_pos_index in range(len(self.z_stack_positions)):
+                if self.scanning_flag == True:
+                    # Go through each position and get image.
+                    self.make_PMT_iamge(
+                        round(self.z_stack_positions[self.each_pos_index], 6)
+                    )
+                else:
+                    break
+
         self.pi_device_instance.CloseMotorConnection()
 
     def stop_scan(self):
         self.scanning_flag = False
+        self.stack_abort_event.set()
+        if self.stack_mission is not None:
+            self.stack_mission.abort()
 
     def make_PMT_iamge(self, obj_position=None):
         """
@@ -312,6 +472,69 @@ class PMT_zscan:
                 tif.save(self.galvo_image.astype("float32"), compress=0)
         time.sleep(0.5)
 
+    def make_PMT_stack(self):
+        """
+        Take all planes in one DAQ run, the objective moved by the DAQ, and
+        save them like make_PMT_iamge.
+        """
+        if self.hardware_timed == "trigger":
+            # The drive steps on from the first plane with each trigger.
+            self.pi_device_instance.move(round(self.z_stack_positions[0], 6))
+
+        self.stack_mission = DAQmission()
+        if self.scanning_flag == False:
+            print("Z-stack stopped.")
+            return
+        pmt_channels = self.RasterScanins.pmt_channels
+        try:
+            self.stack_mission.runWaveforms(
+                clock_source="DAQ",
+                sampling_rate=self.RasterScanins.Daq_sample_rate,
+                analog_signals=self.stack_waveforms.analog_signals(),
+                digital_signals=self.stack_waveforms.digital_signals(),
+                readin_channels=pmt_channels,
+                abort_event=self.stack_abort_event,
+            )
+        except CancelledError:
+            print("Z-stack stopped.")
+            return
+
+        # Rows of the PMTs, the channels are recorded in the order of
+        # NiDaqChannels.
+        recorded_channel_names = self.stack_mission.recording_channel_names()
+        recording = self.stack_mission.get_scaled_data()
+        if len(pmt_channels) == 1:
+            pmt_data = recording[0]
+        else:
+            pmt_data = np.stack(
+                [recording[recorded_channel_names.index(channel)] for channel in pmt_channels]
+            )
+
+        # Split the recording into the planes, the fly back cut off like in
+        # RasterScan. (planes, yPixels, xPixels), with the PMTs in front for
+        # several PMTs.
+        self.galvo_images = self.stack_waveforms.reconstruction(
+            x_slice=self.RasterScanins.reconstruction.x_slice, polarity=-1
+        ).reconstruct(pmt_data)
+        if len(pmt_channels) != 1:
+            # (planes, PMTs, yPixels, xPixels), one image of RasterScan each.
+            self.galvo_images = np.moveaxis(self.galvo_images, 0, 1)
+
+        for self.each_pos_index, obj_position in enumerate(self.z_stack_positions):
+            meta_infor = (
+                "index_"
+                + str(self.each_pos_index)
+                + "_pos_"
+                + str(round(obj_position, 6))
+            )
+            with skimtiff.TiffWriter(
+                os.path.join(self.saving_dir, meta_infor + ".tif")
+            ) as tif:
+                tif.save(
+                    self.galvo_images[self.each_pos_index].astype("float32"),
+                    compress=0,
+                )
+
 
 if __name__ == "__main__":
     import matplotlib.pyplot as plt
@@ -51,6 +51,8 @@ from GeneralUsage.ThreadingFunc import run_in_thread
 from NIDAQ.constants import HardwareConstants
 from GalvoWidget.pmt_thread import pmtimagingTest, pmtimagingTest_contour
 from GalvoWidget.GalvoScan_backend import PMT_zscan
+from GalvoWidget.contourtrajectory import plan_contour_trajectory
+from GalvoWidget.adaptiveaveraging import AdaptiveAverager
 from NIDAQ.DAQoperator import DAQmission
 import StylishQT
 
@@ -153,9 +155,10 @@ class PMTWidgetUI(QWidget):
         self.pmtContourLayout.addWidget(self.pmt_handlenum_Label, 1, 0)
 
         self.contour_strategy = QComboBox()
-        self.contour_strategy.addItems(["Evenly between", "Uniform"])
+        self.contour_strategy.addItems(["Evenly between", "Uniform", "Time optimal"])
         self.contour_strategy.setToolTip(
-            "Even in-between: points evenly distribute inbetween handles; Uniform: evenly distribute regardless of handles"
+            "Even in-between: points evenly distribute inbetween handles; Uniform: evenly distribute regardless of handles; "
+            "Time optimal: as fast as the galvos can follow, the number of points follows from the sampling rate"
             )
         self.pmtContourLayout.addWidget(self.contour_strategy, 1, 1)
 
@@ -255,7 +258,7 @@ Left drag + Shift + Ctrl scales the ROI with size snapping")
         # controlContainer.setFixedWidth(280)
         self.scanning_tabs = QTabWidget()
         self.scanning_tabs.setFixedWidth(280)
-        self.scanning_tabs.setFixedHeight(320)
+        self.scanning_tabs.setFixedHeight(350)
         
         # ---------------------------- Continuous scanning -----------------------------------
         Continuous_widget = QWidget()
@@ -321,12 +324,61 @@ Left drag + Shift + Ctrl scales the ROI with size snapping")
         controlLayout.addWidget(self.continuous_scanning_average_spinbox, 4, 1)
         controlLayout.addWidget(QLabel("average over:"), 4, 0)
 
+        self.continuous_scanning_bidirectional_checkbox = QCheckBox("Bidirectional")
+        self.continuous_scanning_bidirectional_checkbox.setToolTip(
+            "Scan every other line backwards with a triangle wave instead of flying back."
+        )
+        controlLayout.addWidget(self.continuous_scanning_bidirectional_checkbox, 0, 0)
+
+        self.continuous_scanning_phase_spinbox = QSpinBox(self)
+        # -1 takes the phase from the galvo lag calibration.
+        self.continuous_scanning_phase_spinbox.setMinimum(-1)
+        self.continuous_scanning_phase_spinbox.setMaximum(1000)
+        self.continuous_scanning_phase_spinbox.setValue(-1)
+        self.continuous_scanning_phase_spinbox.setPrefix("Phase: ")
+        self.continuous_scanning_phase_spinbox.setSpecialValueText("Phase: calibrated")
+        self.continuous_scanning_phase_spinbox.setToolTip(
+            "Number of samples the PMT signal lags behind the galvos in bidirectional scanning."
+        )
+        controlLayout.addWidget(self.continuous_scanning_phase_spinbox, 0, 1)
+
+        self.continuous_scanning_adaptive_checkbox = QCheckBox("Stop at SNR")
+        self.continuous_scanning_adaptive_checkbox.setToolTip(
+            "Average frames until the SNR of the mean reaches the target, at most "
+            "the average number, then stop."
+        )
+        controlLayout.addWidget(self.continuous_scanning_adaptive_checkbox, 7, 0)
+
+        self.continuous_scanning_snr_spinbox = QDoubleSpinBox(self)
+        self.continuous_scanning_snr_spinbox.setMinimum(1)
+        self.continuous_scanning_snr_spinbox.setMaximum(1000)
+        self.continuous_scanning_snr_spinbox.setValue(20)
+        self.continuous_scanning_snr_spinbox.setSingleStep(5)
+        self.continuous_scanning_snr_spinbox.setPrefix("SNR: ")
+        controlLayout.addWidget(self.continuous_scanning_snr_spinbox, 7, 1)
+
+        self.continuous_scanning_pmt2_checkbox = QCheckBox("Record PMT2")
+        self.continuous_scanning_pmt2_checkbox.setToolTip(
+            "Record the second PMT at the same time, the frames of both are shown "
+            "on the time slider and saved in one file."
+        )
+        controlLayout.addWidget(self.continuous_scanning_pmt2_checkbox, 8, 0)
+
         Continuous_widget.setLayout(controlLayout)
 
         # -------------------------- stack scanning ----------------------------
         Zstack_widget = QWidget()
         Zstack_Layout = QGridLayout()
 
+        self.stack_scanning_mode = QComboBox()
+        self.stack_scanning_mode.addItems(["Plane by plane", "Staircase", "Ramp", "Trigger"])
+        self.stack_scanning_mode.setToolTip(
+            "Plane by plane: move the objective motor and scan each plane; Staircase, Ramp: the whole stack in one DAQ run, "
+            "the focus drive follows objectiveAO; Trigger: the whole stack in one DAQ run, the focus drive steps on objectivetrigger"
+            )
+        Zstack_Layout.addWidget(self.stack_scanning_mode, 0, 1)
+        Zstack_Layout.addWidget(QLabel("Stack mode:"), 0, 0)
+
         self.stack_scanning_sampling_rate_spinbox = QSpinBox(self)
         self.stack_scanning_sampling_rate_spinbox.setMinimum(0)
         self.stack_scanning_sampling_rate_spinbox.setMaximum(1000000)
@@ -382,6 +434,13 @@ Left drag + Shift + Ctrl scales the ROI with size snapping")
             "In case of not changing z-position, set here to 0."
         )
 
+        self.stack_scanning_pmt2_checkbox = QCheckBox("Record PMT2")
+        self.stack_scanning_pmt2_checkbox.setToolTip(
+            "Record the second PMT at the same time, the images of both are "
+            "saved in one file for each plane."
+        )
+        Zstack_Layout.addWidget(self.stack_scanning_pmt2_checkbox, 7, 0)
+
         self.startButton_stack_scanning = StylishQT.runButton("")
         self.startButton_stack_scanning.setFixedHeight(32)
         self.startButton_stack_scanning.setCheckable(True)
@@ -391,7 +450,7 @@ Left drag + Shift + Ctrl scales the ROI with size snapping")
         self.startButton_stack_scanning.clicked.connect(
             lambda: run_in_thread(self.start_Zstack_scanning)
         )
-        Zstack_Layout.addWidget(self.startButton_stack_scanning, 7, 0)
+        Zstack_Layout.addWidget(self.startButton_stack_scanning, 8, 0)
 
         self.stopButton_stack_scanning = StylishQT.stop_deleteButton()
         self.stopButton_stack_scanning.setFixedHeight(32)
@@ -402,7 +461,7 @@ Left drag + Shift + Ctrl scales the ROI with size snapping")
             lambda: run_in_thread(self.stop_Zstack_scanning)
         )
         self.stopButton_stack_scanning.setEnabled(False)
-        Zstack_Layout.addWidget(self.stopButton_stack_scanning, 7, 1)
+        Zstack_Layout.addWidget(self.stopButton_stack_scanning, 8, 1)
 
         Zstack_widget.setLayout(Zstack_Layout)
 
@@ -550,6 +609,15 @@ Left drag + Shift + Ctrl scales the ROI with size snapping")
             self.Value_xPixels = int(self.Scanning_pixel_num_combobox.value())
             Value_yPixels = self.Value_xPixels
             self.averagenum = int(self.continuous_scanning_average_spinbox.value())
+
+            adaptive_averaging = None
+            if self.continuous_scanning_adaptive_checkbox.isChecked():
+                # The average number is the most frames it takes.
+                adaptive_averaging = AdaptiveAverager(
+                    target_snr=self.continuous_scanning_snr_spinbox.value(),
+                    max_frames=self.averagenum,
+                )
+                self.averagenum = 1
     
             Totalscansamples = self.pmtTest.setWave(
                 self.Daq_sample_rate_pmt,
@@ -560,17 +628,31 @@ Left drag + Shift + Ctrl scales the ROI with size snapping")
                 self.Value_xPixels,
                 Value_yPixels,
                 self.averagenum,
+                bidirectional=self.continuous_scanning_bidirectional_checkbox.isChecked(),
+                phase_offset=self.continuous_scanning_phase_spinbox.value()
+                if self.continuous_scanning_phase_spinbox.value() >= 0
+                else None,
+                adaptive_averaging=adaptive_averaging,
+                pmt_channels=["PMT", "PMT2"]
+                if self.continuous_scanning_pmt2_checkbox.isChecked()
+                else ["PMT"],
             )
             time_per_frame_pmt = Totalscansamples / self.Daq_sample_rate_pmt
+            self.time_per_frame_pmt = time_per_frame_pmt
     
             ScanArrayXnum = int((Totalscansamples / self.averagenum) / Value_yPixels)
     
             # r1 = QRectF(500, 500, ScanArrayXnum, int(Value_yPixels))
             # self.pmtimageitem.setRect(r1)
     
-            self.pmtTest.pmtimagingThread.measurement.connect(
-                self.update_pmt_Graphs
-            )  # Connecting to the measurement signal
+            self.pmtTest.pmtimagingThread.frame_ready.connect(
+                self.show_latest_pmt_frame
+            )  # Connecting to the new frame signal
+            if adaptive_averaging is not None:
+                # The scan stops by itself once the image is good enough.
+                self.pmtTest.pmtimagingThread.finished.connect(
+                    lambda: self.buttonenabled("rasterscan", "stop")
+                )
             self.pmt_fps_Label.setText("Per frame:  %.4f s" % time_per_frame_pmt)
             self.pmtTest.start()
             
@@ -598,8 +680,14 @@ Left drag + Shift + Ctrl scales the ROI with size snapping")
         self.MessageToMainGUI("---!! Continuous contour scanning !!---" + "\n")
 
     def saveimage_pmt(self):
-        Localimg = Image.fromarray(self.data_pmtcontineous)  # generate an image object
-        Localimg.save(
+        # One page for each PMT channel.
+        Localimgs = [
+            Image.fromarray(frame)
+            for frame in self.data_pmtcontineous.reshape(
+                (-1,) + self.data_pmtcontineous.shape[-2:]
+            )
+        ]  # generate an image object
+        Localimgs[0].save(
             os.path.join(
                 self.savedirectory,
                 "PMT_"
@@ -607,10 +695,27 @@ Left drag + Shift + Ctrl scales the ROI with size snapping")
                 + "_"
                 + datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
                 + ".tif",
-            )
+            ),
+            save_all=True,
+            append_images=Localimgs[1:],
         )  # save as tif
         # np.save(os.path.join(self.savedirectory, 'PMT'+ self.saving_prefix +datetime.now().strftime('%Y-%m-%d_%H-%M-%S')), self.data_pmtcontineous)
 
+    def show_latest_pmt_frame(self):
+        """
+        Show the latest frame of the continuous scan. Frames that came in
+        while the display was busy are skipped and counted as dropped.
+        """
+        frame_ring = self.pmtTest.pmtimagingThread.frame_ring
+        frame_number, data = frame_ring.take_latest()
+        if data is None:
+            return
+        self.update_pmt_Graphs(data)
+        self.pmt_fps_Label.setText(
+            "Per frame:  %.4f s, dropped: %d"
+            % (self.time_per_frame_pmt, frame_ring.dropped_frames)
+        )
+
     def update_pmt_Graphs(self, data):
         """Update graphs."""
 
@@ -1222,6 +1327,47 @@ Left drag + Shift + Ctrl scales the ROI with size snapping")
                                           self.handle_viewbox_coordinate_position_array_expanded_x,
                                           self.handle_viewbox_coordinate_position_array_expanded_y)
         
+        #========================= Time optimal ===============================
+        
+        if self.contour_strategy.currentText() == "Time optimal":
+            # Only the handles are converted, the planner puts the points in
+            # between along the speed profile the galvos can follow.
+            handle_viewbox_coordinates = np.zeros((self.ROIhandles_nubmer, 2))
+            for i in range(self.ROIhandles_nubmer):
+                qpoint_viewbox = self.pmtvb.mapSceneToView(
+                    QPoint(
+                        int(self.handle_scene_coordinate_position_array[i][0]),
+                        int(self.handle_scene_coordinate_position_array[i][1]),
+                    )
+                )
+                handle_viewbox_coordinates[i] = np.array(
+                    [qpoint_viewbox.x(), qpoint_viewbox.y()]
+                )
+            
+            handle_voltage_x, handle_voltage_y = \
+            self.convert_coordinates_to_voltage(Value_xPixels = self.Value_xPixels, Value_voltXMax = self.Value_voltXMax,
+                                                contour_point_number = self.ROIhandles_nubmer, 
+                                                handle_viewbox_coordinates = handle_viewbox_coordinates)
+            
+            # ================= The signals to NIDAQ ==================
+            current_stacked_voltage_signals = plan_contour_trajectory(
+                np.column_stack((handle_voltage_x, handle_voltage_y)),
+                self.Daq_sample_rate_pmt,
+            )
+            print(
+                "Time optimal contour: {} points, {:.3f} ms per round".format(
+                    current_stacked_voltage_signals.shape[1],
+                    current_stacked_voltage_signals.shape[1]
+                    / self.Daq_sample_rate_pmt
+                    * 1000,
+                )
+            )
+            
+            #================= Speed and acceleration check ===================
+            self.speed_acceleration_check(self.Daq_sample_rate_pmt,
+                                          current_stacked_voltage_signals[0],
+                                          current_stacked_voltage_signals[1])
+        
         # print(current_stacked_voltage_signals)
         
         # stacked_voltage_signals_length_hori = len(current_stacked_voltage_signals[1])
@@ -1600,8 +1746,20 @@ Left drag + Shift + Ctrl scales the ROI with size snapping")
             "average_number": self.stack_scanning_Avgnumber_spinbox.value(),
         }
 
+        if self.stack_scanning_mode.currentText() == "Plane by plane":
+            hardware_timed = None
+        else:
+            hardware_timed = self.stack_scanning_mode.currentText().lower()
+
         self.zstack_ins = PMT_zscan(
-            saving_dir, z_depth, z_step_size, imaging_conditions
+            saving_dir,
+            z_depth,
+            z_step_size,
+            imaging_conditions,
+            hardware_timed=hardware_timed,
+            pmt_channels=["PMT", "PMT2"]
+            if self.stack_scanning_pmt2_checkbox.isChecked()
+            else ["PMT"],
         )
         self.zstack_ins.start_scan()
 
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+Frame averaging that stops when the image is good enough.
+
+RasterScan and the continuous PMT imaging average a fixed number of frames,
+however bright the sample is. AdaptiveAverager keeps the running mean and the
+variance of every pixel over the frames as they come in, and says when to
+stop: as soon as the SNR of the mean reaches a target, or the focus score of
+the mean stops changing, or at max_frames:
+
+    averager = AdaptiveAverager(target_snr=20, max_frames=16)
+    averager.start(image_shape)
+    while averager.add(next_frame()) == False:
+        pass
+    image = averager.mean
+
+The noise of the mean is the standard error of the pixels, the square root of
+their mean variance over the frames divided by the number of frames. The
+signal is the spread of the pixels of the mean with that noise taken out. The
+focus score is the variance of the Laplacian of the mean, like
+ImageAnalysis.ImageProcessing.ProcessImage.variance_of_laplacian.
+"""
+
+import numpy as np
+
+
+def laplacian_variance(image):
+    """
+    Variance of the 4-neighbour Laplacian of an image, high for sharp images.
+    The images of several channels, (channels, y, x), count together.
+    """
+    laplacian = (
+        image[..., :-2, 1:-1]
+        + image[..., 2:, 1:-1]
+        + image[..., 1:-1, :-2]
+        + image[..., 1:-1, 2:]
+        - 4 * image[..., 1:-1, 1:-1]
+    )
+    return float(np.var(laplacian))
+
+
+class AdaptiveAverager:
+    def __init__(
+        self, target_snr=None, focus_tolerance=None, min_frames=2, max_frames=16
+    ):
+        """
+        Running mean and variance of frames, and when to stop averaging.
+
+        Parameters
+        ----------
+        target_snr : float, optional
+            Stop when the SNR of the mean reaches it. The default is None.
+        focus_tolerance : float, optional
+            Stop when the focus score of the mean changes less than this
+            fraction from one frame to the next. The default is None.
+        min_frames : int, optional
+            Frames averaged before the SNR or focus score is checked, at least
+            2 for a variance. The default is 2.
+        max_frames : int, optional
+            Most frames that are averaged. The default is 16.
+
+        Without target_snr and focus_tolerance it averages max_frames frames.
+
+        Returns
+        -------
+        None.
+
+        """
+        if max_frames < 1:
+            raise ValueError("Averaging needs at least 1 frame.")
+        self.target_snr = target_snr
+        self.focus_tolerance = focus_tolerance
+        self.min_frames = max(int(min_frames), 2)
+        self.max_frames = int(max_frames)
+
+        self.mean = None
+        self.frame_number = 0
+
+    def start(self, shape):
+        """
+        Start averaging frames of the shape, the buffers are allocated once.
+        """
+        if self.mean is None or self.mean.shape != tuple(shape):
+            self.mean = np.zeros(shape)
+            self._squares = np.zeros(shape)
+            self._delta = np.zeros(shape)
+        else:
+            self.mean.fill(0)
+            self._squares.fill(0)
+        self.frame_number = 0
+        self.focus_score = None
+        self._previous_focus_score = None
+        self.done = False
+        self.reason = None
+
+    def add(self, frame):
+        """
+        Add a frame to the mean.
+
+        Parameters
+        ----------
+        frame : np.ndarray
+            The frame, of the shape given to start().
+
+        Returns
+        -------
+        bool
+            True when the averaging is done, the mean is in self.mean.
+
+        """
+        if self.mean is None:
+            self.start(np.shape(frame))
+        self.frame_number += 1
+
+        # Welford's update of the mean and the sum of squared deviations.
+        np.subtract(frame, self.mean, out=self._delta)
+        self.mean += self._delta / self.frame_number
+        self._squares += self._delta * (frame - self.mean)
+
+        if self.focus_tolerance is not None:
+            self._previous_focus_score = self.focus_score
+            self.focus_score = laplacian_variance(self.mean)
+
+        self.done = self._check()
+        return self.done
+
+    def _check(self):
+        if self.frame_number >= self.max_frames:
+            self.reason = "max frames"
+            return True
+        if self.frame_number < self.min_frames:
+            return False
+
+        if self.target_snr is not None and self.snr() >= self.target_snr:
+            self.reason = "SNR"
+            return True
+        if (
+            self.focus_tolerance is not None
+            and self._previous_focus_score is not None
+            and abs(self.focus_score - self._previous_focus_score)
+            <= self.focus_tolerance * abs(self._previous_focus_score)
+        ):
+            self.reason = "focus"
+            return True
+        return False
+
+    def noise(self):
+        """
+        Standard error of the pixels of the mean, 0 before the second frame.
+        """
+        if self.frame_number < 2:
+            return 0.0
+        pixel_variance = np.mean(self._squares) / (self.frame_number - 1)
+        return float(np.sqrt(pixel_variance / self.frame_number))
+
+    def snr(self):
+        """
+        Spread of the pixels of the mean over its noise, 0 before the second
+        frame.
+        """
+        noise = self.noise()
+        if noise == 0:
+            return 0.0 if self.frame_number < 2 else np.inf
+        signal_variance = max(float(np.var(self.mean)) - noise ** 2, 0)
+        return np.sqrt(signal_variance) / noise
+
+    def summary(self):
+        """
+        Like "6 frames averaged, SNR 21.3 (SNR)".
+        """
+        return "{} frames averaged, SNR {:.1f} ({})".format(
+            self.frame_number, self.snr(), self.reason
+        )
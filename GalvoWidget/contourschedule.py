@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""
+Contour scans of several cells in one periodic waveform.
+
+Each cell is scanned round its contour once per period, the cells one after
+the other with a transit from one to the next. The order of the cells is a
+short round trip, nearest neighbour then 2-opt, and the whole path, contours
+and transits, goes through GalvoWidget.contourtrajectory so it stays within
+the galvo limits and takes as little time as they allow. That is the highest
+rate at which every cell can be revisited:
+
+    schedule = schedule_contours([contour_1, contour_2, contour_3], 50000)
+    contourScanningSignal = schedule.samples  # (2, samples), one round
+    traces = schedule.cell_traces(pmt_data)  # (rounds, samples) of each cell
+
+The distance between the cells is the larger of the x and y distance, as the
+galvos move at the same time.
+"""
+
+import numpy as np
+
+from GalvoWidget.contourtrajectory import plan_contour_trajectory
+
+
+def _distance(points, point):
+    return np.max(np.abs(points - point), axis=-1)
+
+
+def visiting_order(positions):
+    """
+    Order of the positions for a short round trip.
+
+    Parameters
+    ----------
+    positions : array like
+        (n, 2) x and y of the cells.
+
+    Returns
+    -------
+    list
+        Indices of the positions, starting with 0.
+
+    """
+    positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+    count = len(positions)
+    if count < 4:
+        # All the round trips are the same.
+        return list(range(count))
+    distance = _distance(positions[:, np.newaxis], positions[np.newaxis])
+
+    # Nearest neighbour from the first position.
+    order = [0]
+    left = np.ones(count, dtype=bool)
+    left[0] = False
+    for _ in range(count - 1):
+        nearest = int(np.argmin(np.where(left, distance[order[-1]], np.inf)))
+        order.append(nearest)
+        left[nearest] = False
+    order = np.array(order)
+
+    # 2-opt: swap the edges a-b and c-d for a-c and b-d, by reversing the
+    # path from b to c, as long as that makes the trip shorter.
+    improved = True
+    while improved:
+        improved = False
+        for i in range(count - 2):
+            a, b = order[i], order[i + 1]
+            c = order[i + 2 :]
+            d = np.roll(order, -1)[i + 2 :]
+            gain = distance[a, b] + distance[c, d] - distance[a, c] - distance[b, d]
+            j = int(np.argmax(gain))
+            if gain[j] > 1e-9:
+                j += i + 2
+                order[i + 1 : j + 1] = order[i + 1 : j + 1][::-1].copy()
+                improved = True
+    return order.tolist()
+
+
+class ContourSchedule:
+    def __init__(self, samples, sampling_rate, order, cell_ranges):
+        """
+        One period of a multi-cell contour scan.
+
+        Parameters
+        ----------
+        samples : np.ndarray
+            (2, samples) x and y voltages of one round.
+        sampling_rate : int
+            Sampling rate of the DAQ.
+        order : list
+            Indices of the contours in the order they are scanned.
+        cell_ranges : list of tuple
+            (start, stop) samples of the round that scan each contour, in
+            the order the contours were given.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.samples = samples
+        self.sampling_rate = sampling_rate
+        self.order = order
+        self.cell_ranges = cell_ranges
+
+    @property
+    def round_sample_number(self):
+        return self.samples.shape[1]
+
+    @property
+    def revisit_rate(self):
+        """
+        Rounds per second, the rate at which each cell is sampled.
+        """
+        return self.sampling_rate / self.round_sample_number
+
+    @property
+    def scan_fraction(self):
+        """
+        Fraction of the round spent on the contours, the rest is transit.
+        """
+        return (
+            sum(stop - start for start, stop in self.cell_ranges)
+            / self.round_sample_number
+        )
+
+    def to_daq_signals(self, repeats=1):
+        """
+        The rounds as galvos_X_contour and galvos_Y_contour analog signals,
+        like ProcessImage.mask_to_contourScanning_DAQsignals.
+        """
+        X_samples = np.tile(self.samples[0], repeats)
+        Y_samples = np.tile(self.samples[1], repeats)
+
+        # Pure numerical np arrays need to be converted to structured array, with 'Sepcification' field being the channel name.
+        tp_analog = np.dtype(
+            [("Waveform", float, (len(X_samples),)), ("Sepcification", "U20")]
+        )
+        ContourArray_forDaq = np.zeros(2, dtype=tp_analog)
+        ContourArray_forDaq[0] = np.array(
+            [(X_samples, "galvos_X_contour")], dtype=tp_analog
+        )
+        ContourArray_forDaq[1] = np.array(
+            [(Y_samples, "galvos_Y_contour")], dtype=tp_analog
+        )
+        return ContourArray_forDaq
+
+    def cell_traces(self, data):
+        """
+        Recorded samples of each cell.
+
+        Parameters
+        ----------
+        data : np.ndarray
+            1-D recording of whole rounds, e.g. the PMT channel.
+
+        Returns
+        -------
+        list of np.ndarray
+            (rounds, samples) of each contour, in the order they were given.
+
+        """
+        data = np.asarray(data)
+        rounds = data.reshape(-1, self.round_sample_number)
+        return [rounds[:, start:stop] for start, stop in self.cell_ranges]
+
+
+def schedule_contours(
+    contours,
+    sampling_rate,
+    max_speed=None,
+    max_acceleration=None,
+    margin=0.95,
+):
+    """
+    Scan several contours round and round in one periodic waveform.
+
+    Parameters
+    ----------
+    contours : list of array like
+        (2, n) x and y voltages along each closed contour, like the signals
+        of ProcessImage.mask_to_contourScanning_DAQsignals.
+    sampling_rate : int
+        Sampling rate of the DAQ.
+    max_speed, max_acceleration, margin : optional
+        See GalvoWidget.contourtrajectory.plan_contour_trajectory.
+
+    Returns
+    -------
+    ContourSchedule
+
+    """
+    contours = [np.asarray(contour, dtype=float).reshape(2, -1).T for contour in contours]
+    if len(contours) == 0:
+        raise ValueError("No contours to schedule.")
+    order = visiting_order([contour.mean(axis=0) for contour in contours])
+
+    # Enter each contour at its point closest to where the previous one was
+    # entered and left, the first one closest to the last cell.
+    previous = contours[order[-1]].mean(axis=0)
+    nodes = []
+    starts = []
+    for index in order:
+        contour = contours[index]
+        entry = int(np.argmin(_distance(contour, previous)))
+        starts.append(sum(len(part) for part in nodes))
+        # Round the contour and back to the entry.
+        nodes.append(np.vstack((np.roll(contour, -entry, axis=0), contour[entry])))
+        previous = contour[entry]
+
+    samples, node_samples = plan_contour_trajectory(
+        np.vstack(nodes),
+        sampling_rate,
+        max_speed=max_speed,
+        max_acceleration=max_acceleration,
+        margin=margin,
+        node_samples=True,
+    )
+
+    cell_ranges = [None] * len(contours)
+    for index, start, part in zip(order, starts, nodes):
+        cell_ranges[index] = (
+            int(node_samples[start]),
+            int(node_samples[start + len(part) - 1]),
+        )
+
+    schedule = ContourSchedule(samples, sampling_rate, order, cell_ranges)
+    print(
+        "{} cells, {} samples per round, {:.1f} Hz, {:.0f}% on the contours".format(
+            len(contours),
+            schedule.round_sample_number,
+            schedule.revisit_rate,
+            100 * schedule.scan_fraction,
+        )
+    )
+    return schedule
@@ -0,0 +1,451 @@
+# -*- coding: utf-8 -*-
+"""
+Time optimal galvo trajectories along contours.
+
+The contour scans used to put a fixed number of points evenly along the
+contour and only checked afterwards whether the galvos could follow. The
+planner here works out how fast the galvos can go at every point of the
+contour instead, within HardwareConstants.maxGalvoSpeed and maxGalvoAccel on
+each axis: full speed on the straight stretches, slowing down where the
+contour bends, and to a stop on sharp corners. The contour is then sampled at
+the DAQ sampling rate along that speed profile, so one round takes as little
+time as the galvos allow:
+
+    samples = plan_contour_trajectory(node_voltages, 50000)  # (2, samples)
+    contour_frequency = 50000 / samples.shape[1]
+
+The speed profile is the usual forward and backward pass: the speed at each
+point is limited by the speed limit along the direction of the contour and
+the acceleration the bend needs, then the acceleration along the contour with
+what is left of the acceleration limit. The bend is what a sample sees, the
+turns within one sample on either side, so a curve at constant speed can use
+the whole acceleration limit. A circle goes round at the speed
+min(max_speed, sqrt(max_acceleration * radius)), run this module to check.
+"""
+
+import math
+
+import numpy as np
+
+from NIDAQ.constants import HardwareConstants
+
+
+def _pass(limit, direction, step_length, window_turn, context, backward):
+    # One pass over the points, the speed can only grow by the acceleration
+    # that is left after the bend. Step i goes from point i to i + 1.
+    max_acceleration, sampling_rate, laps = context
+    speed = limit
+    count = len(limit)
+    order = list(range(count - 1, -1, -1) if backward else range(count))
+    previous = order[0]
+    for step in range(1, laps * count):
+        index = order[step % count]
+        step_index = index if backward else previous
+        if step_length[step_index] == 0:
+            previous = index
+            continue
+
+        # The bends at both ends of the step take v * turns * sampling_rate,
+        # the one at the end at the speed u that is reached there:
+        #     u^2 <= v^2 + 2 * step * (max_acceleration - bend) / direction
+        v = speed[previous]
+        reachable = speed[index]
+        for axis in (0, 1):
+            if direction[axis][step_index] != 0:
+                k = 2 * step_length[step_index] / abs(direction[axis][step_index])
+                room = v * v + k * max_acceleration
+                start_bend = v * sampling_rate * window_turn[axis][previous]
+                window = k * sampling_rate * window_turn[axis][index]
+                reachable = min(
+                    reachable,
+                    math.sqrt(max(room - k * start_bend, 0)),
+                    (math.sqrt(window * window + 4 * room) - window) / 2,
+                )
+        if reachable < speed[index]:
+            speed[index] = reachable
+        previous = index
+    return speed
+
+
+def _distances(step_length, closed):
+    # Distance along the path of the points, a closed path three times over
+    # so the windows can reach round, and of the points themselves.
+    count = len(step_length)
+    if closed:
+        distance = np.concatenate(([0], np.cumsum(step_length)))
+        distance = np.concatenate(
+            (distance[:-1] - distance[-1], distance[:-1], distance[:-1] + distance[-1])
+        )
+        return distance, distance[count : 2 * count]
+    distance = np.concatenate(([0], np.cumsum(step_length[:-1])))
+    return distance, distance
+
+
+def _kink_limit(
+    absolute_turn, step_length, acceleration, max_speed, sampling_rate, closed
+):
+    # Highest speed v at each point with
+    #     v * sampling_rate * (turns within v / sampling_rate) <= acceleration
+    # found by bisection, the left side grows with v.
+    count = len(absolute_turn)
+    distance, centre = _distances(step_length, closed)
+    if closed:
+        absolute_turn = np.tile(absolute_turn, (3, 1))
+    summed_turn = np.vstack(([[0, 0]], np.cumsum(absolute_turn, axis=0)))
+    summed_moment = np.vstack(
+        ([[0, 0]], np.cumsum(absolute_turn * distance[:, np.newaxis], axis=0))
+    )
+
+    def weighted_turn(reach):
+        # Turns within reach, weighted 1 - |distance| / reach.
+        low = np.searchsorted(distance, centre - reach, side="right")
+        middle = np.searchsorted(distance, centre, side="right")
+        high = np.searchsorted(distance, centre + reach)
+        before = summed_turn[middle] - summed_turn[low]
+        after = summed_turn[high] - summed_turn[middle]
+        moment = (summed_moment[middle] - summed_moment[low]) - (
+            summed_moment[high] - summed_moment[middle]
+        )
+        r = reach[:, np.newaxis]
+        c = centre[:, np.newaxis]
+        return before + after + (moment - c * (before - after)) / r
+
+    low = np.zeros(count)
+    high = np.full(count, max_speed * math.sqrt(2))
+    for _ in range(30):
+        speed = (low + high) / 2
+        too_fast = np.any(
+            speed[:, np.newaxis] * sampling_rate * weighted_turn(speed / sampling_rate)
+            > acceleration[:, np.newaxis],
+            axis=1,
+        )
+        high = np.where(too_fast, speed, high)
+        low = np.where(too_fast, low, speed)
+    # The weighted turns at the limit are the most there can be at any speed.
+    return low[:, np.newaxis], weighted_turn(np.maximum(low, 1e-9) / sampling_rate)
+
+
+def _spread(values, step_length, reach, closed, extreme):
+    # Largest (np.maximum) or smallest (np.minimum) of the values of the
+    # points that have each point within their reach. Each value is put on
+    # the two runs of 2^k points that cover its reach, and the runs are then
+    # split down to single points.
+    distance, centre = _distances(step_length, closed)
+    first = np.searchsorted(distance, centre - reach)
+    last = np.searchsorted(distance, centre + reach, side="right")
+    level = np.log2(last - first).astype(int)
+    empty = np.inf if extreme is np.minimum else -np.inf
+
+    table = [
+        np.full((len(distance) - 2 ** k + 1,) + values.shape[1:], empty)
+        for k in range(level.max() + 1)
+    ]
+    for k in np.unique(level):
+        rows = level == k
+        extreme.at(table[k], first[rows], values[rows])
+        extreme.at(table[k], last[rows] - 2 ** k, values[rows])
+    for k in range(len(table) - 1, 0, -1):
+        half = 2 ** (k - 1)
+        length = len(table[k])
+        table[k - 1][:length] = extreme(table[k - 1][:length], table[k])
+        table[k - 1][half:] = extreme(table[k - 1][half:], table[k])
+
+    if closed:
+        return extreme.reduce(table[0].reshape((3, -1) + values.shape[1:]), axis=0)
+    return table[0]
+
+
+def _tangential_acceleration(speed, step_length, closed):
+    # Acceleration along the path on the steps on both sides of each point.
+    squared = np.asarray(speed) ** 2
+    if closed:
+        change = np.roll(squared, -1) - squared
+    else:
+        change = np.append(np.diff(squared), 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        acceleration = np.nan_to_num(
+            np.abs(change) / (2 * step_length), posinf=0.0
+        )
+    return np.maximum(acceleration, np.roll(acceleration, 1))
+
+
+def speed_profile(positions, max_speed, max_acceleration, sampling_rate, closed=True):
+    """
+    Highest speed at each point of a path.
+
+    Parameters
+    ----------
+    positions : np.ndarray
+        (points, 2) x and y voltages along the path, close together and
+        including the corners. For a closed path the last point is not the
+        first one again.
+    max_speed, max_acceleration : float
+        Limits of each galvo, in V/s and V/s^2.
+    sampling_rate : int
+        Sampling rate of the DAQ.
+    closed : bool, optional
+        The path goes round, else it starts and ends at rest. The default
+        is True.
+
+    Returns
+    -------
+    np.ndarray
+        Speed along the path in V/s at each point.
+
+    """
+    if closed:
+        steps = np.roll(positions, -1, axis=0) - positions
+    else:
+        steps = np.vstack((np.diff(positions, axis=0), [[0, 0]]))
+    step_length = np.hypot(steps[:, 0], steps[:, 1])
+    with np.errstate(invalid="ignore"):
+        direction = np.nan_to_num(steps / step_length[:, np.newaxis])
+
+    # Change of direction at each point.
+    incoming = np.roll(direction, 1, axis=0)
+    turn = direction - incoming
+    if closed == False:
+        turn[0] = turn[-1] = 0
+    with np.errstate(divide="ignore"):
+        speed_limit = np.min(
+            max_speed / np.maximum(np.abs(direction), np.abs(incoming)), axis=1
+        )
+
+    def passes(limit, window_turn):
+        arguments = (
+            direction.T.tolist(),
+            step_length.tolist(),
+            window_turn.T.tolist(),
+            # Two laps round a closed path, so the speed where it closes is
+            # right.
+            (max_acceleration, sampling_rate, 2 if closed else 1),
+        )
+        speed = _pass(list(limit), *arguments, backward=False)
+        return _pass(speed, *arguments, backward=True)
+
+    # A sample of the galvos sees the turns within one sample on either side,
+    # weighted down with the distance, e.g. a corner right before a curve.
+    # The first profile keeps half the acceleration for the speed changes
+    # along the path, the second only what the speed changes of the first
+    # one use, so a curve that is taken at constant speed gets all of it.
+    reserve = np.full(len(positions), 0.5 * max_acceleration)
+    for _ in range(2):
+        kink_limit, window_turn = _kink_limit(
+            np.abs(turn),
+            step_length,
+            max_acceleration - reserve,
+            max_speed,
+            sampling_rate,
+            closed,
+        )
+        # A sample can be anywhere, a point gets the lowest limit within one
+        # sample of it.
+        kink_limit = _spread(
+            kink_limit[:, 0],
+            step_length,
+            kink_limit[:, 0] / sampling_rate,
+            closed,
+            np.minimum,
+        )
+        limit = np.minimum(
+            np.minimum(speed_limit, kink_limit), max_speed * math.sqrt(2)
+        )
+        if closed == False:
+            limit[0] = limit[-1] = 0.0
+        speed = passes(limit, window_turn)
+        reserve = np.minimum(
+            _tangential_acceleration(speed, step_length, closed),
+            0.5 * max_acceleration,
+        )
+
+    # A sample also sees the speed changes of all steps within one sample,
+    # they have to leave room for the most turns any of those samples sees.
+    window_turn = _spread(
+        window_turn, step_length, np.array(speed) / sampling_rate, closed, np.maximum
+    )
+    return np.array(passes(limit, window_turn))
+
+
+def plan_contour_trajectory(
+    nodes,
+    sampling_rate,
+    max_speed=None,
+    max_acceleration=None,
+    closed=True,
+    margin=0.95,
+    oversampling=4,
+    node_samples=False,
+):
+    """
+    Galvo samples that go along the contour through the nodes in the least
+    time.
+
+    Parameters
+    ----------
+    nodes : array like
+        (n, 2) x and y voltages of the corners of the contour, e.g. the roi
+        handles, or of a finely sampled contour.
+    sampling_rate : int
+        Sampling rate of the DAQ.
+    max_speed, max_acceleration : float, optional
+        Limits of each galvo in V/s and V/s^2. The default is None, the ones
+        in HardwareConstants.
+    closed : bool, optional
+        The contour goes from the last node back to the first and is scanned
+        round and round. The default is True.
+    margin : float, optional
+        Fraction of the limits that is used. The default is 0.95.
+    oversampling : int, optional
+        Number of path points per sample at full speed for the speed
+        profile. The default is 4.
+    node_samples : bool, optional
+        Also return where the nodes are in the samples. The default is False.
+
+    Returns
+    -------
+    np.ndarray
+        (2, samples) x and y voltages, one round of the contour for a closed
+        one.
+    np.ndarray
+        Only with node_samples, index of the first sample at or past each
+        node.
+
+    """
+    constants = HardwareConstants()
+    if max_speed is None:
+        max_speed = constants.maxGalvoSpeed
+    if max_acceleration is None:
+        max_acceleration = constants.maxGalvoAccel
+    max_speed *= margin
+    max_acceleration *= margin
+
+    nodes = np.asarray(nodes, dtype=float)
+    node_number = len(nodes)
+    if closed:
+        nodes = np.vstack((nodes, nodes[:1]))
+    input_distance = np.concatenate(
+        ([0], np.cumsum(np.hypot(*np.diff(nodes, axis=0).T)))
+    )
+    # Repeated nodes have no direction.
+    keep = np.concatenate(([True], np.any(np.diff(nodes, axis=0) != 0, axis=1)))
+    nodes = nodes[keep]
+    if len(nodes) < 2:
+        if node_samples:
+            return nodes[:1].T.copy(), np.zeros(node_number, dtype=int)
+        return nodes[:1].T.copy()
+
+    node_distance = input_distance[keep]
+    length = node_distance[-1]
+
+    # Path points on every node and in between, fine enough that a sample at
+    # full speed spans several of them.
+    longest_step = max_speed / sampling_rate / oversampling
+    step_numbers = np.maximum(
+        np.ceil(np.diff(node_distance) / longest_step).astype(int), 1
+    )
+    distance = np.concatenate(
+        [
+            np.linspace(node_distance[i], node_distance[i + 1], number, endpoint=False)
+            for i, number in enumerate(step_numbers)
+        ]
+        + [[length]]
+    )
+    positions = np.column_stack(
+        (
+            np.interp(distance, node_distance, nodes[:, 0]),
+            np.interp(distance, node_distance, nodes[:, 1]),
+        )
+    )
+    if closed:
+        # The last point is the first one again.
+        speed = speed_profile(
+            positions[:-1], max_speed, max_acceleration, sampling_rate
+        )
+        speed = np.append(speed, speed[0])
+    else:
+        speed = speed_profile(
+            positions, max_speed, max_acceleration, sampling_rate, closed=False
+        )
+
+    # Time at each path point, with constant acceleration in each step.
+    with np.errstate(divide="ignore"):
+        step_time = 2 * np.diff(distance) / (speed[1:] + speed[:-1])
+    time = np.concatenate(([0], np.cumsum(step_time)))
+
+    # Whole samples for the round, the slight stretch only slows it down.
+    sample_number = max(int(math.ceil(time[-1] * sampling_rate)), 1)
+    if closed:
+        sample_time = np.arange(sample_number) * (time[-1] / sample_number)
+    else:
+        sample_time = np.linspace(0, time[-1], sample_number + 1)
+
+    step = np.searchsorted(time, sample_time, side="right") - 1
+    step = np.clip(step, 0, len(step_time) - 1)
+    step_acceleration = (speed[1:] - speed[:-1]) / step_time
+    elapsed = sample_time - time[step]
+    sample_distance = np.minimum(
+        distance[step]
+        + speed[step] * elapsed
+        + 0.5 * step_acceleration[step] * elapsed ** 2,
+        length,
+    )
+
+    samples = np.vstack(
+        (
+            np.interp(sample_distance, node_distance, nodes[:, 0]),
+            np.interp(sample_distance, node_distance, nodes[:, 1]),
+        )
+    )
+    if node_samples:
+        # A sample on a node can come out a rounding error short of it.
+        return samples, np.searchsorted(
+            sample_distance, input_distance[:node_number] - 1e-12 * length
+        )
+    return samples
+
+
+def trajectory_limits(samples, sampling_rate, closed=True):
+    """
+    Highest speed and acceleration of each galvo in the samples.
+
+    Returns
+    -------
+    max_speed, max_acceleration : np.ndarray
+        Of the x and y galvo, in V/s and V/s^2.
+
+    """
+    samples = np.asarray(samples, dtype=float)
+    if closed:
+        samples = np.hstack((samples, samples[:, :2]))
+    speed = np.diff(samples, axis=1) * sampling_rate
+    acceleration = np.diff(speed, axis=1) * sampling_rate
+    return np.max(np.abs(speed), axis=1), np.max(np.abs(acceleration), axis=1)
+
+
+if __name__ == "__main__":
+    # Finely noded circles against the analytic optimum, both galvos at the
+    # speed min(max_speed, sqrt(max_acceleration * radius)).
+    constants = HardwareConstants()
+    max_speed = 0.95 * constants.maxGalvoSpeed
+    max_acceleration = 0.95 * constants.maxGalvoAccel
+    angle = np.linspace(0, 2 * np.pi, 2000, endpoint=False)
+    for radius in (0.2, 1, 3):
+        for sampling_rate in (50000, 200000, 1000000):
+            nodes = radius * np.column_stack((np.cos(angle), np.sin(angle)))
+            samples = plan_contour_trajectory(nodes, sampling_rate)
+            optimum = (
+                2
+                * np.pi
+                * radius
+                / min(max_speed, math.sqrt(max_acceleration * radius))
+            )
+            speed, acceleration = trajectory_limits(samples, sampling_rate)
+            print(
+                "Circle of {} V at {} Hz: {:.3f} of the optimal period, "
+                "{:.3f} of maxGalvoAccel".format(
+                    radius,
+                    sampling_rate,
+                    samples.shape[1] / sampling_rate / optimum,
+                    np.max(acceleration) / constants.maxGalvoAccel,
+                )
+            )
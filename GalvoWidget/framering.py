@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+Preallocated frame buffers between an acquisition thread and the display.
+
+The acquisition thread reconstructs every frame straight into a buffer of the
+ring and publishes it. The display takes the latest published frame when it
+gets to it; frames it didn't get to are counted as dropped instead of piling
+up in the Qt event queue, so a busy GUI shows up in the counters instead of as
+a growing lag:
+
+    frame_ring = FrameRing((500, 500))
+    # Acquisition thread
+    reconstruction.reconstruct_image(output, out=frame_ring.next_buffer())
+    if frame_ring.publish():
+        frame_ready.emit()
+    # GUI thread
+    frame_number, frame = frame_ring.take_latest()
+
+With exponential averaging each published frame is the running average
+    average = average + factor * (frame - average)
+which raises the SNR of the display without extra reads.
+"""
+
+import threading
+
+import numpy as np
+
+
+class FrameRing:
+    def __init__(self, shape, length=3, dtype=np.float64, exponential_factor=None):
+        """
+        Ring of preallocated frames with a latest-frame mailbox.
+
+        Parameters
+        ----------
+        shape : tuple
+            Shape of a frame.
+        length : int, optional
+            Number of buffers, at least 2: one being written, one published.
+            The default is 3.
+        dtype : optional
+            Data type of the frames. The default is np.float64.
+        exponential_factor : float, optional
+            Weight of a new frame in the running average, between 0 and 1.
+            The default is None, no averaging.
+
+        Returns
+        -------
+        None.
+
+        """
+        if length < 2:
+            raise ValueError("Frame ring needs at least 2 buffers.")
+        self.frames = np.zeros((length,) + tuple(shape), dtype=dtype)
+        self.exponential_factor = exponential_factor
+
+        self._lock = threading.Lock()
+        self._write_index = 0
+        self._latest_index = None
+        self._latest_taken = True
+
+        self.reset_statistics()
+
+    @property
+    def shape(self):
+        return self.frames.shape[1:]
+
+    def set_exponential_averaging(self, exponential_factor):
+        """
+        Set the weight of a new frame in the running average, None to switch
+        the averaging off. The average starts again from the next frame.
+        """
+        with self._lock:
+            self.exponential_factor = exponential_factor
+            self._restart_average = True
+
+    # -----------------------------------------------------------------------
+    def next_buffer(self):
+        """
+        Buffer to fill with the next frame. It is never the published frame,
+        so the display can copy that one meanwhile.
+        """
+        with self._lock:
+            if self._write_index == self._latest_index:
+                self._write_index = (self._write_index + 1) % len(self.frames)
+            return self.frames[self._write_index]
+
+    def publish(self, late=False):
+        """
+        Publish the frame written into next_buffer() as the latest frame.
+
+        Parameters
+        ----------
+        late : bool, optional
+            The frame was read late, e.g. a whole frame was already waiting
+            in the DAQ buffer. The default is False.
+
+        Returns
+        -------
+        bool
+            True if the display has to be notified. False if it still has a
+            notification for a frame it didn't take yet, it will get this
+            frame instead.
+
+        """
+        with self._lock:
+            index = self._write_index
+            frame = self.frames[index]
+
+            if self.exponential_factor is not None:
+                if self._restart_average == False and self._latest_index is not None:
+                    # average + factor * (frame - average), in place.
+                    average = self.frames[self._latest_index]
+                    frame -= average
+                    frame *= self.exponential_factor
+                    frame += average
+                self._restart_average = False
+
+            notify = self._latest_taken
+            if self._latest_taken == False:
+                self.dropped_frames += 1
+            if late:
+                self.late_frames += 1
+
+            self._latest_index = index
+            self._latest_taken = False
+            self.frame_number += 1
+            self._write_index = (index + 1) % len(self.frames)
+            return notify
+
+    def take_latest(self, out=None):
+        """
+        Copy of the latest published frame.
+
+        Parameters
+        ----------
+        out : np.ndarray, optional
+            Array to copy the frame into. The default is None, a new array.
+
+        Returns
+        -------
+        frame_number : int
+            Number of the frame since the start, -1 if there is none yet.
+        frame : np.ndarray or None
+            The frame, None if no frame was published yet.
+
+        """
+        with self._lock:
+            if self._latest_index is None:
+                return -1, None
+            if out is None:
+                out = self.frames[self._latest_index].copy()
+            else:
+                np.copyto(out, self.frames[self._latest_index])
+            if self._latest_taken == False:
+                self.displayed_frames += 1
+            self._latest_taken = True
+            return self.frame_number, out
+
+    # -----------------------------------------------------------------------
+    def reset_statistics(self):
+        # frame_number counts the published frames, -1 before the first one.
+        self.frame_number = -1
+        self.displayed_frames = 0
+        self.dropped_frames = 0
+        self.late_frames = 0
+        self._restart_average = True
+
+    def summary(self):
+        """
+        Frame counters, like "120 frames, 118 displayed, 2 dropped, 0 late".
+        """
+        return "{} frames, {} displayed, {} dropped, {} late".format(
+            self.frame_number + 1,
+            self.displayed_frames,
+            self.dropped_frames,
+            self.late_frames,
+        )
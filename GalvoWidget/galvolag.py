@@ -0,0 +1,363 @@
+# -*- coding: utf-8 -*-
+"""
+Calibration of the lag of the galvo scanners behind their command.
+
+The mirrors follow the x ramp of a raster a little late, so the first samples
+of every recorded line belong to the turn around and the image starts some
+samples into the line. The scans used to cut the lines with slices chosen by
+hand for 500 and 250 kHz and 500 and 256 pixels. GalvoLagModel keeps measured
+lags instead and works out the crop, or the phase offset of a bidirectional
+scan, for any setting:
+
+    x_slice = default_galvo_lag.crop(500000, 500, voltage_range=6)
+    image = full_line_image[:, x_slice]
+
+The lag is measured from a bidirectional scan of any sample: with phase
+offset 0 the lines scanned backwards are shifted by twice the lag against the
+forward ones (lag_from_bidirectional_image), or from a unidirectional scan of
+a sample with a known reference image (lag_from_reference_image).
+calibrate() scans at several rates and amplitudes and saves the model.
+
+Between measured settings the lag time is modelled as
+    lag = t0 + k * line speed
+with the line speed in V/s, a constant delay plus a speed dependent tracking
+error of the galvo servo.
+"""
+
+import json
+import os
+
+import numpy as np
+
+DEFAULT_CALIBRATION_FILE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "galvo_lag_calibration.json"
+)
+
+# Start of the hand chosen crops the scans used before, lag in samples at
+# (sampling rate, pixel number). Used until the galvos are calibrated.
+DEFAULT_LAG_MEASUREMENTS = [
+    {"sampling_rate": 500000, "xPixels": 500, "voltage_range": None, "lag": 50},
+    {"sampling_rate": 500000, "xPixels": 256, "voltage_range": None, "lag": 70},
+    {"sampling_rate": 250000, "xPixels": 500, "voltage_range": None, "lag": 25},
+    {"sampling_rate": 250000, "xPixels": 256, "voltage_range": None, "lag": 25},
+]
+
+
+def _correlation_shift(moving, reference):
+    """
+    Shift in samples, with sub-sample precision, that best lines moving up
+    with reference: moving[j + shift] ~ reference[j]. Both are (lines,
+    samples) arrays, the cross-correlations of the lines are summed.
+    """
+    moving = np.atleast_2d(np.asarray(moving, dtype=float))
+    reference = np.atleast_2d(np.asarray(reference, dtype=float))
+    moving = moving - moving.mean(axis=1, keepdims=True)
+    reference = reference - reference.mean(axis=1, keepdims=True)
+
+    # Full cross-correlation with the FFT, padded so it doesn't wrap around.
+    size = moving.shape[1] + reference.shape[1] - 1
+    fft_size = 1 << (size - 1).bit_length()
+    correlation = np.fft.irfft(
+        np.fft.rfft(moving, fft_size) * np.conj(np.fft.rfft(reference, fft_size)),
+        fft_size,
+    ).sum(axis=0)
+    # Shifts 0 .. len(moving) - 1, then the negative shifts.
+    correlation = np.concatenate(
+        (
+            correlation[fft_size - (reference.shape[1] - 1) :],
+            correlation[: moving.shape[1]],
+        )
+    )
+    shifts = np.arange(-(reference.shape[1] - 1), moving.shape[1])
+
+    peak = int(np.argmax(correlation))
+    shift = float(shifts[peak])
+    if 0 < peak < len(correlation) - 1:
+        # Parabola through the peak and its neighbours.
+        left, centre, right = correlation[peak - 1 : peak + 2]
+        denominator = left - 2 * centre + right
+        if denominator != 0:
+            shift += 0.5 * (left - right) / denominator
+    return shift
+
+
+def lag_from_bidirectional_image(image):
+    """
+    Lag in samples from an image of a bidirectional scan reconstructed with
+    phase_offset 0, e.g. RasterScan(..., bidirectional=True).run().
+
+    A forward line shows the sample lag samples to the left and a backward
+    line lag samples to the right, so the backward lines are the forward
+    lines shifted by twice the lag.
+
+    Parameters
+    ----------
+    image : np.ndarray
+        (yPixels, xPixels) image, the odd lines scanned backwards.
+
+    Returns
+    -------
+    float
+        Lag in samples.
+
+    """
+    line_number = image.shape[0] // 2 * 2
+    forward = image[0:line_number:2]
+    backward = image[1:line_number:2]
+    return _correlation_shift(forward, backward) / 2
+
+
+def lag_from_reference_image(image, reference):
+    """
+    Lag in samples from a unidirectional image with the whole lines, fly
+    back included, of a sample of which the reference image is known.
+
+    Parameters
+    ----------
+    image : np.ndarray
+        (yPixels, line samples) image.
+    reference : np.ndarray
+        (yPixels, xPixels) image of the same field, e.g. from a slow scan.
+
+    Returns
+    -------
+    float
+        Lag in samples, the start of the crop.
+
+    """
+    return _correlation_shift(image, reference)
+
+
+class GalvoLagModel:
+    def __init__(self, measurements=None, file_path=DEFAULT_CALIBRATION_FILE):
+        """
+        Measured galvo lags and the crops and phase offsets made from them.
+
+        Parameters
+        ----------
+        measurements : list of dict, optional
+            Measurements with the keys sampling_rate, xPixels, voltage_range
+            (peak to peak volts of the x scan, None if not known) and lag (in
+            samples). The default is None, the hand chosen crops of
+            DEFAULT_LAG_MEASUREMENTS.
+        file_path : str or None, optional
+            File the model is saved to. The default is
+            galvo_lag_calibration.json next to this module.
+
+        Returns
+        -------
+        None.
+
+        """
+        if measurements is None:
+            measurements = [dict(item) for item in DEFAULT_LAG_MEASUREMENTS]
+        self.measurements = measurements
+        self.file_path = file_path
+
+    @classmethod
+    def load(cls, file_path=DEFAULT_CALIBRATION_FILE):
+        """
+        Model saved in file_path, the default model if there is no readable
+        file.
+        """
+        if file_path is not None and os.path.exists(file_path):
+            try:
+                with open(file_path, "r") as file:
+                    return cls(json.load(file)["measurements"], file_path)
+            except (OSError, ValueError, KeyError) as error:
+                print("Galvo lag calibration not readable: {}".format(error))
+        return cls(file_path=file_path)
+
+    def save(self, file_path=None):
+        file_path = file_path or self.file_path
+        with open(file_path, "w") as file:
+            json.dump({"measurements": self.measurements}, file, indent=2)
+        self.file_path = file_path
+
+    def add_measurement(self, sampling_rate, xPixels, voltage_range, lag):
+        """
+        Add a measured lag in samples, replacing the default ones.
+        """
+        self.measurements = [
+            item for item in self.measurements if item["voltage_range"] is not None
+        ]
+        self.measurements.append(
+            {
+                "sampling_rate": int(sampling_rate),
+                "xPixels": int(xPixels),
+                "voltage_range": float(voltage_range),
+                "lag": float(lag),
+            }
+        )
+
+    # -----------------------------------------------------------------------
+    def lag_samples(self, sampling_rate, xPixels, voltage_range=None):
+        """
+        Lag in samples of a raster scan.
+
+        Parameters
+        ----------
+        sampling_rate : int
+            Sampling rate of the scan.
+        xPixels : int
+            Number of pixels of a line.
+        voltage_range : float, optional
+            Peak to peak voltage of the x scan. The default is None, not
+            known, then only the measurements of the same rate and pixel
+            number and the mean lag time are used.
+
+        Returns
+        -------
+        int
+
+        """
+        # Measured at the same setting.
+        matches = [
+            item["lag"]
+            for item in self.measurements
+            if item["sampling_rate"] == sampling_rate
+            and item["xPixels"] == xPixels
+            and (
+                voltage_range is None
+                or item["voltage_range"] is None
+                or np.isclose(item["voltage_range"], voltage_range)
+            )
+        ]
+        if len(matches) != 0:
+            return int(round(np.mean(matches)))
+
+        if len(self.measurements) == 0:
+            return 0
+
+        lag_times = np.array(
+            [item["lag"] / item["sampling_rate"] for item in self.measurements]
+        )
+        lag_time = np.mean(lag_times)
+
+        # lag = t0 + k * line speed, from the measurements with known speed.
+        known = [
+            index
+            for index, item in enumerate(self.measurements)
+            if item["voltage_range"] is not None
+        ]
+        if voltage_range is not None and len(known) != 0:
+            speeds = np.array(
+                [self._line_speed(**self.measurements[index]) for index in known]
+            )
+            if len(np.unique(speeds)) > 1:
+                slope, intercept = np.polyfit(speeds, lag_times[known], 1)
+                lag_time = intercept + slope * self._line_speed(
+                    sampling_rate, xPixels, voltage_range
+                )
+            else:
+                lag_time = np.mean(lag_times[known])
+
+        return max(int(round(lag_time * sampling_rate)), 0)
+
+    @staticmethod
+    def _line_speed(sampling_rate, xPixels, voltage_range, **kwargs):
+        # Speed of the x ramp in V/s.
+        return voltage_range * sampling_rate / xPixels
+
+    def crop(
+        self, sampling_rate, xPixels, voltage_range=None, line_sample_number=None
+    ):
+        """
+        Samples of each line of a unidirectional scan that make the image.
+
+        Parameters
+        ----------
+        sampling_rate, xPixels, voltage_range
+            See lag_samples.
+        line_sample_number : int, optional
+            Number of samples of a line including the fly back, the crop
+            doesn't go past it. The default is None.
+
+        Returns
+        -------
+        slice
+
+        """
+        start = self.lag_samples(sampling_rate, xPixels, voltage_range)
+        if line_sample_number is not None:
+            start = min(start, max(line_sample_number - xPixels, 0))
+        return slice(start, start + xPixels)
+
+    def phase_offset(
+        self, sampling_rate, xPixels, voltage_range=None, line_sample_number=None
+    ):
+        """
+        Phase offset of a bidirectional scan, see
+        NIDAQ.rasterreconstruction.RasterReconstruction. Limited to the turn
+        around samples if line_sample_number is given.
+        """
+        offset = self.lag_samples(sampling_rate, xPixels, voltage_range)
+        if line_sample_number is not None:
+            offset = min(offset, max(line_sample_number - xPixels, 0))
+        return offset
+
+
+def calibrate(
+    sampling_rates,
+    edge_volts,
+    pixel_number=500,
+    average_number=2,
+    model=None,
+    save=True,
+):
+    """
+    Measure the galvo lag with bidirectional scans of the sample under the
+    objective, at every sampling rate and scan amplitude.
+
+    Parameters
+    ----------
+    sampling_rates : list of int
+        Sampling rates of the scans.
+    edge_volts : list of float
+        Scan amplitudes, the scans go from -edge_volt to edge_volt.
+    pixel_number : int, optional
+        Number of pixels of the scans. The default is 500.
+    average_number : int, optional
+        Frames averaged for each measurement. The default is 2.
+    model : GalvoLagModel, optional
+        Model to add the measurements to. The default is None, the
+        default_galvo_lag.
+    save : bool, optional
+        Save the model. The default is True.
+
+    Returns
+    -------
+    GalvoLagModel
+
+    """
+    # Imported here, the scan backend uses this module.
+    from GalvoWidget.GalvoScan_backend import RasterScan
+
+    if model is None:
+        model = default_galvo_lag
+
+    for sampling_rate in sampling_rates:
+        for edge_volt in edge_volts:
+            scan = RasterScan(
+                sampling_rate,
+                edge_volt,
+                pixel_number,
+                average_number,
+                bidirectional=True,
+                phase_offset=0,
+            )
+            lag = lag_from_bidirectional_image(scan.run())
+            print(
+                "Galvo lag at {} Hz, +-{} V: {:.2f} samples".format(
+                    sampling_rate, edge_volt, lag
+                )
+            )
+            model.add_measurement(sampling_rate, pixel_number, 2 * edge_volt, lag)
+
+    if save == True:
+        model.save()
+    return model
+
+
+# Shared by all scans, the saved calibration if there is one.
+default_galvo_lag = GalvoLagModel.load()
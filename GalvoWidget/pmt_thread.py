@@ -7,12 +7,6 @@ Created on Mon Mar 18 12:21:01 2019
 Notes:
     
 """
-import nidaqmx
-from nidaqmx.stream_readers import AnalogMultiChannelReader
-from nidaqmx.stream_writers import AnalogSingleChannelWriter
-from nidaqmx.constants import AcquisitionType, TaskMode
-from nidaqmx.stream_writers import AnalogMultiChannelWriter, DigitalMultiChannelWriter
-from nidaqmx.stream_readers import AnalogSingleChannelReader
 from PyQt5.QtCore import pyqtSignal, QThread
 
 import sys
@@ -20,9 +14,23 @@ import sys
 sys.path.append("../")
 
 import numpy as np
-import NIDAQ.wavegenerator
+from NIDAQ.daqbackend import (
+    nidaqmx,
+    AcquisitionType,
+    TaskMode,
+    AnalogMultiChannelReader,
+    AnalogSingleChannelReader,
+    AnalogSingleChannelWriter,
+    AnalogMultiChannelWriter,
+    DigitalMultiChannelWriter,
+)
 from NIDAQ.wavegenerator import blockWave
-from NIDAQ.constants import MeasurementConstants
+from NIDAQ.rastercache import default_raster_cache
+from NIDAQ.rasterreconstruction import RasterReconstruction
+from GalvoWidget.framering import FrameRing
+from GalvoWidget.galvolag import default_galvo_lag
+from NIDAQ.staticoutput import default_static_output
+from NIDAQ.constants import MeasurementConstants, NiDaqChannels
 
 # =============================================================================
 # For continuous raster scanning
@@ -30,9 +38,9 @@ from NIDAQ.constants import MeasurementConstants
 
 
 class pmtimaging_continuous_Thread(QThread):
-    measurement = pyqtSignal(
-        np.ndarray
-    )  # The signal for the measurement, we can connect to this signal
+    # Emitted when a new frame is in self.frame_ring, only once until the
+    # display took it with self.frame_ring.take_latest().
+    frame_ready = pyqtSignal()
 
     def __init__(
         self,
@@ -41,13 +49,36 @@ class pmtimaging_continuous_Thread(QThread):
         readNumber,
         averagenumber,
         ScanArrayXnum,
+        exponential_factor=None,
+        bidirectional=False,
+        xPixels=None,
+        phase_offset=None,
+        voltage_range=None,
+        adaptive_averaging=None,
+        pmt_channels=None,
         *args,
         **kwargs
     ):
         """
         wave is the output data
         sampleRate is the sampleRate of the DAQ
-        readNumber is the
+        readNumber is the number of samples of one (averaged) frame
+        exponential_factor is the weight of a new frame in the running average
+        of the displayed frames, None for no running average
+        bidirectional is True for a triangle raster, the odd lines are scanned
+        backwards
+        xPixels is the number of pixels of each line, by default yPixels
+        phase_offset is the number of samples the PMT signal lags behind the
+        galvos in a bidirectional scan, None to take it from the galvo lag
+        calibration
+        voltage_range is the peak to peak voltage of the x scan, for the galvo
+        lag calibration
+        adaptive_averaging is a GalvoWidget.adaptiveaveraging.AdaptiveAverager,
+        the displayed frames are then its running mean and the imaging stops
+        when it has averaged enough, None for free running imaging
+        pmt_channels are the read-in channels of NiDaqChannels recorded at the
+        same time, like ["PMT", "PMT2"], the frames are then (channels, y, x),
+        None for ["PMT"]
         """
         super().__init__(*args, **kwargs)
 
@@ -59,6 +90,51 @@ class pmtimaging_continuous_Thread(QThread):
             (self.readNumber / self.averagenumber) / self.ScanArrayXnum
         )
 
+        if xPixels is None:
+            xPixels = self.ypixelnumber
+
+        # Cut off the flying back part, after the calibrated galvo lag.
+        x_slice = None
+        if bidirectional == True:
+            # Only the linear part of the lines is read, no fly back.
+            if phase_offset is None:
+                phase_offset = default_galvo_lag.phase_offset(
+                    self.sampleRate, xPixels, voltage_range, self.ScanArrayXnum
+                )
+        else:
+            x_slice = default_galvo_lag.crop(
+                self.sampleRate, xPixels, voltage_range, self.ScanArrayXnum
+            )
+            phase_offset = 0
+
+        self.reconstruction = RasterReconstruction(
+            self.ScanArrayXnum,
+            self.ypixelnumber,
+            self.averagenumber,
+            x_slice=x_slice,
+            polarity=-1,
+            bidirectional=bidirectional,
+            xPixels=xPixels,
+            phase_offset=phase_offset,
+        )
+        if pmt_channels is None:
+            pmt_channels = ["PMT"]
+        self.pmt_channels = list(pmt_channels)
+        # Frames of several PMTs have the channels in front.
+        self.channel_number = (
+            len(self.pmt_channels) if len(self.pmt_channels) > 1 else None
+        )
+
+        self.adaptive_averaging = adaptive_averaging
+        if self.adaptive_averaging is not None:
+            # The averager keeps the mean, no running average on top.
+            exponential_factor = None
+        # The frames are reconstructed straight into the ring.
+        self.frame_ring = FrameRing(
+            self.reconstruction.image_shape(channel_number=self.channel_number),
+            exponential_factor=exponential_factor,
+        )
+
         self.wave = wave
 
     def run(self):
@@ -67,11 +143,16 @@ class pmtimaging_continuous_Thread(QThread):
         the buffer periodically
         """
 
+        # Free the galvo channels if they are held open by single value writes.
+        default_static_output.release("/Dev1/ao0:1")
+
         # DAQ
         with nidaqmx.Task() as slave_Task3, nidaqmx.Task() as master_Task:
             # slave_Task3 = nidaqmx.Task()
             slave_Task3.ao_channels.add_ao_voltage_chan("/Dev1/ao0:1")
-            master_Task.ai_channels.add_ai_voltage_chan("/Dev1/ai0")
+            channel_LUT = NiDaqChannels().look_up_table
+            for channel in self.pmt_channels:
+                master_Task.ai_channels.add_ai_voltage_chan(channel_LUT[channel])
 
             slave_Task3.timing.cfg_samp_clk_timing(
                 rate=self.sampleRate,
@@ -86,7 +167,12 @@ class pmtimaging_continuous_Thread(QThread):
                 samps_per_chan=self.readNumber,
             )
 
-            reader = AnalogSingleChannelReader(master_Task.in_stream)
+            if self.channel_number is None:
+                reader = AnalogSingleChannelReader(master_Task.in_stream)
+                output = np.zeros(self.readNumber)
+            else:
+                reader = AnalogMultiChannelReader(master_Task.in_stream)
+                output = np.zeros((self.channel_number, self.readNumber))
             writer = AnalogMultiChannelWriter(slave_Task3.out_stream)
 
             reader.auto_start = False
@@ -99,36 +185,41 @@ class pmtimaging_continuous_Thread(QThread):
             This way the task will have to wait slightly longer for incoming samples. And leaves the buffer
             entirely clean. This way we always know the correct numpy size and are always left with an empty
             buffer (and the buffer will not slowly fill up)."""
-            output = np.zeros(self.readNumber)
+            self.frame_ring.reset_statistics()
+            if self.adaptive_averaging is not None:
+                frame = np.zeros(self.frame_ring.shape)
+                self.adaptive_averaging.start(frame.shape)
             slave_Task3.start()  # Will wait for the readtask to start so it can use its clock
             master_Task.start()
             while not self.isInterruptionRequested():
                 reader.read_many_sample(
                     data=output, number_of_samples_per_channel=self.readNumber
                 )
-
-                # Emiting the data just received as a signal
-
-                Dataholder_average = np.mean(
-                    output.reshape(self.averagenumber, -1), axis=0
-                )
-
-                self.data_PMT = np.reshape(
-                    Dataholder_average, (self.ypixelnumber, self.ScanArrayXnum)
-                )
-                
-                if self.sampleRate == 500000:
-                    if self.ypixelnumber == 500:
-                        self.data_PMT = self.data_PMT[:, 50:550] * -1
-                    elif self.ypixelnumber == 256:
-                        self.data_PMT = self.data_PMT[:, 70:326] * -1
-                elif self.sampleRate == 250000:
-                    if self.ypixelnumber == 500:
-                        self.data_PMT = self.data_PMT[:, 25:525] * -1
-                    elif self.ypixelnumber == 256:
-                        self.data_PMT = self.data_PMT[:, 25:525] * -1
-
-                self.measurement.emit(self.data_PMT)
+                # A whole frame already waiting means the loop falls behind.
+                late = master_Task.in_stream.avail_samp_per_chan >= self.readNumber
+
+                if self.adaptive_averaging is None:
+                    self.reconstruction.reconstruct_image(
+                        output, out=self.frame_ring.next_buffer()
+                    )
+                    done = False
+                else:
+                    # Show the running mean until it is good enough.
+                    self.reconstruction.reconstruct_image(output, out=frame)
+                    done = self.adaptive_averaging.add(frame)
+                    np.copyto(
+                        self.frame_ring.next_buffer(), self.adaptive_averaging.mean
+                    )
+
+                # Notify the display, unless it didn't take the last frame yet.
+                if self.frame_ring.publish(late):
+                    self.frame_ready.emit()
+                if done == True:
+                    break
+
+        print("Continuous PMT imaging: " + self.frame_ring.summary())
+        if self.adaptive_averaging is not None:
+            print("Continuous PMT imaging: " + self.adaptive_averaging.summary())
 
 
 class pmtimagingTest:
@@ -145,16 +236,25 @@ class pmtimagingTest:
         Value_xPixels,
         Value_yPixels,
         averagenum,
+        exponential_factor=None,
+        bidirectional=False,
+        phase_offset=None,
+        adaptive_averaging=None,
+        pmt_channels=None,
     ):
 
         self.Daq_sample_rate = Daq_sample_rate
         self.averagenum = averagenum
+        if adaptive_averaging is not None:
+            # One frame per read, the averager adds them up.
+            self.averagenum = 1
 
         self.Galvo_samples_offset = 0
         self.offsetsamples_galvo = []
 
-        # Generate galvo samples
-        self.samples_1, self.samples_2 = NIDAQ.wavegenerator.waveRecPic(
+        # Generate galvo samples, or get them from the cache if the same raster
+        # was made before.
+        self.raster = default_raster_cache.get(
             sampleRate=self.Daq_sample_rate,
             imAngle=0,
             voltXMin=Value_voltXMin,
@@ -163,8 +263,10 @@ class pmtimagingTest:
             voltYMax=Value_voltYMax,
             xPixels=Value_xPixels,
             yPixels=Value_yPixels,
-            sawtooth=True,
+            sawtooth=not bidirectional,
         )
+        self.samples_1 = self.raster.samples_X
+        self.samples_2 = self.raster.samples_Y
         # ScanArrayX = wavegenerator.xValuesSingleSawtooth(sampleRate = Daq_sample_rate, voltXMin = Value_voltXMin, voltXMax = Value_voltXMax, xPixels = Value_xPixels, sawtooth = True)
         self.Totalscansamples = (
             len(self.samples_1) * self.averagenum
@@ -175,12 +277,7 @@ class pmtimagingTest:
         # print(self.ScanArrayXnum)
         # print(self.Digital_container_feeder[:, 0])
 
-        self.repeated_samples_1 = np.tile(self.samples_1, self.averagenum)
-        self.repeated_samples_2_yaxis = np.tile(self.samples_2, self.averagenum)
-
-        self.Galvo_samples = np.vstack(
-            (self.repeated_samples_1, self.repeated_samples_2_yaxis)
-        )
+        self.Galvo_samples = self.raster.galvo_samples(self.averagenum)
 
         self.pmtimagingThread = pmtimaging_continuous_Thread(
             self.Galvo_samples,
@@ -188,6 +285,13 @@ class pmtimagingTest:
             self.Totalscansamples,
             self.averagenum,
             self.ScanArrayXnum,
+            exponential_factor,
+            bidirectional,
+            Value_xPixels,
+            phase_offset,
+            Value_voltXMax - Value_voltXMin,
+            adaptive_averaging,
+            pmt_channels,
         )
         # self.pmtimagingThread.wave = self.Galvo_samples
         return self.Totalscansamples
@@ -245,6 +349,9 @@ class pmtimaging_continuous_Thread_contour(QThread):
         self.ypixelnumber = int(
             (self.readNumber / self.averagenumber) / self.ScanArrayXnum
         )
+        self.reconstruction = RasterReconstruction(
+            self.ScanArrayXnum, self.ypixelnumber, self.averagenumber
+        )
 
         self.wave = wave
 
@@ -254,6 +361,9 @@ class pmtimaging_continuous_Thread_contour(QThread):
         the buffer periodically
         """
 
+        # Free the galvo channels if they are held open by single value writes.
+        default_static_output.release("/Dev1/ao0:1")
+
         # DAQ
         with nidaqmx.Task() as slave_Task3, nidaqmx.Task() as master_Task:
             # slave_Task3 = nidaqmx.Task()
@@ -297,13 +407,7 @@ class pmtimaging_continuous_Thread_contour(QThread):
 
                 # Emiting the data just received as a signal
 
-                Dataholder_average = np.mean(
-                    output.reshape(self.averagenumber, -1), axis=0
-                )
-
-                self.data_PMT = np.reshape(
-                    Dataholder_average, (self.ypixelnumber, self.ScanArrayXnum)
-                )
+                self.data_PMT = self.reconstruction.reconstruct_image(output)
 
                 self.data_PMT = self.data_PMT * -1
                 # self.measurement.emit(self.data_PMT)
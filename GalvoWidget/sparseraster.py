@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+"""
+Sparse raster scans that only visit the cells of a field.
+
+When the cells of the previous round (ProcessImage.Region_Proposal, the
+MaskRCNN rois) cover a small part of the field, scanning the whole square
+spends most of the time on background. SparseRaster scans only the parts of
+the lines that cover the bounding boxes, at the pixel pitch and line speed of
+the full raster, so the pixels land where they would in a full image. Each
+line segment has a run-up and run-out at the galvo acceleration limit, and
+the galvos skip from one segment to the next as fast as they can:
+
+    boxes = [(120, 40, 180, 95), (300, 310, 352, 371)]
+    raster = SparseRaster(500000, 5, 500, boxes, lag=50)
+    Galvo_samples = raster.galvo_samples(average_number)
+    reconstruction = SparseReconstruction(raster, average_number)
+    image = reconstruction.reconstruct_image(pmt_data)  # (500, 500), 0 outside
+
+The scan time goes down roughly with the part of the lines the boxes cover.
+"""
+
+import math
+
+import numpy as np
+
+from NIDAQ.constants import HardwareConstants
+
+
+def box_segments(bounding_boxes, xPixels, yPixels, merge_gap=0):
+    """
+    Line segments that cover the bounding boxes.
+
+    Parameters
+    ----------
+    bounding_boxes : list of tuple
+        (minr, minc, maxr, maxc) of each box in pixels, the max excluded, like
+        region.bbox of skimage regionprops.
+    xPixels, yPixels : int
+        Size of the full image.
+    merge_gap : int, optional
+        Segments on the same line with at most this many pixels between them
+        are scanned as one. The default is 0.
+
+    Returns
+    -------
+    np.ndarray
+        (segments, 3) int array of row, first column and end column
+        (excluded), by row and column.
+
+    """
+    covered = np.zeros((yPixels, xPixels), dtype=bool)
+    for minr, minc, maxr, maxc in bounding_boxes:
+        covered[
+            max(int(minr), 0) : min(int(maxr), yPixels),
+            max(int(minc), 0) : min(int(maxc), xPixels),
+        ] = True
+
+    segments = []
+    for row in np.flatnonzero(covered.any(axis=1)):
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], covered[row], [0]))))
+        starts, stops = edges[0::2], edges[1::2]
+        # Start a new segment after gaps longer than merge_gap.
+        new = np.concatenate(([True], starts[1:] - stops[:-1] > merge_gap))
+        last = np.append(np.flatnonzero(new)[1:] - 1, len(stops) - 1)
+        for start, stop in zip(starts[new], stops[last]):
+            segments.append((row, start, stop))
+    return np.array(segments, dtype=int).reshape(-1, 3)
+
+
+def _skip(start, end, max_speed, max_acceleration, sampling_rate):
+    # Straight move from rest at start to rest at end, accelerating and
+    # braking at the limit of the galvo that moves most. The samples in
+    # between, start and end excluded.
+    start = np.asarray(start, dtype=float)
+    end = np.asarray(end, dtype=float)
+    distance = np.max(np.abs(end - start))
+    if distance == 0:
+        return np.zeros((2, 0))
+
+    # Along the largest axis, the other one follows in proportion.
+    speed = min(max_speed, math.sqrt(distance * max_acceleration))
+    ramp_time = speed / max_acceleration
+    ramp_distance = 0.5 * speed * ramp_time
+    duration = 2 * ramp_time + (distance - 2 * ramp_distance) / speed
+
+    # Whole samples, the slight stretch only slows it down.
+    sample_number = int(math.ceil(duration * sampling_rate))
+    time = np.arange(1, sample_number) * (duration / sample_number)
+    travelled = np.where(
+        time < ramp_time,
+        0.5 * max_acceleration * time ** 2,
+        np.where(
+            time < duration - ramp_time,
+            ramp_distance + speed * (time - ramp_time),
+            distance - 0.5 * max_acceleration * (duration - time) ** 2,
+        ),
+    )
+    return start[:, np.newaxis] + np.outer(end - start, travelled / distance)
+
+
+class SparseRaster:
+    def __init__(
+        self,
+        sampling_rate,
+        edge_volt,
+        pixel_number,
+        bounding_boxes,
+        lag=0,
+        merge_gap=None,
+        max_speed=None,
+        max_acceleration=None,
+        margin=0.95,
+    ):
+        """
+        Galvo samples of one frame of a sparse raster scan.
+
+        Parameters
+        ----------
+        sampling_rate : int
+            Sampling rate of the DAQ.
+        edge_volt : float
+            The full field goes from -edge_volt to edge_volt, like RasterScan.
+        pixel_number : int
+            Number of pixels of the full image in x and y.
+        bounding_boxes : list of tuple
+            (minr, minc, maxr, maxc) of the cells in pixels of the full image.
+        lag : int, optional
+            Number of samples the recorded signal lags behind the galvo
+            command, see GalvoWidget.galvolag. The pixels are read lag
+            samples after they are scanned. The default is 0.
+        merge_gap : int, optional
+            See box_segments. The default is None, gaps that take less time
+            to scan than to skip are scanned.
+        max_speed, max_acceleration : float, optional
+            Limits of each galvo in V/s and V/s^2. The default is None, the
+            ones in HardwareConstants.
+        margin : float, optional
+            Fraction of the limits that is used. The default is 0.95.
+
+        Attributes
+        ----------
+        samples : np.ndarray
+            (2, samples) x and y galvo voltages of one frame.
+        segments : np.ndarray
+            (segments, 3) row, first column and end column of each segment.
+        pixel_rows, pixel_columns, pixel_sample_index : np.ndarray
+            Pixel of the full image of each scanned pixel and its sample in
+            the frame.
+
+        """
+        constants = HardwareConstants()
+        if max_speed is None:
+            max_speed = constants.maxGalvoSpeed
+        if max_acceleration is None:
+            max_acceleration = constants.maxGalvoAccel
+        max_speed *= margin
+        max_acceleration *= margin
+
+        self.sampling_rate = sampling_rate
+        self.xPixels = self.yPixels = int(pixel_number)
+        self.lag = int(lag)
+
+        # Pixel positions of the full raster, see wavegenerator.waveRecPic.
+        pitch = 2 * edge_volt / (self.xPixels - 1)
+        row_step = 2 * edge_volt / self.yPixels
+
+        # Run-up from rest to the line speed at constant acceleration.
+        ramp_number = int(
+            math.ceil(pitch * sampling_rate ** 2 / max_acceleration)
+        )
+        ramp = np.arange(1, ramp_number + 1)
+        ramp_offset = pitch * ramp - pitch / (2 * ramp_number) * ramp ** 2
+
+        if merge_gap is None:
+            merge_gap = 2 * ramp_number
+        self.segments = box_segments(
+            bounding_boxes, self.xPixels, self.yPixels, merge_gap
+        )
+        if len(self.segments) == 0:
+            raise ValueError("No bounding boxes inside the field.")
+
+        pieces = []
+        pixel_sample_index = []
+        sample_number = 0
+        position = None
+        for row, start, stop in self.segments:
+            x_start = -edge_volt + start * pitch
+            x_stop = -edge_volt + (stop - 1) * pitch
+            y = -edge_volt + row * row_step
+            run_up = x_start - ramp_offset[::-1]
+            if position is not None:
+                pieces.append(
+                    _skip(
+                        position,
+                        (run_up[0], y),
+                        max_speed,
+                        max_acceleration,
+                        sampling_rate,
+                    )
+                )
+                sample_number += pieces[-1].shape[1]
+            x = np.concatenate(
+                (
+                    run_up,
+                    x_start + pitch * np.arange(stop - start),
+                    x_stop + ramp_offset,
+                )
+            )
+            pieces.append(np.vstack((x, np.full(len(x), y))))
+            pixel_sample_index.append(
+                sample_number + ramp_number + np.arange(stop - start)
+            )
+            sample_number += len(x)
+            position = (x[-1], y)
+
+        # Back to the start of the first run-up for the next frame, and wait
+        # there until the last pixel is read.
+        first = pieces[0][:, 0]
+        pieces.append(
+            _skip(position, first, max_speed, max_acceleration, sampling_rate)
+        )
+        sample_number += pieces[-1].shape[1]
+        hold_number = max(
+            pixel_sample_index[-1][-1] + self.lag + 1 - sample_number, 1
+        )
+        pieces.append(np.repeat(first[:, np.newaxis], hold_number, axis=1))
+
+        self.samples = np.hstack(pieces)
+        self.samples_X = self.samples[0]
+        self.samples_Y = self.samples[1]
+        self.pixel_sample_index = np.concatenate(pixel_sample_index)
+        self.pixel_rows = np.repeat(
+            self.segments[:, 0], self.segments[:, 2] - self.segments[:, 1]
+        )
+        self.pixel_columns = np.concatenate(
+            [np.arange(start, stop) for row, start, stop in self.segments]
+        )
+
+        self._repeated_average_number = None
+        self._repeated_samples = None
+
+    @property
+    def frame_sample_number(self):
+        return self.samples.shape[1]
+
+    @property
+    def coverage(self):
+        """
+        Fraction of the pixels of the full image that are scanned.
+        """
+        return len(self.pixel_sample_index) / (self.xPixels * self.yPixels)
+
+    def galvo_samples(self, average_number=1):
+        """
+        (2, frame samples * average_number) array to write to the galvos,
+        the frame repeated average_number times. The last one is kept.
+        """
+        if self._repeated_average_number != average_number:
+            self._repeated_samples = np.tile(self.samples, average_number)
+            self._repeated_average_number = average_number
+        return self._repeated_samples
+
+
+class SparseReconstruction:
+    def __init__(self, raster, average_number=1, polarity=1, fill_value=0):
+        """
+        Full size images from the recorded samples of a sparse raster scan.
+
+        Parameters
+        ----------
+        raster : SparseRaster
+            The raster that was scanned.
+        average_number : int, optional
+            Number of frames recorded one after the other that are averaged.
+            The default is 1.
+        polarity : float, optional
+            Factor applied to the images, -1 for the inverted PMT signal. The
+            default is 1.
+        fill_value : float, optional
+            Value of the pixels that are not scanned. The default is 0.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.raster = raster
+        self.average_number = int(average_number)
+        self.read_index = raster.pixel_sample_index + raster.lag
+        self.polarity = polarity
+        self.fill_value = fill_value
+
+    @property
+    def required_samples(self):
+        return self.raster.frame_sample_number * self.average_number
+
+    def image_shape(self, channel_number=None):
+        if channel_number is None:
+            return (self.raster.yPixels, self.raster.xPixels)
+        return (channel_number, self.raster.yPixels, self.raster.xPixels)
+
+    def reconstruct_image(self, data, out=None):
+        """
+        (yPixels, xPixels) image of the recording, the average of the frames.
+        (channels, yPixels, xPixels) for (channels, samples) data of several
+        PMTs.
+        """
+        data = np.asarray(data)
+        if data.shape[-1] < self.required_samples:
+            raise ValueError(
+                "Recording of {} samples is shorter than the {} samples of the "
+                "frames.".format(data.shape[-1], self.required_samples)
+            )
+        frames = data[..., : self.required_samples].reshape(
+            data.shape[:-1] + (self.average_number, -1)
+        )
+        values = frames[..., self.read_index].mean(axis=-2)
+
+        if out is None:
+            out = np.empty(
+                self.image_shape(data.shape[0] if data.ndim == 2 else None)
+            )
+        out.fill(self.fill_value)
+        out[..., self.raster.pixel_rows, self.raster.pixel_columns] = (
+            values * self.polarity
+        )
+        return out
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""
+Waveforms of a PMT z-stack in one DAQ run.
+
+PMT_zscan used to take a stack plane by plane: move the objective, run a
+raster scan, save it and wait, with the software round trips in between.
+ZStackWaveforms puts the whole stack in one run of the galvos instead. Each
+plane is a settle time with the galvos held at the start of the raster and
+then the frames of the plane, and the objective is moved by the DAQ in the
+same run:
+
+    "staircase"  The objectiveAO channel steps to the voltage of the next
+                 plane at the start of its settle time, for a focus drive
+                 with analog input, e.g. a piezo objective scanner.
+    "ramp"       The objectiveAO channel moves steadily through the stack,
+                 each plane is scanned while the objective goes through one
+                 step around its position. No settle time between planes.
+    "trigger"    A pulse on the objectivetrigger line at the start of the
+                 settle time of each plane after the first, for a drive that
+                 makes a stored step on each trigger.
+
+The recording is split into the planes afterwards, the settle samples are the
+gaps between the images of a RasterReconstruction:
+
+    stack = ZStackWaveforms(raster, 500000, z_positions, average_number=2)
+    mission.runWaveforms("DAQ", 500000, stack.analog_signals(),
+                         stack.digital_signals(), ["PMT"])
+    planes = stack.reconstruction(polarity=-1).reconstruct(pmt_data)
+"""
+
+import math
+
+import numpy as np
+
+from NIDAQ.constants import HardwareConstants
+from NIDAQ.digitalwaveform import DigitalEdgeWaveform, DigitalEdgeWaveforms
+from NIDAQ.rasterreconstruction import RasterReconstruction
+
+ZSTACK_MODES = ("staircase", "ramp", "trigger")
+
+
+class ZStackWaveforms:
+    def __init__(
+        self,
+        raster,
+        sampling_rate,
+        z_positions,
+        average_number=1,
+        mode="staircase",
+        settle_time=0.01,
+        volt_per_mm=None,
+        offset_volt=0.0,
+        trigger_time=1e-4,
+    ):
+        """
+        Galvo, objective and trigger waveforms of a z-stack.
+
+        Parameters
+        ----------
+        raster : NIDAQ.rastercache.RasterWaveforms
+            Raster of one frame.
+        sampling_rate : int
+            Sampling rate of the DAQ.
+        z_positions : array like
+            Objective position of each plane in mm.
+        average_number : int, optional
+            Frames averaged in each plane. The default is 1.
+        mode : str, optional
+            "staircase", "ramp" or "trigger". The default is "staircase".
+        settle_time : float, optional
+            Seconds the objective gets to settle before each plane, only
+            before the first one for a ramp. The default is 0.01.
+        volt_per_mm : float, optional
+            Analog input of the focus drive, volts per mm from the first
+            plane. The default is None, HardwareConstants.objectiveVoltPerMm.
+        offset_volt : float, optional
+            Voltage of the first plane. The default is 0.
+        trigger_time : float, optional
+            Length of the trigger pulses in seconds. The default is 1e-4.
+
+        Returns
+        -------
+        None.
+
+        """
+        if mode not in ZSTACK_MODES:
+            raise ValueError(
+                "Z-stack mode {} is not one of {}.".format(mode, ZSTACK_MODES)
+            )
+        if volt_per_mm is None:
+            volt_per_mm = HardwareConstants().objectiveVoltPerMm
+
+        self.raster = raster
+        self.sampling_rate = sampling_rate
+        self.z_positions = np.asarray(z_positions, dtype=float)
+        self.average_number = int(average_number)
+        self.mode = mode
+
+        self.plane_number = len(self.z_positions)
+        self.plane_sample_number = raster.frame_sample_number * self.average_number
+        self.settle_sample_number = int(math.ceil(settle_time * sampling_rate))
+        # A ramp keeps moving, only the first plane waits.
+        if self.mode == "ramp":
+            self.gap_sample_number = 0
+        else:
+            self.gap_sample_number = self.settle_sample_number
+        # Samples from the start of one plane to the start of the next.
+        self.plane_stride = self.plane_sample_number + self.gap_sample_number
+        self.total_sample_number = (
+            self.settle_sample_number
+            + self.plane_number * self.plane_stride
+            - self.gap_sample_number
+        )
+        # First sample of the frames of each plane.
+        self.plane_starts = self.settle_sample_number + self.plane_stride * np.arange(
+            self.plane_number
+        )
+
+        # Galvos held at the start of the raster while the objective settles.
+        galvo_samples = raster.galvo_samples(self.average_number)
+        hold = np.repeat(galvo_samples[:, :1], self.settle_sample_number, axis=1)
+        plane = [galvo_samples, hold[:, : self.gap_sample_number]]
+        self.galvo_samples = np.hstack([hold] + plane * self.plane_number)[
+            :, : self.total_sample_number
+        ]
+
+        plane_volts = offset_volt + volt_per_mm * (
+            self.z_positions - self.z_positions[0]
+        )
+        self.objective_samples = None
+        self.trigger_waveform = None
+        if self.mode == "staircase":
+            # The next voltage from the start of the settle time of the plane.
+            step_starts = np.append(0, self.plane_starts[1:] - self.gap_sample_number)
+            self.objective_samples = np.repeat(
+                plane_volts, np.diff(np.append(step_starts, self.total_sample_number))
+            )
+        elif self.mode == "ramp":
+            # At the position of each plane halfway through its frames.
+            centres = self.plane_starts + self.plane_sample_number / 2
+            if self.plane_number > 1:
+                slope = (plane_volts[-1] - plane_volts[0]) / (
+                    centres[-1] - centres[0]
+                )
+            else:
+                slope = 0.0
+            sample_index = np.clip(
+                np.arange(self.total_sample_number),
+                self.settle_sample_number,
+                self.total_sample_number,
+            )
+            self.objective_samples = plane_volts[0] + slope * (
+                sample_index - centres[0]
+            )
+        else:
+            # One pulse at the start of the settle time of each next plane.
+            pulse_number = max(int(round(trigger_time * sampling_rate)), 1)
+            pulse_starts = self.plane_starts[1:] - self.gap_sample_number
+            edges = np.column_stack((pulse_starts, pulse_starts + pulse_number)).ravel()
+            self.trigger_waveform = DigitalEdgeWaveform(
+                self.total_sample_number, edges
+            )
+
+    @property
+    def duration(self):
+        return self.total_sample_number / self.sampling_rate
+
+    def analog_signals(self):
+        """
+        Structured array of the galvo and objective waveforms for
+        DAQmission.runWaveforms.
+        """
+        specifications = ["galvosx", "galvosy"]
+        waveforms = [self.galvo_samples[0], self.galvo_samples[1]]
+        if self.objective_samples is not None:
+            specifications.append("objectiveAO")
+            waveforms.append(self.objective_samples)
+
+        signals = np.zeros(
+            len(waveforms),
+            dtype=np.dtype(
+                [
+                    ("Waveform", float, (self.total_sample_number,)),
+                    ("Sepcification", "U20"),
+                ]
+            ),
+        )
+        for row, (waveform, specification) in enumerate(
+            zip(waveforms, specifications)
+        ):
+            signals[row] = (waveform, specification)
+        return signals
+
+    def digital_signals(self):
+        """
+        The trigger line for DAQmission.runWaveforms, {} without triggers.
+        """
+        if self.trigger_waveform is None:
+            return {}
+        return DigitalEdgeWaveforms([self.trigger_waveform], ["objectivetrigger"])
+
+    def reconstruction(self, **kwargs):
+        """
+        RasterReconstruction of all planes of the recording, kwargs like
+        x_slice and polarity are passed on.
+        """
+        return RasterReconstruction.from_raster(
+            self.raster,
+            self.average_number,
+            repeat_number=self.plane_number,
+            offset_samples=self.settle_sample_number,
+            gap_samples=self.gap_sample_number,
+            **kwargs
+        )
@@ -60,6 +60,13 @@ if __name__ == "__main__":
     dname = os.path.dirname(abspath)
     os.chdir(dname + "/../")
 from ImageAnalysis.ImageProcessing import ProcessImage, PatchAnalysis
+from NIDAQ.digitalwaveform import load_waveforms_file
+from NIDAQ.recording import (
+    RecordingFile,
+    is_recording_file,
+    load_recorded_channel,
+    RECORDING_FILE_EXTENSION,
+)
 import StylishQT
 
 
@@ -385,8 +392,9 @@ class AnalysisWidgetUI(QWidget):
         Load the 1D array files, like voltage, current recordings or waveform information.
         
         By default the waveforms configured contain 4 extra samples at the front
-        and 1 in the end, while the recored waveforms contain 8 extra samples at
-        the front and 1 in the end.
+        and 1 in the end, and so do the recorded waveforms. The recording file
+        holds the sampling rate of each channel, the Vp and Ip .npy files saved
+        before it have the sampling rate and 4 scaling coefficients in front.
 
         Returns
         -------
@@ -420,8 +428,8 @@ class AnalysisWidgetUI(QWidget):
                 self.Waveform_filename_npy = self.main_directory + "/" + file
                 # Read in configured waveforms
                 configwave_wavenpfileName = self.Waveform_filename_npy
-                self.configured_waveforms_container = np.load(
-                    configwave_wavenpfileName, allow_pickle=True
+                self.configured_waveforms_container = load_waveforms_file(
+                    configwave_wavenpfileName
                 )
                 
                 # Get the sampling rate
@@ -464,17 +472,31 @@ class AnalysisWidgetUI(QWidget):
                             print("Length of cut Vp: {}".format(len(self.configured_Vp)))                            
                         
             # For python generated data
+            elif file.endswith(RECORDING_FILE_EXTENSION):
+                recording = RecordingFile(self.main_directory + "/" + file)
+
+                # In the recorded traces, the first 4 samples are extra
+                # samples for extra camera trigger,
+                # The last one is padding 0 to reset NIDaq channels.
+                if "Vp" in recording:
+                    self.Vpfilename_npy = recording.file_path
+                    self.Vp = recording.channel("Vp")[4:-1]
+                    self.samplingrate_display_curve = recording.sampling_rate("Vp")
+                if "Ip" in recording:
+                    self.Ipfilename_npy = recording.file_path
+                    self.Ip = recording.channel("Ip")[4:-1]
+                    self.samplingrate_display_curve = recording.sampling_rate("Ip")
+
             elif file.startswith("Vp"):
                 self.Vpfilename_npy = self.main_directory + "/" + file
-                curvereadingobjective_V = np.load(self.Vpfilename_npy)
-                
-                # In the recorded Vp trace, the 0 data is sampling rate,
-                # 1 to 4 are NiDaq scaling coffecients, 
-                # 5 to 8 are extra samples for extra camera trigger,
+                (
+                    self.Vp,
+                    self.samplingrate_display_curve,
+                ) = load_recorded_channel(self.Vpfilename_npy, "Vp")
+
+                # 4 extra samples for extra camera trigger,
                 # The last one is padding 0 to reset NIDaq channels.
-                self.Vp = curvereadingobjective_V[9:]
-                self.samplingrate_display_curve = curvereadingobjective_V[0]
-                self.Vp = self.Vp[0:-1]
+                self.Vp = self.Vp[4:-1]
                 
                 # This is from Fixed output from the patch amplifier, unfiltered, x10 already.
                 # Ditched x10 voltage channel in amplifier from 22.12.2021
@@ -482,16 +504,14 @@ class AnalysisWidgetUI(QWidget):
 
             elif file.startswith("Ip"):
                 self.Ipfilename_npy = self.main_directory + "/" + file
-                curvereadingobjective_I = np.load(self.Ipfilename_npy)
-                # print("I raw: {}".format(curvereadingobjective_I[1000]))
-                                
-                # In the recorded Vp trace, the 0 data is sampling rate,
-                # 1 to 4 are NiDaq scaling coffecients, 
-                # 5 to 8 are extra samples for extra camera trigger,
+                (
+                    self.Ip,
+                    self.samplingrate_display_curve,
+                ) = load_recorded_channel(self.Ipfilename_npy, "Ip")
+
+                # 4 extra samples for extra camera trigger,
                 # The last one is padding 0 to reset NIDaq channels.
-                self.Ip = curvereadingobjective_I[9:]
-                self.Ip = self.Ip[0:-1]
-                self.samplingrate_display_curve = curvereadingobjective_I[0]
+                self.Ip = self.Ip[4:-1]
 
     def getfile_background(self):
         self.fileName_background, _ = QtWidgets.QFileDialog.getOpenFileName(
@@ -989,27 +1009,39 @@ class AnalysisWidgetUI(QWidget):
         )
         self.textbox_single_waveform_filename.setText(self.single_waveform_fileName)
 
-        self.single_waveform = np.load(
-            self.single_waveform_fileName, allow_pickle=True
-        )
-
         wave_sampling_rate = self.waveform_samplingrate_box.value()
+        channel_name = self.single_waveform_fileName
+
+        if is_recording_file(self.single_waveform_fileName):
+            # Plot the first channel, at the sampling rate in the file.
+            recording = RecordingFile(self.single_waveform_fileName)
+            channel_name = recording.channel_names[0]
+            wave_sampling_rate = recording.sampling_rate(channel_name)
+            # 4 extra samples for extra camera trigger, padding 0 at the end.
+            self.single_waveform = recording.channel(channel_name)
+            trace = self.single_waveform[4:-1]
+        else:
+            self.single_waveform = np.load(
+                self.single_waveform_fileName, allow_pickle=True
+            )
+            # first 5 are sampling rate, Daq coffs
+            trace = self.single_waveform[9:-1]
         
-        time_axis = np.arange(len(self.single_waveform[9:-1]))/wave_sampling_rate
+        time_axis = np.arange(len(trace))/wave_sampling_rate
         
         try:
-            if 'Ip' in self.single_waveform_fileName:
+            if 'Ip' in channel_name:
             # If plotting the patch current
-                self.Ip = self.single_waveform[9:-1]
+                self.Ip = trace
                 
                 fig, ax = plt.subplots()
                 plt.plot(time_axis, self.Ip * 10000)
                 ax.set_title("Patch current")
                 ax.set_ylabel("Current (pA)")
                 ax.set_xlabel("time(s)")
-            elif 'Vp' in self.single_waveform_fileName:
+            elif 'Vp' in channel_name:
                 # If plotting the patch voltage
-                self.Vp = self.single_waveform[9:-1]
+                self.Vp = trace
                 
                 fig, ax = plt.subplots()
                 plt.plot(time_axis, self.Vp * 1000)
@@ -1020,8 +1052,8 @@ class AnalysisWidgetUI(QWidget):
                 print(
                 "For Vp recored earlier than 22.12.2021, pls devided by 10 as the amplifier channel multipliesby 10 by default."
                 )
-            elif "PMT" in self.single_waveform_fileName:
-                self.PMT_recording = self.single_waveform[9:-1]
+            elif "PMT" in channel_name:
+                self.PMT_recording = trace
                 
                 fig, ax = plt.subplots()
                 plt.plot(time_axis, self.PMT_recording)
@@ -1154,7 +1186,7 @@ class PlotAnalysisGUI(QWidget):
         configwave_wavenpfileName = (
             self.wave_fileName
         )  
-        temp_loaded_container = np.load(configwave_wavenpfileName, allow_pickle=True)
+        temp_loaded_container = load_waveforms_file(configwave_wavenpfileName)
 
         Daq_sample_rate = int(
             float(
@@ -1229,8 +1261,8 @@ class PlotAnalysisGUI(QWidget):
                 if (
                     "Vp" in os.path.split(Readin_fileName)[1]
                 ):  # See which channel is recorded
-                    Vm = np.load(Readin_fileName, allow_pickle=True)
-                    Vm = Vm[9:-1]  # first 5 are sampling rate, Daq coffs
+                    Vm, _ = load_recorded_channel(Readin_fileName, "Vp")
+                    Vm = Vm[4:-1]  # extra camera trigger samples and padding 0
                     # Vm[0] = Vm[1]
 
                 ax2.set_xlabel("time(s)")
@@ -1344,8 +1376,8 @@ class PlotAnalysisGUI(QWidget):
                     if (
                         "Vp" in os.path.split(Readin_fileName)[1]
                     ):  # See which channel is recorded
-                        Vm = np.load(Readin_fileName, allow_pickle=True)
-                        Vm = Vm[9:-1]  # first 5 are sampling rate, Daq coffs
+                        Vm, _ = load_recorded_channel(Readin_fileName, "Vp")
+                        Vm = Vm[4:-1]  # extra camera trigger samples and padding 0
                         # Vm[0] = Vm[1]
 
                     ax2.set_xlabel("time(s)")
@@ -51,6 +51,10 @@ import scipy.stats as stats
 import cv2
 import seaborn as sns
 
+from NIDAQ.digitalwaveform import load_waveforms_file
+from NIDAQ.recording import load_recorded_channel, RECORDING_FILE_EXTENSION
+from GalvoWidget.contourschedule import schedule_contours
+
 # import plotly.express as px
 
 class ProcessImage:
@@ -1063,7 +1067,7 @@ class ProcessImage:
                 #                print(len(np.where(contour_mask_thin_line == 1)[0]))
                 if len(np.where(contour_mask_thin_line == 1)[0]) > 0:
                     # -------------------Sorting and filtering----------------------
-                    clockwise_sorted_raw_trace = ProcessImage.sort_index_clockwise(
+                    clockwise_sorted_raw_trace = ProcessImage.trace_contour_clockwise(
                         contour_mask_thin_line
                     )
                     [
@@ -1157,123 +1161,114 @@ class ProcessImage:
 
         return CellSkeletonizedContourDict
 
-    def sort_index_clockwise(cellmap):
+    # Moore neighbourhood, clockwise on the image (row axis pointing down)
+    # starting from the west neighbour.
+    _CLOCKWISE_NEIGHBOURS = (
+        (0, -1),
+        (-1, -1),
+        (-1, 0),
+        (-1, 1),
+        (0, 1),
+        (1, 1),
+        (1, 0),
+        (1, -1),
+    )
+
+    def trace_contour_clockwise(cellmap):
         """
-        Given the binary contour, sort the index so that they are in clockwise sequence for further contour scanning.
+        Given the binary contour, walk along it clockwise and return the pixels
+        in that order, for contour scanning.
+
+        Moore neighbour tracing from the top left pixel of the contour: from
+        each pixel the neighbours are searched clockwise, starting after the
+        background pixel it was entered from, so every step takes constant
+        time. Each pixel on the outside of the contour is visited once,
+        pixels on the inside corner of a staircase are passed over.
 
         Parameters
         ----------
         cellmap : ndarray
-            Binary contour skeleton.
+            Binary contour skeleton, contour pixels are 1.
 
         Returns
         -------
-        result : ndarray
-            In clockwise sequence.
+        result : list of tuple
+            (row, column) of the contour pixels in clockwise sequence,
+            starting at the top left one.
 
         """
-
-        rawindexlist = list(zip(np.where(cellmap == 1)[0], np.where(cellmap == 1)[1]))
-        rawindexlist.sort()
-
-        cclockwiselist = rawindexlist[0:1]  # first point in clockwise direction
-        clockwiselist = rawindexlist[1:2]  # first point in counter clockwise direction
-        # reverse the above assignment depending on how first 2 points relate
-        if rawindexlist[1][1] > rawindexlist[0][1]:
-            clockwiselist = rawindexlist[1:2]
-            cclockwiselist = rawindexlist[0:1]
-
-        coordstorage = rawindexlist[2:]
-        #        print(len(rawindexlist))
-        timeout = time.time()
-        while len(clockwiselist + cclockwiselist) != len(rawindexlist):
-            for (
-                p
-            ) in (
-                coordstorage
-            ):  # Try one by one from coords dump until find one that is right next to existing clockwise or counter clockwise liste.
-                # append to the list to which the next point is closest
-                x_last_clockwise = clockwiselist[-1][0]
-                y_last_clockwise = clockwiselist[-1][1]
-                x_last_cclockwise = cclockwiselist[-1][0]
-                y_last_cclockwise = cclockwiselist[-1][1]
-                #                if (x_last_clockwise-p[0])**2+(y_last_clockwise-p[1])**2 == 1 and \
-                #                ((x_last_clockwise-p[0])**2+(y_last_clockwise-p[1])**2) < ((x_last_cclockwise-p[0])**2+(y_last_cclockwise-p[1])**2):
-                #                    clockwiselist.append(p)
-                #                    coordstorage.remove(p)
-                if (x_last_clockwise - p[0]) ** 2 + (
-                    y_last_clockwise - p[1]
-                ) ** 2 <= 2 and (
-                    (x_last_clockwise - p[0]) ** 2 + (y_last_clockwise - p[1]) ** 2
-                ) <= (
-                    (x_last_cclockwise - p[0]) ** 2 + (y_last_cclockwise - p[1]) ** 2
-                ):
-                    clockwiselist.append(p)
-                    coordstorage.remove(p)
+        # Padded so the neighbours of the edge pixels can always be looked up.
+        contour = np.pad(np.asarray(cellmap) == 1, 1)
+        rows, columns = np.nonzero(contour)
+        if len(rows) == 0:
+            return []
+
+        neighbours = ProcessImage._CLOCKWISE_NEIGHBOURS
+        direction_index = {offset: index for index, offset in enumerate(neighbours)}
+
+        # np.nonzero is in row major order, the first pixel is the top left
+        # one and its west neighbour is background.
+        start = (int(rows[0]), int(columns[0]))
+        current = start
+        backtrack = 0
+        result = [(start[0] - 1, start[1] - 1)]
+
+        # A closed contour is done when the start pixel is entered the same
+        # way again, the limit only matters for odd shapes like spurs.
+        for _ in range(4 * len(rows) + 4):
+            for turn in range(1, 9):
+                direction = (backtrack + turn) % 8
+                row = current[0] + neighbours[direction][0]
+                column = current[1] + neighbours[direction][1]
+                if contour[row, column]:
                     break
-                elif (x_last_cclockwise - p[0]) ** 2 + (
-                    y_last_cclockwise - p[1]
-                ) ** 2 <= 2 and (
-                    (x_last_clockwise - p[0]) ** 2 + (y_last_clockwise - p[1]) ** 2
-                ) > (
-                    (x_last_cclockwise - p[0]) ** 2 + (y_last_cclockwise - p[1]) ** 2
-                ):
-                    #                    print((cclockwiselist[-1][0]-p[0])**2+(cclockwiselist[-1][1]-p[1])**2)
-                    #                    print('cc')
-                    cclockwiselist.append(p)
-                    coordstorage.remove(p)
-                    break
-            # If clockwise and counter clockwise meet each other
-            if (
-                len(clockwiselist + cclockwiselist) > 10
-                and (x_last_clockwise - x_last_cclockwise) ** 2
-                + (y_last_clockwise - y_last_cclockwise) ** 2
-                <= 2
-            ):
+            else:
+                # Single pixel.
                 break
-            # If we have a situation like this at the end of enclosure:
-            #  0  0  1
-            #  0  1  1
-            #  1  0  0
-            if (
-                len(clockwiselist + cclockwiselist) > 10
-                and (x_last_clockwise - x_last_cclockwise) ** 2
-                + (y_last_clockwise - y_last_cclockwise) ** 2
-                == 5
-            ):
-                if (cclockwiselist[-2][0] - clockwiselist[-1][0]) ** 2 + (
-                    cclockwiselist[-2][1] - clockwiselist[-1][1]
-                ) ** 2 == 2:
-                    cclockwiselist.remove(cclockwiselist[-1])
-                    break
 
-            if time.time() > timeout + 2:
-                print("timeout")
+            # The background pixel checked last, seen from the new pixel.
+            previous = neighbours[(direction - 1) % 8]
+            backtrack = direction_index[
+                (
+                    current[0] + previous[0] - row,
+                    current[1] + previous[1] - column,
+                )
+            ]
+            current = (row, column)
+            if current == start and backtrack == 0:
                 break
-        #        print(clockwiselist[-1])
-        #        print(cclockwiselist[-1])
-        #        print(p)
-        print(coordstorage)
-        cclockwiselist.reverse()
-        result = clockwiselist + cclockwiselist
+            result.append((row - 1, column - 1))
 
         return result
 
+    def sort_index_clockwise(cellmap):
+        """
+        Given the binary contour, sort the index so that they are in clockwise sequence for further contour scanning.
+
+        Kept for older scripts, see trace_contour_clockwise.
+
+        Parameters
+        ----------
+        cellmap : ndarray
+            Binary contour skeleton.
+
+        Returns
+        -------
+        result : list
+            In clockwise sequence.
+
+        """
+        return ProcessImage.trace_contour_clockwise(cellmap)
+
     def tune_contour_routine(cellmap, clockwise_sorted_raw_trace, filtering_kernel):
         """
         # =============================================================================
         #  Given the clockwise sorted binary contour, interploate and filter for further contour scanning.
         # =============================================================================
         """
-        Unfiltered_contour_routine_X = np.array([])
-        Unfiltered_contour_routine_Y = np.array([])
-        for rawcoord in clockwise_sorted_raw_trace:
-            Unfiltered_contour_routine_X = np.append(
-                Unfiltered_contour_routine_X, rawcoord[0]
-            )
-            Unfiltered_contour_routine_Y = np.append(
-                Unfiltered_contour_routine_Y, rawcoord[1]
-            )
+        raw_trace = np.asarray(clockwise_sorted_raw_trace, dtype=float).reshape(-1, 2)
+        Unfiltered_contour_routine_X = raw_trace[:, 0]
+        Unfiltered_contour_routine_Y = raw_trace[:, 1]
 
         # filtering and show filtered contour
         #        X_routine = medfilt(Unfiltered_contour_routine_X, kernel_size=filtering_kernel)
@@ -1286,11 +1281,55 @@ class ProcessImage:
         )
 
         filtered_cellmap = np.zeros((cellmap.shape[0], cellmap.shape[1]))
-        for i in range(len(X_routine)):
-            filtered_cellmap[int(X_routine[i]), int(Y_routine[i])] = 1
+        filtered_cellmap[X_routine.astype(int), Y_routine.astype(int)] = 1
 
         return [X_routine, Y_routine], filtered_cellmap
 
+    def mask_to_contour_voltages(filled_mask, OriginalImage, scanning_voltage):
+        """
+        Smoothed contour of the cell in the filled mask, in galvo voltages.
+
+        Parameters
+        ----------
+        filled_mask : ndarray
+            The filled binary mask which ONLY covers cell of interest.
+        OriginalImage : ndarray
+            Raw image.
+        scanning_voltage : float
+            The scanning voltage of input image.
+
+        Returns
+        -------
+        ndarray or None
+            (2, n) x and y voltages clockwise along the contour, None if no
+            contour is found.
+
+        """
+        # Find contour along filled image
+        contour_mask_thin_line = ProcessImage.findContour(
+            filled_mask, OriginalImage.copy(), threshold=0.001
+        )
+        if len(np.where(contour_mask_thin_line == 1)[0]) == 0:
+            return None
+
+        # -------------------Sorting and filtering----------------------
+        clockwise_sorted_raw_trace = ProcessImage.trace_contour_clockwise(
+            contour_mask_thin_line
+        )
+        [X_routine, Y_routine], filtered_cellmap = ProcessImage.tune_contour_routine(
+            contour_mask_thin_line, clockwise_sorted_raw_trace, filtering_kernel=1.5
+        )
+
+        # ------------Organize for Ni-daq execution---------------------
+        voltage_contour_routine_X = (
+            X_routine / OriginalImage.shape[0]
+        ) * scanning_voltage * 2 - scanning_voltage
+        voltage_contour_routine_Y = (
+            Y_routine / OriginalImage.shape[1]
+        ) * scanning_voltage * 2 - scanning_voltage
+
+        return np.vstack((voltage_contour_routine_X, voltage_contour_routine_Y))
+
     def mask_to_contourScanning_DAQsignals(
         filled_mask,
         OriginalImage,
@@ -1316,31 +1355,11 @@ class ProcessImage:
             1.54 * 10 ** 8
         )  # Maximum acceleration of galvo mirror in volt/s^2
 
-        # Find contour along filled image
-        contour_mask_thin_line = ProcessImage.findContour(
-            filled_mask, OriginalImage.copy(), threshold=0.001
+        contour_voltages = ProcessImage.mask_to_contour_voltages(
+            filled_mask, OriginalImage, scanning_voltage
         )
-        # --------------------------------------------------------------
-        if len(np.where(contour_mask_thin_line == 1)[0]) > 0:
-            # -------------------Sorting and filtering----------------------
-            clockwise_sorted_raw_trace = ProcessImage.sort_index_clockwise(
-                contour_mask_thin_line
-            )
-            [
-                X_routine,
-                Y_routine,
-            ], filtered_cellmap = ProcessImage.tune_contour_routine(
-                contour_mask_thin_line, clockwise_sorted_raw_trace, filtering_kernel=1.5
-            )
-            # --------------------------------------------------------------
-
-            # ------------Organize for Ni-daq execution---------------------
-            voltage_contour_routine_X = (
-                X_routine / OriginalImage.shape[0]
-            ) * scanning_voltage * 2 - scanning_voltage
-            voltage_contour_routine_Y = (
-                Y_routine / OriginalImage.shape[1]
-            ) * scanning_voltage * 2 - scanning_voltage
+        if contour_voltages is not None:
+            voltage_contour_routine_X, voltage_contour_routine_Y = contour_voltages
 
             # -----interpolate to get desired number of points in one contour---
             x_axis = np.arange(0, len(voltage_contour_routine_X))
@@ -1384,6 +1403,53 @@ class ProcessImage:
             return
 
         return ContourArray_forDaq
+
+    def masks_to_scheduled_contourScanning_DAQsignals(
+        filled_masks, OriginalImage, scanning_voltage, sampling_rate, repeats=1
+    ):
+        """
+        Contour scanning signals of several cells in one waveform. The cells
+        are visited in a short round trip and the galvos go round the
+        contours and between the cells as fast as they can, see
+        GalvoWidget.contourschedule.
+
+        Parameters
+        ----------
+        filled_masks : list of ndarray
+            The filled binary masks, each ONLY covering one cell of interest.
+        OriginalImage : ndarray
+            Raw image.
+        scanning_voltage : float
+            The scanning voltage of input image.
+        sampling_rate : int
+            sampling rate for contour scanning.
+        repeats : int, optional
+            Number of rounds. The default is 1.
+
+        Returns
+        -------
+        ContourArray_forDaq : ndarray
+            galvos_X_contour and galvos_Y_contour signals.
+        schedule : GalvoWidget.contourschedule.ContourSchedule
+            Samples of each cell in a round, in the order of the masks that
+            have a contour.
+
+        """
+        contours = []
+        for filled_mask in filled_masks:
+            contour_voltages = ProcessImage.mask_to_contour_voltages(
+                filled_mask, OriginalImage, scanning_voltage
+            )
+            if contour_voltages is None:
+                print("Error: no contour found")
+            else:
+                contours.append(contour_voltages)
+
+        if len(contours) == 0:
+            return
+
+        schedule = schedule_contours(contours, sampling_rate)
+        return schedule.to_daq_signals(repeats), schedule
     
     def SNR_2P_calculation(
         path,
@@ -4403,20 +4469,23 @@ class ProcessImage:
         for file in os.listdir(main_directory):
             if "Wavefroms_sr_" in file and "npy" in file:
                 wave_fileName = os.path.join(main_directory, file)
-                temp_wave_container = np.load(wave_fileName, allow_pickle=True)
+                temp_wave_container = load_waveforms_file(wave_fileName)
                 
                 wave_file_sampling_rate = int(file[file.index("sr_")+3:file.index(".npy")])
                 
-            if "Ip" in file and "npy" in file:
+            if "Ip" in file and ("npy" in file or file.endswith(RECORDING_FILE_EXTENSION)):
                 current_fileName = os.path.join(main_directory, file)
-                temp_current_container = np.load(current_fileName, allow_pickle=True)
-                # Here in raw file, first 5 numbers are meta data, then in the beginning
-                # and the end both have a 0 extra recording to reset the NIDAQ channel.
+                # Recording file, or raw file with 5 numbers of meta data in front.
+                temp_current_container, current_sampling_rate = load_recorded_channel(
+                    current_fileName, "Ip"
+                )
+                # In the beginning and the end both have a 0 extra recording to
+                # reset the NIDAQ channel.
                 # Probe gain: low-100M ohem
                 # [DAQ recording / 10**8 (voltage to current)]* 10**12 (A to pA) == pA
-                current_curve = temp_current_container[6:len(temp_current_container)-1] * 10000
+                current_curve = temp_current_container[1:-1] * 10000
                 
-                patchcurrentlabel = np.arange(len(current_curve)) / wave_file_sampling_rate
+                patchcurrentlabel = np.arange(len(current_curve)) / current_sampling_rate
                 
         # Get the blanking waveform as indication of laser on and off.
         for i in temp_wave_container:
@@ -10,15 +10,9 @@ READIN TASK HAS TO START AHEAD OF READ MANY SAMPLES, OTHERWISE ITS NOT in SYN!!!
 # The adaptive NI DAQ tool
 
 # import time
-import nidaqmx
+import threading
+from concurrent.futures import CancelledError
 import numpy as np
-from nidaqmx.constants import AcquisitionType, TaskMode, LineGrouping, Signal
-from nidaqmx.stream_writers import (
-    AnalogMultiChannelWriter,
-    DigitalMultiChannelWriter,
-    DigitalSingleChannelWriter,
-)
-from nidaqmx.stream_readers import AnalogSingleChannelReader, AnalogMultiChannelReader
 from datetime import datetime
 import os
 from PyQt5.QtCore import pyqtSignal, QThread
@@ -26,6 +20,30 @@ import sys
 
 sys.path.append("../")
 from NIDAQ.constants import NiDaqChannels
+from NIDAQ.waveformcompiler import default_cache
+from NIDAQ.staticoutput import default_static_output
+from NIDAQ.daqbackend import (
+    nidaqmx,
+    ai_dev_scaling_coeff,
+    AcquisitionType,
+    TaskMode,
+    LineGrouping,
+    Signal,
+    RegenerationMode,
+    AnalogMultiChannelWriter,
+    DigitalMultiChannelWriter,
+    DigitalSingleChannelWriter,
+    AnalogSingleChannelReader,
+    AnalogMultiChannelReader,
+    AnalogUnscaledReader,
+)
+from NIDAQ.recording import (
+    scale_counts,
+    save_recording,
+    waveform_specifications,
+)
+from NIDAQ.datasink import DecimatingSink
+from NIDAQ.taskpool import release_pools
 
 
 class DAQmission(
@@ -39,7 +57,9 @@ class DAQmission(
     collected_data = pyqtSignal(np.ndarray)
     finishSignal = pyqtSignal()
 
-    def __init__(self, channel_LUT=None, *args, **kwargs):
+    def __init__(
+        self, channel_LUT=None, waveform_cache=None, static_output=None, *args, **kwargs
+    ):
 
         super().__init__(*args, **kwargs)
         """
@@ -47,21 +67,54 @@ class DAQmission(
         purpose of the channel (the same as the fields from the input waveforms' "Sepcification" 
         field) and values being the port of the daq. If not specified it will load the dictionary
         from NiDaqChannels class in NIDAQ.constants.
+
+        waveform_cache is the NIDAQ.waveformcompiler.WaveformCache to take compiled
+        waveform packages from, by default the shared default_cache.
+
+        static_output is the NIDAQ.staticoutput.StaticOutputManager that keeps the
+        tasks of sendSingleAnalog and sendSingleDigital open, by default the shared
+        default_static_output.
         """
         if channel_LUT == None:
             self.channel_LUT = NiDaqChannels().look_up_table
         else:
             self.channel_LUT = channel_LUT
 
+        # Set by runWaveforms, None unless the recording is streamed.
+        self.data_sink = None
+        self.streamed = False
+        # Set by runWaveforms when channels are recorded at their own rate.
+        self.multi_rate = False
+        self.channel_sampling_rates = None
+
+        # Abort event of the current run, set by abort() to stop it.
+        self._abort_event = None
+        self._readin_task = None
+        self._chunks_done = None
+
+        # Compiled waveform packages, shared between instances by default.
+        if waveform_cache == None:
+            self.waveform_cache = default_cache
+        else:
+            self.waveform_cache = waveform_cache
+
+        if static_output == None:
+            self.static_output = default_static_output
+        else:
+            self.static_output = static_output
+
     def sendSingleAnalog(self, channel, value):
         """
-        Write one single digital signal.
+        Write one single analog signal.
+
+        The task of the channel is kept open by self.static_output, so only the
+        first write to a channel has to create it.
 
         Parameters
         ----------
         channel : str
             Purpose of the channel.
-        value : bool
+        value : float
             Value to send.
 
         Returns
@@ -73,20 +126,20 @@ class DAQmission(
         self.channelname = self.channel_LUT[channel]
         self.writting_value = value
 
-        # Assume that dev1 is always employed
-        with nidaqmx.Task() as writingtask:
-            writingtask.ao_channels.add_ao_voltage_chan(self.channelname)
-            writingtask.write(self.writting_value)
+        self.static_output.write_analog(self.channelname, self.writting_value)
 
     def sendSingleDigital(self, channel, value):
         """
-        Write one single analog signal.
+        Write one single digital signal.
+
+        The task of the channel is kept open by self.static_output, so only the
+        first write to a channel has to create it.
 
         Parameters
         ----------
         channel : str
             Purpose of the channel.
-        value : float
+        value : bool
             Value to send.
 
         Returns
@@ -97,13 +150,11 @@ class DAQmission(
 
         self.channelname = self.channel_LUT[channel]
         if value == True:
-            writting_value = np.array([1], dtype=bool)
+            writting_value = True
         else:
-            writting_value = np.array([0], dtype=bool)
+            writting_value = False
 
-        with nidaqmx.Task() as writingtask:
-            writingtask.do_channels.add_do_chan(self.channelname)
-            writingtask.write(writting_value)
+        self.static_output.write_digital(self.channelname, writting_value)
 
     def runWaveforms(
         self,
@@ -112,6 +163,12 @@ class DAQmission(
         analog_signals,
         digital_signals,
         readin_channels,
+        data_sink=None,
+        chunk_size=None,
+        task_pool=None,
+        unscaled=False,
+        channel_rates=None,
+        abort_event=None,
     ):
         """
         Input:
@@ -133,168 +190,128 @@ class DAQmission(
               It's a structured array with two fields: 1) 'Waveform': Raw 1-D np.array of type bool.
                                                        2) 'Sepcification': string that specifies the NI-daq port.
                                                           for example: dtype = np.dtype([('Waveform', float, (self.reference_length,)), ('Sepcification', 'U20')])
+              Can also be a NIDAQ.digitalwaveform.DigitalEdgeWaveforms, the lines
+              as edge lists, which is packed into the port waveform without
+              expanding the lines one by one.
            -readinchannels:
               A list that contains the readin channels wanted.
+
+           -data_sink:
+              Optional, object from NIDAQ.datasink (or anything with the same
+              open/write/close methods). If given, the recording is streamed:
+              AI is read in chunks of chunk_size samples through an every-N-samples
+              callback and each chunk is handed to the sink instead of being
+              kept in self.Dataholder, so memory use no longer grows with the
+              recording length.
+
+           -chunk_size:
+              Number of samples per channel in each streamed chunk. Defaults
+              to 0.1 s worth of samples.
+
+           -task_pool:
+              Optional NIDAQ.taskpool.DAQTaskPool. If given, the tasks are
+              taken from the pool and kept configured and armed after the run,
+              instead of being created and closed again. Runs with only
+              digital signals don't use the pool. Runs without a pool close
+              the idle pools first, they hold the channels reserved.
+
+           -unscaled:
+              If True, the AI channels are read as raw int16 ADC counts with
+              AnalogUnscaledReader, a quarter of the size of scaled float64.
+              self.Dataholder and collected_data then hold counts, use
+              get_scaled_data() for volts. save_as_binary stores the counts
+              with the scaling coefficients of every channel, NIDAQ.recording.RecordingFile
+              scales them when they are read.
+              When streaming, give the data sink dtype="int16" to keep the
+              counts small on disk as well. Can't be combined with
+              channel_rates.
+
+           -channel_rates:
+              Optional dict with the sampling rate of recording channels,
+              like {"Vp": 10000, "Ip": 10000}, channels not in it are recorded
+              at sampling_rate. The rates have to divide sampling_rate. All
+              channels are still sampled at sampling_rate by the one AI clock
+              of the device, the read samples are block-averaged down to the
+              channel's rate before they are stored.
+              self.Dataholder and collected_data then hold a 1-D object array
+              with the samples of each channel, self.channel_sampling_rates
+              the rate of every channel, save_as_binary saves them with
+              the recording. A data sink gets the decimated
+              chunks, which needs the same rate for all recorded channels.
+
+           -abort_event:
+              Optional threading.Event of this run, the acquisition stops
+              when it is set, also when it is set before the run starts.
+              abort() sets it. Defaults to a new event, so an abort() of an
+              earlier run doesn't stop this one.
         """
 
         # =============================================================================
         #         Setting up waveforms
         # =============================================================================
 
-        Analog_channel_number = len(analog_signals)
-        Digital_channel_number = len(digital_signals)
+        # Every run has its own abort event.
+        if abort_event is None:
+            abort_event = threading.Event()
+        self._abort_event = abort_event
         self.readin_channels = readin_channels
         self.sampling_rate = sampling_rate
+        self.clock_source = clock_source
+        # Kept with the recording when it is saved.
+        self.waveform_specs = waveform_specifications(
+            analog_signals, digital_signals, self.channel_LUT
+        )
+        self.acquisition_start_time = None
+        self.acquisition_finish_time = None
 
         # ----------------------------------------------------------------------
-        # galvosx and galvosy as specification key words are already enough.
-
-        # Get the average number and y pixel number information from data
-        self.galvosx_originalkey = "galvosx"
-        self.galvosy_originalkey = "galvosy"
-
-        # If there are kyes with information like 'galvosxavgnum', extract the
-        # information and then convert the key to 'galvosx'.
-        if Analog_channel_number != 0:
-            for i in range(len(analog_signals["Sepcification"])):
-                if "galvosxavgnum" in analog_signals["Sepcification"][i]:
-                    self.averagenumber = int(
-                        analog_signals["Sepcification"][i][
-                            analog_signals["Sepcification"][i].index("_")
-                            + 1 : len(analog_signals["Sepcification"][i])
-                        ]
-                    )
-                    self.galvosx_originalkey = analog_signals["Sepcification"][i]
-                    analog_signals["Sepcification"][i] = "galvosx"
-                elif "galvosyypixels" in analog_signals["Sepcification"][i]:
-                    self.ypixelnumber = int(
-                        analog_signals["Sepcification"][i][
-                            analog_signals["Sepcification"][i].index("_")
-                            + 1 : len(analog_signals["Sepcification"][i])
-                        ]
-                    )
-                    self.galvosy_originalkey = analog_signals["Sepcification"][i]
-                    analog_signals["Sepcification"][i] = "galvosy"
-                elif "galvos_X_contour" in analog_signals["Sepcification"][i]:
-                    self.galvosx_originalkey = analog_signals["Sepcification"][i]
-                    analog_signals["Sepcification"][i] = "galvosx"
-
-                elif "galvos_Y_contour" in analog_signals["Sepcification"][i]:
-                    self.galvosy_originalkey = analog_signals["Sepcification"][i]
-                    analog_signals["Sepcification"][i] = "galvosy"
-
-        # ----------------------------------------------------------------------
+        # Sorting the channels over the devices, stacking the analog samples
+        # and packing the digital lines is done once per waveform package,
+        # packages that were sent before come straight from the cache.
+        compiled = self.waveform_cache.get(
+            analog_signals, digital_signals, self.channel_LUT
+        )
+        self.compiled_waveforms = compiled
 
-        # -------------------Devide samples from Dev1 or 2----------------------
-        self.Dev1_analog_channel_list = []
-        self.Dev2_analog_channel_list = []
+        Analog_channel_number = compiled.Analog_channel_number
+        Digital_channel_number = compiled.Digital_channel_number
 
-        Dev1_analog_waveforms_list = []
-        Dev2_analog_waveforms_list = []
-
-        if Analog_channel_number != 0:
-            if len(analog_signals["Waveform"]) != 0:
-                num_rows, num_cols = analog_signals["Waveform"].shape
-                for i in range(int(num_rows)):
-                    if "Dev1" in self.channel_LUT[analog_signals["Sepcification"][i]]:
-                        self.Dev1_analog_channel_list.append(
-                            self.channel_LUT[analog_signals["Sepcification"][i]]
-                        )
-                        Dev1_analog_waveforms_list.append(analog_signals["Waveform"][i])
-                    else:
-                        self.Dev2_analog_channel_list.append(
-                            self.channel_LUT[analog_signals["Sepcification"][i]]
-                        )
-                        Dev2_analog_waveforms_list.append(analog_signals["Waveform"][i])
+        # galvosx and galvosy as specification key words are already enough.
+        # Information like the average number and y pixel number, from keys
+        # like 'galvosxavgnum_2', is extracted while compiling.
+        self.galvosx_originalkey = compiled.galvosx_originalkey
+        self.galvosy_originalkey = compiled.galvosy_originalkey
+        if compiled.averagenumber is not None:
+            self.averagenumber = compiled.averagenumber
+        if compiled.ypixelnumber is not None:
+            self.ypixelnumber = compiled.ypixelnumber
+
+        self.Dev1_analog_channel_list = compiled.Dev1_analog_channel_list
+        self.Dev2_analog_channel_list = compiled.Dev2_analog_channel_list
 
         Dev1_analog_channel_number = len(self.Dev1_analog_channel_list)
         Dev2_analog_channel_number = len(self.Dev2_analog_channel_list)
-        # ----------------------------------------------------------------------
 
         # See if only digital signal is involved.
-        if Analog_channel_number == 0 and Digital_channel_number != 0:
-            self.Only_Digital_signals = True
-        else:
-            self.Only_Digital_signals = False
-
-        # See if Dev1 is involved. If only Dev2 is involved in sending analog
-        # signals then the timing configs are different.
+        self.Only_Digital_signals = compiled.Only_Digital_signals
 
         # ------------------Number of samples in each waveform------------------
+        self.Waveforms_length = compiled.Waveforms_length
         if self.Only_Digital_signals == False:
-            self.Waveforms_length = len(analog_signals["Waveform"][0])
-            num_rows, num_cols = analog_signals["Waveform"].shape
-            print("row number of analog signals:  " + str(num_rows))
-        elif self.Only_Digital_signals == True:
-            self.Waveforms_length = len(digital_signals["Waveform"][0])
-        # ----------------------------------------------------------------------
-
-        # -------Stack the Analog samples of dev1 and dev2 individually---------
-        # IN CASE OF ONLY ONE ARRAY, WE NEED TO CONVERT THE SHAPE TO (1,N) BY USING np.array([]) OUTSIDE THE ARRAY!!
-        if Dev1_analog_channel_number == 1:
-            Dev1_analog_samples_to_write = np.array([Dev1_analog_waveforms_list[0]])
-
-        elif Dev1_analog_channel_number == 0:
-            Dev1_analog_samples_to_write = []
-        else:
-            Dev1_analog_samples_to_write = Dev1_analog_waveforms_list[0]
-            for i in range(1, Dev1_analog_channel_number):
-                Dev1_analog_samples_to_write = np.vstack(
-                    (Dev1_analog_samples_to_write, Dev1_analog_waveforms_list[i])
-                )
-
-        if Dev2_analog_channel_number == 1:
-            Dev2_analog_samples_to_write = np.array([Dev2_analog_waveforms_list[0]])
-        elif Dev2_analog_channel_number == 0:
-            Dev2_analog_samples_to_write = []
-        else:
-            Dev2_analog_samples_to_write = Dev2_analog_waveforms_list[0]
-            for i in range(1, Dev2_analog_channel_number):
-                Dev2_analog_samples_to_write = np.vstack(
-                    (Dev2_analog_samples_to_write, Dev2_analog_waveforms_list[i])
+            print("row number of analog signals:  " + str(Analog_channel_number))
+
+        # C-contiguous (channel number, samples) arrays, digital lines already
+        # packed into one uint32 port waveform of shape (1, samples).
+        Dev1_analog_samples_to_write = compiled.Dev1_analog_samples
+        Dev2_analog_samples_to_write = compiled.Dev2_analog_samples
+        Digital_samples_to_write = compiled.Digital_samples
+        if compiled.Period_length is not None:
+            print(
+                "Periodic waveforms, writing one period of {} samples.".format(
+                    compiled.Period_length
                 )
-
-        # Stack the digital samples
-        if Digital_channel_number == 1:
-            Digital_samples_to_write = np.array([digital_signals["Waveform"][0]])
-
-        elif Digital_channel_number == 0:
-            Digital_samples_to_write = []
-        else:
-            Digital_samples_to_write = digital_signals["Waveform"][0]
-            for i in range(1, Digital_channel_number):
-                Digital_samples_to_write = np.vstack(
-                    (Digital_samples_to_write, digital_signals["Waveform"][i])
-                )
-        # ----------------------------------------------------------------------
-
-        # ------------------Set the dtype of digital signals--------------------
-        # For each digital waveform sample, it 0 or 1. To write to NI-daq, you
-        # need to send int number corresponding to the channel binary value,
-        # like write 8(2^3, 0001) to channel 4.
-        # The same as (0b1 << n)
-        Digital_samples_to_write = np.array(Digital_samples_to_write, dtype="uint32")
-
-        for i in range(Digital_channel_number):
-
-            convernum = int(
-                self.channel_LUT[digital_signals["Sepcification"][i]][
-                    self.channel_LUT[digital_signals["Sepcification"][i]].index("line")
-                    + 4 : len(self.channel_LUT[digital_signals["Sepcification"][i]])
-                ]
-            )
-            Digital_samples_to_write[i] = Digital_samples_to_write[i] * (
-                2 ** (convernum)
             )
-
-        # For example, to send commands to line 0 and line 3, you hava to write 1001 to digital port, convert to uint32 that is 9.
-        if Digital_channel_number > 1:
-            Digital_samples_to_write = np.sum(
-                Digital_samples_to_write, axis=0
-            )  # sum along the columns, for multiple lines
-            Digital_samples_to_write = np.array(
-                [Digital_samples_to_write]
-            )  # here convert the shape from (n,) to (1,n)
+        # ----------------------------------------------------------------------
 
         # ------------Set up data holder for recording data---------------------
         if len(self.readin_channels) != 0:
@@ -302,14 +319,71 @@ class DAQmission(
         else:
             self.has_recording_channel = False
 
+        self.unscaled = unscaled
+        if self.unscaled == True:
+            self.Dataholder_dtype = np.int16
+        else:
+            self.Dataholder_dtype = np.float64
+
+        # Recording channels at a lower rate are decimated chunk by chunk, as
+        # in streaming mode.
+        self.streamed = data_sink is not None
+        self.decimation_factors = self.get_decimation_factors(channel_rates)
+        self.channel_sampling_rates = None
+        if self.has_recording_channel == True and any(
+            factor != 1 for factor in self.decimation_factors
+        ):
+            if self.unscaled == True:
+                # Averaged counts are no int16 counts anymore.
+                raise ValueError(
+                    "Channels recorded at their own rate can't be unscaled, "
+                    "record them in volts."
+                )
+            self.multi_rate = True
+            data_sink = DecimatingSink(
+                self.decimation_factors, data_sink, dtype=self.Dataholder_dtype
+            )
+            if chunk_size is None:
+                # Whole blocks of every channel in each chunk.
+                block_size = int(np.lcm.reduce(self.decimation_factors))
+                chunk_size = block_size * max(
+                    round(self.sampling_rate / 10 / block_size), 1
+                )
+        else:
+            self.multi_rate = False
+
+        # In streaming mode the data holder only keeps one chunk.
+        self.data_sink = data_sink
+        if self.data_sink is not None:
+            if chunk_size is None:
+                chunk_size = max(int(self.sampling_rate / 10), 1)
+            self.chunk_size = int(min(chunk_size, self.Waveforms_length))
+            self.Dataholder_length = self.chunk_size
+        else:
+            self.Dataholder_length = self.Waveforms_length
+
         if self.has_recording_channel == True:
             self.Dataholder = np.zeros(
-                (len(self.readin_channels), self.Waveforms_length)
+                (len(self.readin_channels), self.Dataholder_length),
+                dtype=self.Dataholder_dtype,
             )
         else:
-            self.Dataholder = np.zeros((1, self.Waveforms_length))
+            self.Dataholder = np.zeros((1, self.Dataholder_length), dtype=self.Dataholder_dtype)
         # ----------------------------------------------------------------------
 
+        # Free the channels held open by single value writes.
+        self.static_output.release(
+            self.Dev1_analog_channel_list
+            + self.Dev2_analog_channel_list
+            + ["/Dev1/port0"]
+        )
+
+        if task_pool is not None and self.Only_Digital_signals == False:
+            self.run_pooled_tasks(task_pool, clock_source, compiled)
+            return
+        # Pools from earlier runs still hold the channels reserved.
+        release_pools()
+
         # =============================================================================
         #         Configure DAQ channels and execute waveforms
         # =============================================================================
@@ -334,31 +408,24 @@ class DAQmission(
 
                 if self.has_recording_channel == True:
                     self.Dataholder = np.zeros(
-                        (len(self.readin_channels), self.Waveforms_length)
+                        (len(self.readin_channels), self.Dataholder_length),
+                        dtype=self.Dataholder_dtype,
                     )
                 else:
-                    self.Dataholder = np.zeros((1, self.Waveforms_length))
+                    self.Dataholder = np.zeros((1, self.Dataholder_length), dtype=self.Dataholder_dtype)
                     master_Task_readin.ai_channels.add_ai_voltage_chan(
                         self.channel_LUT["Vp"]
                     )  # If no read-in channel is added, vp channel is added to keep code alive.
 
                 #            print(self.Dataholder.shape)
-                if "PMT" in self.readin_channels:
-                    master_Task_readin.ai_channels.add_ai_voltage_chan(
-                        self.channel_LUT["PMT"]
-                    )
-                if "Vp" in self.readin_channels:
-                    master_Task_readin.ai_channels.add_ai_voltage_chan(
-                        self.channel_LUT["Vp"]
-                    )
                 # =============================================================================
                 #     For the current measurement, we use the voltage channel in DAQ
                 #     and convert to current later devided by current gain and patch
                 #     probe resistance.
                 # =============================================================================
-                if "Ip" in self.readin_channels:
+                for channel in self.recording_channel_names():
                     master_Task_readin.ai_channels.add_ai_voltage_chan(
-                        self.channel_LUT["Ip"]
+                        self.channel_LUT[channel]
                     )
                 # ----------------------------------------------------------
 
@@ -368,27 +435,13 @@ class DAQmission(
                 self.ai_dev_scaling_coeff_vp = []
                 self.ai_dev_scaling_coeff_ip = []
                 if "Vp" in self.readin_channels:
-                    self.ai_dev_scaling_coeff_vp = (
-                        nidaqmx._task_modules.channels.ai_channel.AIChannel(
-                            master_Task_readin._handle, self.channel_LUT["Vp"]
-                        )
-                    )
-                    # https://knowledge.ni.com/KnowledgeArticleDetails?id=kA00Z0000019TuoSAE&l=nl-NL
-                    # self.ai_dev_scaling_coeff.ai_dev_scaling_coeff
-                    self.ai_dev_scaling_coeff_vp = np.array(
-                        self.ai_dev_scaling_coeff_vp.ai_dev_scaling_coeff
+                    self.ai_dev_scaling_coeff_vp = ai_dev_scaling_coeff(
+                        master_Task_readin, self.channel_LUT["Vp"]
                     )
 
                 if "Ip" in self.readin_channels:
-                    self.ai_dev_scaling_coeff_ip = (
-                        nidaqmx._task_modules.channels.ai_channel.AIChannel(
-                            master_Task_readin._handle, self.channel_LUT["Ip"]
-                        )
-                    )
-                    # https://knowledge.ni.com/KnowledgeArticleDetails?id=kA00Z0000019TuoSAE&l=nl-NL
-                    # self.ai_dev_scaling_coeff.ai_dev_scaling_coeff
-                    self.ai_dev_scaling_coeff_ip = np.array(
-                        self.ai_dev_scaling_coeff_ip.ai_dev_scaling_coeff
+                    self.ai_dev_scaling_coeff_ip = ai_dev_scaling_coeff(
+                        master_Task_readin, self.channel_LUT["Ip"]
                     )
 
                 self.ai_dev_scaling_coeff_list = np.append(
@@ -439,13 +492,13 @@ class DAQmission(
                             samps_per_chan=self.Waveforms_length,
                         )
 
-                        AnalogWriter = nidaqmx.stream_writers.AnalogMultiChannelWriter(
+                        AnalogWriter = AnalogMultiChannelWriter(
                             slave_Task_1_analog_dev1.out_stream, auto_start=False
                         )
                         AnalogWriter.auto_start = False
 
                         AnalogWriter_dev2 = (
-                            nidaqmx.stream_writers.AnalogMultiChannelWriter(
+                            AnalogMultiChannelWriter(
                                 slave_Task_1_analog_dev2.out_stream, auto_start=False
                             )
                         )
@@ -515,13 +568,13 @@ class DAQmission(
 
                         # slave_Task_1_analog_dev2.triggers.start_trigger.cfg_dig_edge_start_trig(self.channel_LUT["trigger2Channel"])#'/Dev2/PFI7'
 
-                        AnalogWriter = nidaqmx.stream_writers.AnalogMultiChannelWriter(
+                        AnalogWriter = AnalogMultiChannelWriter(
                             slave_Task_1_analog_dev1.out_stream, auto_start=False
                         )
                         AnalogWriter.auto_start = False
 
                         AnalogWriter_dev2 = (
-                            nidaqmx.stream_writers.AnalogMultiChannelWriter(
+                            AnalogMultiChannelWriter(
                                 slave_Task_1_analog_dev2.out_stream, auto_start=False
                             )
                         )
@@ -542,12 +595,12 @@ class DAQmission(
                     # ----------------------------------------------------------
 
                 # ------------Configure the writer and reader---------------
-                AnalogWriter = nidaqmx.stream_writers.AnalogMultiChannelWriter(
+                AnalogWriter = AnalogMultiChannelWriter(
                     slave_Task_1_analog_dev1.out_stream, auto_start=False
                 )
                 AnalogWriter.auto_start = False
                 if Digital_channel_number != 0:
-                    DigitalWriter = nidaqmx.stream_writers.DigitalMultiChannelWriter(
+                    DigitalWriter = DigitalMultiChannelWriter(
                         slave_Task_2_digitallines.out_stream, auto_start=False
                     )
                     DigitalWriter.auto_start = False
@@ -556,16 +609,19 @@ class DAQmission(
                 # ---------------------------------------------------------------------------------------------------------------------
 
                 # -----------------------------------------------------Begin to execute in DAQ------------------------------------------
+                self.configure_regeneration(slave_Task_1_analog_dev1)
                 AnalogWriter.write_many_sample(
                     Dev1_analog_samples_to_write, timeout=605.0
                 )
 
                 if Dev2_analog_channel_number != 0:
+                    self.configure_regeneration(slave_Task_1_analog_dev2)
                     AnalogWriter_dev2.write_many_sample(
                         Dev2_analog_samples_to_write, timeout=605.0
                     )
 
                 if Digital_channel_number != 0:
+                    self.configure_regeneration(slave_Task_2_digitallines)
                     DigitalWriter.write_many_sample_port_uint32(
                         Digital_samples_to_write, timeout=605.0
                     )
@@ -578,13 +634,8 @@ class DAQmission(
                 if Digital_channel_number != 0:
                     slave_Task_2_digitallines.start()
 
-                master_Task_readin.start()  #!!!!!!!!!!!!!!!!!!!! READIN TASK HAS TO START AHEAD OF READ MANY SAMPLES, OTHERWISE ITS NOT SYN!!!
-
-                reader.read_many_sample(
-                    data=self.Dataholder,
-                    number_of_samples_per_channel=self.Waveforms_length,
-                    timeout=605.0,
-                )
+                #!!!!!!!!!!!!!!!!!!!! READIN TASK HAS TO START AHEAD OF READ MANY SAMPLES, OTHERWISE ITS NOT SYN!!!
+                self.acquire_recording(master_Task_readin, reader)
                 # self.data_PMT = []
 
                 slave_Task_1_analog_dev1.wait_until_done()
@@ -601,19 +652,11 @@ class DAQmission(
                     slave_Task_2_digitallines.stop()
                 master_Task_readin.stop()
 
-                if self.has_recording_channel == True:
+                if self.has_recording_channel == True and self.streamed == False:
                     self.collected_data.emit(self.Dataholder)
                 self.finishSignal.emit()
                 print("^^^^^^^^^^^^^^^^^^Daq tasks finish^^^^^^^^^^^^^^^^^^")
 
-            # set the keys of galvos back for next round
-            if Analog_channel_number != 0:
-                for i in range(len(analog_signals["Sepcification"])):
-                    if "galvosx" in analog_signals["Sepcification"][i]:
-                        analog_signals["Sepcification"][i] = self.galvosx_originalkey
-                    elif "galvosy" in analog_signals["Sepcification"][i]:
-                        analog_signals["Sepcification"][i] = self.galvosy_originalkey
-
             """
             # =============================================================================
             #         Only Dev 2 is involved  in sending analog signals
@@ -630,26 +673,19 @@ class DAQmission(
 
                 if self.has_recording_channel == True:
                     self.Dataholder = np.zeros(
-                        (len(self.readin_channels), self.Waveforms_length)
+                        (len(self.readin_channels), self.Dataholder_length),
+                        dtype=self.Dataholder_dtype,
                     )
                 else:
-                    self.Dataholder = np.zeros((1, self.Waveforms_length))
+                    self.Dataholder = np.zeros((1, self.Dataholder_length), dtype=self.Dataholder_dtype)
                     master_Task_readin.ai_channels.add_ai_voltage_chan(
                         self.channel_LUT["Vp"]
                     )  # If no read-in channel is added, vp channel is added to keep code alive.
 
                 #            print(self.Dataholder.shape)
-                if "PMT" in self.readin_channels:
-                    master_Task_readin.ai_channels.add_ai_voltage_chan(
-                        self.channel_LUT["PMT"]
-                    )
-                if "Vp" in self.readin_channels:
-                    master_Task_readin.ai_channels.add_ai_voltage_chan(
-                        self.channel_LUT["Vp"]
-                    )
-                if "Ip" in self.readin_channels:
+                for channel in self.recording_channel_names():
                     master_Task_readin.ai_channels.add_ai_voltage_chan(
-                        self.channel_LUT["Ip"]
+                        self.channel_LUT[channel]
                     )
 
                 # get scaling coefficients
@@ -658,25 +694,13 @@ class DAQmission(
                 self.ai_dev_scaling_coeff_vp = []
                 self.ai_dev_scaling_coeff_ip = []
                 if "Vp" in self.readin_channels:
-                    self.ai_dev_scaling_coeff_vp = (
-                        nidaqmx._task_modules.channels.ai_channel.AIChannel(
-                            master_Task_readin._handle, self.channel_LUT["Vp"]
-                        )
-                    )
-                    # self.ai_dev_scaling_coeff.ai_dev_scaling_coeff
-                    self.ai_dev_scaling_coeff_vp = np.array(
-                        self.ai_dev_scaling_coeff_vp.ai_dev_scaling_coeff
+                    self.ai_dev_scaling_coeff_vp = ai_dev_scaling_coeff(
+                        master_Task_readin, self.channel_LUT["Vp"]
                     )
 
                 if "Ip" in self.readin_channels:
-                    self.ai_dev_scaling_coeff_ip = (
-                        nidaqmx._task_modules.channels.ai_channel.AIChannel(
-                            master_Task_readin._handle, self.channel_LUT["Ip"]
-                        )
-                    )
-                    # self.ai_dev_scaling_coeff.ai_dev_scaling_coeff
-                    self.ai_dev_scaling_coeff_ip = np.array(
-                        self.ai_dev_scaling_coeff_ip.ai_dev_scaling_coeff
+                    self.ai_dev_scaling_coeff_ip = ai_dev_scaling_coeff(
+                        master_Task_readin, self.channel_LUT["Ip"]
                     )
 
                 self.ai_dev_scaling_coeff_list = np.append(
@@ -717,7 +741,7 @@ class DAQmission(
                         )
 
                         AnalogWriter_dev2 = (
-                            nidaqmx.stream_writers.AnalogMultiChannelWriter(
+                            AnalogMultiChannelWriter(
                                 slave_Task_1_analog_dev2.out_stream, auto_start=False
                             )
                         )
@@ -771,7 +795,7 @@ class DAQmission(
                             self.cam_trigger_receiving_port
                         )
                         AnalogWriter_dev2 = (
-                            nidaqmx.stream_writers.AnalogMultiChannelWriter(
+                            AnalogMultiChannelWriter(
                                 slave_Task_1_analog_dev2.out_stream, auto_start=False
                             )
                         )
@@ -793,7 +817,7 @@ class DAQmission(
                 # Configure the writer and reader
 
                 if Digital_channel_number != 0:
-                    DigitalWriter = nidaqmx.stream_writers.DigitalMultiChannelWriter(
+                    DigitalWriter = DigitalMultiChannelWriter(
                         slave_Task_2_digitallines.out_stream, auto_start=False
                     )
                     DigitalWriter.auto_start = False
@@ -804,11 +828,13 @@ class DAQmission(
                 # -----------------------------------------------------Begin to execute in DAQ------------------------------------------
 
                 if Dev2_analog_channel_number != 0:
+                    self.configure_regeneration(slave_Task_1_analog_dev2)
                     AnalogWriter_dev2.write_many_sample(
                         Dev2_analog_samples_to_write, timeout=605.0
                     )
 
                 if Digital_channel_number != 0:
+                    self.configure_regeneration(slave_Task_2_digitallines)
                     DigitalWriter.write_many_sample_port_uint32(
                         Digital_samples_to_write, timeout=605.0
                     )
@@ -820,13 +846,8 @@ class DAQmission(
                 if Digital_channel_number != 0:
                     slave_Task_2_digitallines.start()
 
-                master_Task_readin.start()  #!!!!!!!!!!!!!!!!!!!! READIN TASK HAS TO START AHEAD OF READ MANY SAMPLES, OTHERWISE ITS NOT SYN!!!
-
-                reader.read_many_sample(
-                    data=self.Dataholder,
-                    number_of_samples_per_channel=self.Waveforms_length,
-                    timeout=605.0,
-                )
+                #!!!!!!!!!!!!!!!!!!!! READIN TASK HAS TO START AHEAD OF READ MANY SAMPLES, OTHERWISE ITS NOT SYN!!!
+                self.acquire_recording(master_Task_readin, reader)
                 # self.data_PMT = []
 
                 if Dev2_analog_channel_number != 0:
@@ -841,19 +862,11 @@ class DAQmission(
                     slave_Task_2_digitallines.stop()
                 master_Task_readin.stop()
 
-                if self.has_recording_channel == True:
+                if self.has_recording_channel == True and self.streamed == False:
                     self.collected_data.emit(self.Dataholder)
                 self.finishSignal.emit()
                 print("^^^^^^^^^^^^^^^^^^Daq tasks finish^^^^^^^^^^^^^^^^^^")
 
-            # set the keys of galvos back for next round
-            if Analog_channel_number != 0:
-                for i in range(len(analog_signals["Sepcification"])):
-                    if "galvosx" in analog_signals["Sepcification"][i]:
-                        analog_signals["Sepcification"][i] = self.galvosx_originalkey
-                    elif "galvosy" in analog_signals["Sepcification"][i]:
-                        analog_signals["Sepcification"][i] = self.galvosy_originalkey
-
             """
             # =============================================================================
             #         Only digital signals
@@ -862,9 +875,9 @@ class DAQmission(
         elif self.Only_Digital_signals == True:
 
             # some preparations for digital lines
-            Waveforms_length = len(digital_signals["Waveform"][0])
+            Waveforms_length = self.Waveforms_length
 
-            digitalsignalslinenumber = len(digital_signals["Waveform"])
+            digitalsignalslinenumber = Digital_channel_number
 
             # Assume that dev1 is always employed
             with nidaqmx.Task() as slave_Task_2_digitallines:
@@ -881,7 +894,7 @@ class DAQmission(
                 )
 
                 # Configure the writer and reader
-                DigitalWriter = nidaqmx.stream_writers.DigitalMultiChannelWriter(
+                DigitalWriter = DigitalMultiChannelWriter(
                     slave_Task_2_digitallines.out_stream, auto_start=False
                 )
                 DigitalWriter.auto_start = False
@@ -889,6 +902,7 @@ class DAQmission(
                 # ---------------------------------------------------------------------------------------------------------------------
                 # -----------------------------------------------------Begin to execute in DAQ------------------------------------------
                 print("^^^^^^^^^^^^^^^^^^Daq tasks start^^^^^^^^^^^^^^^^^^")
+                self.configure_regeneration(slave_Task_2_digitallines)
                 DigitalWriter.write_many_sample_port_uint32(
                     Digital_samples_to_write, timeout=605.0
                 )
@@ -901,109 +915,394 @@ class DAQmission(
                 print("^^^^^^^^^^^^^^^^^^Daq tasks finish^^^^^^^^^^^^^^^^^^")
         # ----------------------------------------------------------------------------------------------------------------------------------
 
-    def get_raw_data(self):
+    def acquire_recording(self, master_Task_readin, reader):
+        """
+        Start the read-in task and collect the recording, see read_recording.
+        Raises CancelledError if the acquisition was stopped with abort().
+        """
+        self._readin_task = master_Task_readin
+        try:
+            if self.abort_requested == True:
+                raise CancelledError("Acquisition aborted.")
+            self.acquisition_start_time = datetime.now().isoformat()
+            self.read_recording(master_Task_readin, reader)
+            self.acquisition_finish_time = datetime.now().isoformat()
+            if self.abort_requested == True:
+                raise CancelledError("Acquisition aborted.")
+        except Exception:
+            # Reading from the aborted task fails.
+            if self.abort_requested == True:
+                raise CancelledError("Acquisition aborted.")
+            raise
+        finally:
+            self._readin_task = None
+            self._chunks_done = None
+            self._abort_event = None
+
+    @property
+    def abort_requested(self):
+        abort_event = self._abort_event
+        return abort_event is not None and abort_event.is_set()
+
+    def abort(self):
+        """
+        Stop the running acquisition from another thread. runWaveforms then
+        raises CancelledError, the tasks are closed when it returns. Without
+        a running acquisition it does nothing.
+        """
+        abort_event = self._abort_event
+        if abort_event is not None:
+            abort_event.set()
+        readin_task = self._readin_task
+        if readin_task is not None:
+            try:
+                readin_task.control(TaskMode.TASK_ABORT)
+            except Exception as exc:
+                print("Aborting read-in task failed: {}".format(exc))
+        # Wake up a streaming acquisition that waits for the chunks.
+        chunks_done = self._chunks_done
+        if chunks_done is not None:
+            chunks_done.set()
+
+    def read_recording(self, master_Task_readin, reader):
+        """
+        Start the read-in task and collect the recording.
 
-        return self.Dataholder
+        Without data sink the whole recording is read in one go into
+        self.Dataholder. In streaming mode an every-N-samples callback reads
+        chunk_size samples at a time into self.Dataholder and passes them to
+        self.data_sink; the samples left over after the last full chunk are
+        read once the callbacks are done.
 
-    def save_as_binary(self, directory):
-        # print(self.ai_dev_scaling_coeff_vp)
-        if self.has_recording_channel == True:
-            if "Vp" in self.readin_channels:
-
-                if "PMT" not in self.readin_channels:
-                    self.binaryfile_vp_data = np.concatenate(
-                        (
-                            np.array([self.sampling_rate]),
-                            np.array(self.ai_dev_scaling_coeff_vp),
-                            self.Dataholder[0, :],
-                        )
-                    )
-                    np.save(
-                        os.path.join(
-                            directory,
-                            "Vp" + datetime.now().strftime("%Y-%m-%d_%H-%M-%S"),
-                        ),
-                        self.binaryfile_vp_data,
-                    )
+        Parameters
+        ----------
+        master_Task_readin : nidaqmx.Task
+            The configured, not yet started, read-in task.
+        reader : AnalogMultiChannelReader
+            Reader on the in_stream of master_Task_readin.
 
-                    if "Ip" in self.readin_channels:
-                        self.binaryfile_Ip_data = np.concatenate(
-                            (
-                                np.array([self.sampling_rate]),
-                                np.array(self.ai_dev_scaling_coeff_ip),
-                                self.Dataholder[1, :],
-                            )
-                        )
-                        np.save(
-                            os.path.join(
-                                directory,
-                                "Ip" + datetime.now().strftime("%Y-%m-%d_%H-%M-%S"),
-                            ),
-                            self.binaryfile_Ip_data,
-                        )
-                else:
-                    self.binaryfile_vp_data = np.concatenate(
-                        (
-                            np.array([self.sampling_rate]),
-                            np.array(self.ai_dev_scaling_coeff_vp),
-                            self.Dataholder[1, :],
-                        )
-                    )
-                    np.save(
-                        os.path.join(
-                            directory,
-                            "Vp" + datetime.now().strftime("%Y-%m-%d_%H-%M-%S"),
-                        ),
-                        self.binaryfile_vp_data,
+        Returns
+        -------
+        None.
+
+        """
+        if self.unscaled == True:
+            reader = AnalogUnscaledReader(master_Task_readin.in_stream)
+            reader.auto_start = False
+            # Coefficients to convert the counts of each channel to volts.
+            self.ai_dev_scaling_coeff_dict = {
+                channel: ai_dev_scaling_coeff(
+                    master_Task_readin, self.channel_LUT[channel]
+                )
+                for channel in self.recording_channel_names()
+            }
+
+        if self.data_sink is None:
+            master_Task_readin.start()
+
+            self.read_samples(
+                reader, self.Dataholder, self.Waveforms_length, timeout=605.0
+            )
+            return
+
+        full_chunk_number = self.Waveforms_length // self.chunk_size
+        remaining_samples = self.Waveforms_length % self.chunk_size
+        # Expected duration of the recording plus some slack for start up.
+        stream_timeout = self.Waveforms_length / self.sampling_rate + 60.0
+
+        self.streamed_chunk_number = 0
+        self._stream_error = None
+        chunks_done = threading.Event()
+        self._chunks_done = chunks_done
+        if full_chunk_number == 0:
+            chunks_done.set()
+
+        def read_chunk(
+            task_handle, every_n_samples_event_type, number_of_samples, callback_data
+        ):
+            if self.streamed_chunk_number >= full_chunk_number:
+                return 0
+            try:
+                self.read_samples(
+                    reader, self.Dataholder, self.chunk_size, timeout=10.0
+                )
+                if self.has_recording_channel == True:
+                    self.data_sink.write(
+                        self.Dataholder, self.streamed_chunk_number * self.chunk_size
                     )
+            except Exception as exc:
+                self._stream_error = exc
+                chunks_done.set()
+                return 0
+
+            self.streamed_chunk_number += 1
+            if self.streamed_chunk_number == full_chunk_number:
+                chunks_done.set()
+            return 0
+
+        # The buffer only has to hold a few chunks instead of the whole recording.
+        full_buffer_size = master_Task_readin.in_stream.input_buf_size
+        master_Task_readin.in_stream.input_buf_size = min(
+            self.Waveforms_length, 10 * self.chunk_size
+        )
+        master_Task_readin.register_every_n_samples_acquired_into_buffer_event(
+            self.chunk_size, read_chunk
+        )
 
-                    if "Ip" in self.readin_channels:
-                        self.binaryfile_Ip_data = np.concatenate(
-                            (
-                                np.array([self.sampling_rate]),
-                                np.array(self.ai_dev_scaling_coeff_ip),
-                                self.Dataholder[2, :],
-                            )
-                        )
-                        np.save(
-                            os.path.join(
-                                directory,
-                                "Ip" + datetime.now().strftime("%Y-%m-%d_%H-%M-%S"),
-                            ),
-                            self.binaryfile_Ip_data,
-                        )
-            
-            if "Ip" in self.readin_channels:
-                
-                self.binaryfile_Ip_data = np.concatenate(
-                    (
-                        np.array([self.sampling_rate]),
-                        np.array(self.ai_dev_scaling_coeff_ip),
-                        self.Dataholder[0, :],
+        if self.has_recording_channel == True:
+            self.data_sink.open(
+                self.recording_channel_names(), self.sampling_rate, self.Waveforms_length
+            )
+        try:
+            master_Task_readin.start()
+
+            if not chunks_done.wait(timeout=stream_timeout):
+                raise TimeoutError("Streaming acquisition timed out.")
+            if self._stream_error is not None:
+                raise self._stream_error
+            if self.abort_requested == True:
+                return
+
+            if remaining_samples != 0:
+                remaining_holder = np.zeros(
+                    (len(self.Dataholder), remaining_samples),
+                    dtype=self.Dataholder_dtype,
+                )
+                self.read_samples(
+                    reader, remaining_holder, remaining_samples, timeout=10.0
+                )
+                if self.has_recording_channel == True:
+                    self.data_sink.write(
+                        remaining_holder, full_chunk_number * self.chunk_size
+                    )
+        finally:
+            # Tasks from a task pool are used again, remove the callback.
+            master_Task_readin.register_every_n_samples_acquired_into_buffer_event(
+                self.chunk_size, None
+            )
+            # And give it back the buffer for a whole recording.
+            master_Task_readin.in_stream.input_buf_size = full_buffer_size
+            if self.has_recording_channel == True:
+                self.data_sink.close()
+
+        if self.multi_rate == True and self.streamed == False:
+            self.Dataholder = np.empty(len(self.data_sink.channel_data), dtype=object)
+            for row, channel_data in enumerate(self.data_sink.channel_data):
+                self.Dataholder[row] = channel_data
+            self.channel_sampling_rates = list(self.data_sink.sampling_rates)
+
+    def get_decimation_factors(self, channel_rates):
+        """
+        Decimation factor of each recording channel, 1 for the channels that
+        are recorded at the sampling rate of the waveforms.
+        """
+        if channel_rates is None:
+            channel_rates = {}
+
+        decimation_factors = []
+        for channel in self.recording_channel_names():
+            rate = channel_rates.get(channel, self.sampling_rate)
+            factor = self.sampling_rate / rate
+            if factor < 1 or abs(factor - round(factor)) > 1e-9:
+                raise ValueError(
+                    "Rate of {} ({}) has to divide the sampling rate ({}).".format(
+                        channel, rate, self.sampling_rate
                     )
                 )
-                np.save(
-                    os.path.join(
-                        directory,
-                        "Ip" + datetime.now().strftime("%Y-%m-%d_%H-%M-%S"),
-                    ),
-                    self.binaryfile_Ip_data,
-                )                
-                
-                
-            if "PMT" in self.readin_channels:
-                self.data_PMT = self.Dataholder[0, :] * -1
-                np.save(
-                    os.path.join(
-                        directory,
-                        "PMT_array_" + datetime.now().strftime("%Y-%m-%d_%H-%M-%S"),
-                    ),
-                    self.data_PMT,
+            decimation_factors.append(int(round(factor)))
+        return decimation_factors
+
+    def configure_regeneration(self, task):
+        """
+        If the waveform package is periodic only one period was kept when
+        compiling. Set the output buffer of the task to one period, the device
+        then regenerates it until the finite number of samples is generated.
+
+        Parameters
+        ----------
+        task : nidaqmx.Task
+            Output task, with its timing already configured.
+
+        Returns
+        -------
+        None.
+
+        """
+        if self.compiled_waveforms.Period_length is not None:
+            task.out_stream.regen_mode = RegenerationMode.ALLOW_REGENERATION
+            task.out_stream.output_buf_size = self.compiled_waveforms.Period_length
+
+    def run_pooled_tasks(self, task_pool, clock_source, compiled):
+        """
+        Execute the compiled waveforms with the tasks kept in task_pool.
+
+        Parameters
+        ----------
+        task_pool : NIDAQ.taskpool.DAQTaskPool
+            Pool that holds the configured tasks.
+        clock_source : str
+            "DAQ" or "Camera".
+        compiled : NIDAQ.waveformcompiler.CompiledWaveforms
+            The compiled waveform package.
+
+        Returns
+        -------
+        None.
+
+        """
+        master_Task_readin, reader = task_pool.prepare(
+            clock_source, self.sampling_rate, compiled, self.readin_channels
+        )
+
+        # ---------------get scaling coefficients-------------------
+        self.aichannelnames = master_Task_readin.ai_channels.channel_names
+
+        self.ai_dev_scaling_coeff_vp = []
+        self.ai_dev_scaling_coeff_ip = []
+        if "Vp" in self.readin_channels:
+            self.ai_dev_scaling_coeff_vp = task_pool.ai_dev_scaling_coeff[
+                self.channel_LUT["Vp"]
+            ]
+        if "Ip" in self.readin_channels:
+            self.ai_dev_scaling_coeff_ip = task_pool.ai_dev_scaling_coeff[
+                self.channel_LUT["Ip"]
+            ]
+
+        self.ai_dev_scaling_coeff_list = np.append(
+            self.ai_dev_scaling_coeff_vp, self.ai_dev_scaling_coeff_ip
+        )
+        # ----------------------------------------------------------
+
+        print("^^^^^^^^^^^^^^^^^^Daq tasks start^^^^^^^^^^^^^^^^^^")
+        try:
+            self.acquire_recording(master_Task_readin, reader)
+            task_pool.finish()
+        except Exception:
+            task_pool.close()
+            raise
+
+        if self.has_recording_channel == True and self.streamed == False:
+            self.collected_data.emit(self.Dataholder)
+        self.finishSignal.emit()
+        print("^^^^^^^^^^^^^^^^^^Daq tasks finish^^^^^^^^^^^^^^^^^^")
+
+    def read_samples(self, reader, data, number_of_samples, timeout):
+        """
+        Read number_of_samples per channel into data, as counts in unscaled
+        mode and as volts otherwise.
+        """
+        if self.unscaled == True:
+            reader.read_int16(
+                data, number_of_samples_per_channel=number_of_samples, timeout=timeout
+            )
+        else:
+            reader.read_many_sample(
+                data=data,
+                number_of_samples_per_channel=number_of_samples,
+                timeout=timeout,
+            )
+
+    def recording_channel_names(self):
+        """
+        Names of the recorded channels, in the order of the rows in self.Dataholder.
+        """
+        return [
+            channel
+            for channel in NiDaqChannels().readin_channels
+            if channel in self.readin_channels
+        ]
+
+    def get_raw_data(self):
+
+        return self.Dataholder
+
+    def get_scaled_data(self):
+        """
+        Recorded data in volts. Same as get_raw_data() unless the recording
+        was unscaled, then the counts are converted with the scaling
+        coefficients of each channel.
+        """
+        if self.unscaled == False or self.has_recording_channel == False:
+            return self.Dataholder
+
+        if self.multi_rate == True:
+            scaled = np.empty(len(self.Dataholder), dtype=object)
+            for row, channel in enumerate(self.recording_channel_names()):
+                scaled[row] = scale_counts(
+                    self.Dataholder[row], self.ai_dev_scaling_coeff_dict[channel]
                 )
+            return scaled
+
+        coefficients = np.array(
+            [
+                self.ai_dev_scaling_coeff_dict[channel]
+                for channel in self.recording_channel_names()
+            ]
+        )
+        return scale_counts(self.Dataholder, coefficients)
+
+    def save_as_binary(self, directory):
+        """
+        Save the recording of the last run into one recording file, with the
+        sampling rate, scaling coefficients and polarity of every channel, the
+        waveforms and the time of the run. Read it with
+        NIDAQ.recording.RecordingFile, or NIDAQ.recording.load_recorded_channel.
+
+        Parameters
+        ----------
+        directory : str
+            Directory to save the file.
+
+        Returns
+        -------
+        str or None
+            Path of the saved file, None if nothing was recorded.
+
+        """
+        if self.streamed == True:
+            # Streamed recordings are already written by the data sink.
+            print("Recording was streamed to data sink, nothing to save.")
+            return None
 
+        if self.has_recording_channel == False:
+            return None
 
-#                self.pmtimage = Image.fromarray(self.data_PMT) #generate an image object
-#                self.pmtimage.save(os.path.join(directory, 'PMT'+datetime.now().strftime('%Y-%m-%d_%H-%M-%S')+'.tif')) #save as tif
+        channel_names = self.recording_channel_names()
+        if self.multi_rate == True:
+            sampling_rates = self.channel_sampling_rates
+        else:
+            sampling_rates = [self.sampling_rate] * len(channel_names)
+
+        # Unscaled recordings are stored as counts, scaled when they are read.
+        if self.unscaled == True:
+            scaling_coeff = self.ai_dev_scaling_coeff_dict
+        else:
+            scaling_coeff = None
+
+        device_scaling_coeff = {}
+        if "Vp" in channel_names:
+            device_scaling_coeff["Vp"] = self.ai_dev_scaling_coeff_vp
+        if "Ip" in channel_names:
+            device_scaling_coeff["Ip"] = self.ai_dev_scaling_coeff_ip
+
+        self.recording_file_path = save_recording(
+            directory,
+            list(self.Dataholder),
+            channel_names,
+            sampling_rates,
+            scaling_coeff=scaling_coeff,
+            waveform_specs=self.waveform_specs,
+            metadata={
+                "clock_source": self.clock_source,
+                "waveform_sampling_rate": self.sampling_rate,
+                "waveform_samples": self.Waveforms_length,
+                "unscaled": self.unscaled,
+                "device_scaling_coeff": device_scaling_coeff,
+                "start_time": self.acquisition_start_time,
+                "finish_time": self.acquisition_finish_time,
+            },
+        )
+        return self.recording_file_path
 
 
 if __name__ == "__main__":
@@ -58,9 +58,16 @@ from NIDAQ.wavegenerator import (
     generate_AO,
 )
 from NIDAQ.DAQoperator import DAQmission
+from NIDAQ.constants import NiDaqChannels
+from NIDAQ.rasterreconstruction import RasterReconstruction
+from NIDAQ.digitalwaveform import (
+    DigitalEdgeWaveform,
+    DigitalEdgeWaveforms,
+    load_waveforms_file,
+)
 from ThorlabsFilterSlider.filterpyserial import ELL9Filter
 from GeneralUsage.ThreadingFunc import run_in_thread
-from PIL import Image
+import skimage.external.tifffile as skimtiff
 
 import threading
 import time
@@ -242,6 +249,16 @@ class WaveformGenerator(QWidget):
             'color:CadetBlue;font:bold "Times New Roman"'
         )
         record_channel_container_layout.addWidget(self.ReadChanPMTTextbox, 0, 3)
+
+        self.ReadChanPMT2Textbox = QCheckBox("   PMT2   ")
+        self.ReadChanPMT2Textbox.setStyleSheet(
+            'color:CadetBlue;font:bold "Times New Roman"'
+        )
+        self.ReadChanPMT2Textbox.setToolTip(
+            "Record the second PMT at the same time, the screening saves the "
+            "images of both PMTs in one file."
+        )
+        record_channel_container_layout.addWidget(self.ReadChanPMT2Textbox, 0, 4)
         
         # Without self. the QbuttonGroup won't work
         self.patchRecordingGroup = QButtonGroup()
@@ -279,6 +296,8 @@ class WaveformGenerator(QWidget):
         self.button_import_np_load.clicked.connect(self.load_wave_np)
 
         self.saving_prefix = ""
+        # Reconstructs the PMT images of raster scans, None for contour scans.
+        self.PMT_reconstruction = None
 
         # ----------------------------------------------------------------------
         executionContainer = QGroupBox("Execution")
@@ -874,7 +893,9 @@ class WaveformGenerator(QWidget):
         )
         
         try:
-            temp_loaded_container = np.load(self.wavenpfileName, allow_pickle=True)
+            temp_loaded_container = load_waveforms_file(
+                self.wavenpfileName, expand_digital=False
+            )
     
             try:
                 self.uiDaq_sample_rate = int(os.path.split(self.wavenpfileName)[1][20:-4])
@@ -896,9 +917,21 @@ class WaveformGenerator(QWidget):
     
                 channel_keyword = temp_loaded_container[i]["Sepcification"]
                     
-                self.waveform_data_dict[channel_keyword] = temp_loaded_container[i][
-                    "Waveform"
-                ]
+                if "Edges" in temp_loaded_container[i].dtype.names:
+                    self.waveform_data_dict[
+                        channel_keyword
+                    ] = DigitalEdgeWaveform.from_record(temp_loaded_container[i])
+                elif temp_loaded_container[i]["Waveform"].dtype == "bool":
+                    # Saved before the digital lines were kept as edge lists.
+                    self.waveform_data_dict[
+                        channel_keyword
+                    ] = DigitalEdgeWaveform.from_array(
+                        temp_loaded_container[i]["Waveform"]
+                    )
+                else:
+                    self.waveform_data_dict[channel_keyword] = temp_loaded_container[
+                        i
+                    ]["Waveform"]
                 self.generate_graphy(
                     channel_keyword, self.waveform_data_dict[channel_keyword]
                 )
@@ -1051,8 +1084,8 @@ class WaveformGenerator(QWidget):
             # If the waveform exists already
             if channel_keyword in self.waveform_data_dict.keys():
                 self.waveform_data_dict[channel_keyword] = \
-                    np.append(self.waveform_data_dict[channel_keyword],
-                          waveform_to_add)
+                    self.waveform_data_dict[channel_keyword].append(
+                        waveform_to_add)
             # The first to append
             else:
                 self.waveform_data_dict[channel_keyword] = \
@@ -1060,8 +1093,8 @@ class WaveformGenerator(QWidget):
                     
         if channel_keyword == "cameratrigger":
             # For camera triggers, set to zeros so that it does not block canvas.
-            rectified_waveform = np.zeros(
-                len(self.waveform_data_dict[channel_keyword]), dtype=bool
+            rectified_waveform = DigitalEdgeWaveform(
+                len(self.waveform_data_dict[channel_keyword])
             )
             self.generate_graphy(channel_keyword, rectified_waveform)
         else:
@@ -1111,6 +1144,8 @@ class WaveformGenerator(QWidget):
 
         """
         self.total_contour_scanning_time = int(self.GalvoContourLastTextbox.value())
+        # The recording of a contour scan is saved flat, not as images.
+        self.PMT_reconstruction = None
 
         repeatnum_contour = int(self.total_contour_scanning_time / self.time_per_contour)
         repeated_contoursamples_1 = np.tile(
@@ -1247,6 +1282,16 @@ class WaveformGenerator(QWidget):
         self.PMT_data_index_array_repeated = np.append(
             self.offsetsamples_galvo, self.PMT_data_index_array_repeated
         )
+        # Where each image starts in the recording, to reconstruct them
+        # without searching the index array.
+        self.PMT_reconstruction = RasterReconstruction(
+            self.ScanArrayXnum,
+            Value_yPixels,
+            self.averagenum,
+            image_starts=len(self.offsetsamples_galvo)
+            + np.arange(self.repeatnum)
+            * (len(self.samples_1) * self.averagenum + self.gapsamples_number_galvo),
+        )
         # self.PMT_data_index_array_repeated = np.append(
         #     self.PMT_data_index_array_repeated, 0
         # )
@@ -1344,39 +1389,30 @@ class WaveformGenerator(QWidget):
             samplenumber_oneframe - self.true_sample_num_singleperiod_galvotrigger
         )
 
-        self.true_sample_singleperiod_galvotrigger = np.ones(
-            self.true_sample_num_singleperiod_galvotrigger, dtype=bool
-        )
-        self.true_sample_singleperiod_galvotrigger[
-            0
-        ] = False  # first one False to give a rise.
-
-        self.sample_singleperiod_galvotrigger = np.append(
-            self.true_sample_singleperiod_galvotrigger,
-            np.zeros(self.false_sample_num_singleperiod_galvotrigger, dtype=bool),
-        )
-
-        self.sample_repeatedperiod_galvotrigger = np.tile(
-            self.sample_singleperiod_galvotrigger, self.averagenum
-        )
+        # Runs of one frame, first one False to give a rise.
+        frame_values = [False, True, False]
+        frame_run_lengths = [
+            1,
+            self.true_sample_num_singleperiod_galvotrigger - 1,
+            self.false_sample_num_singleperiod_galvotrigger,
+        ]
 
-        self.gap_samples_galvotrigger = np.zeros(
-            self.gapsamples_number_galvo, dtype=bool
-        )
-        self.gap_samples_galvotrigger = np.append(
-            self.sample_repeatedperiod_galvotrigger, self.gap_samples_galvotrigger
-        )
-        self.repeated_gap_samples_galvotrigger = np.tile(
-            self.gap_samples_galvotrigger, repeatnum
+        # averagenum frames, then the gap.
+        cycle_values = np.append(np.tile(frame_values, self.averagenum), False)
+        cycle_run_lengths = np.append(
+            np.tile(frame_run_lengths, self.averagenum), self.gapsamples_number_galvo
         )
-        self.offset_galvotrigger = np.array(self.offsetsamples_galvo, dtype=bool)
 
-        final_galvotrigger = np.append(
-            self.offset_galvotrigger, self.repeated_gap_samples_galvotrigger
+        # Offset first, then the cycle repeated.
+        final_galvotrigger = DigitalEdgeWaveform.from_runs(
+            np.append(False, np.tile(cycle_values, repeatnum)),
+            np.append(
+                len(self.offsetsamples_galvo), np.tile(cycle_run_lengths, repeatnum)
+            ),
         )
         
         # Adding a False in the end
-        # final_galvotrigger = np.append(final_galvotrigger, False)
+        # final_galvotrigger = final_galvotrigger.append(DigitalEdgeWaveform(1))
 
         return final_galvotrigger
 
@@ -1472,7 +1508,7 @@ class WaveformGenerator(QWidget):
             self.uiwavegap_digital_waveform,
         )
 
-        return digital_waveform.generate()
+        return digital_waveform.generate_edges()
 
     #%%
     # -------------- for generating ramp voltage signals----------------------
@@ -1581,10 +1617,13 @@ class WaveformGenerator(QWidget):
     def generate_graphy(self, channel, waveform):
         
         self.uiDaq_sample_rate = int(self.SamplingRateTextbox.value())
-        if waveform.dtype == "bool":
+        if isinstance(waveform, DigitalEdgeWaveform):
+            # Only the corners of the digital line are drawn.
+            sample_positions, waveform = waveform.plot_points()
             waveform = waveform.astype(int)
-
-        x_label = np.arange(len(waveform)) / self.uiDaq_sample_rate
+            x_label = sample_positions / self.uiDaq_sample_rate
+        else:
+            x_label = np.arange(len(waveform)) / self.uiDaq_sample_rate
         current_PlotDataItem = PlotDataItem(x_label, waveform, name=channel)
         current_PlotDataItem.setPen(self.color_dictionary[channel])
 
@@ -1613,9 +1652,13 @@ class WaveformGenerator(QWidget):
 
         It's the last step before executing waveforms.
         
+        Digital lines are kept as edge lists (NIDAQ.digitalwaveform), which
+        are also what is saved, so the file size of digital lines scales with
+        the number of transitions.
+
         To load the waveforms from saved np file:
-            Trace = np.load(file path)[index of channel]("Waveform")
-            Channel name = np.load(file path)[index of channel]("Sepcification")
+            Trace = load_waveforms_file(file path)[index of channel]["Waveform"]
+            Channel name = load_waveforms_file(file path)[index of channel]["Sepcification"]
 
         Returns
         -------
@@ -1689,44 +1732,31 @@ class WaveformGenerator(QWidget):
     
                         else:
                             # For digital boolen signals
-                            insert_array = np.zeros([self.padding_number], dtype = bool)
+                            insert_array = DigitalEdgeWaveform(self.padding_number)
                                            
                             # Add False in the end
-                            self.waveform_data_dict[waveform_key] = np.append\
-                            (self.waveform_data_dict[waveform_key], False)
+                            self.waveform_data_dict[waveform_key] = \
+                            self.waveform_data_dict[waveform_key].append(
+                                DigitalEdgeWaveform(1))
                     else:
                         # In case of cameratrigger, add a trigger composed of 4 values
-                        insert_array = np.array([False, False, False, False, False, \
-                                                 False, False, False, False, False, \
-                                                 False, False, False, False, False, \
-                                                 False, False, False, False, False, \
-                                                 False, False, False, False, False, \
-                                                True, True, True, True, True, \
-                                                True, True, True, True, True, \
-                                                True, True, True, True, True, \
-                                                True, True, True, True, True, \
-                                                True, True, True, True, True, \
-                                                 False, False, False, False, False, \
-                                                 False, False, False, False, False, \
-                                                 False, False, False, False, False, \
-                                                 False, False, False, False, False, \
-                                                 False, False, False, False, False, \
-                                                True, True, True, True, True, \
-                                                True, True, True, True, True, \
-                                                True, True, True, True, True, \
-                                                True, True, True, True, True, \
-                                                True, True, True, True, True, \
-                                                 False, False, False, False, False, \
-                                                 False, False, False, False, False, \
-                                                 False, False, False, False, False])
+                        # 25 False, 25 True, 25 False, 25 True, 15 False.
+                        insert_array = DigitalEdgeWaveform.from_runs(
+                            [False, True, False, True, False], [25, 25, 25, 25, 15]
+                        )
                         
                         # Add False in the end
-                        self.waveform_data_dict[waveform_key] = np.append\
-                        (self.waveform_data_dict[waveform_key], False)
+                        self.waveform_data_dict[waveform_key] = \
+                        self.waveform_data_dict[waveform_key].append(
+                            DigitalEdgeWaveform(1))
     
                     # Insert the appendix
-                    self.waveform_data_dict[waveform_key] = np.insert\
-                    (self.waveform_data_dict[waveform_key], 0, insert_array)
+                    if isinstance(insert_array, DigitalEdgeWaveform):
+                        self.waveform_data_dict[waveform_key] = \
+                        insert_array.append(self.waveform_data_dict[waveform_key])
+                    else:
+                        self.waveform_data_dict[waveform_key] = np.insert\
+                        (self.waveform_data_dict[waveform_key], 0, insert_array)
     
                     # print(self.waveform_data_dict[waveform_key])
             else:
@@ -1749,14 +1779,19 @@ class WaveformGenerator(QWidget):
                             self.waveform_data_dict[waveform_key] = np.append\
                             (self.waveform_data_dict[waveform_key], self.waveform_data_dict[waveform_key][-1])  
                     else:
-                        insert_array = np.zeros(self.padding_number, dtype = bool)
+                        insert_array = DigitalEdgeWaveform(self.padding_number)
                         # Add False in the end
-                        self.waveform_data_dict[waveform_key] = np.append\
-                        (self.waveform_data_dict[waveform_key], False)
+                        self.waveform_data_dict[waveform_key] = \
+                        self.waveform_data_dict[waveform_key].append(
+                            DigitalEdgeWaveform(1))
     
                     # Insert the appendix
-                    self.waveform_data_dict[waveform_key] = np.insert\
-                    (self.waveform_data_dict[waveform_key], 0, insert_array)
+                    if isinstance(insert_array, DigitalEdgeWaveform):
+                        self.waveform_data_dict[waveform_key] = \
+                        insert_array.append(self.waveform_data_dict[waveform_key])
+                    else:
+                        self.waveform_data_dict[waveform_key] = np.insert\
+                        (self.waveform_data_dict[waveform_key], 0, insert_array)
                     
                     # print(self.waveform_data_dict[waveform_key])
         else:
@@ -1793,7 +1828,13 @@ class WaveformGenerator(QWidget):
         
         for waveform_key in self.waveform_data_dict:
 
-            if self.waveform_data_dict[waveform_key].ndim == 1:
+            if isinstance(self.waveform_data_dict[waveform_key], DigitalEdgeWaveform):
+                # Cut or append False to the digital lines.
+                self.waveform_data_dict[waveform_key] = self.waveform_data_dict[
+                    waveform_key
+                ].resized(self.reference_length)
+
+            elif self.waveform_data_dict[waveform_key].ndim == 1:
                 # Cut or append 0 to the data for non-reference waveforms.
                 if len(self.waveform_data_dict[waveform_key]) >= self.reference_length:
                     self.waveform_data_dict[waveform_key] = self.waveform_data_dict[
@@ -1894,9 +1935,6 @@ class WaveformGenerator(QWidget):
         dataType_analog = np.dtype(
             [("Waveform", float, (self.reference_length,)), ("Sepcification", "U20")]
         )
-        dataType_digital = np.dtype(
-            [("Waveform", bool, (self.reference_length,)), ("Sepcification", "U20")]
-        )
 
 
         
@@ -1905,7 +1943,9 @@ class WaveformGenerator(QWidget):
         
         for waveform_key in self.waveform_data_dict:
                 # 
-                if self.waveform_data_dict[waveform_key].dtype == "float64":
+                if not isinstance(
+                    self.waveform_data_dict[waveform_key], DigitalEdgeWaveform
+                ):
                     # In case of galvos re-drawing
                     if "galvos_contour" in waveform_key:
                         self.PlotDataItem_dict["galvos_contour"].setData(
@@ -1934,20 +1974,24 @@ class WaveformGenerator(QWidget):
                 else:
                     if waveform_key != "cameratrigger":
                         # In case of digital boolen signals, convert to int before ploting.
+                        sample_positions, values = self.waveform_data_dict[
+                            waveform_key
+                        ].plot_points()
                         self.PlotDataItem_dict[waveform_key].setData(
-                            x_label,
-                            self.waveform_data_dict[waveform_key].astype(int),
+                            sample_positions / self.uiDaq_sample_rate,
+                            values.astype(int),
                             name=waveform_key,
                         )
                     else:
                         # For camera triggers, set to zeros so that it does not block canvas.
-                        rectified_waveform = np.zeros(
-                            len(self.waveform_data_dict[waveform_key]), dtype=bool
+                        rectified_waveform = DigitalEdgeWaveform(
+                            len(self.waveform_data_dict[waveform_key])
                         )
+                        sample_positions, values = rectified_waveform.plot_points()
                         
                         self.PlotDataItem_dict[waveform_key].setData(
-                            x_label,
-                            rectified_waveform.astype(int),
+                            sample_positions / self.uiDaq_sample_rate,
+                            values.astype(int),
                             name=waveform_key,
                         )
                                             
@@ -1959,7 +2003,7 @@ class WaveformGenerator(QWidget):
         analog_line_num = len(self.waveform_data_dict.keys()) - digital_line_num
 
         self.analog_array = np.zeros(analog_line_num, dtype=dataType_analog)
-        self.digital_array = np.zeros(digital_line_num, dtype=dataType_digital)
+        self.digital_array = DigitalEdgeWaveforms()
 
         digital_line_num = 0
         analog_line_num = 0
@@ -1975,9 +2019,8 @@ class WaveformGenerator(QWidget):
 
             elif waveform_key in self.DigitalChannelList:
 
-                self.digital_array[digital_line_num] = np.array(\
-                    [(self.waveform_data_dict[waveform_key], waveform_key)],
-                    dtype=dataType_digital,
+                self.digital_array.add(
+                    self.waveform_data_dict[waveform_key], waveform_key
                 )
                 digital_line_num += 1
         print("Writing channels: {}".format(self.waveform_data_dict.keys()))
@@ -2012,6 +2055,8 @@ class WaveformGenerator(QWidget):
 
         if self.ReadChanPMTTextbox.isChecked():
             self.readinchan.append("PMT")
+        if self.ReadChanPMT2Textbox.isChecked():
+            self.readinchan.append("PMT2")
         if self.ReadChanVpTextbox.isChecked():
             self.readinchan.append("Vp")
         if self.ReadChanIpTextbox.isChecked():
@@ -2144,8 +2189,9 @@ class WaveformGenerator(QWidget):
 
         Parameters
         ----------
-        data_waveformreceived : TYPE
-            DESCRIPTION.
+        data_waveformreceived : np.ndarray
+            Recorded data, one row for each channel of
+            self.adcollector.recording_channel_names().
 
         Returns
         -------
@@ -2154,235 +2200,129 @@ class WaveformGenerator(QWidget):
         """
         self.adcollector.save_as_binary(self.savedirectory)
         self.channel_number = len(data_waveformreceived)
-        if self.channel_number == 1:
-            if "Vp" in self.readinchan:
-                self.data_collected_0 = data_waveformreceived[0]
-
-                self.PlotDataItem_patch_voltage = PlotDataItem(
-                    self.xlabelhere_all, self.data_collected_0
-                )
-                # use the same color as before, taking advantages of employing same keys in dictionary
-                self.PlotDataItem_patch_voltage.setPen("w")
-                self.pw_data.addItem(self.PlotDataItem_patch_voltage)
-
-                self.textitem_patch_voltage = pg.TextItem(
-                    ("Vp"), color=("w"), anchor=(1, 1)
-                )
-                self.textitem_patch_voltage.setPos(0, 1)
-                self.pw_data.addItem(self.textitem_patch_voltage)
-            elif "Ip" in self.readinchan:
-                self.data_collected_0 = data_waveformreceived[0]
-
-                self.PlotDataItem_patch_current = PlotDataItem(
-                    self.xlabelhere_all, self.data_collected_0
-                )
-                # use the same color as before, taking advantages of employing same keys in dictionary
-                self.PlotDataItem_patch_current.setPen("c")
-                self.pw_data.addItem(self.PlotDataItem_patch_current)
 
-                self.textitem_patch_current = pg.TextItem(
-                    ("Ip"), color=("w"), anchor=(1, 1)
-                )
-                self.textitem_patch_current.setPos(0, 1)
-                self.pw_data.addItem(self.textitem_patch_current)
-            elif (
-                "PMT" in self.readinchan
-            ):  # repeatnum, PMT_data_index_array, averagenum, ScanArrayXnum
-                self.data_collected_0 = data_waveformreceived[0] * -1
-                self.data_collected_0 = self.data_collected_0[
-                    0 : len(self.data_collected_0) - 1
-                ]
-
-                # pmt data could come from raster scanning mode or from contour scanning mode.
-                try:
-                    for i in range(self.repeatnum):
-                        self.PMT_image_reconstructed_array = self.data_collected_0[
-                            np.where(self.PMT_data_index_array_repeated == i + 1)
-                        ]
-                        Dataholder_average = np.mean(
-                            self.PMT_image_reconstructed_array.reshape(
-                                self.averagenum, -1
-                            ),
-                            axis=0,
-                        )
-                        Value_yPixels = int(len(self.samples_1) / self.ScanArrayXnum)
-                        self.PMT_image_reconstructed = np.reshape(
-                            Dataholder_average, (Value_yPixels, self.ScanArrayXnum)
-                        )
-
-                        # Stack the arrays into a 3d array
-                        if i == 0:
-                            self.PMT_image_reconstructed_stack = (
-                                self.PMT_image_reconstructed
-                            )
-                        else:
-                            self.PMT_image_reconstructed_stack = np.concatenate(
-                                (
-                                    self.PMT_image_reconstructed_stack,
-                                    self.PMT_image_reconstructed,
-                                ),
-                                axis=0,
-                            )
-
-                        Localimg = Image.fromarray(
-                            self.PMT_image_reconstructed
-                        )  # generate an image object
-                        Localimg.save(
-                            os.path.join(
-                                self.savedirectory,
-                                datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-                                + "_PMT_"
-                                + self.saving_prefix
-                                + "_"
-                                + str(i)
-                                + ".tif",
-                            )
-                        )  # save as tif
-
-                        plt.figure()
-                        plt.imshow(self.PMT_image_reconstructed, cmap=plt.cm.gray)
-                        plt.show()
-                except:
-                    np.save(
-                        os.path.join(
-                            self.savedirectory,
-                            datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-                            + "_PMT_"
-                            + self.saving_prefix
-                            + "_"
-                            + "flatten",
-                        ),
-                        self.data_collected_0,
-                    )
+        # Rows of the recording, the channels are recorded in the order of
+        # NiDaqChannels.
+        recorded_channel_names = self.adcollector.recording_channel_names()
+        pmt_channel_names = [
+            channel
+            for channel in recorded_channel_names
+            if channel in NiDaqChannels().pmt_channels
+        ]
 
-        elif self.channel_number == 2:
-            if "PMT" not in self.readinchan:
-                self.data_collected_0 = data_waveformreceived[0]
+        if "Vp" in recorded_channel_names:
+            self.data_collected_Vp = data_waveformreceived[
+                recorded_channel_names.index("Vp")
+            ]
 
-                self.PlotDataItem_patch_voltage = PlotDataItem(
-                    self.xlabelhere_all, self.data_collected_0
-                )
-                # use the same color as before, taking advantages of employing same keys in dictionary
-                self.PlotDataItem_patch_voltage.setPen("w")
-                self.pw_data.addItem(self.PlotDataItem_patch_voltage)
+            self.PlotDataItem_patch_voltage = PlotDataItem(
+                self.xlabelhere_all, self.data_collected_Vp
+            )
+            # use the same color as before, taking advantages of employing same keys in dictionary
+            self.PlotDataItem_patch_voltage.setPen("w")
+            self.pw_data.addItem(self.PlotDataItem_patch_voltage)
 
-                self.textitem_patch_voltage = pg.TextItem(
-                    ("Vp"), color=("w"), anchor=(1, 1)
-                )
-                self.textitem_patch_voltage.setPos(0, 1)
-                self.pw_data.addItem(self.textitem_patch_voltage)
+            self.textitem_patch_voltage = pg.TextItem(
+                ("Vp"), color=("w"), anchor=(1, 1)
+            )
+            self.textitem_patch_voltage.setPos(0, 1)
+            self.pw_data.addItem(self.textitem_patch_voltage)
 
-                self.data_collected_1 = data_waveformreceived[1]
+        if "Ip" in recorded_channel_names:
+            self.data_collected_Ip = data_waveformreceived[
+                recorded_channel_names.index("Ip")
+            ]
 
-                self.PlotDataItem_patch_current = PlotDataItem(
-                    self.xlabelhere_all, self.data_collected_1
-                )
-                # use the same color as before, taking advantages of employing same keys in dictionary
-                self.PlotDataItem_patch_current.setPen("c")
-                self.pw_data.addItem(self.PlotDataItem_patch_current)
+            self.PlotDataItem_patch_current = PlotDataItem(
+                self.xlabelhere_all, self.data_collected_Ip
+            )
+            # use the same color as before, taking advantages of employing same keys in dictionary
+            self.PlotDataItem_patch_current.setPen("c")
+            self.pw_data.addItem(self.PlotDataItem_patch_current)
 
-                self.textitem_patch_current = pg.TextItem(
-                    ("Ip"), color=("w"), anchor=(1, 1)
-                )
-                self.textitem_patch_current.setPos(0, 1)
-                self.pw_data.addItem(self.textitem_patch_current)
-            elif "PMT" in self.readinchan:
-                self.data_collected_0 = data_waveformreceived[0] * -1
-                self.data_collected_0 = self.data_collected_0[
-                    0 : len(self.data_collected_0) - 1
-                ]
+            self.textitem_patch_current = pg.TextItem(
+                ("Ip"), color=("w"), anchor=(1, 1)
+            )
+            self.textitem_patch_current.setPos(0, 1)
+            self.pw_data.addItem(self.textitem_patch_current)
+
+        if len(pmt_channel_names) != 0:
+            # repeatnum, PMT_data_index_array, averagenum, ScanArrayXnum
+            # (PMTs, samples), all of them are reconstructed together.
+            self.data_collected_0 = (
+                np.stack(
+                    [
+                        data_waveformreceived[recorded_channel_names.index(channel)]
+                        for channel in pmt_channel_names
+                    ]
+                )[:, :-1]
+                * -1
+            )
 
-                try:
-                    for i in range(self.repeatnum):
-                        self.PMT_image_reconstructed_array = self.data_collected_0[
-                            np.where(self.PMT_data_index_array_repeated == i + 1)
-                        ]
-                        Dataholder_average = np.mean(
-                            self.PMT_image_reconstructed_array.reshape(
-                                self.averagenum, -1
-                            ),
-                            axis=0,
-                        )
-                        Value_yPixels = int(len(self.samples_1) / self.ScanArrayXnum)
-                        self.PMT_image_reconstructed = np.reshape(
-                            Dataholder_average, (Value_yPixels, self.ScanArrayXnum)
-                        )
+            # pmt data could come from raster scanning mode or from contour scanning mode.
+            if self.PMT_reconstruction is None:
+                if self.channel_number == 1:
+                    flat_suffix = "flatten"
+                else:
+                    flat_suffix = "contourscanning"
 
-                        # Stack the arrays into a 3d array
-                        if i == 0:
-                            self.PMT_image_reconstructed_stack = (
-                                self.PMT_image_reconstructed
-                            )
-                        else:
-                            self.PMT_image_reconstructed_stack = np.concatenate(
-                                (
-                                    self.PMT_image_reconstructed_stack,
-                                    self.PMT_image_reconstructed,
-                                ),
-                                axis=0,
-                            )
-
-                        Localimg = Image.fromarray(
-                            self.PMT_image_reconstructed
-                        )  # generate an image object
-                        Localimg.save(
-                            os.path.join(
-                                self.savedirectory,
-                                datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-                                + "_PMT_"
-                                + self.saving_prefix
-                                + "_"
-                                + str(i)
-                                + ".tif",
-                            )
-                        )  # save as tif
-
-                        plt.figure()
-                        plt.imshow(self.PMT_image_reconstructed, cmap=plt.cm.gray)
-                        plt.show()
-                except:
+                for channel, channel_data in zip(
+                    pmt_channel_names, self.data_collected_0
+                ):
                     np.save(
                         os.path.join(
                             self.savedirectory,
                             datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-                            + "_PMT_"
+                            + "_"
+                            + channel
+                            + "_"
                             + self.saving_prefix
                             + "_"
-                            + "contourscanning",
+                            + flat_suffix,
                         ),
-                        self.data_collected_0,
+                        channel_data,
                     )
+                return
 
-                if "Vp" in self.readinchan:
-                    self.data_collected_1 = data_waveformreceived[1]
+            # All images of all PMTs in one pass.
+            PMT_images = self.PMT_reconstruction.reconstruct(self.data_collected_0)
 
-                    self.PlotDataItem_patch_voltage = PlotDataItem(
-                        self.xlabelhere_all, self.data_collected_1
-                    )
-                    # use the same color as before, taking advantages of employing same keys in dictionary
-                    self.PlotDataItem_patch_voltage.setPen("w")
-                    self.pw_data.addItem(self.PlotDataItem_patch_voltage)
+            # Stack the images of the first PMT into a 3d array
+            self.PMT_image_reconstructed_stack = np.concatenate(
+                PMT_images[0], axis=0
+            )
 
-                    self.textitem_patch_voltage = pg.TextItem(
-                        ("Vp"), color=("w"), anchor=(1, 1)
+            for i in range(self.repeatnum):
+                # One file for each repeat, the PMTs along the channel axis.
+                PMT_channel_images = PMT_images[:, i]
+                if len(PMT_channel_images) == 1:
+                    PMT_channel_images = PMT_channel_images[0]
+
+                with skimtiff.TiffWriter(
+                    os.path.join(
+                        self.savedirectory,
+                        datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+                        + "_PMT_"
+                        + self.saving_prefix
+                        + "_"
+                        + str(i)
+                        + ".tif",
+                    ),
+                    imagej=True,
+                ) as tif:
+                    tif.save(
+                        PMT_channel_images.astype("float32"),
+                        compress=0,
+                        metadata={"Channels: ": str(pmt_channel_names)},
                     )
-                    self.textitem_patch_voltage.setPos(0, 1)
-                    self.pw_data.addItem(self.textitem_patch_voltage)
-                elif "Ip" in self.readinchan:
-                    self.data_collected_1 = data_waveformreceived[1]
 
-                    self.PlotDataItem_patch_current = PlotDataItem(
-                        self.xlabelhere_all, self.data_collected_1
-                    )
-                    # use the same color as before, taking advantages of employing same keys in dictionary
-                    self.PlotDataItem_patch_current.setPen("c")
-                    self.pw_data.addItem(self.PlotDataItem_patch_current)
+                for channel, channel_images in zip(pmt_channel_names, PMT_images):
+                    self.PMT_image_reconstructed = channel_images[i]
 
-                    self.textitem_patch_current = pg.TextItem(
-                        ("Ip"), color=("w"), anchor=(1, 1)
-                    )
-                    self.textitem_patch_current.setPos(0, 1)
-                    self.pw_data.addItem(self.textitem_patch_current)
+                    plt.figure()
+                    plt.imshow(self.PMT_image_reconstructed, cmap=plt.cm.gray)
+                    plt.title(channel)
+                    plt.show()
 
     #
 
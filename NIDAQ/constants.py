@@ -26,6 +26,11 @@ class HardwareConstants:
 
         self.pmt_3v_indentation_pixels = 52
 
+        # Analog input of the objective focus drive for hardware timed
+        # z-stacks, e.g. 10 V over 400 um. Set it to the drive that is
+        # connected to objectiveAO.
+        self.objectiveVoltPerMm = 25.0
+
 
 class NiDaqChannels:
     def __init__(self):
@@ -44,7 +49,10 @@ class NiDaqChannels:
             "532blanking": "Dev1/port0/line6",
             "488blanking": "Dev1/port0/line3",
             "DMD_trigger": "Dev1/port0/line0",
+            "objectiveAO": "Dev1/ao2",  # Analog input of the focus drive
+            "objectivetrigger": "Dev1/port0/line2",  # Next z-stack plane
             "PMT": "Dev1/ai0",
+            "PMT2": "Dev1/ai1",  # Second PMT, the other colour
             "Vp": "Dev1/ai20",# patchVoltOutChannel Vp and Ip are from the same channel(22.12.2021)
             "VpPatch": "Dev1/ai22", #For sealtest only
             "Ip": "Dev1/ai20",  # patchCurOutChannel
@@ -61,6 +69,10 @@ class NiDaqChannels:
             "trigger2Channel": "/Dev2/PFI7",
         }
 
+        # Read-in channels in the order they are recorded, the PMTs first.
+        self.pmt_channels = ["PMT", "PMT2"]
+        self.readin_channels = self.pmt_channels + ["Vp", "Ip"]
+
         # self.patchVoltOutChannel = "Dev1/ai22"
         # self.patchCurOutChannel = "Dev1/ai20"
         # self.patchVoltInChannel = 'Dev2/ao2'
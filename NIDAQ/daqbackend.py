@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+Device layer between the DAQ code and the driver.
+
+Modules that talk to the NI-DAQ import nidaqmx, its constants and its stream
+readers/writers from here instead of from nidaqmx directly. By default this is
+the real nidaqmx package; setting the environment variable
+
+    GEVIDAQ_DAQ_BACKEND=simulated
+
+before the first import switches everything over to the software simulator in
+NIDAQ.simulated_nidaqmx, so the acquisition code can be run and benchmarked on
+a computer without NI hardware.
+"""
+
+import os
+
+import numpy as np
+
+BACKEND = os.environ.get("GEVIDAQ_DAQ_BACKEND", "nidaqmx").lower()
+
+if BACKEND == "simulated":
+    from NIDAQ import simulated_nidaqmx as nidaqmx
+    from NIDAQ.simulated_nidaqmx import constants, stream_readers, stream_writers
+    from NIDAQ.simulated_nidaqmx import DaqError
+elif BACKEND == "nidaqmx":
+    import nidaqmx
+    import nidaqmx.constants as constants
+    import nidaqmx.stream_readers as stream_readers
+    import nidaqmx.stream_writers as stream_writers
+    from nidaqmx.errors import DaqError
+else:
+    raise ValueError(
+        "Unknown DAQ backend '{}', use 'nidaqmx' or 'simulated'.".format(BACKEND)
+    )
+
+AcquisitionType = constants.AcquisitionType
+TaskMode = constants.TaskMode
+LineGrouping = constants.LineGrouping
+Signal = constants.Signal
+RegenerationMode = constants.RegenerationMode
+
+AnalogSingleChannelReader = stream_readers.AnalogSingleChannelReader
+AnalogMultiChannelReader = stream_readers.AnalogMultiChannelReader
+AnalogUnscaledReader = stream_readers.AnalogUnscaledReader
+
+AnalogSingleChannelWriter = stream_writers.AnalogSingleChannelWriter
+AnalogMultiChannelWriter = stream_writers.AnalogMultiChannelWriter
+DigitalSingleChannelWriter = stream_writers.DigitalSingleChannelWriter
+DigitalMultiChannelWriter = stream_writers.DigitalMultiChannelWriter
+
+
+def is_simulated():
+    return BACKEND == "simulated"
+
+
+def ai_dev_scaling_coeff(task, physical_channel):
+    """
+    Get the polynomial coefficients that convert the raw ADC counts of an AI
+    channel in the task to volts.
+
+    Parameters
+    ----------
+    task : nidaqmx.Task
+        Task that holds the channel.
+    physical_channel : str
+        Physical channel name, like "Dev1/ai20".
+
+    Returns
+    -------
+    np.ndarray
+        Coefficients, lowest order first.
+
+    """
+    if is_simulated():
+        channel = task.ai_channels[physical_channel]
+    else:
+        # https://knowledge.ni.com/KnowledgeArticleDetails?id=kA00Z0000019TuoSAE&l=nl-NL
+        channel = nidaqmx._task_modules.channels.ai_channel.AIChannel(
+            task._handle, physical_channel
+        )
+    return np.array(channel.ai_dev_scaling_coeff)
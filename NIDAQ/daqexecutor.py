@@ -0,0 +1,341 @@
+# -*- coding: utf-8 -*-
+"""
+Run DAQmission.runWaveforms in the background and get a future back.
+
+DAQExecutor has two worker threads, so hardware work can be pipelined:
+    1. Preparation: the waveform package is compiled into device buffers
+       (NIDAQ.waveformcompiler), while the acquisition before it is running.
+    2. Acquisition: runWaveforms, one package after the other in the order
+       they were submitted, so the device is never used twice at the same
+       time. The compiled package comes from the waveform cache.
+
+The caller gets a DAQFuture right away and can move the stage, make the next
+waveform or write files meanwhile:
+
+    future = default_executor.submit(
+        DAQmission(),
+        dict(
+            clock_source="DAQ",
+            sampling_rate=50000,
+            analog_signals=analog_signals,
+            digital_signals=digital_signals,
+            readin_channels=["PMT"],
+        ),
+    )
+    future.add_done_callback(lambda future: print("done"))
+    ...
+    print(future.progress())
+    data = future.result()
+
+Every run gets its own abort event, cancel() sets it, so a cancel right
+before the acquisition starts still stops it.
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import CancelledError, TimeoutError
+
+import numpy as np
+
+PENDING = "pending"
+PREPARING = "preparing"
+RUNNING = "running"
+FINISHED = "finished"
+CANCELLED = "cancelled"
+
+
+class DAQFuture:
+    def __init__(self, mission):
+        """
+        Result of a submitted DAQ run.
+
+        Parameters
+        ----------
+        mission : NIDAQ.DAQoperator.DAQmission
+            The mission that runs the waveforms.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.mission = mission
+        self.state = PENDING
+
+        self._result = None
+        self._exception = None
+        self._callbacks = []
+        self._condition = threading.Condition()
+        self._cancel_requested = False
+        # Passed to runWaveforms, stops this run only.
+        self._abort_event = threading.Event()
+
+        # Set when the acquisition starts, to estimate the progress.
+        self.expected_duration = None
+        self._start_time = None
+
+    # -----------------------------------------------------------------------
+    def cancel(self):
+        """
+        Cancel the run. A run that has not started yet is dropped, a running
+        acquisition is aborted.
+
+        Returns
+        -------
+        bool
+            False if the run was already finished.
+
+        """
+        with self._condition:
+            if self.state in (PENDING, PREPARING):
+                self._finish(CANCELLED)
+                return True
+            if self.state == RUNNING:
+                self._cancel_requested = True
+                self._abort_event.set()
+                self.mission.abort()
+                return True
+            return self.state == CANCELLED
+
+    def cancelled(self):
+        return self.state == CANCELLED
+
+    def running(self):
+        return self.state == RUNNING
+
+    def done(self):
+        return self.state in (FINISHED, CANCELLED)
+
+    def progress(self):
+        """
+        Estimated fraction of the run that is done, from the time since the
+        acquisition started and the length of the waveforms.
+
+        Returns
+        -------
+        float
+            0 before the acquisition starts, 1 when it is done.
+
+        """
+        if self.state == FINISHED:
+            return 1.0
+        if self.state != RUNNING or not self.expected_duration:
+            return 0.0
+        elapsed = time.perf_counter() - self._start_time
+        # Never report 1 before the run really finished.
+        return min(elapsed / self.expected_duration, 0.99)
+
+    def result(self, timeout=None):
+        """
+        Wait for the run and return a copy of the recorded data of the run,
+        None if the recording was streamed.
+
+        Raises CancelledError if the run was cancelled, TimeoutError if it
+        didn't finish within timeout seconds, or the exception raised by the
+        run.
+        """
+        self._wait(timeout)
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+    def exception(self, timeout=None):
+        self._wait(timeout)
+        return self._exception
+
+    def add_done_callback(self, callback):
+        """
+        Call callback(future) when the run is done. It is called in a thread
+        of its own, so a slow callback like a file write doesn't hold up the
+        next acquisition, or right away if the run is already done.
+        """
+        with self._condition:
+            if not self.done():
+                self._callbacks.append(callback)
+                return
+        self._call(callback)
+
+    # -----------------------------------------------------------------------
+    def _wait(self, timeout):
+        with self._condition:
+            if not self._condition.wait_for(self.done, timeout):
+                raise TimeoutError()
+            if self.state == CANCELLED and self._exception is None:
+                self._exception = CancelledError()
+
+    def _set_preparing(self):
+        with self._condition:
+            if self.state != PENDING:
+                return False
+            self.state = PREPARING
+            return True
+
+    def _set_running(self, expected_duration):
+        with self._condition:
+            if self.state != PREPARING:
+                return False
+            self.expected_duration = expected_duration
+            self._start_time = time.perf_counter()
+            self.state = RUNNING
+            return True
+
+    def _set_result(self, result):
+        with self._condition:
+            self._result = result
+            self._finish(FINISHED)
+
+    def _set_exception(self, exception):
+        with self._condition:
+            if isinstance(exception, CancelledError) and self._cancel_requested:
+                self._finish(CANCELLED)
+            else:
+                self._exception = exception
+                self._finish(FINISHED)
+
+    def _finish(self, state):
+        # Called with the condition held.
+        self.state = state
+        self._condition.notify_all()
+        callbacks, self._callbacks = self._callbacks, []
+        if len(callbacks) != 0:
+            threading.Thread(
+                target=lambda: [self._call(callback) for callback in callbacks],
+                daemon=True,
+            ).start()
+
+    def _call(self, callback):
+        try:
+            callback(self)
+        except Exception as exc:
+            print("DAQ future callback failed: {}".format(exc))
+
+
+class DAQExecutor:
+    def __init__(self):
+        """
+        Background preparation and acquisition threads for DAQ runs.
+
+        Returns
+        -------
+        None.
+
+        """
+        self._prepare_queue = queue.Queue()
+        self._acquire_queue = queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._shutdown = False
+
+    def submit(self, mission, run_arguments):
+        """
+        Queue a run of mission.runWaveforms.
+
+        Parameters
+        ----------
+        mission : NIDAQ.DAQoperator.DAQmission
+            The mission to run.
+        run_arguments : dict
+            Keyword arguments of runWaveforms.
+
+        Returns
+        -------
+        DAQFuture
+
+        """
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError("DAQ executor is shut down.")
+            if len(self._threads) == 0:
+                for target in (self._prepare_loop, self._acquire_loop):
+                    thread = threading.Thread(target=target, daemon=True)
+                    thread.start()
+                    self._threads.append(thread)
+
+        future = DAQFuture(mission)
+        self._prepare_queue.put((future, run_arguments))
+        return future
+
+    def shutdown(self, wait=True):
+        """
+        Stop the threads after the runs already submitted.
+        """
+        with self._lock:
+            self._shutdown = True
+            threads = self._threads
+            self._threads = []
+        if len(threads) != 0:
+            self._prepare_queue.put(None)
+        if wait:
+            for thread in threads:
+                thread.join()
+
+    # -----------------------------------------------------------------------
+    def _prepare_loop(self):
+        while True:
+            item = self._prepare_queue.get()
+            if item is None:
+                self._acquire_queue.put(None)
+                return
+
+            future, run_arguments = item
+            if not future._set_preparing():
+                # Cancelled while waiting.
+                continue
+            try:
+                mission = future.mission
+                compiled = mission.waveform_cache.get(
+                    run_arguments["analog_signals"],
+                    run_arguments["digital_signals"],
+                    mission.channel_LUT,
+                )
+                expected_duration = compiled.Waveforms_length / float(
+                    run_arguments["sampling_rate"]
+                )
+            except Exception as exc:
+                future._set_exception(exc)
+                continue
+            self._acquire_queue.put((future, run_arguments, expected_duration))
+
+    def _acquire_loop(self):
+        while True:
+            item = self._acquire_queue.get()
+            if item is None:
+                return
+
+            future, run_arguments, expected_duration = item
+            mission = future.mission
+            if not future._set_running(expected_duration):
+                continue
+            try:
+                if future._abort_event.is_set():
+                    raise CancelledError("Acquisition aborted.")
+                mission.runWaveforms(
+                    abort_event=future._abort_event, **run_arguments
+                )
+            except Exception as exc:
+                future._set_exception(exc)
+                continue
+
+            if mission.streamed == False:
+                # The next run of the mission fills its buffers again.
+                future._set_result(snapshot(mission.get_raw_data()))
+            else:
+                future._set_result(None)
+
+
+def snapshot(data):
+    """
+    Copy of the recorded data, also of the rows of a recording with
+    channels at their own rate, which is a 1-D object array.
+    """
+    if data.dtype == object:
+        copied = np.empty(len(data), dtype=object)
+        for row, channel_data in enumerate(data):
+            copied[row] = np.array(channel_data)
+        return copied
+    return np.array(data)
+
+
+# Shared by all missions, so the runs never use the device at the same time.
+default_executor = DAQExecutor()
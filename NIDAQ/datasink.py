@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+"""
+Sinks that receive the recorded AI data chunk by chunk when DAQmission runs
+in streaming mode (runWaveforms(..., data_sink=...)).
+
+A sink only has to implement three methods:
+    open(channel_names, sampling_rate, total_samples)
+    write(chunk, start_index)
+    close()
+where chunk is a (channel number, samples) array that is reused by the reader,
+so a sink has to copy it if it keeps it around.
+
+DecimatingSink sits in front of another sink, or keeps the data itself, and
+block-averages channels that are recorded at a lower rate than the waveforms.
+
+RecordingFileSink writes the chunks into a recording file (NIDAQ.recording),
+the same container DAQmission.save_as_binary saves.
+"""
+
+import os
+import queue
+from datetime import datetime
+
+import numpy as np
+
+from NIDAQ.recording import RecordingWriter, RECORDING_FILE_EXTENSION
+
+
+class BinaryFileSink:
+    def __init__(self, directory, prefix="Stream_", dtype="float64"):
+        """
+        Append-only writer for streamed recordings.
+
+        The data is written into a .npy file sample-major, with shape
+        (total_samples, channel number), so that every chunk can be appended
+        at the end of the file without seeking. Load it with
+        np.load(file, mmap_mode="r") and transpose to get the same layout as
+        DAQmission.Dataholder.
+
+        Parameters
+        ----------
+        directory : str
+            Directory to save the file.
+        prefix : str, optional
+            Prefix of the file name. The default is "Stream_".
+        dtype : str, optional
+            Data type written to disk. The default is "float64".
+
+        Returns
+        -------
+        None.
+
+        """
+        self.directory = directory
+        self.prefix = prefix
+        self.dtype = np.dtype(dtype)
+        self.file_path = None
+        self._file = None
+
+    def open(self, channel_names, sampling_rate, total_samples):
+        self.channel_names = list(channel_names)
+        self.sampling_rate = sampling_rate
+        self.samples_written = 0
+
+        self.file_path = os.path.join(
+            self.directory,
+            self.prefix
+            + "_".join(self.channel_names)
+            + "_sr_"
+            + str(int(sampling_rate))
+            + "_"
+            + datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+            + ".npy",
+        )
+        self._file = open(self.file_path, "wb")
+        np.lib.format.write_array_header_1_0(
+            self._file,
+            {
+                "descr": np.lib.format.dtype_to_descr(self.dtype),
+                "fortran_order": False,
+                "shape": (int(total_samples), len(self.channel_names)),
+            },
+        )
+
+    def write(self, chunk, start_index):
+        self._file.write(np.ascontiguousarray(chunk.T, dtype=self.dtype).tobytes())
+        self.samples_written += chunk.shape[1]
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class RecordingFileSink:
+    def __init__(
+        self,
+        directory,
+        prefix="Stream_",
+        dtype="float64",
+        scaling_coeff=None,
+        waveform_specs=None,
+        metadata=None,
+    ):
+        """
+        Write streamed recordings into a recording file, read it with
+        NIDAQ.recording.RecordingFile.
+
+        Parameters
+        ----------
+        directory : str
+            Directory to save the file.
+        prefix : str, optional
+            Prefix of the file name. The default is "Stream_".
+        dtype : str, optional
+            Data type written to disk. The default is "float64", use "int16"
+            for unscaled recordings.
+        scaling_coeff : dict, optional
+            Scaling coefficients of each channel for int16 counts, see
+            NIDAQ.recording.RecordingWriter. The default is None.
+        waveform_specs, metadata : optional
+            Stored in the header, see NIDAQ.recording.RecordingWriter.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.directory = directory
+        self.prefix = prefix
+        self.dtype = np.dtype(dtype)
+        self.scaling_coeff = scaling_coeff
+        self.waveform_specs = waveform_specs
+        self.metadata = metadata
+        self.file_path = None
+        self._writer = None
+
+    def open(self, channel_names, sampling_rate, total_samples):
+        self.channel_names = list(channel_names)
+        self.sampling_rate = sampling_rate
+
+        metadata = dict(self.metadata or {})
+        metadata["start_time"] = datetime.now().isoformat()
+        self.file_path = os.path.join(
+            self.directory,
+            self.prefix
+            + "_".join(self.channel_names)
+            + "_"
+            + datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+            + RECORDING_FILE_EXTENSION,
+        )
+        self._writer = RecordingWriter(
+            self.file_path,
+            self.channel_names,
+            [sampling_rate] * len(self.channel_names),
+            [total_samples] * len(self.channel_names),
+            dtype=self.dtype,
+            scaling_coeff=self.scaling_coeff,
+            waveform_specs=self.waveform_specs,
+            metadata=metadata,
+        )
+
+    def write(self, chunk, start_index):
+        for row, name in enumerate(self.channel_names):
+            self._writer.write(name, chunk[row], start_index)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close({"finish_time": datetime.now().isoformat()})
+            self._writer = None
+
+
+class QueueSink:
+    def __init__(self, maxsize=50):
+        """
+        Hand the streamed chunks over to another thread, e.g. a live plot.
+
+        Each item in the queue is a tuple (start_index, chunk). When the
+        consumer falls behind and the queue is full, the oldest chunk is
+        dropped so that memory stays bounded.
+
+        Parameters
+        ----------
+        maxsize : int, optional
+            Maximum number of chunks kept in the queue. The default is 50.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.dropped_chunks = 0
+
+    def open(self, channel_names, sampling_rate, total_samples):
+        self.channel_names = list(channel_names)
+        self.sampling_rate = sampling_rate
+        self.total_samples = total_samples
+        self.dropped_chunks = 0
+
+    def write(self, chunk, start_index):
+        item = (start_index, chunk.copy())
+        while True:
+            try:
+                self.queue.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    self.dropped_chunks += 1
+                except queue.Empty:
+                    pass
+
+    def close(self):
+        pass
+
+
+class DecimatingSink:
+    def __init__(self, decimation_factors, sink=None, dtype=np.float64):
+        """
+        Block-average the channels down to their own rate while recording.
+
+        Every decimation_factors[i] consecutive samples of channel i are
+        averaged into one sample. Blocks that straddle two chunks are finished
+        with the next chunk, the last block of the recording is averaged over
+        the samples it has. The averages are float64, channels that are not
+        decimated keep the data type of the chunks.
+
+        Without sink the decimated channels are kept in channel_data. With a
+        sink the decimated chunks are passed on to it, which needs all
+        channels to have the same decimation factor.
+
+        Parameters
+        ----------
+        decimation_factors : list of int
+            Decimation factor of each channel, in the order of the rows of the
+            chunks.
+        sink : object, optional
+            Sink that gets the decimated chunks. The default is None.
+        dtype : np.dtype, optional
+            Data type of the chunks. The default is np.float64.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.decimation_factors = [int(factor) for factor in decimation_factors]
+        self.sink = sink
+        self.dtype = np.dtype(dtype)
+        if self.sink is not None and len(set(self.decimation_factors)) > 1:
+            raise ValueError(
+                "A data sink takes one rate, stream channels with different "
+                "rates separately."
+            )
+
+    def open(self, channel_names, sampling_rate, total_samples):
+        self.channel_names = list(channel_names)
+        self.sampling_rates = [
+            sampling_rate / factor for factor in self.decimation_factors
+        ]
+        self.decimated_lengths = [
+            -(-int(total_samples) // factor) for factor in self.decimation_factors
+        ]
+        # Samples of the unfinished block of each channel.
+        self._carry = [np.zeros(0) for _ in self.decimation_factors]
+        self._written = [0 for _ in self.decimation_factors]
+
+        if self.sink is not None:
+            self.sink.open(
+                self.channel_names, self.sampling_rates[0], self.decimated_lengths[0]
+            )
+        else:
+            self.channel_data = [
+                np.zeros(length, dtype=self.dtype if factor == 1 else np.float64)
+                for length, factor in zip(
+                    self.decimated_lengths, self.decimation_factors
+                )
+            ]
+
+    def write(self, chunk, start_index):
+        blocks = []
+        for row, factor in enumerate(self.decimation_factors):
+            if factor == 1:
+                blocks.append(np.asarray(chunk[row]))
+                continue
+
+            samples = chunk[row]
+            if len(self._carry[row]) != 0:
+                samples = np.concatenate((self._carry[row], samples))
+            block_number = len(samples) // factor
+            blocks.append(
+                samples[: block_number * factor]
+                .reshape(block_number, factor)
+                .mean(axis=1)
+            )
+            self._carry[row] = np.array(samples[block_number * factor :], dtype=float)
+
+        self._store(blocks)
+
+    def _store(self, blocks):
+        if self.sink is not None:
+            if len(blocks[0]) != 0:
+                self.sink.write(np.vstack(blocks), self._written[0])
+        else:
+            for row, block in enumerate(blocks):
+                start = self._written[row]
+                self.channel_data[row][start : start + len(block)] = block
+        for row, block in enumerate(blocks):
+            self._written[row] += len(block)
+
+    def close(self):
+        # Average the last, incomplete, blocks.
+        blocks = [
+            carry.mean(keepdims=True) if len(carry) != 0 else np.zeros(0)
+            for carry in self._carry
+        ]
+        self._carry = [np.zeros(0) for _ in self.decimation_factors]
+        if any(len(block) != 0 for block in blocks):
+            self._store(blocks)
+        if self.sink is not None:
+            self.sink.close()
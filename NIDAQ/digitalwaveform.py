@@ -0,0 +1,405 @@
+# -*- coding: utf-8 -*-
+"""
+Run-length (edge list) representation of digital waveforms.
+
+A digital line is mostly long stretches of the same value, so instead of one
+bool per sample it is kept as its length, its value at sample 0 and the sample
+indices at which it toggles. Memory and saved file size then scale with the
+number of transitions instead of the duration of the protocol.
+
+DigitalEdgeWaveforms holds the digital lines of a waveform package and can be
+passed to DAQmission.runWaveforms as digital_signals in place of the
+structured array. It supports the same ["Sepcification"] and ["Waveform"]
+access, where ["Waveform"][i] expands line i to a full bool array on request.
+NIDAQ.waveformcompiler packs the edge lists straight into the uint32 port
+buffer without expanding the individual lines.
+"""
+
+import numpy as np
+
+
+class DigitalEdgeWaveform:
+    def __init__(self, length, edges=(), initial_value=False):
+        """
+        One digital line as edge list.
+
+        Parameters
+        ----------
+        length : int
+            Number of samples.
+        edges : array like, optional
+            Sample indices, in (0, length), at which the value toggles.
+            The default is no edges.
+        initial_value : bool, optional
+            Value of the first sample. The default is False.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.length = int(length)
+        self.edges = np.asarray(edges, dtype=np.int64)
+        self.initial_value = bool(initial_value)
+
+    @classmethod
+    def from_array(cls, waveform):
+        """
+        Compress a full bool waveform.
+        """
+        waveform = np.asarray(waveform, dtype=bool)
+        if len(waveform) == 0:
+            return cls(0)
+        edges = np.flatnonzero(waveform[1:] != waveform[:-1]) + 1
+        return cls(len(waveform), edges, waveform[0])
+
+    @classmethod
+    def from_runs(cls, values, run_lengths):
+        """
+        Build the line from consecutive runs of constant value, like
+        (False, 100 samples), (True, 20 samples), ...
+
+        Runs of zero length are skipped and neighbouring runs with the same
+        value are merged.
+        """
+        values = np.asarray(values, dtype=bool)
+        run_lengths = np.asarray(run_lengths, dtype=np.int64)
+
+        keep = run_lengths > 0
+        values = values[keep]
+        run_lengths = run_lengths[keep]
+        if len(values) == 0:
+            return cls(0)
+
+        run_starts = np.cumsum(run_lengths) - run_lengths
+        toggles = np.flatnonzero(values[1:] != values[:-1]) + 1
+        return cls(np.sum(run_lengths), run_starts[toggles], values[0])
+
+    @classmethod
+    def from_record(cls, record):
+        """
+        Inverse of to_record.
+        """
+        edges = record["Edges"][: int(record["EdgeNumber"])]
+        return cls(record["Length"], edges, record["InitialValue"])
+
+    def __len__(self):
+        return self.length
+
+    @property
+    def final_value(self):
+        return self.initial_value ^ bool(len(self.edges) % 2)
+
+    @property
+    def nbytes(self):
+        return self.edges.nbytes
+
+    def run_values_and_lengths(self):
+        """
+        Value and length of each run of constant value.
+        """
+        run_starts = np.concatenate(([0], self.edges))
+        run_lengths = np.diff(np.append(run_starts, self.length))
+        values = (np.arange(len(run_starts)) % 2).astype(bool) ^ self.initial_value
+        return values, run_lengths
+
+    def to_array(self):
+        """
+        Expand to a full bool waveform.
+        """
+        values, run_lengths = self.run_values_and_lengths()
+        return np.repeat(values, run_lengths)
+
+    def plot_points(self):
+        """
+        Sample positions and values of the corners of the line. Drawn as a
+        line they give the same plot as to_array(), with two points per run.
+        """
+        if self.length == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=bool)
+        values, run_lengths = self.run_values_and_lengths()
+        run_starts = np.cumsum(run_lengths) - run_lengths
+        positions = np.stack((run_starts, run_starts + run_lengths - 1), axis=1)
+        return positions.ravel(), np.repeat(values, 2)
+
+    def resized(self, length):
+        """
+        Return the line cut to length samples, or padded with False.
+        """
+        if length <= self.length:
+            return DigitalEdgeWaveform(
+                length, self.edges[self.edges < length], self.initial_value
+            )
+        return self.append(DigitalEdgeWaveform(length - self.length))
+
+    def append(self, other):
+        """
+        Return a new line with other placed after this one.
+        """
+        edges = [self.edges]
+        if self.length != 0 and other.length != 0:
+            if self.final_value != other.initial_value:
+                edges.append([self.length])
+        edges.append(other.edges + self.length)
+
+        if self.length == 0:
+            initial_value = other.initial_value
+        else:
+            initial_value = self.initial_value
+        return DigitalEdgeWaveform(
+            self.length + other.length, np.concatenate(edges), initial_value
+        )
+
+    def to_record(self, specification):
+        """
+        Pack into a structured array record with its channel specification,
+        the form in which it is saved with np.save.
+        """
+        dataType = np.dtype(
+            [
+                ("Edges", np.int64, (max(len(self.edges), 1),)),
+                ("EdgeNumber", np.int64),
+                ("Length", np.int64),
+                ("InitialValue", bool),
+                ("Sepcification", "U20"),
+            ]
+        )
+        record = np.zeros(1, dtype=dataType)
+        record["Edges"][0, : len(self.edges)] = self.edges
+        record["EdgeNumber"] = len(self.edges)
+        record["Length"] = self.length
+        record["InitialValue"] = self.initial_value
+        record["Sepcification"] = specification
+        return record[0]
+
+    def __eq__(self, other):
+        if not isinstance(other, DigitalEdgeWaveform):
+            return NotImplemented
+        return (
+            self.length == other.length
+            and self.initial_value == other.initial_value
+            and np.array_equal(self.edges, other.edges)
+        )
+
+
+class _ExpandedWaveforms:
+    """
+    ["Waveform"] view of DigitalEdgeWaveforms, expands one line at a time.
+    """
+
+    def __init__(self, waveforms):
+        self._waveforms = waveforms
+
+    def __len__(self):
+        return len(self._waveforms)
+
+    def __getitem__(self, index):
+        return self._waveforms[index].to_array()
+
+
+class DigitalEdgeWaveforms:
+    def __init__(self, waveforms=None, specifications=None):
+        """
+        The digital lines of a waveform package, as edge lists.
+
+        Parameters
+        ----------
+        waveforms : list of DigitalEdgeWaveform, optional
+            The lines, all of the same length.
+        specifications : list of str, optional
+            Channel purpose of each line, see NiDaqChannels.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.waveforms = list(waveforms) if waveforms is not None else []
+        self.specifications = (
+            list(specifications) if specifications is not None else []
+        )
+
+        lengths = set(waveform.length for waveform in self.waveforms)
+        if len(lengths) > 1:
+            raise ValueError("Digital waveforms have different lengths.")
+
+    @classmethod
+    def from_structured_array(cls, digital_signals):
+        """
+        Compress a structured array with 'Waveform' and 'Sepcification' fields.
+        """
+        return cls(
+            [DigitalEdgeWaveform.from_array(w) for w in digital_signals["Waveform"]],
+            [str(s) for s in digital_signals["Sepcification"]],
+        )
+
+    def add(self, waveform, specification):
+        if len(self.waveforms) != 0 and waveform.length != self.length:
+            raise ValueError("Digital waveforms have different lengths.")
+        self.waveforms.append(waveform)
+        self.specifications.append(specification)
+
+    @property
+    def length(self):
+        if len(self.waveforms) == 0:
+            return 0
+        return self.waveforms[0].length
+
+    def __len__(self):
+        return len(self.waveforms)
+
+    def __getitem__(self, key):
+        if key == "Sepcification":
+            return np.array(self.specifications, dtype="U20")
+        elif key == "Waveform":
+            return _ExpandedWaveforms(self.waveforms)
+        # Single line, as record like the rows of the structured array.
+        return self.waveforms[key].to_record(self.specifications[key])
+
+    def to_structured_array(self):
+        dataType_digital = np.dtype(
+            [("Waveform", bool, (self.length,)), ("Sepcification", "U20")]
+        )
+        digital_array = np.zeros(len(self), dtype=dataType_digital)
+        for i, waveform in enumerate(self.waveforms):
+            digital_array[i] = (waveform.to_array(), self.specifications[i])
+        return digital_array
+
+    def pack_port(self, line_numbers):
+        """
+        Expand all lines straight into the uint32 port waveform, where line n
+        sets bit n.
+
+        The edges of all lines are merged and sorted once, the port value
+        after each edge follows from a cumulative XOR of the toggled bits,
+        and the runs between edges are repeated out in one go.
+
+        Parameters
+        ----------
+        line_numbers : list of int
+            Port line of each waveform.
+
+        Returns
+        -------
+        np.ndarray
+            uint32 port values, shape (length,).
+
+        """
+        line_bits = [np.uint32(1) << np.uint32(n) for n in line_numbers]
+
+        initial_port = np.uint32(0)
+        for waveform, bit in zip(self.waveforms, line_bits):
+            if waveform.initial_value:
+                initial_port |= bit
+
+        positions = np.concatenate(
+            [np.zeros(0, dtype=np.int64)] + [w.edges for w in self.waveforms]
+        )
+        toggled_bits = np.concatenate(
+            [np.zeros(0, dtype=np.uint32)]
+            + [
+                np.full(len(w.edges), bit, dtype=np.uint32)
+                for w, bit in zip(self.waveforms, line_bits)
+            ]
+        )
+
+        order = np.argsort(positions, kind="stable")
+        positions = positions[order]
+        port_after_edge = initial_port ^ np.bitwise_xor.accumulate(
+            toggled_bits[order]
+        )
+
+        # Lines toggling at the same sample: keep the value after the last one.
+        last_at_position = np.append(positions[1:] != positions[:-1], True)
+        if len(positions) == 0:
+            last_at_position = last_at_position[:0]
+        run_starts = np.concatenate(([0], positions[last_at_position]))
+        run_values = np.concatenate(
+            ([initial_port], port_after_edge[last_at_position])
+        ).astype(np.uint32)
+        run_lengths = np.diff(np.append(run_starts, self.length))
+
+        return np.repeat(run_values, run_lengths)
+
+    def content_bytes(self):
+        """
+        Bytes that identify the content, for hashing.
+        """
+        parts = [str(self.length).encode()]
+        for waveform, specification in zip(self.waveforms, self.specifications):
+            parts.append(specification.encode())
+            parts.append(b"1" if waveform.initial_value else b"0")
+            parts.append(waveform.edges.tobytes())
+            parts.append(b";")
+        return b"".join(parts)
+
+    @property
+    def nbytes(self):
+        return sum(waveform.nbytes for waveform in self.waveforms)
+
+    def save(self, file_path):
+        """
+        Save with np.save, the size scales with the number of edges.
+        """
+        records = np.array(
+            [tuple(self[i].tolist()) for i in range(len(self))],
+            dtype=np.dtype(
+                [
+                    ("Edges", object),
+                    ("EdgeNumber", np.int64),
+                    ("Length", np.int64),
+                    ("InitialValue", bool),
+                    ("Sepcification", "U20"),
+                ]
+            ),
+        )
+        np.save(file_path, records, allow_pickle=True)
+
+    @classmethod
+    def load(cls, file_path):
+        records = np.load(file_path, allow_pickle=True)
+        return cls(
+            [DigitalEdgeWaveform.from_record(record) for record in records],
+            [str(record["Sepcification"]) for record in records],
+        )
+
+
+def load_waveforms_file(file_path, expand_digital=True):
+    """
+    Load the waveforms saved by WaveformWidget ('..._Wavefroms_sr_50000.npy').
+
+    Digital lines are saved as edge list records, these are expanded back to
+    records with a full bool 'Waveform', so that every channel can be read as
+        Trace = load_waveforms_file(file path)[index of channel]["Waveform"]
+        Channel name = load_waveforms_file(file path)[index of channel]["Sepcification"]
+    Files saved before the edge lists were introduced load unchanged.
+
+    Parameters
+    ----------
+    file_path : str
+        Path of the .npy file.
+    expand_digital : bool, optional
+        False to keep the edge list records of the digital lines, they can be
+        read with DigitalEdgeWaveform.from_record. The default is True.
+
+    Returns
+    -------
+    list
+        One structured record per channel.
+
+    """
+    container = np.load(file_path, allow_pickle=True)
+
+    waveforms = []
+    for record in container:
+        if "Edges" in record.dtype.names and expand_digital:
+            waveform = DigitalEdgeWaveform.from_record(record).to_array()
+            dataType_digital = np.dtype(
+                [("Waveform", bool, (len(waveform),)), ("Sepcification", "U20")]
+            )
+            record = np.array(
+                [(waveform, record["Sepcification"])], dtype=dataType_digital
+            )[0]
+        waveforms.append(record)
+
+    return waveforms
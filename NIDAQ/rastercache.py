@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+"""
+Two-level cache of galvo raster waveforms made by wavegenerator.waveRecPic.
+
+Raster scans (GalvoScan_backend.RasterScan, the PMT auto focus and z-scan,
+the continuous PMT scanning) regenerate the same raster over and over from a
+handful of settings. RasterCache keeps the generated rasters:
+
+    1. In-process least recently used cache.
+    2. On-disk .npy store, memory-mapped when it is hit, so the raster is
+       not generated again after a restart.
+
+The key holds all waveRecPic arguments and the galvo speed and acceleration
+limits in HardwareConstants, so changing those makes a new entry.
+
+    raster = default_raster_cache.get(500000, 0, -5, 5, -5, 5, 500, 500)
+    Galvo_samples = raster.galvo_samples(average_number)
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from NIDAQ.constants import HardwareConstants
+from NIDAQ.wavegenerator import waveRecPic
+
+# Change when the raster generation changes, so old files on disk are not used.
+RASTER_CACHE_VERSION = 2
+
+DEFAULT_CACHE_DIRECTORY = os.path.join(
+    tempfile.gettempdir(), "gevidaq_raster_cache"
+)
+
+
+class RasterWaveforms:
+    def __init__(self, samples, xPixels, yPixels):
+        """
+        Galvo raster of one frame.
+
+        The samples can be a read-only memory map, don't modify them in place.
+
+        Parameters
+        ----------
+        samples : np.ndarray
+            (2, samples) array, x and y galvo voltages of one frame.
+        xPixels, yPixels : int
+            Number of pixels of the image.
+
+        Attributes
+        ----------
+        samples_X, samples_Y : np.ndarray
+            x and y galvo voltages of one frame.
+        line_sample_number : int
+            Number of samples of each x line, including the fly back.
+
+        """
+        self.samples = samples
+        self.samples_X = samples[0]
+        self.samples_Y = samples[1]
+        self.xPixels = xPixels
+        self.yPixels = yPixels
+        self.line_sample_number = int(samples.shape[1] / yPixels)
+
+        self._repeated_average_number = None
+        self._repeated_samples = None
+
+    @property
+    def frame_sample_number(self):
+        return self.samples.shape[1]
+
+    def galvo_samples(self, average_number=1):
+        """
+        (2, frame samples * average_number) array to write to the galvos,
+        the frame repeated average_number times. The last one is kept.
+        """
+        if self._repeated_average_number != average_number:
+            self._repeated_samples = np.tile(self.samples, average_number)
+            self._repeated_average_number = average_number
+        return self._repeated_samples
+
+    @property
+    def nbytes(self):
+        nbytes = 0
+        if not isinstance(self.samples, np.memmap):
+            nbytes += self.samples.nbytes
+        if self._repeated_samples is not None:
+            nbytes += self._repeated_samples.nbytes
+        return nbytes
+
+
+class RasterCache:
+    def __init__(
+        self, maxsize=8, max_bytes=1024 ** 3, directory=DEFAULT_CACHE_DIRECTORY
+    ):
+        """
+        Cache of galvo rasters.
+
+        Parameters
+        ----------
+        maxsize : int, optional
+            Maximum number of rasters kept in memory. The default is 8.
+        max_bytes : int, optional
+            Maximum size of the rasters kept in memory. The default is 1 GB.
+        directory : str or None, optional
+            Directory of the on-disk store. None to only cache in memory.
+            The default is gevidaq_raster_cache in the temporary directory.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def raster_key(
+        sampleRate,
+        imAngle,
+        voltXMin,
+        voltXMax,
+        voltYMin,
+        voltYMax,
+        xPixels,
+        yPixels,
+        sawtooth,
+    ):
+        constants = HardwareConstants()
+        parameters = (
+            RASTER_CACHE_VERSION,
+            float(sampleRate),
+            float(imAngle),
+            float(voltXMin),
+            float(voltXMax),
+            float(voltYMin),
+            float(voltYMax),
+            int(xPixels),
+            int(yPixels),
+            bool(sawtooth),
+            float(constants.maxGalvoSpeed),
+            float(constants.maxGalvoAccel),
+        )
+        return hashlib.blake2b(repr(parameters).encode(), digest_size=16).hexdigest()
+
+    def get(
+        self,
+        sampleRate=4000,
+        imAngle=0,
+        voltXMin=0,
+        voltXMax=5,
+        voltYMin=0,
+        voltYMax=5,
+        xPixels=1024,
+        yPixels=512,
+        sawtooth=True,
+    ):
+        """
+        Get the raster, same arguments as wavegenerator.waveRecPic.
+
+        Returns
+        -------
+        RasterWaveforms
+
+        """
+        key = self.raster_key(
+            sampleRate,
+            imAngle,
+            voltXMin,
+            voltXMax,
+            voltYMin,
+            voltYMax,
+            xPixels,
+            yPixels,
+            sawtooth,
+        )
+
+        with self._lock:
+            if key in self._entries:
+                self.memory_hits += 1
+                self._entries.move_to_end(key)
+                return self._entries[key]
+
+            raster = self._load(key, xPixels, yPixels)
+            if raster is not None:
+                self.disk_hits += 1
+            else:
+                self.misses += 1
+                samples_X, samples_Y = waveRecPic(
+                    sampleRate=sampleRate,
+                    imAngle=imAngle,
+                    voltXMin=voltXMin,
+                    voltXMax=voltXMax,
+                    voltYMin=voltYMin,
+                    voltYMax=voltYMax,
+                    xPixels=xPixels,
+                    yPixels=yPixels,
+                    sawtooth=sawtooth,
+                )
+                raster = RasterWaveforms(
+                    np.vstack((samples_X, samples_Y)), xPixels, yPixels
+                )
+                self._save(key, raster)
+
+            self._entries[key] = raster
+            self._evict()
+            return raster
+
+    def waveRecPic(self, *args, **kwargs):
+        """
+        Cached drop-in for wavegenerator.waveRecPic, returns (x, y) samples.
+        """
+        raster = self.get(*args, **kwargs)
+        return raster.samples_X, raster.samples_Y
+
+    # ---------------------------On-disk store------------------------------
+    def _file_path(self, key):
+        return os.path.join(self.directory, "raster_" + key + ".npy")
+
+    def _load(self, key, xPixels, yPixels):
+        if self.directory is None:
+            return None
+        samples_path = self._file_path(key)
+        if not os.path.exists(samples_path):
+            return None
+        try:
+            raster = RasterWaveforms(
+                np.load(samples_path, mmap_mode="r"), xPixels, yPixels
+            )
+        except (OSError, ValueError) as error:
+            print("Raster cache file not readable, generating again: {}".format(error))
+            return None
+        return raster
+
+    def _save(self, key, raster):
+        if self.directory is None:
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = self._file_path(key)
+            # Write to a temporary file first, so other processes never
+            # see a half written file.
+            temporary_path = path[:-4] + "_{}.tmp.npy".format(os.getpid())
+            np.save(temporary_path, raster.samples)
+            os.replace(temporary_path, path)
+        except OSError as error:
+            print("Raster not saved to the cache directory: {}".format(error))
+
+    # ----------------------------------------------------------------------
+    def _evict(self):
+        # Always keep the raster that was just added.
+        while len(self._entries) > 1 and (
+            len(self._entries) > self.maxsize or self.nbytes > self.max_bytes
+        ):
+            self._entries.popitem(last=False)
+
+    @property
+    def nbytes(self):
+        return sum(raster.nbytes for raster in self._entries.values())
+
+    def clear(self, disk=False):
+        """
+        Empty the in-memory cache, and the on-disk store if disk is True.
+        """
+        with self._lock:
+            self._entries.clear()
+            if disk and self.directory is not None and os.path.isdir(self.directory):
+                for file_name in os.listdir(self.directory):
+                    # pixel_index_ files are left by older versions.
+                    if file_name.startswith("raster_") or file_name.startswith(
+                        "pixel_index_"
+                    ):
+                        os.remove(os.path.join(self.directory, file_name))
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# Shared by all scans in the process.
+default_raster_cache = RasterCache()
@@ -0,0 +1,395 @@
+# -*- coding: utf-8 -*-
+"""
+Reconstruction of raster scanned PMT images from the recorded 1-D AI stream.
+
+The samples of a raster scan come in a fixed layout: an offset, then for every
+image the frames that are averaged, each frame yPixels lines of
+line_sample_number samples (including the fly back), then a gap before the
+next image. RasterReconstruction works out where the images start once, from
+the galvo raster or from the index array that the waveform widget makes, and
+then turns the stream into images with one strided view and one mean, without
+searching the index array for every image:
+
+    reconstruction = RasterReconstruction.from_raster(
+        raster, average_number=2, repeat_number=3
+    )
+    images = reconstruction.reconstruct(pmt_data)  # (3, yPixels, line samples)
+
+Bidirectional rasters (waveRecPic with sawtooth=False) scan the odd lines
+backwards on the ramp down of the triangle wave instead of flying back, which
+about halves the time per line. The odd lines are read backwards, and both
+directions are shifted by phase_offset samples, the lag of the recorded signal
+behind the galvo command, so the lines of the two directions line up:
+
+    reconstruction = RasterReconstruction.from_raster(
+        raster, bidirectional=True, phase_offset=50
+    )
+    image = reconstruction.reconstruct_image(pmt_data)  # (yPixels, xPixels)
+
+The recordings of several PMTs, (channels, samples) arrays, are reconstructed
+in the same pass, the images get the channel axis in front:
+
+    images = reconstruction.reconstruct(pmt_data)  # (2, images, yPixels, x)
+"""
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+
+class RasterReconstruction:
+    def __init__(
+        self,
+        line_sample_number,
+        yPixels,
+        average_number=1,
+        image_starts=(0,),
+        line_average_number=1,
+        x_slice=None,
+        polarity=1,
+        bidirectional=False,
+        xPixels=None,
+        phase_offset=0,
+    ):
+        """
+        Layout of the raster images in the recorded samples.
+
+        Parameters
+        ----------
+        line_sample_number : int
+            Number of samples of each x line, including the fly back, like
+            ScanArrayXnum.
+        yPixels : int
+            Number of lines of an image.
+        average_number : int, optional
+            Number of frames recorded one after the other that are averaged
+            into each image. The default is 1.
+        image_starts : array like, optional
+            Index of the first sample of each image. The default is (0,), one
+            image at the start.
+        line_average_number : int, optional
+            Number of times each line is scanned before the next one, the
+            scans are averaged. The default is 1.
+        x_slice : slice, optional
+            Samples of each line that are kept, e.g. slice(50, 550) to cut off
+            the fly back. The default is None, the whole line.
+        polarity : float, optional
+            Factor applied to the images, -1 for the inverted PMT signal. The
+            default is 1.
+        bidirectional : bool, optional
+            The odd lines are scanned backwards, like the triangle rasters of
+            waveRecPic(sawtooth=False). The default is False.
+        xPixels : int, optional
+            Bidirectional only, number of samples of the linear part at the
+            start of each line. The default is None, the whole line.
+        phase_offset : int, optional
+            Bidirectional only, number of samples the recorded signal lags
+            behind the galvo command. The lines are read from phase_offset
+            samples after their start, x_slice then selects from the xPixels
+            samples. The default is 0.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.line_sample_number = int(line_sample_number)
+        self.yPixels = int(yPixels)
+        self.average_number = int(average_number)
+        self.line_average_number = int(line_average_number)
+        self.image_starts = np.asarray(image_starts, dtype=np.int64)
+        self.x_slice = x_slice if x_slice is not None else slice(None)
+        self.polarity = polarity
+        self.bidirectional = bidirectional
+        self.xPixels = (
+            int(xPixels) if xPixels is not None else self.line_sample_number
+        )
+        self.phase_offset = int(phase_offset)
+
+        if self.bidirectional:
+            if self.line_average_number != 1:
+                raise ValueError("Bidirectional scans can't average line scans.")
+            if not 0 <= self.phase_offset <= self.line_sample_number - self.xPixels:
+                raise ValueError(
+                    "Phase offset of {} samples is outside the {} turn around "
+                    "samples of the lines.".format(
+                        self.phase_offset, self.line_sample_number - self.xPixels
+                    )
+                )
+
+        self.frame_sample_number = (
+            self.line_sample_number * self.line_average_number * self.yPixels
+        )
+        # Samples of all the averaged frames of one image.
+        self.image_sample_number = self.frame_sample_number * self.average_number
+
+        self.image_stride = None
+        if len(self.image_starts) > 1:
+            steps = np.diff(self.image_starts)
+            if np.all(steps == steps[0]) and steps[0] > 0:
+                self.image_stride = int(steps[0])
+
+    @classmethod
+    def from_raster(
+        cls,
+        raster,
+        average_number=1,
+        repeat_number=1,
+        offset_samples=0,
+        gap_samples=0,
+        **kwargs
+    ):
+        """
+        Layout of a scan of NIDAQ.rastercache.RasterWaveforms frames.
+
+        Parameters
+        ----------
+        raster : NIDAQ.rastercache.RasterWaveforms
+            Raster of one frame.
+        average_number : int, optional
+            Frames averaged into each image. The default is 1.
+        repeat_number : int, optional
+            Number of images. The default is 1.
+        offset_samples : int, optional
+            Samples before the first image. The default is 0.
+        gap_samples : int, optional
+            Samples between the images. The default is 0.
+        **kwargs
+            x_slice, polarity, bidirectional and phase_offset, see __init__.
+
+        Returns
+        -------
+        RasterReconstruction
+
+        """
+        image_sample_number = raster.frame_sample_number * average_number
+        image_starts = offset_samples + np.arange(repeat_number) * (
+            image_sample_number + gap_samples
+        )
+        kwargs.setdefault("xPixels", raster.xPixels)
+        return cls(
+            raster.line_sample_number,
+            raster.yPixels,
+            average_number,
+            image_starts,
+            **kwargs
+        )
+
+    @classmethod
+    def from_index_array(
+        cls, index_array, line_sample_number, yPixels, average_number=1, **kwargs
+    ):
+        """
+        Layout from an index array like WaveformGenerator's
+        PMT_data_index_array_repeated: the samples of image i are i + 1, the
+        offset and gap samples 0.
+
+        Raises ValueError if a run of samples of an image doesn't hold
+        average_number whole frames.
+        """
+        index_array = np.asarray(index_array)
+        if len(index_array) == 0:
+            return cls(line_sample_number, yPixels, average_number, [], **kwargs)
+
+        # Runs of equal values, one pass over the array.
+        run_starts = np.concatenate(([0], np.flatnonzero(np.diff(index_array)) + 1))
+        run_ends = np.append(run_starts[1:], len(index_array))
+        run_values = index_array[run_starts]
+
+        is_image = run_values > 0
+        order = np.argsort(run_values[is_image], kind="stable")
+        image_starts = run_starts[is_image][order]
+        run_lengths = (run_ends - run_starts)[is_image][order]
+
+        reconstruction = cls(
+            line_sample_number, yPixels, average_number, image_starts, **kwargs
+        )
+        if np.any(run_lengths != reconstruction.image_sample_number):
+            raise ValueError(
+                "Image samples in the index array ({}) don't match {} frames of "
+                "{} x {} samples.".format(
+                    np.unique(run_lengths).tolist(),
+                    average_number,
+                    yPixels,
+                    line_sample_number,
+                )
+            )
+        return reconstruction
+
+    @property
+    def image_number(self):
+        return len(self.image_starts)
+
+    @property
+    def required_samples(self):
+        """
+        Number of samples the recording needs to hold all images.
+        """
+        if self.image_number == 0:
+            return 0
+        return int(self.image_starts[-1]) + self.image_sample_number
+
+    def image_shape(self, image_number=None, channel_number=None):
+        """
+        (yPixels, x samples) shape of an image, with the number of images in
+        front if image_number is given and the number of channels in front of
+        that if channel_number is given.
+        """
+        if self.bidirectional:
+            x_sample_number = len(range(self.xPixels)[self.x_slice])
+        else:
+            x_sample_number = len(range(self.line_sample_number)[self.x_slice])
+        shape = (self.yPixels, x_sample_number)
+        if image_number is not None:
+            shape = (image_number,) + shape
+        if channel_number is not None:
+            shape = (channel_number,) + shape
+        return shape
+
+    @staticmethod
+    def _channel_number(data):
+        # None for the samples of one channel.
+        return data.shape[0] if data.ndim == 2 else None
+
+    # -----------------------------------------------------------------------
+    def _view(self, data, start, image_number, stride):
+        # (channels, images, frames, lines, line scans, samples) view of the
+        # data, without channels for 1-D data.
+        itemsize = data.strides[-1]
+        line_bytes = self.line_sample_number * itemsize
+        return as_strided(
+            data[..., start:],
+            shape=data.shape[:-1]
+            + (
+                image_number,
+                self.average_number,
+                self.yPixels,
+                self.line_average_number,
+                self.line_sample_number,
+            ),
+            strides=data.strides[:-1]
+            + (
+                stride * itemsize,
+                self.frame_sample_number * itemsize,
+                self.line_average_number * line_bytes,
+                line_bytes,
+                itemsize,
+            ),
+            writeable=False,
+        )[..., self.x_slice]
+
+    def _line_view(self, data, start, image_number, stride, line_number):
+        # (channels, images, frames, lines, samples) view of every other line,
+        # xPixels samples from start on.
+        itemsize = data.strides[-1]
+        return as_strided(
+            data[..., start:],
+            shape=data.shape[:-1]
+            + (image_number, self.average_number, line_number, self.xPixels),
+            strides=data.strides[:-1]
+            + (
+                stride * itemsize,
+                self.frame_sample_number * itemsize,
+                2 * self.line_sample_number * itemsize,
+                itemsize,
+            ),
+            writeable=False,
+        )
+
+    def _average(self, view, out):
+        # Mean over the frames and the line scans, into out.
+        np.mean(view, axis=(-4, -2), out=out)
+        if self.polarity != 1:
+            out *= self.polarity
+        return out
+
+    def _fill(self, data, start, image_number, stride, out):
+        # Images starting at start, stride samples apart, into out.
+        if self.bidirectional == False:
+            return self._average(self._view(data, start, image_number, stride), out)
+
+        start += self.phase_offset
+        forward = self._line_view(
+            data, start, image_number, stride, (self.yPixels + 1) // 2
+        )
+        np.mean(forward[..., self.x_slice], axis=-3, out=out[..., 0::2, :])
+
+        # The odd lines backwards, reversing the view doesn't copy.
+        backward = self._line_view(
+            data,
+            start + self.line_sample_number,
+            image_number,
+            stride,
+            self.yPixels // 2,
+        )[..., ::-1]
+        np.mean(backward[..., self.x_slice], axis=-3, out=out[..., 1::2, :])
+
+        if self.polarity != 1:
+            out *= self.polarity
+        return out
+
+    def reconstruct(self, data, out=None):
+        """
+        All images of the recording.
+
+        Parameters
+        ----------
+        data : np.ndarray
+            1-D recorded samples, or (channels, samples) for several PMTs.
+        out : np.ndarray, optional
+            float64 array of shape (image_number, yPixels, x samples), with
+            the channels in front for several PMTs, to put the images in. The
+            default is None, a new array.
+
+        Returns
+        -------
+        np.ndarray
+            (image_number, yPixels, x samples) images, or (channels,
+            image_number, yPixels, x samples).
+
+        """
+        data = np.ascontiguousarray(data)
+        if data.shape[-1] < self.required_samples:
+            raise ValueError(
+                "Recording of {} samples is shorter than the {} samples of the "
+                "images.".format(data.shape[-1], self.required_samples)
+            )
+
+        if out is None:
+            out = np.empty(
+                self.image_shape(self.image_number, self._channel_number(data))
+            )
+
+        if self.image_number <= 1 or self.image_stride is not None:
+            return self._fill(
+                data,
+                int(self.image_starts[0]) if self.image_number != 0 else 0,
+                self.image_number,
+                self.image_stride or 0,
+                out,
+            )
+
+        # Images not evenly spaced, one view for each.
+        for index in range(self.image_number):
+            self.reconstruct_image(data, index, out=out[..., index, :, :])
+        return out
+
+    def reconstruct_image(self, data, index=0, out=None):
+        """
+        One image of the recording, (yPixels, x samples), or (channels,
+        yPixels, x samples) for (channels, samples) data.
+        """
+        data = np.ascontiguousarray(data)
+        start = int(self.image_starts[index])
+        if data.shape[-1] < start + self.image_sample_number:
+            raise ValueError(
+                "Recording of {} samples doesn't hold image {}.".format(
+                    data.shape[-1], index
+                )
+            )
+        if out is None:
+            out = np.empty(
+                self.image_shape(channel_number=self._channel_number(data))
+            )
+        return self._fill(data, start, 1, 0, out[..., np.newaxis, :, :])[
+            ..., 0, :, :
+        ]
@@ -0,0 +1,537 @@
+# -*- coding: utf-8 -*-
+"""
+DAQmission.save_as_binary saves every run into one recording file (.daqrec)
+with RecordingWriter: all channels, each with its sampling rate, data type,
+scaling coefficients and polarity, the waveforms that were sent and the
+metadata of the run, like the clock source and the start and finish time.
+RecordingFile reads the header only and memory-maps the channels, so a time
+range of a multi-GB recording is read without loading the rest:
+    recording = RecordingFile(file_path)
+    pmt = recording.channel("PMT", start_time=0.5, stop_time=1.5)
+
+load_recorded_channel also reads the Vp and Ip .npy files saved before there
+were recording files.
+"""
+
+import json
+import os
+from datetime import datetime
+
+import numpy as np
+
+
+def scale_counts(counts, coefficients):
+    """
+    Convert raw ADC counts to volts with the device scaling polynomial.
+
+    Parameters
+    ----------
+    counts : np.ndarray
+        int16 counts, either 1-D for one channel or (channel number, samples).
+    coefficients : array like
+        Polynomial coefficients, lowest order first. For 2-D counts this is
+        (channel number, order), one row per channel.
+
+    Returns
+    -------
+    np.ndarray
+        float64 array of the same shape as counts.
+
+    """
+    counts = np.asarray(counts)
+    coefficients = np.asarray(coefficients, dtype=np.float64)
+    if coefficients.ndim == 2:
+        # (order, channel number, 1), broadcasts over the samples of each row.
+        coefficients = coefficients.T[:, :, np.newaxis]
+
+    # Horner's scheme, in place on one float64 array.
+    values = np.empty(counts.shape, dtype=np.float64)
+    values[...] = coefficients[-1]
+    for coefficient in coefficients[-2::-1]:
+        values *= counts
+        values += coefficient
+    return values
+
+
+# =============================================================================
+#     Recording file, one self-describing container per run
+# =============================================================================
+
+RECORDING_FILE_EXTENSION = ".daqrec"
+RECORDING_FILE_VERSION = 1
+
+# Magic, format version (uint16) and size of the header (uint32).
+_MAGIC = b"GEVIDAQREC"
+_PREFIX_SIZE = len(_MAGIC) + 2 + 4
+# The channel blocks start at multiples of this, for aligned memory maps.
+_ALIGNMENT = 64
+# Room left in the header for what is only known when the file is closed,
+# like the time the acquisition finished.
+_HEADER_RESERVE = 4096
+
+# Sampling rate and four scaling coefficients in front of the Vp and Ip .npy
+# files saved before there were recording files.
+LEGACY_HEADER_LENGTH = 5
+
+
+def _aligned(offset):
+    return -(-offset // _ALIGNMENT) * _ALIGNMENT
+
+
+def _json_value(value):
+    # numpy scalars and arrays in the metadata, as plain JSON values.
+    if isinstance(value, dict):
+        return {str(key): _json_value(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_json_value(item) for item in value]
+    if isinstance(value, np.ndarray):
+        return _json_value(value.tolist())
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def is_recording_file(file_path):
+    """
+    True if the file is a recording file made by RecordingWriter.
+    """
+    try:
+        with open(file_path, "rb") as recording_file:
+            return recording_file.read(len(_MAGIC)) == _MAGIC
+    except OSError:
+        return False
+
+
+def waveform_specifications(analog_signals, digital_signals, channel_LUT=None):
+    """
+    Description of the waveforms of a run, to store in the recording file.
+
+    Parameters
+    ----------
+    analog_signals, digital_signals
+        Waveform packages as given to DAQmission.runWaveforms, can be {}.
+    channel_LUT : dict, optional
+        Port of each specification. The default is None.
+
+    Returns
+    -------
+    list of dict
+        Specification, "analog" or "digital", and the port of every waveform.
+
+    """
+    specifications = []
+    for kind, signals in (("analog", analog_signals), ("digital", digital_signals)):
+        if len(signals) == 0:
+            continue
+        for specification in signals["Sepcification"]:
+            specification = str(specification)
+            port = None
+            if channel_LUT is not None:
+                port = channel_LUT.get(specification, None)
+            specifications.append(
+                {"specification": specification, "type": kind, "port": port}
+            )
+    return specifications
+
+
+class RecordingWriter:
+    def __init__(
+        self,
+        file_path,
+        channel_names,
+        sampling_rates,
+        numbers_of_samples,
+        dtype="float64",
+        scaling_coeff=None,
+        polarity=None,
+        waveform_specs=None,
+        metadata=None,
+    ):
+        """
+        Write a recording file chunk by chunk.
+
+        The file has a fixed size prefix, a JSON header with everything
+        needed to read the data back, and then one contiguous block per
+        channel. The file is allocated when it is created, so the chunks of
+        each channel can be written in any order with write(). Read it with
+        RecordingFile.
+
+        Parameters
+        ----------
+        file_path : str
+            Path of the file, usually ending with RECORDING_FILE_EXTENSION.
+        channel_names : list of str
+            Name of each channel, like ["PMT", "Vp", "Ip"].
+        sampling_rates : list of float
+            Sampling rate of each channel.
+        numbers_of_samples : list of int
+            Number of samples of each channel.
+        dtype : str or list of str, optional
+            Data type on disk, one for all channels or one per channel. The
+            default is "float64".
+        scaling_coeff : dict, optional
+            Polynomial coefficients, lowest order first, for each channel that
+            is stored as raw ADC counts. The default is None, the data is in
+            volts.
+        polarity : dict, optional
+            Factor, 1 or -1, applied to each channel when read. The default is
+            -1 for the PMTs and 1 for the other channels.
+        waveform_specs : list of dict, optional
+            Waveforms that were sent, see waveform_specifications.
+        metadata : dict, optional
+            Anything else to keep with the recording, like the clock source
+            and the start time. Has to be JSON serialisable.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.file_path = file_path
+        self.channel_names = list(channel_names)
+        if isinstance(dtype, (str, type, np.dtype)):
+            dtype = [dtype] * len(self.channel_names)
+        if scaling_coeff is None:
+            scaling_coeff = {}
+        if polarity is None:
+            polarity = {
+                name: -1 if name.startswith("PMT") else 1
+                for name in self.channel_names
+            }
+
+        channels = []
+        offset = 0
+        for name, rate, samples, channel_dtype in zip(
+            self.channel_names, sampling_rates, numbers_of_samples, dtype
+        ):
+            channel_dtype = np.dtype(channel_dtype)
+            coefficients = scaling_coeff.get(name, None)
+            channels.append(
+                {
+                    "name": name,
+                    "sampling_rate": float(rate),
+                    "samples": int(samples),
+                    "dtype": channel_dtype.str,
+                    # From the start of the data blocks.
+                    "offset": offset,
+                    "unit": "V" if coefficients is None else "counts",
+                    "scaling_coeff": None
+                    if coefficients is None
+                    else [float(c) for c in coefficients],
+                    "polarity": int(polarity.get(name, 1)),
+                }
+            )
+            offset = _aligned(offset + int(samples) * channel_dtype.itemsize)
+
+        self.header = {
+            "version": RECORDING_FILE_VERSION,
+            "channels": channels,
+            "waveforms": _json_value(waveform_specs or []),
+            "metadata": _json_value(metadata or {}),
+        }
+        self._channels = {channel["name"]: channel for channel in channels}
+
+        header_bytes = json.dumps(self.header).encode("utf-8")
+        self._header_size = len(header_bytes) + _HEADER_RESERVE
+        self._data_start = _aligned(_PREFIX_SIZE + self._header_size)
+
+        self._file = open(file_path, "wb+")
+        self._write_header()
+        # Allocates the whole file, sparse where the file system supports it.
+        self._file.truncate(self._data_start + offset)
+
+    def _write_header(self):
+        header_bytes = json.dumps(self.header).encode("utf-8")
+        if len(header_bytes) > self._header_size:
+            raise ValueError("Recording file header doesn't fit the reserved space.")
+
+        self._file.seek(0)
+        self._file.write(_MAGIC)
+        self._file.write(np.uint16(RECORDING_FILE_VERSION).tobytes())
+        self._file.write(np.uint32(self._header_size).tobytes())
+        self._file.write(header_bytes.ljust(self._header_size, b" "))
+
+    def write(self, name, data, start_index=0):
+        """
+        Write samples of one channel.
+
+        Parameters
+        ----------
+        name : str
+            Channel name.
+        data : np.ndarray
+            1-D samples, converted to the data type of the channel.
+        start_index : int, optional
+            Index of the first sample in the channel. The default is 0.
+
+        Returns
+        -------
+        None.
+
+        """
+        channel = self._channels[name]
+        dtype = np.dtype(channel["dtype"])
+        data = np.ascontiguousarray(data, dtype=dtype)
+        if start_index + len(data) > channel["samples"]:
+            raise ValueError(
+                "{} samples from {} don't fit channel {} of {} samples.".format(
+                    len(data), start_index, name, channel["samples"]
+                )
+            )
+        self._file.seek(
+            self._data_start + channel["offset"] + start_index * dtype.itemsize
+        )
+        self._file.write(data.tobytes())
+
+    def close(self, metadata=None):
+        """
+        Close the file.
+
+        Parameters
+        ----------
+        metadata : dict, optional
+            Added to the metadata in the header, like the finish time. The
+            default is None.
+
+        Returns
+        -------
+        None.
+
+        """
+        if self._file is None:
+            return
+        try:
+            if metadata is not None:
+                self.header["metadata"].update(_json_value(metadata))
+                self._write_header()
+        finally:
+            self._file.close()
+            self._file = None
+
+
+def save_recording(
+    directory,
+    channel_data,
+    channel_names,
+    sampling_rates,
+    scaling_coeff=None,
+    polarity=None,
+    waveform_specs=None,
+    metadata=None,
+    prefix="Recording_",
+):
+    """
+    Save the recording of one run into a recording file.
+
+    Parameters
+    ----------
+    directory : str
+        Directory to save the file.
+    channel_data : list of np.ndarray
+        1-D samples of each channel, e.g. the rows of DAQmission.Dataholder.
+    channel_names, sampling_rates, scaling_coeff, polarity, waveform_specs, metadata
+        See RecordingWriter. sampling_rates can also be one rate for all
+        channels.
+    prefix : str, optional
+        Prefix of the file name. The default is "Recording_".
+
+    Returns
+    -------
+    str
+        Path of the saved file.
+
+    """
+    channel_data = [np.asarray(data) for data in channel_data]
+    if np.ndim(sampling_rates) == 0:
+        sampling_rates = [sampling_rates] * len(channel_data)
+
+    file_path = os.path.join(
+        directory,
+        prefix
+        + "_".join(channel_names)
+        + "_"
+        + datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        + RECORDING_FILE_EXTENSION,
+    )
+    writer = RecordingWriter(
+        file_path,
+        channel_names,
+        sampling_rates,
+        [len(data) for data in channel_data],
+        dtype=[data.dtype for data in channel_data],
+        scaling_coeff=scaling_coeff,
+        polarity=polarity,
+        waveform_specs=waveform_specs,
+        metadata=metadata,
+    )
+    try:
+        for name, data in zip(channel_names, channel_data):
+            writer.write(name, data)
+    finally:
+        writer.close()
+    return file_path
+
+
+class RecordingFile:
+    def __init__(self, file_path):
+        """
+        Read a recording file made by RecordingWriter or save_recording.
+
+        Only the header is read when the file is opened. The channels are
+        memory-mapped and only the samples that are asked for are read from
+        disk and scaled, so long recordings open right away, e.g.
+            recording = RecordingFile(r"M:\\...\\Recording_PMT_Vp_2021-05-04_12-00-00.daqrec")
+            vp = recording.channel("Vp", start_time=1.0, stop_time=2.0)
+            t = recording.time_axis("Vp", start_time=1.0, stop_time=2.0)
+
+        Parameters
+        ----------
+        file_path : str
+            Path of the file.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.file_path = file_path
+        with open(file_path, "rb") as recording_file:
+            prefix = recording_file.read(_PREFIX_SIZE)
+            if len(prefix) != _PREFIX_SIZE or prefix[: len(_MAGIC)] != _MAGIC:
+                raise ValueError("{} is not a recording file.".format(file_path))
+            version = int(np.frombuffer(prefix, np.uint16, 1, len(_MAGIC))[0])
+            if version > RECORDING_FILE_VERSION:
+                raise ValueError(
+                    "Recording file version {} is not supported.".format(version)
+                )
+            header_size = int(np.frombuffer(prefix, np.uint32, 1, len(_MAGIC) + 2)[0])
+            self.header = json.loads(recording_file.read(header_size).decode("utf-8"))
+
+        self._data_start = _aligned(_PREFIX_SIZE + header_size)
+        self._channels = {
+            channel["name"]: channel for channel in self.header["channels"]
+        }
+        self.channel_names = [channel["name"] for channel in self.header["channels"]]
+        self.waveform_specs = self.header["waveforms"]
+        self.metadata = self.header["metadata"]
+
+        self._memmaps = {}
+
+    def sampling_rate(self, name):
+        return self._channels[name]["sampling_rate"]
+
+    def number_of_samples(self, name):
+        return self._channels[name]["samples"]
+
+    def duration(self, name):
+        """
+        Length of the channel in s.
+        """
+        return self.number_of_samples(name) / self.sampling_rate(name)
+
+    def sample_range(self, name, start_time=None, stop_time=None):
+        """
+        First sample and the sample after the last one of a time range.
+        """
+        rate = self.sampling_rate(name)
+        samples = self.number_of_samples(name)
+        start = 0 if start_time is None else int(np.ceil(start_time * rate))
+        stop = samples if stop_time is None else int(np.ceil(stop_time * rate))
+        start = min(max(start, 0), samples)
+        stop = min(max(stop, start), samples)
+        return start, stop
+
+    def raw(self, name, start=0, stop=None):
+        """
+        Samples of one channel as stored, counts or volts without polarity.
+        A read-only memory map, nothing is read until it is used.
+        """
+        if name not in self._memmaps:
+            channel = self._channels[name]
+            if channel["samples"] == 0:
+                self._memmaps[name] = np.zeros(0, dtype=channel["dtype"])
+            else:
+                self._memmaps[name] = np.memmap(
+                    self.file_path,
+                    dtype=channel["dtype"],
+                    mode="r",
+                    offset=self._data_start + channel["offset"],
+                    shape=(channel["samples"],),
+                )
+        return self._memmaps[name][start:stop]
+
+    def channel(self, name, start_time=None, stop_time=None):
+        """
+        Samples of one channel in volts, with the polarity applied.
+
+        Parameters
+        ----------
+        name : str
+            Channel name, like "Vp".
+        start_time, stop_time : float, optional
+            Time range in s. The default is the whole recording.
+
+        Returns
+        -------
+        np.ndarray
+            float64 values.
+
+        """
+        channel = self._channels[name]
+        data = self.raw(name, *self.sample_range(name, start_time, stop_time))
+        if channel["scaling_coeff"] is not None:
+            return scale_counts(
+                data, np.asarray(channel["scaling_coeff"]) * channel["polarity"]
+            )
+        return data * np.float64(channel["polarity"])
+
+    def time_axis(self, name, start_time=None, stop_time=None):
+        """
+        Time in s of every sample of the channel in the time range.
+        """
+        start, stop = self.sample_range(name, start_time, stop_time)
+        return np.arange(start, stop) / self.sampling_rate(name)
+
+    def close(self):
+        # Drops the memory maps, arrays returned by raw() keep theirs open.
+        self._memmaps = {}
+
+    def __contains__(self, name):
+        return name in self._channels
+
+    def __getitem__(self, name):
+        return self.channel(name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def load_recorded_channel(file_path, name):
+    """
+    Samples and sampling rate of a channel, from a recording file or from the
+    single channel .npy files saved before there were recording files (Vp and
+    Ip files start with the sampling rate and four scaling coefficients).
+
+    Parameters
+    ----------
+    file_path : str
+        Path of the recording file or the .npy file.
+    name : str
+        Channel name, like "Vp". Not used for .npy files.
+
+    Returns
+    -------
+    data : np.ndarray
+        Samples in volts, including the padding samples of the waveforms.
+    sampling_rate : float
+
+    """
+    if is_recording_file(file_path):
+        recording = RecordingFile(file_path)
+        return recording.channel(name), recording.sampling_rate(name)
+
+    data = np.load(file_path)
+    return data[LEGACY_HEADER_LENGTH:], float(data[0])
@@ -0,0 +1,1076 @@
+# -*- coding: utf-8 -*-
+"""
+Software stand-in for the part of the nidaqmx package that is used in this
+repository, so that the timing critical DAQ code (DAQmission, the continuous
+PMT threads, the seal test) can be run and profiled without NI hardware.
+
+It is selected through NIDAQ.daqbackend, e.g. by setting the environment
+variable GEVIDAQ_DAQ_BACKEND=simulated before starting the program.
+
+What is simulated:
+    - Sample clocks: samples become available at the configured rate, in real
+      time (scaled by system.time_scale). Reads block until the requested
+      samples are acquired and raise on timeout or buffer overflow, so a
+      consumer that can not keep up shows up the same way as on the rig.
+    - Clock and trigger routing: tasks clocked from "ai/SampleClock", or from a
+      PFI terminal that is cabled to an exported clock (clock1Channel ->
+      clock2Channel in NiDaqChannels), follow the timeline of the master task.
+      Tasks waiting for an external clock (e.g. camera on PFI0) that nobody
+      exports run on that terminal's own timeline.
+    - Finite and continuous sample modes, buffer sizes, regeneration of the
+      output buffer and every-N-samples events.
+    - Loopback: AI data is synthesised from the AO samples that are written on
+      the same clock, e.g. a PMT signal from the galvo voltages scanning a
+      synthetic sample, or a patch current from the command voltage.
+
+Example:
+    from NIDAQ import simulated_nidaqmx
+    simulated_nidaqmx.system.time_scale = 10  # Run 10x faster than real time.
+    simulated_nidaqmx.system.set_loopback("Dev1/ai0", simulated_nidaqmx.PMTLoopback(lag_samples=20))
+"""
+
+import itertools
+import threading
+import time
+from enum import Enum
+from types import SimpleNamespace
+
+import numpy as np
+from scipy.signal import lfilter
+
+from NIDAQ.constants import NiDaqChannels
+
+
+# =============================================================================
+#     Constants and errors, with the same names as in nidaqmx
+# =============================================================================
+
+
+class AcquisitionType(Enum):
+    FINITE = 10178
+    CONTINUOUS = 10123
+    HW_TIMED_SINGLE_POINT = 12522
+
+
+class LineGrouping(Enum):
+    CHAN_FOR_ALL_LINES = 1
+    CHAN_PER_LINE = 0
+
+
+class TaskMode(Enum):
+    TASK_START = 0
+    TASK_STOP = 1
+    TASK_VERIFY = 2
+    TASK_COMMIT = 3
+    TASK_RESERVE = 4
+    TASK_UNRESERVE = 5
+    TASK_ABORT = 6
+
+
+class Signal(Enum):
+    SAMPLE_CLOCK = 12487
+    START_TRIGGER = 12481
+
+
+class RegenerationMode(Enum):
+    ALLOW_REGENERATION = 10097
+    DONT_ALLOW_REGENERATION = 10158
+
+
+class Edge(Enum):
+    RISING = 10280
+    FALLING = 10171
+
+
+class EveryNSamplesEventType(Enum):
+    ACQUIRED_INTO_BUFFER = 1
+    TRANSFERRED_FROM_BUFFER = 2
+
+
+constants = SimpleNamespace(
+    AcquisitionType=AcquisitionType,
+    LineGrouping=LineGrouping,
+    TaskMode=TaskMode,
+    Signal=Signal,
+    RegenerationMode=RegenerationMode,
+    Edge=Edge,
+    EveryNSamplesEventType=EveryNSamplesEventType,
+)
+
+
+class DaqError(Exception):
+    def __init__(self, message, error_code=-200000):
+        super().__init__(message)
+        self.error_code = error_code
+
+
+errors = SimpleNamespace(DaqError=DaqError)
+
+
+def _normalise_channel(name):
+    """ '/Dev1/ao0' -> 'Dev1/ao0' """
+    return name.strip().lstrip("/")
+
+
+def _expand_physical_channels(physical_channel):
+    """
+    Expand a physical channel string like "/Dev1/ao0:1, Dev1/ao3" into a list
+    of single channel names.
+    """
+    channels = []
+    for part in physical_channel.split(","):
+        part = _normalise_channel(part)
+        if ":" in part:
+            prefix, last = part.rsplit(":", 1)
+            base = prefix.rstrip("0123456789")
+            first = int(prefix[len(base) :])
+            for index in range(first, int(last) + 1):
+                channels.append(base + str(index))
+        else:
+            channels.append(part)
+    return channels
+
+
+def _device_of(name):
+    return _normalise_channel(name).split("/")[0]
+
+
+# =============================================================================
+#     Loopback models, synthesising AI data from AO data
+# =============================================================================
+
+
+class NoiseSource:
+    def __init__(self, offset=0.0, noise=0.001, seed=None):
+        """
+        Default input: a constant offset with gaussian noise.
+        """
+        self.offset = offset
+        self.noise = noise
+        self.rng = np.random.default_rng(seed)
+
+    def reset(self):
+        pass
+
+    def __call__(self, ao_lookup, start, number_of_samples, sample_rate):
+        return self.offset + self.noise * self.rng.standard_normal(number_of_samples)
+
+
+class PMTLoopback:
+    def __init__(
+        self,
+        x_channel="Dev1/ao0",
+        y_channel="Dev1/ao1",
+        image=None,
+        volt_range=10.0,
+        lag_samples=0,
+        background=0.02,
+        noise=0.005,
+        seed=None,
+    ):
+        """
+        PMT signal of a synthetic sample scanned by the galvos.
+
+        The sample is an image spanning -volt_range..volt_range on both galvo
+        axes. At every sample the galvo position (delayed by lag_samples, to
+        mimic the galvo lag) picks the pixel that is seen by the PMT. As on
+        the rig the PMT output is negative.
+
+        Parameters
+        ----------
+        x_channel, y_channel : str
+            AO channels of the galvos.
+        image : np.ndarray, optional
+            2-D sample. The default is a field of gaussian "cells".
+        volt_range : float, optional
+            Galvo voltage that maps to the edge of the image.
+        lag_samples : int, optional
+            Delay between the galvo command and the actual position.
+        background, noise : float, optional
+            Offset and gaussian noise on the signal, in volts.
+        seed : int, optional
+            Seed for the random generator.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.x_channel = _normalise_channel(x_channel)
+        self.y_channel = _normalise_channel(y_channel)
+        self.volt_range = volt_range
+        self.lag_samples = int(lag_samples)
+        self.background = background
+        self.noise = noise
+        self.rng = np.random.default_rng(seed)
+
+        if image is None:
+            image = self.make_cell_image(seed=seed)
+        self.image = np.asarray(image, dtype=float)
+
+    @staticmethod
+    def make_cell_image(size=512, cell_number=40, cell_radius=12, seed=None):
+        """
+        Make a field of randomly placed gaussian blobs with amplitude ~1 V.
+        """
+        rng = np.random.default_rng(seed)
+        yy, xx = np.mgrid[0:size, 0:size]
+        image = np.zeros((size, size))
+        for x, y, amplitude in zip(
+            rng.uniform(0, size, cell_number),
+            rng.uniform(0, size, cell_number),
+            rng.uniform(0.3, 1.0, cell_number),
+        ):
+            image += amplitude * np.exp(
+                -((xx - x) ** 2 + (yy - y) ** 2) / (2 * cell_radius ** 2)
+            )
+        return image
+
+    def reset(self):
+        pass
+
+    def __call__(self, ao_lookup, start, number_of_samples, sample_rate):
+        lagged_start = start - self.lag_samples
+        x = ao_lookup(self.x_channel, lagged_start, number_of_samples)
+        y = ao_lookup(self.y_channel, lagged_start, number_of_samples)
+
+        rows, columns = self.image.shape
+        column_index = np.clip(
+            ((x + self.volt_range) / (2 * self.volt_range) * columns).astype(int),
+            0,
+            columns - 1,
+        )
+        row_index = np.clip(
+            ((y + self.volt_range) / (2 * self.volt_range) * rows).astype(int),
+            0,
+            rows - 1,
+        )
+
+        signal = self.image[row_index, column_index] + self.background
+        signal += self.noise * self.rng.standard_normal(number_of_samples)
+        return -1 * signal
+
+
+class PatchClampLoopback:
+    def __init__(
+        self,
+        command_channel="Dev2/ao2",
+        seal_resistance=1e9,
+        membrane_capacitance=30e-12,
+        access_resistance=10e6,
+        command_gain=0.1,
+        current_gain=1e9,
+        noise=0.0005,
+        seed=None,
+    ):
+        """
+        Current output of the patch clamp amplifier for a cell behind an
+        access resistance, driven by the command voltage.
+
+        The command voltage (AO volts * command_gain) charges the membrane
+        capacitance through the access resistance, the seal resistance leaks
+        to ground. The current is returned as amplifier output voltage,
+        I * current_gain.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.command_channel = _normalise_channel(command_channel)
+        self.seal_resistance = seal_resistance
+        self.membrane_capacitance = membrane_capacitance
+        self.access_resistance = access_resistance
+        self.command_gain = command_gain
+        self.current_gain = current_gain
+        self.noise = noise
+        self.rng = np.random.default_rng(seed)
+        self.reset()
+
+    def reset(self):
+        self._membrane_voltage = 0.0
+
+    def __call__(self, ao_lookup, start, number_of_samples, sample_rate):
+        command = self.command_gain * ao_lookup(
+            self.command_channel, start, number_of_samples
+        )
+        dt = 1.0 / sample_rate
+        tau = self.access_resistance * self.membrane_capacitance
+        # Exact discretisation of the first order RC response per sample.
+        decay = np.exp(-dt / tau)
+
+        # Membrane voltage follows the command through a first order filter,
+        # the filter state is carried over between reads.
+        membrane, _ = lfilter(
+            [1 - decay],
+            [1, -decay],
+            command,
+            zi=[decay * self._membrane_voltage],
+        )
+        if number_of_samples != 0:
+            self._membrane_voltage = membrane[-1]
+
+        current = (command - membrane) / self.access_resistance
+        current += command / self.seal_resistance
+        current += self.noise / self.current_gain * self.rng.standard_normal(
+            number_of_samples
+        )
+        return current * self.current_gain
+
+
+class VoltageFollowerLoopback:
+    def __init__(self, command_channel="Dev2/ao2", gain=1.0, noise=0.0005, seed=None):
+        """
+        Voltage monitor output: the command voltage times a gain.
+        """
+        self.command_channel = _normalise_channel(command_channel)
+        self.gain = gain
+        self.noise = noise
+        self.rng = np.random.default_rng(seed)
+
+    def reset(self):
+        pass
+
+    def __call__(self, ao_lookup, start, number_of_samples, sample_rate):
+        command = ao_lookup(self.command_channel, start, number_of_samples)
+        return self.gain * command + self.noise * self.rng.standard_normal(
+            number_of_samples
+        )
+
+
+# =============================================================================
+#     The simulated DAQ system
+# =============================================================================
+
+
+class SimulatedSystem:
+    # Polynomial from int16 counts to volts for a +-10 V range.
+    default_scaling_coeff = [0.0, 10.0 / 32768, 0.0, 0.0]
+
+    def __init__(self):
+        """
+        Holds the state shared between simulated tasks: running tasks, static
+        output values, terminal cabling and the loopback models.
+        """
+        self.lock = threading.RLock()
+        self.time_scale = 1.0
+        self.tasks = []
+        self.static_values = {}
+        self.loopbacks = {}
+        self._handle_counter = itertools.count(1)
+
+        # Terminals connected with a BNC cable, from receiving to exporting side.
+        channel_LUT = NiDaqChannels().look_up_table
+        self.cabling = {
+            channel_LUT["clock2Channel"]: channel_LUT["clock1Channel"],
+            channel_LUT["trigger2Channel"]: channel_LUT["trigger1Channel"],
+        }
+        self.set_default_loopbacks(channel_LUT)
+
+    def set_default_loopbacks(self, channel_LUT=None):
+        if channel_LUT is None:
+            channel_LUT = NiDaqChannels().look_up_table
+        self.loopbacks = {}
+        self.set_loopback(
+            channel_LUT["PMT"],
+            PMTLoopback(channel_LUT["galvosx"], channel_LUT["galvosy"]),
+        )
+        if "PMT2" in channel_LUT:
+            # The other colour, another field of cells.
+            self.set_loopback(
+                channel_LUT["PMT2"],
+                PMTLoopback(channel_LUT["galvosx"], channel_LUT["galvosy"]),
+            )
+        self.set_loopback(
+            channel_LUT["VpPatch"], VoltageFollowerLoopback(channel_LUT["patchAO"])
+        )
+        self.set_loopback(
+            channel_LUT["Ip"], PatchClampLoopback(channel_LUT["patchAO"])
+        )
+
+    def set_loopback(self, physical_channel, model):
+        """
+        Set the model that synthesises the data of an AI channel.
+        """
+        self.loopbacks[_normalise_channel(physical_channel)] = model
+
+    def new_handle(self):
+        return next(self._handle_counter)
+
+    def now(self):
+        return time.perf_counter() * self.time_scale
+
+    def sleep(self, seconds):
+        time.sleep(max(seconds, 0) / self.time_scale)
+
+    def register(self, task):
+        with self.lock:
+            self.tasks.append(task)
+
+    def unregister(self, task):
+        with self.lock:
+            if task in self.tasks:
+                self.tasks.remove(task)
+
+    def reserved_by_other_task(self, task):
+        """
+        Whether an output channel of the task is used by another running task.
+        A port channel reserves all its lines.
+        """
+        channels = task._output_channel_list()
+        with self.lock:
+            for other in self.tasks:
+                if other is task or not other._running:
+                    continue
+                for channel in channels:
+                    for other_channel in other._output_channel_list():
+                        if (
+                            channel == other_channel
+                            or channel.startswith(other_channel + "/")
+                            or other_channel.startswith(channel + "/")
+                        ):
+                            return True
+        return False
+
+    # ------------------------------Clock routing------------------------------
+    def exported_by(self, terminal):
+        """
+        Find the task that exports its sample clock to the terminal, following
+        the cabling between devices.
+        """
+        terminal = "/" + _normalise_channel(terminal)
+        terminal = self.cabling.get(terminal, terminal)
+        with self.lock:
+            for task in self.tasks:
+                exported = task.export_signals.samp_clk_output_term
+                if exported and "/" + _normalise_channel(exported) == terminal:
+                    return task
+        return None
+
+    def clock_master(self, task, _visited=None):
+        """
+        Return the task whose timeline the task follows, or a terminal name
+        for an external clock that is not exported by any task.
+        """
+        source = task.timing.samp_clk_src
+        if not source or source == "OnboardClock":
+            return task
+
+        if _visited is None:
+            _visited = set()
+        if id(task) in _visited:
+            return task
+        _visited.add(id(task))
+
+        if "ai/SampleClock" in source:
+            device = (
+                _device_of(source)
+                if source.strip("/").startswith("Dev")
+                else task.device
+            )
+            with self.lock:
+                for other in self.tasks:
+                    if other is not task and other.device == device and other.ai_channel_list:
+                        return self.clock_master(other, _visited)
+            return "/" + device + "/ai/SampleClock"
+
+        exporting_task = self.exported_by(source)
+        if exporting_task is not None and exporting_task is not task:
+            return self.clock_master(exporting_task, _visited)
+        return "/" + _normalise_channel(source)
+
+    def timeline_start(self, task):
+        """
+        Time at which the first sample of the task is clocked, None if the
+        clock has not started yet.
+        """
+        master = self.clock_master(task)
+        if isinstance(master, Task):
+            if not master._running or not task._running:
+                return None
+            return master._start_time
+        # External clock: the tasks on it start on the first edge after the
+        # last one of them is armed.
+        with self.lock:
+            start_times = [
+                other._start_time
+                for other in self.tasks
+                if other._running and self.clock_master(other) == master
+            ]
+        if len(start_times) == 0:
+            return None
+        return max(start_times)
+
+    def samples_clocked(self, task):
+        """
+        Number of samples clocked in (or out) by the task so far.
+        """
+        if not task._running:
+            return task._samples_at_stop
+        start_time = self.timeline_start(task)
+        if start_time is None:
+            return 0
+        clocked = int((self.now() - start_time) * task.timing.samp_clk_rate)
+        clocked = max(clocked, 0)
+        if task.timing.samp_quant_samp_mode == AcquisitionType.FINITE:
+            clocked = min(clocked, task.timing.samp_quant_samp_per_chan)
+        return clocked
+
+    # ------------------------------Loopback-----------------------------------
+    def ao_lookup_for(self, ai_task):
+        """
+        Build the function that returns the AO samples of a channel, aligned to
+        the samples of the AI task.
+        """
+        master = self.clock_master(ai_task)
+        with self.lock:
+            output_tasks = [
+                task
+                for task in self.tasks
+                if task._running
+                and task.ao_channel_list
+                and task._buffer is not None
+                and self.clock_master(task) == master
+            ]
+
+        def ao_lookup(channel, start, number_of_samples):
+            channel = _normalise_channel(channel)
+            for task in output_tasks:
+                if channel in task.ao_channel_list:
+                    row = task._buffer[task.ao_channel_list.index(channel)]
+                    index = np.arange(start, start + number_of_samples)
+                    length = len(row)
+                    if task.timing.samp_quant_samp_mode == AcquisitionType.FINITE:
+                        # After a finite generation the last value is held.
+                        last = task.timing.samp_quant_samp_per_chan - 1
+                        index = np.clip(index, 0, last)
+                    else:
+                        index = np.maximum(index, 0)
+                    return row[index % length]
+            return np.full(number_of_samples, self.static_values.get(channel, 0.0))
+
+        return ao_lookup
+
+    def synthesise(self, ai_task, start, number_of_samples):
+        ao_lookup = self.ao_lookup_for(ai_task)
+        data = np.zeros((len(ai_task.ai_channel_list), number_of_samples))
+        for row, channel in enumerate(ai_task.ai_channel_list):
+            model = self.loopbacks.get(channel)
+            if model is None:
+                model = ai_task._noise_source
+            data[row] = model(
+                ao_lookup, start, number_of_samples, ai_task.timing.samp_clk_rate
+            )
+        return data
+
+    def reset(self):
+        with self.lock:
+            for task in list(self.tasks):
+                task.close()
+            self.static_values = {}
+            for model in self.loopbacks.values():
+                model.reset()
+
+
+system = SimulatedSystem()
+
+
+# =============================================================================
+#     Task and its sub-objects
+# =============================================================================
+
+
+class _ChannelCollection:
+    def __init__(self, task, kind):
+        self._task = task
+        self._kind = kind
+
+    @property
+    def channel_names(self):
+        return list(self._task._channel_lists[self._kind])
+
+    def __len__(self):
+        return len(self._task._channel_lists[self._kind])
+
+    def _add(self, physical_channel):
+        channels = _expand_physical_channels(physical_channel)
+        self._task._channel_lists[self._kind].extend(channels)
+        if self._task.device is None:
+            self._task.device = _device_of(channels[0])
+        return channels
+
+    def add_ao_voltage_chan(self, physical_channel, *args, **kwargs):
+        return self._add(physical_channel)
+
+    def add_ai_voltage_chan(self, physical_channel, *args, **kwargs):
+        return self._add(physical_channel)
+
+    def add_do_chan(self, lines, *args, line_grouping=None, **kwargs):
+        return self._add(lines)
+
+    def __getitem__(self, name):
+        return SimpleNamespace(
+            name=_normalise_channel(name),
+            ai_dev_scaling_coeff=list(system.default_scaling_coeff),
+        )
+
+
+class _Timing:
+    def __init__(self):
+        self.samp_clk_rate = 1000.0
+        self.samp_clk_src = ""
+        self.samp_quant_samp_mode = None
+        self.samp_quant_samp_per_chan = 1000
+
+    def cfg_samp_clk_timing(
+        self,
+        rate,
+        source="",
+        active_edge=None,
+        sample_mode=AcquisitionType.FINITE,
+        samps_per_chan=1000,
+    ):
+        self.samp_clk_rate = float(rate)
+        self.samp_clk_src = source or ""
+        self.samp_quant_samp_mode = sample_mode
+        self.samp_quant_samp_per_chan = int(samps_per_chan)
+
+
+class _StartTrigger:
+    def __init__(self):
+        self.trig_src = ""
+        self.retriggerable = False
+
+    def cfg_dig_edge_start_trig(self, trigger_source, trigger_edge=None):
+        self.trig_src = trigger_source
+
+    def disable_start_trig(self):
+        self.trig_src = ""
+
+
+class _ExportSignals:
+    def __init__(self):
+        self.samp_clk_output_term = ""
+        self.start_trig_output_term = ""
+
+
+def _default_buffer_size(rate):
+    # Same rule of thumb as NI-DAQmx uses for continuous tasks.
+    if rate <= 100:
+        return 1000
+    elif rate <= 10000:
+        return 10000
+    elif rate <= 1000000:
+        return 100000
+    return 1000000
+
+
+class _InStream:
+    def __init__(self, task):
+        self._task = task
+        self._input_buf_size = None
+        self.read_position = 0
+
+    @property
+    def input_buf_size(self):
+        if self._input_buf_size is not None:
+            return self._input_buf_size
+        timing = self._task.timing
+        if timing.samp_quant_samp_mode == AcquisitionType.FINITE:
+            return timing.samp_quant_samp_per_chan
+        return max(
+            timing.samp_quant_samp_per_chan, _default_buffer_size(timing.samp_clk_rate)
+        )
+
+    @input_buf_size.setter
+    def input_buf_size(self, value):
+        self._input_buf_size = int(value)
+
+    @property
+    def avail_samp_per_chan(self):
+        return system.samples_clocked(self._task) - self.read_position
+
+    def read(self, number_of_samples, timeout, auto_start=True):
+        """
+        Block until the samples are acquired and return them, shape
+        (channel number, number_of_samples).
+        """
+        task = self._task
+        if not task._running:
+            if auto_start:
+                task.start()
+            else:
+                raise DaqError("Task is not running.", -200983)
+
+        timing = task.timing
+        target = self.read_position + number_of_samples
+        if (
+            timing.samp_quant_samp_mode == AcquisitionType.FINITE
+            and target > timing.samp_quant_samp_per_chan
+        ):
+            raise DaqError(
+                "Attempted to read samples beyond the final sample acquired.", -200278
+            )
+
+        deadline = None if timeout == -1 else system.now() + timeout
+        while True:
+            if not task._running:
+                # Stopped or aborted from another thread.
+                raise DaqError(
+                    "The specified operation cannot be performed because the "
+                    "task was aborted.",
+                    -88709,
+                )
+            clocked = system.samples_clocked(task)
+            if clocked - self.read_position > self.input_buf_size:
+                raise DaqError(
+                    "The application is not able to keep up with the hardware "
+                    "acquisition. Increasing the buffer size, reading the data "
+                    "more frequently, or specifying a fixed number of samples "
+                    "to read instead of reading all available samples might "
+                    "correct the problem.",
+                    -200279,
+                )
+            if clocked >= target:
+                break
+            if deadline is not None and system.now() > deadline:
+                raise DaqError(
+                    "The operation could not complete within the specified period.",
+                    -200284,
+                )
+            missing = target - clocked
+            system.sleep(min(missing / timing.samp_clk_rate, 0.05))
+
+        data = system.synthesise(task, self.read_position, number_of_samples)
+        self.read_position = target
+        return data
+
+
+class _OutStream:
+    def __init__(self, task):
+        self._task = task
+        self._output_buf_size = None
+        self.regen_mode = RegenerationMode.ALLOW_REGENERATION
+
+    @property
+    def output_buf_size(self):
+        if self._output_buf_size is not None:
+            return self._output_buf_size
+        if self._task._buffer is not None:
+            return self._task._buffer.shape[1]
+        return 0
+
+    @output_buf_size.setter
+    def output_buf_size(self, value):
+        self._output_buf_size = int(value)
+
+    def write(self, data):
+        """
+        Put the samples, shape (channel number, samples), into the buffer.
+        """
+        task = self._task
+        data = np.atleast_2d(np.asarray(data))
+        if data.shape[0] != len(task._output_channel_list()):
+            raise DaqError(
+                "Write cannot be performed, because the number of channels in "
+                "the data does not match the number of channels in the task.",
+                -200524,
+            )
+        if task.timing.samp_quant_samp_mode is None:
+            # On-demand task, the value is applied right away.
+            for channel, value in zip(task._output_channel_list(), data[:, -1]):
+                system.static_values[channel] = value
+            return data.shape[1]
+
+        if (
+            self._output_buf_size is not None
+            and data.shape[1] > self._output_buf_size
+        ):
+            raise DaqError("Write exceeds the output buffer size.", -200547)
+        task._buffer = np.array(data, copy=True)
+        return data.shape[1]
+
+
+class Task:
+    def __init__(self, new_task_name=""):
+        """
+        Simulated nidaqmx.Task.
+        """
+        self.name = new_task_name
+        self._handle = system.new_handle()
+        self.device = None
+        self._channel_lists = {"ao": [], "ai": [], "do": []}
+        self.ao_channels = _ChannelCollection(self, "ao")
+        self.ai_channels = _ChannelCollection(self, "ai")
+        self.do_channels = _ChannelCollection(self, "do")
+        self.timing = _Timing()
+        self.triggers = SimpleNamespace(start_trigger=_StartTrigger())
+        self.export_signals = _ExportSignals()
+        self.in_stream = _InStream(self)
+        self.out_stream = _OutStream(self)
+
+        self._buffer = None
+        self._running = False
+        self._start_time = None
+        self._samples_at_stop = 0
+        self._every_n_samples = None
+        self._event_thread = None
+        self._noise_source = NoiseSource()
+        self._closed = False
+        system.register(self)
+
+    @property
+    def ao_channel_list(self):
+        return self._channel_lists["ao"]
+
+    @property
+    def ai_channel_list(self):
+        return self._channel_lists["ai"]
+
+    @property
+    def do_channel_list(self):
+        return self._channel_lists["do"]
+
+    def _output_channel_list(self):
+        if self.ao_channel_list:
+            return self.ao_channel_list
+        # One port channel holds all its lines.
+        return self.do_channel_list
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def start(self):
+        if self._running:
+            raise DaqError("The specified operation cannot be performed while the task is running.", -200479)
+        if self._output_channel_list() and self.timing.samp_quant_samp_mode is not None:
+            if self._buffer is None:
+                raise DaqError("No samples were written to the output buffer.", -200462)
+        if system.reserved_by_other_task(self):
+            raise DaqError(
+                "The specified resource is reserved. The operation could not be "
+                "completed as specified.",
+                -50103,
+            )
+        self.in_stream.read_position = 0
+        self._start_time = system.now()
+        self._running = True
+        for channel, model in system.loopbacks.items():
+            if channel in self.ai_channel_list:
+                model.reset()
+        if self._every_n_samples is not None:
+            self._event_thread = threading.Thread(
+                target=self._run_every_n_samples_events, daemon=True
+            )
+            self._event_thread.start()
+
+    def stop(self):
+        if self._running:
+            self._samples_at_stop = system.samples_clocked(self)
+            self._running = False
+            if self.ao_channel_list and self._buffer is not None:
+                # The output keeps the last generated value.
+                clocked = self._samples_at_stop
+                if clocked > 0:
+                    for row, channel in enumerate(self.ao_channel_list):
+                        system.static_values[channel] = self._buffer[
+                            row, (clocked - 1) % self._buffer.shape[1]
+                        ]
+        if (
+            self._event_thread is not None
+            and self._event_thread is not threading.current_thread()
+        ):
+            self._event_thread.join()
+        self._event_thread = None
+
+    def close(self):
+        if self._closed:
+            return
+        self.stop()
+        self._closed = True
+        system.unregister(self)
+
+    def control(self, action):
+        # Verify, commit, reserve and unreserve only cost time on hardware.
+        if action == TaskMode.TASK_START:
+            self.start()
+        elif action in (TaskMode.TASK_STOP, TaskMode.TASK_ABORT):
+            self.stop()
+
+    def is_task_done(self):
+        if not self._running:
+            return True
+        if self.timing.samp_quant_samp_mode != AcquisitionType.FINITE:
+            return False
+        if self.triggers.start_trigger.retriggerable:
+            # Re-armed after every generation, never done until stopped.
+            return False
+        return system.samples_clocked(self) >= self.timing.samp_quant_samp_per_chan
+
+    def wait_until_done(self, timeout=10.0):
+        if self._running and self.timing.samp_quant_samp_mode != AcquisitionType.FINITE:
+            raise DaqError("Wait Until Done did not indicate that the task was done within the specified timeout.", -200560)
+        deadline = None if timeout == -1 else system.now() + timeout
+        while not self.is_task_done():
+            if deadline is not None and system.now() > deadline:
+                raise DaqError(
+                    "Wait Until Done did not indicate that the task was done "
+                    "within the specified timeout.",
+                    -200560,
+                )
+            remaining = (
+                self.timing.samp_quant_samp_per_chan - system.samples_clocked(self)
+            )
+            system.sleep(min(max(remaining, 1) / self.timing.samp_clk_rate, 0.05))
+
+    def write(self, data, auto_start=True, timeout=10.0):
+        data = np.asarray(data)
+        if self.do_channel_list and data.dtype == bool:
+            data = data.astype(np.uint32)
+        if data.ndim == 0:
+            data = data.reshape(1, 1)
+        elif data.ndim == 1 and len(self._output_channel_list()) == 1:
+            data = data.reshape(1, -1)
+        elif data.ndim == 1:
+            data = data.reshape(-1, 1)
+        written = self.out_stream.write(data)
+        if auto_start and self.timing.samp_quant_samp_mode is not None and not self._running:
+            self.start()
+        return written
+
+    def register_every_n_samples_acquired_into_buffer_event(
+        self, sample_interval, callback_method
+    ):
+        if callback_method is None:
+            self._every_n_samples = None
+        else:
+            self._every_n_samples = (int(sample_interval), callback_method)
+
+    def _run_every_n_samples_events(self):
+        interval, callback = self._every_n_samples
+        fired = 0
+        while self._running:
+            clocked = system.samples_clocked(self)
+            while clocked >= (fired + 1) * interval and self._running:
+                callback(
+                    self._handle,
+                    EveryNSamplesEventType.ACQUIRED_INTO_BUFFER.value,
+                    interval,
+                    None,
+                )
+                fired += 1
+            if self.is_task_done() and clocked < (fired + 1) * interval:
+                break
+            next_event = (fired + 1) * interval - clocked
+            system.sleep(min(max(next_event, 1) / self.timing.samp_clk_rate, 0.05))
+
+
+# =============================================================================
+#     Stream readers and writers
+# =============================================================================
+
+
+class _ChannelReaderBase:
+    def __init__(self, task_in_stream):
+        self._stream = task_in_stream
+        self._task = task_in_stream._task
+        # Reading from a task that is not started starts it implicitly.
+        self.auto_start = True
+
+    def _read(self, number_of_samples, timeout):
+        return self._stream.read(number_of_samples, timeout, self.auto_start)
+
+
+class _ChannelWriterBase:
+    def __init__(self, task_out_stream, auto_start=False):
+        self._stream = task_out_stream
+        self._task = task_out_stream._task
+        # Writing many samples does not start the task unless asked for.
+        self.auto_start = auto_start
+
+    def _write(self, data):
+        written = self._stream.write(data)
+        if (
+            self.auto_start
+            and self._task.timing.samp_quant_samp_mode is not None
+            and not self._task._running
+        ):
+            self._task.start()
+        return written
+
+
+class AnalogSingleChannelReader(_ChannelReaderBase):
+    def read_many_sample(self, data, number_of_samples_per_channel=-1, timeout=10.0):
+        if number_of_samples_per_channel == -1:
+            number_of_samples_per_channel = len(data)
+        data[:number_of_samples_per_channel] = self._read(
+            number_of_samples_per_channel, timeout
+        )[0]
+        return number_of_samples_per_channel
+
+    def read_one_sample(self, timeout=10):
+        return self._read(1, timeout)[0, 0]
+
+
+class AnalogMultiChannelReader(_ChannelReaderBase):
+    def read_many_sample(self, data, number_of_samples_per_channel=-1, timeout=10.0):
+        if number_of_samples_per_channel == -1:
+            number_of_samples_per_channel = data.shape[1]
+        data[:, :number_of_samples_per_channel] = self._read(
+            number_of_samples_per_channel, timeout
+        )
+        return number_of_samples_per_channel
+
+
+class AnalogUnscaledReader(_ChannelReaderBase):
+    def read_int16(self, data, number_of_samples_per_channel=-1, timeout=10.0):
+        if number_of_samples_per_channel == -1:
+            number_of_samples_per_channel = data.shape[1]
+        volts = self._read(number_of_samples_per_channel, timeout)
+        coeff = system.default_scaling_coeff
+        counts = np.round((volts - coeff[0]) / coeff[1])
+        data[:, :number_of_samples_per_channel] = np.clip(counts, -32768, 32767)
+        return number_of_samples_per_channel
+
+
+class AnalogSingleChannelWriter(_ChannelWriterBase):
+    def write_many_sample(self, data, timeout=10.0):
+        return self._write(np.asarray(data, dtype=float).reshape(1, -1))
+
+    def write_one_sample(self, data, timeout=10):
+        return self._stream.write(np.array([[data]], dtype=float))
+
+
+class AnalogMultiChannelWriter(_ChannelWriterBase):
+    def write_many_sample(self, data, timeout=10.0):
+        return self._write(np.asarray(data, dtype=float))
+
+
+class DigitalSingleChannelWriter(_ChannelWriterBase):
+    def write_many_sample_port_uint32(self, data, timeout=10.0):
+        return self._write(np.asarray(data, dtype=np.uint32).reshape(1, -1))
+
+    def write_one_sample_one_line(self, data, timeout=10):
+        return self._stream.write(np.array([[bool(data)]], dtype=np.uint32))
+
+
+class DigitalMultiChannelWriter(_ChannelWriterBase):
+    def write_many_sample_port_uint32(self, data, timeout=10.0):
+        return self._write(np.asarray(data, dtype=np.uint32))
+
+
+stream_readers = SimpleNamespace(
+    AnalogSingleChannelReader=AnalogSingleChannelReader,
+    AnalogMultiChannelReader=AnalogMultiChannelReader,
+    AnalogUnscaledReader=AnalogUnscaledReader,
+)
+
+stream_writers = SimpleNamespace(
+    AnalogSingleChannelWriter=AnalogSingleChannelWriter,
+    AnalogMultiChannelWriter=AnalogMultiChannelWriter,
+    DigitalSingleChannelWriter=DigitalSingleChannelWriter,
+    DigitalMultiChannelWriter=DigitalMultiChannelWriter,
+)
@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+"""
+Long-lived on-demand output tasks for single value writes.
+
+DAQmission.sendSingleAnalog and sendSingleDigital used to create, write and
+close a new task for every value, which takes tens of milliseconds. The AOTF
+sliders, shutter buttons and the blanking in the auto focus write many single
+values, so StaticOutputManager keeps one started on-demand task per physical
+channel instead and only writes the new value, which takes well under a
+millisecond.
+
+An open task keeps its channel reserved. Code that runs hardware timed tasks on
+the same channels (runWaveforms, the task pool, the galvo raster scans) calls
+release() with its channels first; the static task is recreated on the next
+single value write. The value on the output stays the same when the task is
+closed. The other way round, a new static task closes the idle task pools
+(NIDAQ.taskpool) that hold its channel, e.g. the blanking line on /Dev1/port0
+written by the auto focus between the coordinates of a screening.
+
+Example:
+    default_static_output.write_analog("Dev2/ao1", 1.5)
+    default_static_output.write_digital("Dev1/port0/line4", True)
+    print(default_static_output.latency_summary())
+"""
+
+import atexit
+import threading
+import time
+
+import numpy as np
+
+from NIDAQ.daqbackend import (
+    nidaqmx,
+    DaqError,
+    AnalogSingleChannelWriter,
+    DigitalSingleChannelWriter,
+)
+
+
+def _expand_physical_channels(physical_channels):
+    """
+    Single channel names in a physical channel string or list, e.g.
+    "/Dev1/ao0:1" -> ["Dev1/ao0", "Dev1/ao1"].
+    """
+    if isinstance(physical_channels, str):
+        physical_channels = physical_channels.split(",")
+
+    channels = []
+    for part in physical_channels:
+        part = part.strip().lstrip("/")
+        if ":" in part:
+            prefix, last = part.rsplit(":", 1)
+            base = prefix.rstrip("0123456789")
+            first = int(prefix[len(base) :])
+            for index in range(first, int(last) + 1):
+                channels.append(base + str(index))
+        else:
+            channels.append(part)
+    return channels
+
+
+def _overlap(channel, other):
+    # A line overlaps with its port, "Dev1/port0/line4" and "Dev1/port0".
+    return (
+        channel == other
+        or channel.startswith(other + "/")
+        or other.startswith(channel + "/")
+    )
+
+
+class StaticOutputManager:
+    def __init__(self, verbose=False):
+        """
+        Keep one open on-demand task per output channel.
+
+        All methods can be called from any thread, the calls are serialised.
+
+        Parameters
+        ----------
+        verbose : bool, optional
+            Print the latency of every write. The default is False.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.verbose = verbose
+
+        # Task and write method of each physical channel.
+        self.tasks = {}
+        self.writers = {}
+        self._lock = threading.RLock()
+
+        # Write latencies in seconds of each channel, and the time it took to
+        # create the tasks.
+        self.write_latencies = {}
+        self.creation_latencies = {}
+
+    # -----------------------------------------------------------------------
+    def write_analog(self, physical_channel, value):
+        """
+        Set an analog output.
+
+        Parameters
+        ----------
+        physical_channel : str
+            Like "Dev2/ao1".
+        value : float
+            Voltage.
+
+        Returns
+        -------
+        None.
+
+        """
+        self._write(physical_channel, "ao", float(value))
+
+    def write_digital(self, physical_channel, value):
+        """
+        Set a digital line.
+
+        Parameters
+        ----------
+        physical_channel : str
+            Like "Dev1/port0/line4".
+        value : bool
+            Value to send.
+
+        Returns
+        -------
+        None.
+
+        """
+        self._write(physical_channel, "do", bool(value))
+
+    def _write(self, physical_channel, kind, value):
+        physical_channel = physical_channel.strip().lstrip("/")
+
+        with self._lock:
+            write = self._writer(physical_channel, kind)
+            start_time = time.perf_counter()
+            try:
+                write(value)
+            except DaqError as exc:
+                # The task may have gone stale, e.g. the device was reset, try
+                # once more with a new task.
+                print(
+                    "Static output on {} failed, recreating the task: {}".format(
+                        physical_channel, exc
+                    )
+                )
+                self.release(physical_channel)
+                write = self._writer(physical_channel, kind)
+                start_time = time.perf_counter()
+                write(value)
+
+            latency = time.perf_counter() - start_time
+            self.write_latencies.setdefault(physical_channel, []).append(latency)
+
+        if self.verbose:
+            print(
+                "Static output {} = {}, {:.3f} ms".format(
+                    physical_channel, value, latency * 1000
+                )
+            )
+
+    def _writer(self, physical_channel, kind):
+        # Write method of the channel's task, the task is made if needed.
+        if physical_channel in self.writers:
+            return self.writers[physical_channel]
+
+        start_time = time.perf_counter()
+        # Imported here, the task pool uses the channel helpers of this module.
+        from NIDAQ.taskpool import release_pools
+
+        release_pools(physical_channel)
+
+        task = nidaqmx.Task()
+        try:
+            if kind == "ao":
+                task.ao_channels.add_ao_voltage_chan(physical_channel)
+                writer = AnalogSingleChannelWriter(task.out_stream, auto_start=False)
+                write = writer.write_one_sample
+            else:
+                task.do_channels.add_do_chan(physical_channel)
+                writer = DigitalSingleChannelWriter(task.out_stream, auto_start=False)
+                write = writer.write_one_sample_one_line
+            # Started once, writes to a running on-demand task are output
+            # right away without starting and stopping the task every time.
+            task.start()
+        except Exception:
+            task.close()
+            raise
+
+        self.tasks[physical_channel] = task
+        self.writers[physical_channel] = write
+        self.creation_latencies.setdefault(physical_channel, []).append(
+            time.perf_counter() - start_time
+        )
+        return self.writers[physical_channel]
+
+    # -----------------------------------------------------------------------
+    def release(self, physical_channels=None):
+        """
+        Close the tasks on the given channels, so they can be used by other
+        tasks.
+
+        Parameters
+        ----------
+        physical_channels : str or list of str, optional
+            Channels like "/Dev1/ao0:1" or ["Dev1/port0"]. A port releases all
+            its lines. The default is None, which releases all channels.
+
+        Returns
+        -------
+        None.
+
+        """
+        with self._lock:
+            if physical_channels is None:
+                channels = list(self.tasks)
+            else:
+                requested = _expand_physical_channels(physical_channels)
+                channels = [
+                    channel
+                    for channel in self.tasks
+                    if any(_overlap(channel, other) for other in requested)
+                ]
+
+            for channel in channels:
+                try:
+                    self.tasks[channel].close()
+                except Exception as exc:
+                    print("Closing static output task failed: {}".format(exc))
+                del self.tasks[channel]
+                del self.writers[channel]
+
+    def close(self):
+        """
+        Close all tasks.
+        """
+        self.release()
+
+    # -----------------------------------------------------------------------
+    def latency_summary(self):
+        """
+        Latency statistics of the writes.
+
+        Returns
+        -------
+        dict
+            For each channel the number of writes and task creations, and the
+            mean, median and maximum write latency and mean creation time in
+            seconds.
+
+        """
+        with self._lock:
+            summary = {}
+            for channel, latencies in self.write_latencies.items():
+                latencies = np.array(latencies)
+                creations = np.array(self.creation_latencies.get(channel, []))
+                summary[channel] = {
+                    "writes": len(latencies),
+                    "creations": len(creations),
+                    "write_mean": float(np.mean(latencies)),
+                    "write_median": float(np.median(latencies)),
+                    "write_max": float(np.max(latencies)),
+                    "creation_mean": float(np.mean(creations))
+                    if len(creations) != 0
+                    else None,
+                }
+            return summary
+
+    def reset_statistics(self):
+        with self._lock:
+            self.write_latencies = {}
+            self.creation_latencies = {}
+
+
+# Shared by all DAQmission instances, so the tasks stay open between them.
+default_static_output = StaticOutputManager()
+atexit.register(default_static_output.close)
@@ -0,0 +1,513 @@
+# -*- coding: utf-8 -*-
+"""
+Keep the NI-daq tasks of DAQmission.runWaveforms alive between runs.
+
+Normally every runWaveforms call creates, configures, commits, starts and
+closes up to four tasks (read-in master, Dev1 AO, Dev2 AO and digital lines).
+When a DAQTaskPool is passed to runWaveforms the tasks are kept instead:
+    - Tasks are only recreated when the channels or the clock source change,
+      timing is only reconfigured when the sampling rate or the number of
+      samples change.
+    - Output buffers are only rewritten when the compiled waveform package
+      (NIDAQ.waveformcompiler) is different from the one already in the buffer.
+    - The Dev1 output tasks wait for the start trigger of the read-in task
+      with a retriggerable start trigger, so they stay armed between runs and
+      only the read-in task is started and stopped for each run. Dev2 runs on
+      the sample clock exported by Dev1 without a start trigger, the same as
+      in runWaveforms, so its task is started again before every run.
+
+The pool holds the channels reserved between runs, e.g. the screening pool
+keeps /Dev1/port0 between coordinates. runWaveforms without a pool closes the
+idle pools first with release_pools(), and the single value writes of
+NIDAQ.staticoutput close the idle pools that hold their channel. Other code
+that wants to use the same channels (e.g. a raster scan for auto-focus) has to
+call release_pools() first.
+
+Example:
+    pool = DAQTaskPool()
+    for package in packages:
+        DAQmission().runWaveforms(..., task_pool=pool)
+    print(pool.latency_summary())
+    pool.close()
+"""
+
+import time
+import weakref
+
+import numpy as np
+
+from NIDAQ.constants import NiDaqChannels
+from NIDAQ.staticoutput import _expand_physical_channels, _overlap
+from NIDAQ.daqbackend import (
+    nidaqmx,
+    ai_dev_scaling_coeff,
+    AcquisitionType,
+    TaskMode,
+    LineGrouping,
+    RegenerationMode,
+    AnalogMultiChannelWriter,
+    DigitalMultiChannelWriter,
+    AnalogMultiChannelReader,
+)
+
+# Pools that hold tasks at the moment.
+_open_pools = weakref.WeakSet()
+
+
+def release_pools(physical_channels=None):
+    """
+    Close the tasks of the pools, so the channels can be used outside of a
+    pool. The pools set the tasks up again on their next run.
+
+    Parameters
+    ----------
+    physical_channels : str or list of str, optional
+        Only close the pools that hold one of these channels, like
+        "Dev1/port0/line4". The default is None, which closes all pools.
+
+    Returns
+    -------
+    None.
+
+    """
+    if physical_channels is not None:
+        requested = _expand_physical_channels(physical_channels)
+
+    for pool in list(_open_pools):
+        if physical_channels is not None and not any(
+            _overlap(channel, other)
+            for channel in pool.physical_channels()
+            for other in requested
+        ):
+            continue
+        if pool.running == True:
+            raise RuntimeError(
+                "The DAQ channels are in use by a running DAQTaskPool."
+            )
+        pool.close()
+
+
+class DAQTaskPool:
+    def __init__(self, channel_LUT=None, retriggerable=True, verbose=True):
+        """
+        Pool of configured tasks for DAQmission.runWaveforms.
+
+        Parameters
+        ----------
+        channel_LUT : dict, optional
+            Channel look up table. The default is NiDaqChannels().look_up_table.
+        retriggerable : bool, optional
+            Keep the output tasks armed with retriggerable start triggers.
+            If False they are stopped and started again for every run, which
+            still saves the task creation and configuration. The default is True.
+        verbose : bool, optional
+            Print the latency report of each run. The default is True.
+
+        Returns
+        -------
+        None.
+
+        """
+        if channel_LUT == None:
+            self.channel_LUT = NiDaqChannels().look_up_table
+        else:
+            self.channel_LUT = channel_LUT
+        self.retriggerable = retriggerable
+        self.verbose = verbose
+
+        self.tasks = {}
+        self.ai_dev_scaling_coeff = {}
+        self.readin_channel_list = []
+
+        self._configuration = None
+        self._timing = None
+        # Key of the compiled waveform package in the buffer of each output task.
+        self._written_keys = {}
+        self._armed = set()
+        self.running = False
+
+        self.latency_reports = []
+        self._report = None
+        self._prepare_end = None
+
+    # -----------------------------------------------------------------------
+    def prepare(self, clock_source, sampling_rate, compiled, readin_channels):
+        """
+        Get the tasks ready for a run: configure what changed, write changed
+        buffers and arm the output tasks. The read-in task is left stopped.
+
+        Parameters
+        ----------
+        clock_source : str
+            "DAQ" or "Camera".
+        sampling_rate : float
+            Sampling rate of the waveforms.
+        compiled : NIDAQ.waveformcompiler.CompiledWaveforms
+            The compiled waveform package.
+        readin_channels : list of str
+            Read-in channels, like ["PMT", "Vp"].
+
+        Returns
+        -------
+        master_Task_readin : nidaqmx.Task
+            The read-in task.
+        reader : AnalogMultiChannelReader
+            Reader on the read-in task.
+
+        """
+        start_time = time.perf_counter()
+        self._report = {
+            "configure": 0.0,
+            "write": 0.0,
+            "arm": 0.0,
+            "acquire": 0.0,
+            "reconfigured": False,
+            "rewritten": [],
+        }
+
+        readin_channel_list = [
+            self.channel_LUT[channel]
+            for channel in NiDaqChannels().readin_channels
+            if channel in readin_channels
+        ]
+        if len(readin_channel_list) == 0:
+            # If no read-in channel is added, vp channel is added to keep code alive.
+            readin_channel_list = [self.channel_LUT["Vp"]]
+
+        configuration = (
+            clock_source,
+            tuple(compiled.Dev1_analog_channel_list),
+            tuple(compiled.Dev2_analog_channel_list),
+            compiled.Digital_channel_number != 0,
+            tuple(readin_channel_list),
+        )
+        timing = (
+            float(sampling_rate),
+            compiled.Waveforms_length,
+            compiled.Period_length,
+        )
+
+        try:
+            if configuration != self._configuration:
+                self.close()
+                self._create_tasks(configuration)
+                _open_pools.add(self)
+                self._configure_timing(clock_source, timing)
+                self._report["reconfigured"] = True
+            elif timing != self._timing:
+                self._stop_tasks()
+                self._configure_timing(clock_source, timing)
+                self._report["reconfigured"] = True
+            configure_end = time.perf_counter()
+            self._report["configure"] = configure_end - start_time
+
+            self._write_buffers(compiled)
+            write_end = time.perf_counter()
+            self._report["write"] = write_end - configure_end
+
+            self._arm_output_tasks()
+            self._prepare_end = time.perf_counter()
+            self._report["arm"] = self._prepare_end - write_end
+            self.running = True
+        except Exception:
+            # Leave nothing half configured behind.
+            self.close()
+            raise
+
+        return self.tasks["readin"], self.reader
+
+    def finish(self):
+        """
+        Wait for the read-in task to finish and stop it. The output tasks run
+        on its clock, so they are done as well. The Dev1 tasks stay armed for
+        the next run, the Dev2 task has no start trigger and is stopped.
+        """
+        if "analog_dev2" in self._armed:
+            # Same order as in runWaveforms, Dev2 is done before the read-in
+            # task that clocks it is stopped.
+            self.tasks["analog_dev2"].wait_until_done(timeout=605.0)
+        master_Task_readin = self.tasks["readin"]
+        master_Task_readin.wait_until_done(timeout=605.0)
+        master_Task_readin.stop()
+        self.running = False
+
+        if not self.retriggerable:
+            self._stop_output_tasks()
+        elif "analog_dev2" in self._armed:
+            self.tasks["analog_dev2"].stop()
+            self._armed.discard("analog_dev2")
+
+        self._report["acquire"] = time.perf_counter() - self._prepare_end
+        self._report["total"] = (
+            self._report["configure"]
+            + self._report["write"]
+            + self._report["arm"]
+            + self._report["acquire"]
+        )
+        self.latency_reports.append(self._report)
+        if self.verbose:
+            print(self.format_report(self._report))
+
+    # -----------------------------------------------------------------------
+    def _create_tasks(self, configuration):
+        (
+            clock_source,
+            Dev1_analog_channel_list,
+            Dev2_analog_channel_list,
+            has_digital,
+            readin_channel_list,
+        ) = configuration
+
+        self.tasks["readin"] = nidaqmx.Task()
+        for channel in readin_channel_list:
+            self.tasks["readin"].ai_channels.add_ai_voltage_chan(channel)
+        self.readin_channel_list = list(readin_channel_list)
+        self.ai_dev_scaling_coeff = {
+            channel: ai_dev_scaling_coeff(self.tasks["readin"], channel)
+            for channel in readin_channel_list
+        }
+        self.reader = AnalogMultiChannelReader(self.tasks["readin"].in_stream)
+        self.reader.auto_start = False
+
+        self.writers = {}
+        if len(Dev1_analog_channel_list) != 0:
+            self.tasks["analog_dev1"] = nidaqmx.Task()
+            for channel in Dev1_analog_channel_list:
+                self.tasks["analog_dev1"].ao_channels.add_ao_voltage_chan(channel)
+            self.writers["analog_dev1"] = AnalogMultiChannelWriter(
+                self.tasks["analog_dev1"].out_stream, auto_start=False
+            )
+
+        if len(Dev2_analog_channel_list) != 0:
+            self.tasks["analog_dev2"] = nidaqmx.Task()
+            for channel in Dev2_analog_channel_list:
+                self.tasks["analog_dev2"].ao_channels.add_ao_voltage_chan(channel)
+            self.writers["analog_dev2"] = AnalogMultiChannelWriter(
+                self.tasks["analog_dev2"].out_stream, auto_start=False
+            )
+
+        if has_digital:
+            self.tasks["digital"] = nidaqmx.Task()
+            self.tasks["digital"].do_channels.add_do_chan(
+                "/Dev1/port0", line_grouping=LineGrouping.CHAN_FOR_ALL_LINES
+            )
+            self.writers["digital"] = DigitalMultiChannelWriter(
+                self.tasks["digital"].out_stream, auto_start=False
+            )
+
+        self._configuration = configuration
+
+    def _configure_timing(self, clock_source, timing):
+        sampling_rate, Waveforms_length, Period_length = timing
+        master_Task_readin = self.tasks["readin"]
+
+        if clock_source == "DAQ":
+            # Use the clock on Dev1 as center clock.
+            master_Task_readin.timing.cfg_samp_clk_timing(
+                sampling_rate,
+                sample_mode=AcquisitionType.FINITE,
+                samps_per_chan=Waveforms_length,
+            )
+            Dev1_clock = "ai/SampleClock"
+        elif clock_source == "Camera":
+            # All the clocks refer to the camera output trigger.
+            Dev1_clock = "/Dev1/PFI0"
+            master_Task_readin.timing.cfg_samp_clk_timing(
+                sampling_rate,
+                source=Dev1_clock,
+                sample_mode=AcquisitionType.FINITE,
+                samps_per_chan=Waveforms_length,
+            )
+            master_Task_readin.triggers.start_trigger.cfg_dig_edge_start_trig(
+                Dev1_clock
+            )
+        else:
+            raise ValueError("Unknown clock source '{}'.".format(clock_source))
+
+        # Export the clock and start trigger of Dev1, these ports are bridged
+        # with BNC cables to the receiving ports on Dev2.
+        master_Task_readin.export_signals.samp_clk_output_term = self.channel_LUT[
+            "clock1Channel"
+        ]  #'/Dev1/PFI1'
+        master_Task_readin.export_signals.start_trig_output_term = self.channel_LUT[
+            "trigger1Channel"
+        ]  #'/Dev1/PFI2'
+
+        # The output tasks are started (armed) before the read-in task. Dev1
+        # tasks start generating on its start trigger, Dev2 runs on the
+        # exported sample clock without a start trigger like in runWaveforms,
+        # it only gets clock edges while the read-in task runs.
+        for role in ["analog_dev1", "analog_dev2", "digital"]:
+            if role not in self.tasks:
+                continue
+            task = self.tasks[role]
+            if role == "analog_dev2":
+                clock = self.channel_LUT["clock2Channel"]  # /Dev2/PFI1
+            else:
+                clock = Dev1_clock
+            task.timing.cfg_samp_clk_timing(
+                sampling_rate,
+                source=clock,
+                sample_mode=AcquisitionType.FINITE,
+                samps_per_chan=Waveforms_length,
+            )
+            if role != "analog_dev2":
+                task.triggers.start_trigger.cfg_dig_edge_start_trig(
+                    "/Dev1/ai/StartTrigger"
+                )
+                task.triggers.start_trigger.retriggerable = self.retriggerable
+
+            if Period_length is not None:
+                # Periodic package, the buffer holds one period and the task
+                # regenerates it until Waveforms_length samples are generated.
+                task.out_stream.regen_mode = RegenerationMode.ALLOW_REGENERATION
+                task.out_stream.output_buf_size = Period_length
+
+        # Verify and reserve everything now, so start and stop are cheap.
+        for task in self.tasks.values():
+            task.control(TaskMode.TASK_COMMIT)
+
+        self._timing = timing
+        self._written_keys = {}
+
+    def _write_buffers(self, compiled):
+        buffers = {
+            "analog_dev1": compiled.Dev1_analog_samples,
+            "analog_dev2": compiled.Dev2_analog_samples,
+            "digital": compiled.Digital_samples,
+        }
+        for role, writer in self.writers.items():
+            if self._written_keys.get(role) == compiled.key:
+                continue
+            # A task has to be stopped before its buffer can be replaced.
+            if role in self._armed:
+                self.tasks[role].stop()
+                self._armed.discard(role)
+
+            if role == "digital":
+                writer.write_many_sample_port_uint32(buffers[role], timeout=605.0)
+            else:
+                writer.write_many_sample(buffers[role], timeout=605.0)
+            self._written_keys[role] = compiled.key
+            self._report["rewritten"].append(role)
+
+    def _arm_output_tasks(self):
+        # Dev2 first, the same order as in runWaveforms.
+        for role in ["analog_dev2", "analog_dev1", "digital"]:
+            if role in self.tasks and role not in self._armed:
+                self.tasks[role].start()
+                self._armed.add(role)
+
+    def _stop_output_tasks(self):
+        for role in list(self._armed):
+            self.tasks[role].stop()
+        self._armed = set()
+
+    def physical_channels(self):
+        """
+        Channels the tasks of the pool hold reserved.
+        """
+        if self._configuration is None:
+            return []
+        (
+            clock_source,
+            Dev1_analog_channel_list,
+            Dev2_analog_channel_list,
+            has_digital,
+            readin_channel_list,
+        ) = self._configuration
+
+        channels = _expand_physical_channels(
+            list(Dev1_analog_channel_list)
+            + list(Dev2_analog_channel_list)
+            + list(readin_channel_list)
+        )
+        if has_digital:
+            channels.append("Dev1/port0")
+        return channels
+
+    def _stop_tasks(self):
+        self._stop_output_tasks()
+        if "readin" in self.tasks:
+            self.tasks["readin"].stop()
+
+    def close(self):
+        """
+        Stop and close all tasks, which releases the channels.
+        """
+        for task in self.tasks.values():
+            try:
+                task.close()
+            except Exception as exc:
+                print("Closing pooled task failed: {}".format(exc))
+        self.tasks = {}
+        self.writers = {}
+        self._armed = set()
+        self._written_keys = {}
+        self._configuration = None
+        self._timing = None
+        self.running = False
+        _open_pools.discard(self)
+
+    # -----------------------------------------------------------------------
+    @staticmethod
+    def format_report(report):
+        return (
+            "DAQ task pool: configure {:.1f} ms{}, write {:.1f} ms ({}), "
+            "arm {:.1f} ms, acquire {:.1f} ms, total {:.1f} ms".format(
+                report["configure"] * 1000,
+                " (reconfigured)" if report["reconfigured"] else "",
+                report["write"] * 1000,
+                ", ".join(report["rewritten"]) if report["rewritten"] else "reused",
+                report["arm"] * 1000,
+                report["acquire"] * 1000,
+                report["total"] * 1000,
+            )
+        )
+
+    def latency_summary(self):
+        """
+        Compare the set up time of runs that had to configure the tasks with
+        the runs that reused them.
+
+        Returns
+        -------
+        dict
+            Number of runs, mean set up time (configure + write + arm) in
+            seconds for cold and reused runs, and the estimated time saved by
+            the reused runs.
+
+        """
+        setup_times = np.array(
+            [
+                report["configure"] + report["write"] + report["arm"]
+                for report in self.latency_reports
+            ]
+        )
+        reconfigured = np.array(
+            [report["reconfigured"] for report in self.latency_reports], dtype=bool
+        )
+
+        summary = {
+            "runs": len(self.latency_reports),
+            "cold_runs": int(np.sum(reconfigured)),
+            "reused_runs": int(np.sum(~reconfigured)),
+            "cold_setup_mean": float(np.mean(setup_times[reconfigured]))
+            if np.any(reconfigured)
+            else None,
+            "reused_setup_mean": float(np.mean(setup_times[~reconfigured]))
+            if np.any(~reconfigured)
+            else None,
+            "saved": None,
+        }
+        if summary["cold_setup_mean"] is not None and summary["reused_runs"] != 0:
+            summary["saved"] = (
+                summary["cold_setup_mean"] - summary["reused_setup_mean"]
+            ) * summary["reused_runs"]
+        return summary
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
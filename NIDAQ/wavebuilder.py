@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""
+Vectorised waveform builders.
+
+Waveforms are assembled from a compact parameter table in one go with
+np.repeat, np.tile and index arithmetic, instead of growing an array with
+np.append inside a Python loop. The time it takes is linear in the number of
+samples, so protocols with thousands of cycles generate in milliseconds.
+
+The tables are structured arrays (a list of tuples is converted), e.g. a train
+of 10 pulses of 5 V, 2 ms wide, every 100 ms starting at 0.5 s, followed by
+1000 pulses of 1 V:
+
+    pulses = [(0.5, 0.002, 5, 10, 0.1), (2, 0.002, 1, 1000, 0.01)]
+    waveform = pulse_train(50000, 50000 * 13, pulses)
+
+and a sawtooth going up from -3 V to 3 V in 1000 samples and back in 100:
+
+    ramps = [(-3, 3, 1000), (3, -3, 100)]
+    waveform = np.tile(ramp_segments(ramps), 500)
+"""
+
+import numpy as np
+
+# start (s), width (s), amplitude, number of pulses, interval between the
+# starts of the pulses (s).
+PULSE_TABLE_DTYPE = np.dtype(
+    [
+        ("start", float),
+        ("width", float),
+        ("amplitude", float),
+        ("count", np.int64),
+        ("interval", float),
+    ]
+)
+
+# Value of the first and of the last sample, number of samples. Each segment
+# is np.linspace(start_value, end_value, samples).
+RAMP_TABLE_DTYPE = np.dtype(
+    [("start_value", float), ("end_value", float), ("samples", np.int64)]
+)
+
+
+def _as_table(table, dtype):
+    if isinstance(table, np.ndarray) and table.dtype == dtype:
+        return np.atleast_1d(table)
+    return np.array([tuple(row) for row in table], dtype=dtype)
+
+
+def constant_segments(levels, lengths):
+    """
+    Piecewise constant waveform.
+
+    Parameters
+    ----------
+    levels : array like
+        Value of each segment.
+    lengths : array like
+        Number of samples of each segment.
+
+    Returns
+    -------
+    np.ndarray
+        float64 waveform of sum(lengths) samples.
+
+    """
+    return np.repeat(
+        np.asarray(levels, dtype=float), np.asarray(lengths, dtype=np.int64)
+    )
+
+
+def repeat_cycle(cycle, repeats, offset_samples=0, gap_samples=0, baseline=0):
+    """
+    Offset at baseline, followed by the cycle plus a gap at baseline, repeated.
+
+    Parameters
+    ----------
+    cycle : np.ndarray
+        Samples of one cycle.
+    repeats : int
+        Number of times the cycle with its gap is repeated.
+    offset_samples : int, optional
+        Number of baseline samples before the first cycle. The default is 0.
+    gap_samples : int, optional
+        Number of baseline samples after each cycle. The default is 0.
+    baseline : float, optional
+        Value of the offset and gap samples. The default is 0.
+
+    Returns
+    -------
+    np.ndarray
+
+    """
+    cycle = np.asarray(cycle)
+    cycle_with_gap = np.concatenate(
+        (cycle, np.full(gap_samples, baseline, dtype=cycle.dtype))
+    )
+    return np.concatenate(
+        (
+            np.full(offset_samples, baseline, dtype=cycle.dtype),
+            np.tile(cycle_with_gap, repeats),
+        )
+    )
+
+
+def stepped_cycles(cycle_is_high, high_values, baseline):
+    """
+    Repeat a cycle, with the high samples of repetition i at high_values[i],
+    like pulses that step up in amplitude from cycle to cycle.
+
+    Parameters
+    ----------
+    cycle_is_high : np.ndarray of bool
+        Which samples of one cycle are high.
+    high_values : array like
+        Value of the high samples, one for each repetition.
+    baseline : float
+        Value of the other samples.
+
+    Returns
+    -------
+    np.ndarray
+        float64 waveform of len(cycle_is_high) * len(high_values) samples.
+
+    """
+    cycle_is_high = np.asarray(cycle_is_high, dtype=bool)
+    high_values = np.asarray(high_values, dtype=float)
+    return np.where(
+        np.tile(cycle_is_high, len(high_values)),
+        np.repeat(high_values, len(cycle_is_high)),
+        baseline,
+    )
+
+
+def pulse_train(sample_rate, number_of_samples, pulse_table, baseline=0.0):
+    """
+    Rectangular pulses from a table of pulse trains.
+
+    Sample i is part of a pulse starting at t (s) with width w (s) if
+    t <= i / sample_rate < t + w. Overlapping pulses add up, pulses outside
+    the waveform are cut off.
+
+    Parameters
+    ----------
+    sample_rate : float
+        Sampling rate.
+    number_of_samples : int
+        Length of the waveform.
+    pulse_table : np.ndarray or list of tuples
+        Rows of (start, width, amplitude, count, interval), see
+        PULSE_TABLE_DTYPE.
+    baseline : float, optional
+        Value outside the pulses. The default is 0.
+
+    Returns
+    -------
+    np.ndarray
+        float64 waveform.
+
+    """
+    table = _as_table(pulse_table, PULSE_TABLE_DTYPE)
+    number_of_samples = int(number_of_samples)
+
+    # Pulse k of each row, with index arithmetic instead of a loop.
+    counts = np.maximum(table["count"], 0)
+    row = np.repeat(np.arange(len(table)), counts)
+    k = np.arange(len(row)) - np.repeat(np.cumsum(counts) - counts, counts)
+    starts = table["start"][row] + k * table["interval"][row]
+
+    # Rounded first, so that times on the sample grid don't end up one sample
+    # off because of floating point errors, like 0.15 * 1000 = 150.00000000000003
+    first_sample = np.ceil(np.round(starts * sample_rate, 6)).astype(np.int64)
+    end_sample = np.ceil(
+        np.round((starts + table["width"][row]) * sample_rate, 6)
+    ).astype(np.int64)
+    first_sample = np.clip(first_sample, 0, number_of_samples)
+    end_sample = np.clip(end_sample, 0, number_of_samples)
+
+    # Amplitude changes at the pulse edges, summed up along the waveform.
+    changes = np.zeros(number_of_samples + 1)
+    np.add.at(changes, first_sample, table["amplitude"][row])
+    np.add.at(changes, end_sample, -table["amplitude"][row])
+
+    return baseline + np.cumsum(changes[:-1])
+
+
+def ramp_segments(ramp_table):
+    """
+    Piecewise linear waveform, like ramps, sawtooth and triangle waves.
+
+    Parameters
+    ----------
+    ramp_table : np.ndarray or list of tuples
+        Rows of (start_value, end_value, samples), see RAMP_TABLE_DTYPE.
+
+    Returns
+    -------
+    np.ndarray
+        float64 waveform, segment n equal to
+        np.linspace(start_value[n], end_value[n], samples[n]).
+
+    """
+    table = _as_table(ramp_table, RAMP_TABLE_DTYPE)
+    samples = np.maximum(table["samples"], 0)
+
+    segment = np.repeat(np.arange(len(table)), samples)
+    position = np.arange(len(segment)) - np.repeat(
+        np.cumsum(samples) - samples, samples
+    )
+
+    # Step size of each segment, single sample segments are at start_value.
+    steps = np.maximum(samples - 1, 1)
+    step = (table["end_value"] - table["start_value"]) / steps
+
+    waveform = table["start_value"][segment] + position * step[segment]
+    # Same as np.linspace, the last sample is exactly at end_value.
+    last = (np.cumsum(samples) - 1)[samples > 1]
+    waveform[last] = table["end_value"][samples > 1]
+    return waveform
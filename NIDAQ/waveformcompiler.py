@@ -0,0 +1,391 @@
+# -*- coding: utf-8 -*-
+"""
+Compile the waveform package that goes into DAQmission.runWaveforms into
+device-ready buffers, and keep recently compiled packages in an LRU cache.
+
+Compiling means: look up the NI-daq port of every 'Sepcification' in the
+channel look up table, split the analog waveforms over Dev1 and Dev2 into
+C-contiguous (channel number, samples) float64 arrays and pack all digital
+lines into one uint32 port waveform. The result is keyed by a hash of the
+content of the package, so when the same package is sent again (like at every
+coordinate of a screening) all of this is skipped.
+
+Protocols made by repeating one period many times (generate_AO_for640,
+generate_ramp, repeatWave, ...) are detected while compiling. For those only
+one period is kept, and DAQmission writes just that period and lets the
+device regenerate it until the whole finite sample count is generated, so
+host memory and write time scale with the period instead of the duration.
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from NIDAQ.digitalwaveform import DigitalEdgeWaveforms
+
+# Shorter periods are not regenerated, to keep the buffer transfers sensible.
+MIN_REGENERATION_PERIOD = 1000
+
+
+def waveform_package_key(analog_signals, digital_signals, channel_LUT):
+    """
+    Hash the content of a waveform package.
+
+    Parameters
+    ----------
+    analog_signals : np.ndarray or {}
+        Structured array with 'Waveform' and 'Sepcification' fields.
+    digital_signals : np.ndarray, DigitalEdgeWaveforms or {}
+        Structured array with 'Waveform' and 'Sepcification' fields, or the
+        digital lines as edge lists.
+    channel_LUT : dict
+        Channel look up table used to compile the package.
+
+    Returns
+    -------
+    str
+        Hex digest of the package.
+
+    """
+    hasher = hashlib.blake2b(digest_size=16)
+
+    for signals in (analog_signals, digital_signals):
+        if len(signals) == 0:
+            hasher.update(b"empty")
+            continue
+        if isinstance(signals, DigitalEdgeWaveforms):
+            # Hash the edges, never expand the lines.
+            hasher.update(b"edges")
+            hasher.update(signals.content_bytes())
+            continue
+        signals = np.ascontiguousarray(signals)
+        hasher.update(str(signals.dtype.descr).encode())
+        hasher.update(str(signals.shape).encode())
+        hasher.update(signals.view(np.uint8))
+
+    hasher.update(repr(sorted(channel_LUT.items())).encode())
+
+    return hasher.hexdigest()
+
+
+class CompiledWaveforms:
+    def __init__(self, key):
+        """
+        Device-ready buffers of one waveform package.
+
+        The arrays are shared between all runs that hit the cache, don't
+        modify them in place.
+
+        Attributes
+        ----------
+        Dev1_analog_channel_list, Dev2_analog_channel_list : list of str
+            NI-daq ports of the analog channels on each device.
+        Dev1_analog_samples, Dev2_analog_samples : np.ndarray or []
+            C-contiguous (channel number, samples) float64 arrays.
+        Digital_samples : np.ndarray or []
+            C-contiguous (1, samples) uint32 port waveform.
+        Digital_channel_number : int
+            Number of digital lines packed into Digital_samples.
+        Waveforms_length : int
+            Number of samples per channel.
+        Period_length : int or None
+            If all waveforms repeat exactly with this period, the sample
+            buffers only hold the first period, to be regenerated on the
+            device. None if the package is not periodic.
+        """
+        self.key = key
+
+        self.Dev1_analog_channel_list = []
+        self.Dev2_analog_channel_list = []
+        self.Dev1_analog_samples = []
+        self.Dev2_analog_samples = []
+        self.Digital_samples = []
+
+        self.Analog_channel_number = 0
+        self.Digital_channel_number = 0
+        self.Only_Digital_signals = False
+        self.Waveforms_length = 0
+        self.Period_length = None
+
+        # Information carried in the galvo specification keys.
+        self.galvosx_originalkey = "galvosx"
+        self.galvosy_originalkey = "galvosy"
+        self.averagenumber = None
+        self.ypixelnumber = None
+
+    @property
+    def nbytes(self):
+        return sum(
+            array.nbytes
+            for array in (
+                self.Dev1_analog_samples,
+                self.Dev2_analog_samples,
+                self.Digital_samples,
+            )
+            if isinstance(array, np.ndarray)
+        )
+
+
+def _channel_purpose(specification, compiled):
+    """
+    Convert specification keys with extra information, like 'galvosxavgnum_2',
+    to the plain channel purpose and keep the information in compiled.
+    """
+    if "galvosxavgnum" in specification:
+        compiled.averagenumber = int(specification[specification.index("_") + 1 :])
+        compiled.galvosx_originalkey = specification
+        return "galvosx"
+    elif "galvosyypixels" in specification:
+        compiled.ypixelnumber = int(specification[specification.index("_") + 1 :])
+        compiled.galvosy_originalkey = specification
+        return "galvosy"
+    elif "galvos_X_contour" in specification:
+        compiled.galvosx_originalkey = specification
+        return "galvosx"
+    elif "galvos_Y_contour" in specification:
+        compiled.galvosy_originalkey = specification
+        return "galvosy"
+    return specification
+
+
+def _divisors(number):
+    small = [i for i in range(1, int(number ** 0.5) + 1) if number % i == 0]
+    return sorted(set(small + [number // i for i in small]))
+
+
+def find_common_period(sample_arrays, min_period_length=MIN_REGENERATION_PERIOD):
+    """
+    Find the shortest period with which all sample arrays repeat exactly.
+
+    Parameters
+    ----------
+    sample_arrays : list of np.ndarray
+        (channel number, samples) arrays, all with the same number of samples.
+    min_period_length : int, optional
+        Shortest period to look for.
+
+    Returns
+    -------
+    int or None
+        The period in samples, which divides the number of samples and fits
+        at least twice. None if there is no such period.
+
+    """
+    sample_arrays = [array for array in sample_arrays if isinstance(array, np.ndarray)]
+    if len(sample_arrays) == 0:
+        return None
+    length = sample_arrays[0].shape[1]
+
+    for period in _divisors(length):
+        if period < min_period_length:
+            continue
+        if period > length // 2:
+            break
+        # Cheap test on the second period first, most candidates fail here.
+        if not all(
+            np.array_equal(array[:, period : 2 * period], array[:, :period])
+            for array in sample_arrays
+        ):
+            continue
+        if all(
+            np.array_equal(array[:, period:], array[:, :-period])
+            for array in sample_arrays
+        ):
+            return period
+
+    return None
+
+
+def compile_waveforms(analog_signals, digital_signals, channel_LUT, key=None):
+    """
+    Turn a waveform package into device-ready buffers.
+
+    Parameters
+    ----------
+    analog_signals : np.ndarray or {}
+        Analog waveforms, see DAQmission.runWaveforms.
+    digital_signals : np.ndarray, DigitalEdgeWaveforms or {}
+        Digital waveforms, see DAQmission.runWaveforms.
+    channel_LUT : dict
+        Channel look up table.
+    key : str, optional
+        Content hash of the package. Calculated if not given.
+
+    Returns
+    -------
+    CompiledWaveforms
+
+    """
+    if key is None:
+        key = waveform_package_key(analog_signals, digital_signals, channel_LUT)
+
+    compiled = CompiledWaveforms(key)
+    compiled.Analog_channel_number = len(analog_signals)
+    compiled.Digital_channel_number = len(digital_signals)
+    compiled.Only_Digital_signals = (
+        compiled.Analog_channel_number == 0 and compiled.Digital_channel_number != 0
+    )
+
+    if compiled.Only_Digital_signals == False:
+        compiled.Waveforms_length = len(analog_signals["Waveform"][0])
+    elif isinstance(digital_signals, DigitalEdgeWaveforms):
+        compiled.Waveforms_length = digital_signals.length
+    else:
+        compiled.Waveforms_length = len(digital_signals["Waveform"][0])
+
+    # -------------------Devide samples from Dev1 or 2----------------------
+    Dev1_rows = []
+    Dev2_rows = []
+    for i in range(compiled.Analog_channel_number):
+        port = channel_LUT[
+            _channel_purpose(str(analog_signals["Sepcification"][i]), compiled)
+        ]
+        if "Dev1" in port:
+            compiled.Dev1_analog_channel_list.append(port)
+            Dev1_rows.append(i)
+        else:
+            compiled.Dev2_analog_channel_list.append(port)
+            Dev2_rows.append(i)
+
+    # Fill preallocated arrays instead of stacking row by row.
+    if len(Dev1_rows) != 0:
+        compiled.Dev1_analog_samples = np.empty(
+            (len(Dev1_rows), compiled.Waveforms_length), dtype=np.float64
+        )
+        for row, i in enumerate(Dev1_rows):
+            compiled.Dev1_analog_samples[row] = analog_signals["Waveform"][i]
+
+    if len(Dev2_rows) != 0:
+        compiled.Dev2_analog_samples = np.empty(
+            (len(Dev2_rows), compiled.Waveforms_length), dtype=np.float64
+        )
+        for row, i in enumerate(Dev2_rows):
+            compiled.Dev2_analog_samples[row] = analog_signals["Waveform"][i]
+
+    # ---------------------Pack the digital lines---------------------------
+    # Each line n sets bit n of the port value, so lines 0 and 3 high is
+    # 1001 in binary, 9 as uint32.
+    if compiled.Digital_channel_number != 0:
+        line_numbers = []
+        for i in range(compiled.Digital_channel_number):
+            port = channel_LUT[str(digital_signals["Sepcification"][i])]
+            line_numbers.append(int(port[port.index("line") + 4 :]))
+
+        if isinstance(digital_signals, DigitalEdgeWaveforms):
+            # Straight from the edge lists, in one vectorised pass.
+            compiled.Digital_samples = np.ascontiguousarray(
+                digital_signals.pack_port(line_numbers)[np.newaxis, :]
+            )
+        else:
+            compiled.Digital_samples = np.zeros(
+                (1, compiled.Waveforms_length), dtype=np.uint32
+            )
+            for i, line_number in enumerate(line_numbers):
+                compiled.Digital_samples[0] |= (
+                    np.asarray(digital_signals["Waveform"][i]).astype(np.uint32)
+                    << np.uint32(line_number)
+                )
+
+    # -----------------Keep one period of periodic packages-----------------
+    compiled.Period_length = find_common_period(
+        [
+            compiled.Dev1_analog_samples,
+            compiled.Dev2_analog_samples,
+            compiled.Digital_samples,
+        ]
+    )
+    if compiled.Period_length is not None:
+        # Copies, so the full length buffers are freed.
+        if isinstance(compiled.Dev1_analog_samples, np.ndarray):
+            compiled.Dev1_analog_samples = compiled.Dev1_analog_samples[
+                :, : compiled.Period_length
+            ].copy()
+        if isinstance(compiled.Dev2_analog_samples, np.ndarray):
+            compiled.Dev2_analog_samples = compiled.Dev2_analog_samples[
+                :, : compiled.Period_length
+            ].copy()
+        if isinstance(compiled.Digital_samples, np.ndarray):
+            compiled.Digital_samples = compiled.Digital_samples[
+                :, : compiled.Period_length
+            ].copy()
+
+    return compiled
+
+
+class WaveformCache:
+    def __init__(self, maxsize=8, max_bytes=2 * 1024 ** 3):
+        """
+        Least recently used cache of compiled waveform packages.
+
+        Parameters
+        ----------
+        maxsize : int, optional
+            Maximum number of packages kept. The default is 8.
+        max_bytes : int, optional
+            Maximum total size of the kept buffers. The least recently used
+            packages are dropped first. The default is 2 GB.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        # Packages can be compiled ahead in another thread, see NIDAQ.daqexecutor.
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, analog_signals, digital_signals, channel_LUT):
+        """
+        Get the compiled package, compiling it if it is not in the cache.
+
+        Returns
+        -------
+        CompiledWaveforms
+
+        """
+        key = waveform_package_key(analog_signals, digital_signals, channel_LUT)
+
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            self.misses += 1
+
+        compiled = compile_waveforms(analog_signals, digital_signals, channel_LUT, key)
+        with self._lock:
+            self._entries[key] = compiled
+            self._evict()
+        return compiled
+
+    def _evict(self):
+        # Always keep the package that was just added.
+        while len(self._entries) > 1 and (
+            len(self._entries) > self.maxsize or self.nbytes > self.max_bytes
+        ):
+            self._entries.popitem(last=False)
+
+    @property
+    def nbytes(self):
+        return sum(compiled.nbytes for compiled in self._entries.values())
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+
+# Shared by all DAQmission instances, as callers usually create a new
+# DAQmission for every run.
+default_cache = WaveformCache()
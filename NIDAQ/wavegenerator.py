@@ -5,6 +5,14 @@ import math
 from scipy import signal
 
 from NIDAQ.constants import HardwareConstants
+from NIDAQ.digitalwaveform import DigitalEdgeWaveform
+from NIDAQ.wavebuilder import (
+    constant_segments,
+    pulse_train,
+    ramp_segments,
+    repeat_cycle,
+    stepped_cycles,
+)
 
 
 def xValuesSingleSawtooth(
@@ -23,7 +31,6 @@ def xValuesSingleSawtooth(
     speedGalvo = constants.maxGalvoSpeed  # Volt/s
     aGalvo = constants.maxGalvoAccel  # Acceleration galvo in volt/s^2
     aGalvoPix = aGalvo / (sampleRate ** 2)  # Acceleration galvo in volt/pixel^2
-    xArray = np.array([])  # Array for x voltages
     rampUpSpeed = (voltXMax - voltXMin) / xPixels  # Ramp up speed in volt/pixel
     rampDownSpeed = (
         -speedGalvo / sampleRate
@@ -37,14 +44,13 @@ def xValuesSingleSawtooth(
     # ---------------------------x pixel wave function---------------------------
     # ---------------------------------------------------------------------------
 
+    # The parts are calculated one after the other and concatenated once at
+    # the end, each part only needs the last value of the part before.
+
     # -----------Defining the ramp up (x)------------
-    rampUp = np.linspace(voltXMin, voltXMax, xPixels)
-    xArray = np.append(xArray, rampUp)  # Adding the voltage values for the ramp up
+    rampUp = ramp_segments([(voltXMin, voltXMax, xPixels)])
 
     # -----------Defining the inertial part-------------
-    inertialPart = np.array(
-        []
-    )  # Making a temporary array for storing the voltage values of the inertial part
     vIn = rampUpSpeed  # Speed of "incoming" ramp (volt/pixel)
     vOut = rampDownSpeed  # Speed of "outgoing" ramp (volt/pixel)
     a = -aGalvoPix  # Acceleration in volt/pixel^2
@@ -53,18 +59,18 @@ def xValuesSingleSawtooth(
     )  # Calculating the timespan needed
     t = np.arange(timespanInertial)
     inertialPart = (
-        0.5 * a * t[1::] ** 2 + vIn * t[1::] + xArray[-1]
+        0.5 * a * t[1::] ** 2 + vIn * t[1::] + rampUp[-1]
     )  # Making the array with the voltage values, we are not taking into acount the first value as this is the value of the previous sample
-    xArray = np.append(xArray, inertialPart)  # Adding the array to the total path
+    lastVoltage = inertialPart[-1] if inertialPart.size != 0 else rampUp[-1]
 
     if sawtooth == False:
         lineSizeStepFunction = (
-            xArray.size
+            rampUp.size + inertialPart.size
         )  # Defining the linesize for the yArray in case of a triangle wave
 
     # ----------Defining the ramp down----------------
     a = aGalvoPix
-    startVoltage = xArray[-1] + rampDownSpeed
+    startVoltage = lastVoltage + rampDownSpeed
     # We calculate the endvoltage by using the timespan for the intertial part and
     # the starting voltage
     endVoltage = (
@@ -76,24 +82,25 @@ def xValuesSingleSawtooth(
         rampDownSpeed = (
             endVoltage - startVoltage
         ) / timespanRampDown  # Above line changed the rampDownSpeed so we have to recalculate
-    else:
-        timespanRampDown = (
-            rampUp.size
-        )  # If it is a triangle wave the ramp down part should be as big as the ramp up part
 
-    rampDown = np.linspace(
-        startVoltage, endVoltage, timespanRampDown
-    )  # Specifying the linear path
-    xArray = np.append(xArray, rampDown)  # Adding the array to the total path
+        rampDown = ramp_segments(
+            [(startVoltage, endVoltage, timespanRampDown)]
+        )  # Specifying the linear path
+    else:
+        # For the triangle wave the ramp down retraces the ramp up, so the
+        # lines scanned backwards sample the same positions (bidirectional
+        # scanning, see rasterreconstruction).
+        rampDown = rampUp[::-1]
+    if rampDown.size != 0:
+        lastVoltage = rampDown[-1]
 
     # ----------Defining the second inertial part-------------
-    inertialPart2 = np.array([])
     vIn = rampDownSpeed  # Speed of "incoming" ramp (volt/pixel)
     a = aGalvoPix  # Acceleration in volt/pixel^2
     inertialPart2 = (
-        0.5 * a * t[1::] ** 2 + vIn * t[1::] + xArray[-1]
+        0.5 * a * t[1::] ** 2 + vIn * t[1::] + lastVoltage
     )  # We can use the same time units as the first inertial part but not including the last value, as this is part of the next iteration
-    xArray = np.append(xArray, inertialPart2)
+    xArray = np.concatenate((rampUp, inertialPart, rampDown, inertialPart2))
 
     if sawtooth == True:
         lineSizeStepFunction = xArray.size
@@ -112,19 +119,18 @@ def yValuesFullSawtooth(sampleRate, voltYMin, voltYMax, xPixels, yPixels, lineSi
     stepSize = (voltYMax - voltYMin) / yPixels
 
     # Creating the 'stairs'
-    extendedYArray = (
-        np.ones(xPixels) * voltYMin
-    )  # The first line is created manually as this is shorter
-    # The step is starting at the beginning of the intertial part
-    for i in np.arange(yPixels - 1) + 1:
-        extendedYArray = np.append(
-            extendedYArray, np.ones(lineSize) * i * stepSize + voltYMin
-        )
+    # The first line is shorter, the step is starting at the beginning of the
+    # intertial part.
+    stepLevels = (np.arange(yPixels - 1) + 1) * stepSize + voltYMin
 
     extraPixels = (
-        lineSize * yPixels - extendedYArray.size
+        lineSize - xPixels
     )  # Some extra pixels are needed to make x and y the same size
-    extendedYArray = np.append(extendedYArray, np.ones(extraPixels) * voltYMin)
+
+    extendedYArray = constant_segments(
+        np.concatenate(([voltYMin], stepLevels, [voltYMin])),
+        np.concatenate(([xPixels], np.full(yPixels - 1, lineSize), [extraPixels])),
+    )
 
     return extendedYArray
     """
@@ -165,9 +171,7 @@ def repeatWave(wave, repeats):
     """
     Repeats the wave a set number of times and returns a new repeated wave.
     """
-    extendedWave = np.array([])
-    for i in range(repeats):
-        extendedWave = np.append(extendedWave, wave)
+    extendedWave = np.tile(np.asarray(wave, dtype=float), repeats)
     return extendedWave
 
 
@@ -220,12 +224,11 @@ def blockWave(sampleRate, frequency, voltMin, voltMax, dutycycle):
     dutycycle       duty cycle of the wave (wavelength at voltMax) (float)
     """
     wavelength = int(sampleRate / frequency)  # Wavelength in number of samples
-    # The high values
-    high = np.ones(math.ceil(wavelength * dutycycle)) * voltMax
-    # Low values
-    low = np.ones(math.floor(wavelength * (1 - dutycycle))) * voltMin
-    # Adding them
-    return np.append(high, low)
+    # The high values, then the low values
+    return constant_segments(
+        [voltMax, voltMin],
+        [math.ceil(wavelength * dutycycle), math.floor(wavelength * (1 - dutycycle))],
+    )
 
 
 def testSawtooth():
@@ -283,9 +286,6 @@ class generate_AO_for640:
         self.offsetsamples_number_2 = int(
             (self.waveoffset_2 / 1000) * self.Daq_sample_rate
         )  
-        self.offsetsamples_2 = self.wavebaseline_2 * np.ones(
-            self.offsetsamples_number_2
-        )  # Be default offsetsamples_number is an integer.
 
         self.sample_num_singleperiod_2 = round(
             self.Daq_sample_rate / self.wavefrequency_2
@@ -297,9 +297,12 @@ class generate_AO_for640:
             self.sample_num_singleperiod_2 - self.true_sample_num_singleperiod_2
         )
 
-        self.sample_singleperiod_2 = np.append(
-            self.wavestartamplitude_2 * np.ones(self.true_sample_num_singleperiod_2),
-            self.wavebaseline_2 * np.ones(self.false_sample_num_singleperiod_2),
+        self.sample_singleperiod_2 = constant_segments(
+            [self.wavestartamplitude_2, self.wavebaseline_2],
+            [
+                self.true_sample_num_singleperiod_2,
+                self.false_sample_num_singleperiod_2,
+            ],
         )
         self.repeatnumberintotal_2 = int(
             self.wavefrequency_2 * (self.waveperiod_2 / 1000)
@@ -309,26 +312,20 @@ class generate_AO_for640:
             self.sample_singleperiod_2, int(self.repeatnumberintotal_2)
         )  # At least 1 rise and fall during one cycle
 
-        self.waveallcycle_2 = []
-        # Adding steps to cycles
-        for i in range(self.wavecycles_2):
-            cycle_roof_value = self.wavestep_2 * i
-            self.cycleappend = np.where(
-                self.sample_singlecycle_2 < self.wavestartamplitude_2,
-                self.wavebaseline_2,
-                self.wavestartamplitude_2 + cycle_roof_value,
-            )
-            self.waveallcycle_2 = np.append(self.waveallcycle_2, self.cycleappend)
-
-        if self.wavegap_2 != 0:
-            self.gapsample = self.wavebaseline_2 * np.ones(self.wavegap_2)
-            self.waveallcyclewithgap_2 = np.append(self.waveallcycle_2, self.gapsample)
-        else:
-            self.waveallcyclewithgap_2 = self.waveallcycle_2
-
-        self.waverepeated = np.tile(self.waveallcyclewithgap_2, self.waverepeat_2)
-
-        AO_output = np.append(self.offsetsamples_2, self.waverepeated)
+        # Adding steps to cycles, cycle i is wavestep_2 * i higher.
+        self.waveallcycle_2 = stepped_cycles(
+            ~(self.sample_singlecycle_2 < self.wavestartamplitude_2),
+            self.wavestartamplitude_2 + self.wavestep_2 * np.arange(self.wavecycles_2),
+            self.wavebaseline_2,
+        )
+
+        AO_output = repeat_cycle(
+            self.waveallcycle_2,
+            self.waverepeat_2,
+            offset_samples=self.offsetsamples_number_2,
+            gap_samples=self.wavegap_2,
+            baseline=self.wavebaseline_2,
+        )
         
         # Appending at the end of the waveforms
         # AO_output = np.append(AO_output, 0)
@@ -602,14 +599,22 @@ class generate_digital_waveform:
         self.waverepeat = value6
         self.wavegap = value7
 
-    def generate(self):
+    def generate_edges(self):
+        """
+        Generate the waveform as edge list, see NIDAQ.digitalwaveform.
+
+        The runs of constant value are calculated directly from the settings,
+        so the memory used scales with the number of pulses instead of the
+        number of samples.
 
+        Returns
+        -------
+        DigitalEdgeWaveform
+
+        """
         self.offsetsamples_number = int(
             (self.waveoffset / 1000) * self.Daq_sample_rate
         )  # By default one 0 is added so that we have a rising edge at the beginning.
-        self.offsetsamples = np.zeros(
-            self.offsetsamples_number, dtype=bool
-        )  # Be default offsetsamples_number is an integer.
 
         self.sample_num_singleperiod = round(self.Daq_sample_rate / self.wavefrequency)
         self.true_sample_num_singleperiod = round(
@@ -619,29 +624,34 @@ class generate_digital_waveform:
             self.sample_num_singleperiod - self.true_sample_num_singleperiod
         )
 
-        self.sample_singleperiod = np.append(
-            np.ones(self.true_sample_num_singleperiod, dtype=bool),
-            np.zeros(self.false_sample_num_singleperiod, dtype=bool),
-        )
         self.repeatnumberintotal = int(self.wavefrequency * (self.waveperiod / 1000))
         # In default, pulses * sample_singleperiod_2 = period
-        self.sample_singlecycle = np.tile(
-            self.sample_singleperiod, int(self.repeatnumberintotal)
-        )  # At least 1 rise and fall during one cycle
+        # One cycle: repeatnumberintotal times (high, low), then the gap.
+        cycle_values = np.append(
+            np.tile([True, False], self.repeatnumberintotal), False
+        )
+        cycle_run_lengths = np.append(
+            np.tile(
+                [
+                    self.true_sample_num_singleperiod,
+                    self.false_sample_num_singleperiod,
+                ],
+                self.repeatnumberintotal,
+            ),
+            self.wavegap,
+        )
 
-        if self.wavegap != 0:
-            self.gapsample = np.zeros(self.wavegap, dtype=bool)
-            self.waveallcyclewithgap = np.append(
-                self.sample_singlecycle, self.gapsample
-            )
-        else:
-            self.waveallcyclewithgap = self.sample_singlecycle
+        # Offset first, then the cycle repeated.
+        values = np.append(False, np.tile(cycle_values, self.waverepeat))
+        run_lengths = np.append(
+            self.offsetsamples_number, np.tile(cycle_run_lengths, self.waverepeat)
+        )
 
-        self.waverepeated = np.tile(self.waveallcyclewithgap, self.waverepeat)
-        
-        # Append a False in the end
-        self.finalwave = np.append(self.offsetsamples, self.waverepeated)
-        # self.finalwave = np.append(self.finalwave, False)
+        return DigitalEdgeWaveform.from_runs(values, run_lengths)
+
+    def generate(self):
+
+        self.finalwave = self.generate_edges().to_array()
 
         return self.finalwave
 
@@ -745,9 +755,6 @@ class generate_ramp:
         self.offsetsamples_number_ramp = int(
             1 + (self.waveoffset / 1000) * self.Daq_sample_rate
         )  # By default one 0 is added
-        self.offsetsamples_ramp = self.wavebaseline * np.ones(
-            self.offsetsamples_number_ramp
-        )  # Be default offsetsamples_number is an integer.
 
         t = np.linspace(
             0,
@@ -774,17 +781,13 @@ class generate_ramp:
             self.cycleappend = np.where(self.sample_singlecycle_ramp < self.waveheight, self.wavebaseline, self.waveheight + cycle_roof_value)
             self.waveallcycle_ramp = np.append(self.waveallcycle_ramp, self.cycleappend)
         """
-        if self.wavegap != 0:
-            self.gapsample = self.wavebaseline * np.ones(self.wavegap)
-            self.waveallcyclewithgap_ramp = np.append(
-                self.sample_singlecycle_ramp, self.gapsample
-            )
-        else:
-            self.waveallcyclewithgap_ramp = self.sample_singlecycle_ramp
-
-        self.waverepeated = np.tile(self.waveallcyclewithgap_ramp, self.waverepeat)
-
-        self.finalwave_ramp = np.append(self.offsetsamples_ramp, self.waverepeated)
+        self.finalwave_ramp = repeat_cycle(
+            self.sample_singlecycle_ramp,
+            self.waverepeat,
+            offset_samples=self.offsetsamples_number_ramp,
+            gap_samples=self.wavegap,
+            baseline=self.wavebaseline,
+        )
         self.finalwave_ramp = np.append(self.finalwave_ramp, 0)
         return self.finalwave_ramp
 
@@ -823,78 +826,45 @@ class generate_AO:
         self.controlamp_2 = control_amp2
 
     def generate(self):
-        def rect(T):
-            """create a centered rectangular pulse of width $T"""
-            return lambda t: (-T / 2 <= t) & (t < T / 2)
-
-        def pulse_train(t, at, shape):
-            """create a train of pulses over $t at times $at and shape $shape"""
-            return np.sum(shape(t - at[:, np.newaxis]), axis=0)
-
+        # Pulse width in s, the pulses are centered on their times.
         self.shape = 0.5 * (1 / self.wavefrequency_2)
+        period_samples = (self.waveperiod_2 / 1000) * self.Daq_sample_rate
+
+        # One pulse at start_time_2 in the first period.
         sig = pulse_train(
-            t=np.arange(
-                (self.waveperiod_2 / 1000) * self.Daq_sample_rate
-            ),  # time domain
-            at=np.array(
-                [(self.start_time_2 * self.Daq_sample_rate)]
-            ),  # times of pulses
-            shape=rect(self.shape * self.Daq_sample_rate),  # shape of pulse
+            self.Daq_sample_rate,
+            math.ceil(period_samples),
+            [(self.start_time_2 - self.shape / 2, self.shape, self.wavestep_2, 1, 0)],
         )
 
-        sig = self.wavestep_2 * sig
-        number = 1
-        sigdouble = []
-        # print(sig)
-        while number <= self.waverepeat_2:
-            number = number + 1
-            # print(number)
-            sigdouble = (
-                number * sig[0 : (int(self.waveperiod_2 / 1000) * self.Daq_sample_rate)]
-            )
-            sig = np.append(sig, sigdouble)
-            # print(sig)
-
-        # define the control signal
-        self.time_control = self.waveperiod_2 / 1000
-        at_control = []
-        while self.time_control < ((self.waveperiod_2 / 1000) * self.waverepeat_2):
-            self.time_control = self.time_control + (self.waveperiod_2 / 1000)
-            self.time_control_2 = self.time_control * self.Daq_sample_rate
-            at_control.append(self.time_control_2)
-        # print(at_control)
-        # print([10*self.Daq_sample_rate, 20*self.Daq_sample_rate, 30*self.Daq_sample_rate, 40*self.Daq_sample_rate, 50*self.Daq_sample_rate, 60*self.Daq_sample_rate, 70*self.Daq_sample_rate, 80*self.Daq_sample_rate, 90*self.Daq_sample_rate, 100*self.Daq_sample_rate, 110*self.Daq_sample_rate])
+        # Followed by waverepeat_2 copies, copy n - 1 scaled by n.
+        repeated_length = int(self.waveperiod_2 / 1000) * self.Daq_sample_rate
+        sigdouble = (
+            np.arange(2, self.waverepeat_2 + 2)[:, np.newaxis]
+            * sig[np.newaxis, 0:repeated_length]
+        )
+        sig = np.append(sig, sigdouble.ravel())
 
+        # define the control signal, one pulse at the start of every period
+        # after the first one.
         sig2 = pulse_train(
-            t=np.arange(
+            self.Daq_sample_rate,
+            math.ceil(
                 (self.waverepeat_2 + 1)
                 * (self.waveperiod_2 / 1000)
                 * self.Daq_sample_rate
-            ),  # time domain
-            at=np.array(
-                [
-                    1 * self.Daq_sample_rate,
-                    2 * self.Daq_sample_rate,
-                    3 * self.Daq_sample_rate,
-                    4 * self.Daq_sample_rate,
-                    5 * self.Daq_sample_rate,
-                    6 * self.Daq_sample_rate,
-                    7 * self.Daq_sample_rate,
-                    8 * self.Daq_sample_rate,
-                    9 * self.Daq_sample_rate,
-                    10 * self.Daq_sample_rate,
-                    11 * self.Daq_sample_rate,
-                    12 * self.Daq_sample_rate,
-                    13 * self.Daq_sample_rate,
-                    14 * self.Daq_sample_rate,
-                    15 * self.Daq_sample_rate,
-                ]
-            ),  # times of pulses
-            shape=rect(self.shape * self.Daq_sample_rate),  # shape of pulse
+            ),
+            [
+                (
+                    self.waveperiod_2 / 1000 - self.shape / 2,
+                    self.shape,
+                    self.controlamp_2,
+                    self.waverepeat_2 + 1,
+                    self.waveperiod_2 / 1000,
+                )
+            ],
         )
 
-        sig2 = self.controlamp_2 * sig2
-
         self.finalwave_ = sig + sig2
         return self.finalwave_
 
@@ -7,10 +7,6 @@ Created on Mon Mar 18 12:21:01 2019
 Notes:
     
 """
-import nidaqmx
-from nidaqmx.stream_readers import AnalogMultiChannelReader
-from nidaqmx.stream_writers import AnalogSingleChannelWriter
-
 from PyQt5.QtCore import pyqtSignal, QThread
 
 import numpy as np
@@ -19,6 +15,12 @@ import sys
 
 sys.path.append("../")
 
+from NIDAQ.daqbackend import (
+    nidaqmx,
+    AnalogMultiChannelReader,
+    AnalogSingleChannelWriter,
+)
+
 from NIDAQ.wavegenerator import blockWave
 from NIDAQ.constants import MeasurementConstants, NiDaqChannels
 
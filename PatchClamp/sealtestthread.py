@@ -11,11 +11,12 @@ import sys
 import numpy as np
 from PyQt5.QtCore import pyqtSignal, QThread, pyqtSlot
 
-import nidaqmx
-from nidaqmx.stream_readers import AnalogMultiChannelReader
-from nidaqmx.stream_writers import AnalogSingleChannelWriter
-
 sys.path.append("../")
+from NIDAQ.daqbackend import (
+    nidaqmx,
+    AnalogMultiChannelReader,
+    AnalogSingleChannelWriter,
+)
 from NIDAQ.wavegenerator import blockWave
 from NIDAQ.constants import MeasurementConstants, NiDaqChannels
 
@@ -19,6 +19,10 @@ import threading
 
 from SampleStageControl.stage import LudlStage
 from NIDAQ.DAQoperator import DAQmission
+from NIDAQ.taskpool import DAQTaskPool
+from NIDAQ.constants import NiDaqChannels
+from NIDAQ.rasterreconstruction import RasterReconstruction
+from GalvoWidget.galvolag import default_galvo_lag
 from PI_ObjectiveMotor.focuser import PIMotor
 from PI_ObjectiveMotor.AutoFocus import FocusFinder
 from ThorlabsFilterSlider.filterpyserial import ELL9Filter
@@ -158,6 +162,9 @@ class ScanningExecutionThread(QThread):
         GridSequence = 0
         TotalGridNumber = self.meshgridnumber ** 2
 
+        # Keep the DAQ tasks configured between coordinates.
+        self.daq_task_pool = DAQTaskPool()
+
         for EachGrid in range(TotalGridNumber):
             """
             #------------------------------------------------------------------------------
@@ -526,6 +533,10 @@ class ScanningExecutionThread(QThread):
 
             self.Laserinstance.Turn_Off_PumpLaser()
 
+        # Release the DAQ channels
+        self.daq_task_pool.close()
+        print("DAQ task pool: {}".format(self.daq_task_pool.latency_summary()))
+
         # Disconnect camera
         if self._use_camera == True:
             self.HamamatsuCam.Exit()
@@ -816,6 +827,10 @@ class ScanningExecutionThread(QThread):
             # auto_focus_flag = False
             print("focus_position {}".format(self.coord_array["focus_position"]))
 
+            # Auto-focus scans with its own DAQ tasks, release the pooled ones.
+            if auto_focus_flag in ["yes", "pure AF"]:
+                self.daq_task_pool.close()
+
             # -----------------------Auto focus---------------------------------
             if auto_focus_flag == "yes":
 
@@ -1157,6 +1172,7 @@ class ScanningExecutionThread(QThread):
             analog_signals=WaveformPackageToBeExecute[1],
             digital_signals=WaveformPackageToBeExecute[2],
             readin_channels=WaveformPackageToBeExecute[3],
+            task_pool=self.daq_task_pool,
         )
         self.adcollector.save_as_binary(self.scansavedirectory)
         self.recorded_raw_data = self.adcollector.get_raw_data()
@@ -1187,28 +1203,35 @@ class ScanningExecutionThread(QThread):
 
         self.channel_number = len(self.recorded_raw_data)
 
-        self.data_collected_0 = (
-            self.recorded_raw_data[0][0 : len(self.recorded_raw_data[0]) - 1] * -1
-        )
-        print(len(self.data_collected_0))
+        # Rows of the PMTs in the recording, the channels are recorded in the
+        # order of NiDaqChannels.
+        self.pmt_channel_names = [
+            channel
+            for channel in NiDaqChannels().pmt_channels
+            if channel in self.readinchan
+        ]
+        recorded_channel_names = [
+            channel
+            for channel in NiDaqChannels().readin_channels
+            if channel in self.readinchan
+        ]
 
-        if self.channel_number == 1:
-            if "Vp" in self.readinchan:
-                pass
-            elif "Ip" in self.readinchan:
-                pass
-            elif (
-                "PMT" in self.readinchan
-            ):  # repeatnum, PMT_data_index_array, averagenum, ScanArrayXnum
-                # Reconstruct the image from np array and save it.
-                self.PMT_image_processing()
-
-        elif self.channel_number == 2:
-            if "PMT" not in self.readinchan:
-                pass
-            elif "PMT" in self.readinchan:
+        if len(self.pmt_channel_names) != 0:
+            # (PMTs, samples), all of them are reconstructed together.
+            self.data_collected_0 = (
+                np.stack(
+                    [
+                        self.recorded_raw_data[recorded_channel_names.index(channel)]
+                        for channel in self.pmt_channel_names
+                    ]
+                )[:, :-1]
+                * -1
+            )
+            print(self.data_collected_0.shape)
 
-                self.PMT_image_processing()
+            # repeatnum, PMT_data_index_array, averagenum, ScanArrayXnum
+            # Reconstruct the image from np array and save it.
+            self.PMT_image_processing()
 
         print("ProcessData executed.")
 
@@ -1243,45 +1266,43 @@ class ScanningExecutionThread(QThread):
 
     def PMT_image_processing(self):
         """
-        Reconstruct the image from np array and save it.
+        Reconstruct the image from np array and save it. With several PMTs the
+        images of all channels are saved in one file, the focus degree and the
+        max projection are from the first one.
 
         Returns
         -------
         None.
 
         """
+        Value_yPixels = int(self.lenSample_1 / self.ScanArrayXnum)
+        try:
+            # All images in one pass, located once in the index array.
+            # Cut off the flying back part, after the calibrated galvo lag.
+            PMT_images = RasterReconstruction.from_index_array(
+                self.PMT_data_index_array,
+                self.ScanArrayXnum,
+                Value_yPixels,
+                self.averagenum,
+                x_slice=default_galvo_lag.crop(
+                    self.daq_sampling_rate,
+                    Value_yPixels,
+                    line_sample_number=self.ScanArrayXnum,
+                ),
+            ).reconstruct(self.data_collected_0)
+        except ValueError as exc:
+            print("PMT images failed to generate: {}".format(exc))
+            return
+
         for imageSequence in range(self.repeatnum):
 
             try:
-                self.PMT_image_reconstructed_array = self.data_collected_0[
-                    np.where(self.PMT_data_index_array == imageSequence + 1)
-                ]
-
-                Dataholder_average = np.mean(
-                    self.PMT_image_reconstructed_array.reshape(self.averagenum, -1),
-                    axis=0,
-                )
-
-                Value_yPixels = int(self.lenSample_1 / self.ScanArrayXnum)
-                self.PMT_image_reconstructed = np.reshape(
-                    Dataholder_average, (Value_yPixels, self.ScanArrayXnum)
-                )
-
-                # self.PMT_image_reconstructed = self.PMT_image_reconstructed[
-                #     :, 50:550]
-                # Cut off the flying back part.
-                if self.daq_sampling_rate == 500000:
-                    if Value_yPixels == 500:
-                        self.PMT_image_reconstructed = self.PMT_image_reconstructed[:, 50:550]
-                    elif Value_yPixels == 256:
-                        self.PMT_image_reconstructed = self.PMT_image_reconstructed[:, 70:326]
-                elif self.daq_sampling_rate == 250000:
-                    if Value_yPixels == 500:
-                        self.PMT_image_reconstructed = self.PMT_image_reconstructed[:, 25:525]
-                    elif Value_yPixels == 256:
-                        self.PMT_image_reconstructed = self.PMT_image_reconstructed[:, 25:525]
-                  # Crop size based on: M:\tnw\ist\do\projects\Neurophotonics\Brinkslab\Data\Xin\2019-12-30 2p beads area test 4um
-                # self.PMT_image_reconstructed = self.PMT_image_reconstructed[:, 70:326] # for 256*256 images
+                # The fly back is cut off in the reconstruction.
+                # (PMTs, yPixels, xPixels), or one image for one PMT.
+                PMT_channel_images = PMT_images[:, imageSequence]
+                if len(PMT_channel_images) == 1:
+                    PMT_channel_images = PMT_channel_images[0]
+                self.PMT_image_reconstructed = PMT_images[0, imageSequence]
 
                 #=== Evaluate the focus degree of re-constructed image. =======
                 self.FocusDegree_img_reconstructed = ProcessImage.local_entropy(
@@ -1316,9 +1337,12 @@ class ScanningExecutionThread(QThread):
                     imagej=True,
                 ) as tif:
                     tif.save(
-                        self.PMT_image_reconstructed.astype("float32"),
+                        PMT_channel_images.astype("float32"),
                         compress=0,
-                        metadata={"FocusPos: ": str(self.FocusPos)},
+                        metadata={
+                            "FocusPos: ": str(self.FocusPos),
+                            "Channels: ": str(self.pmt_channel_names),
+                        },
                     )
 
                 plt.figure()
@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the stages before an acquisition starts: waveform generation in
+NIDAQ.wavegenerator, building the waveform package like
+WaveformWidget.organize_waveforms does, and compiling the package into device
+buffers like DAQmission.runWaveforms does.
+
+The classes follow the asv conventions (params, param_names, setup, time_*
+and peakmem_* methods), so they run with airspeed velocity. Without asv, run
+
+    python benchmarks/waveform_benchmarks.py [--quick] [--filter name]
+
+which prints the wall time and the peak memory (traced with tracemalloc) of
+every benchmark over the parameter grid. --quick only runs the smallest
+parameters of each grid.
+
+Parameter grids: 250 and 500 kS/s, 256 to 1024 pixels, 1 to 60 s protocols.
+"""
+
+import argparse
+import gc
+import itertools
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+# Ensure that the benchmarks can be run directly from the repository.
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from NIDAQ.digitalwaveform import DigitalEdgeWaveform, DigitalEdgeWaveforms
+from NIDAQ.waveformcompiler import WaveformCache, compile_waveforms
+from NIDAQ.constants import NiDaqChannels
+import NIDAQ.wavegenerator as wavegenerator
+
+SAMPLING_RATES = [250000, 500000]
+PIXEL_NUMBERS = [256, 512, 1024]
+DURATIONS = [1, 10, 60]  # s
+
+
+def make_protocol(sampling_rate, duration):
+    """
+    Waveforms of a typical voltage imaging protocol: 640 laser pulses, the
+    camera trigger at 1 kHz and the LED pulses, duration seconds long.
+
+    Returns
+    -------
+    dict
+        Waveform of each channel, like WaveformWidget.waveform_data_dict.
+
+    """
+    waveform_data_dict = {}
+    waveform_data_dict["640AO"] = wavegenerator.generate_AO_for640(
+        sampling_rate, 5, 0, duration * 1000, 50, 1, 0, 2, 0, 0, 1
+    ).generate()
+    waveform_data_dict["cameratrigger"] = wavegenerator.generate_digital_waveform(
+        sampling_rate, 1000, 0, duration * 1000, 50, 1, 0
+    ).generate_edges()
+    waveform_data_dict["LED"] = wavegenerator.generate_digital_waveform(
+        sampling_rate, 1, 0, duration * 1000, 20, 1, 0
+    ).generate_edges()
+    return waveform_data_dict
+
+
+def organize_waveforms(waveform_data_dict, digital_channels, padding_number=115):
+    """
+    Padding and packing of WaveformWidget.organize_waveforms, without the
+    widget: pad every waveform, then put the analog waveforms in a structured
+    array and the digital ones in a DigitalEdgeWaveforms package.
+    """
+    padded = {}
+    for key, waveform in waveform_data_dict.items():
+        if key in digital_channels:
+            padded[key] = (
+                DigitalEdgeWaveform(padding_number)
+                .append(waveform)
+                .append(DigitalEdgeWaveform(1))
+            )
+        else:
+            padded[key] = np.append(np.append(np.zeros(padding_number), waveform), 0)
+
+    reference_length = max(len(waveform) for waveform in padded.values())
+    for key, waveform in padded.items():
+        if key in digital_channels:
+            padded[key] = waveform.resized(reference_length)
+        elif len(waveform) < reference_length:
+            padded[key] = np.append(
+                waveform,
+                np.zeros(reference_length - len(waveform), dtype=waveform.dtype),
+            )
+
+    analog_keys = [key for key in padded if key not in digital_channels]
+    dataType_analog = np.dtype(
+        [("Waveform", float, (reference_length,)), ("Sepcification", "U20")]
+    )
+    analog_array = np.zeros(len(analog_keys), dtype=dataType_analog)
+    for i, key in enumerate(analog_keys):
+        analog_array[i] = np.array([(padded[key], key)], dtype=dataType_analog)
+
+    digital_array = DigitalEdgeWaveforms()
+    for key in padded:
+        if key in digital_channels:
+            digital_array.add(padded[key], key)
+
+    return analog_array, digital_array
+
+
+class WaveRecPic:
+    params = [SAMPLING_RATES, PIXEL_NUMBERS]
+    param_names = ["sampling_rate", "pixels"]
+
+    def time_waveRecPic(self, sampling_rate, pixels):
+        wavegenerator.waveRecPic(
+            sampling_rate, 0, -3, 3, -3, 3, pixels, pixels, True
+        )
+
+    def peakmem_waveRecPic(self, sampling_rate, pixels):
+        wavegenerator.waveRecPic(
+            sampling_rate, 0, -3, 3, -3, 3, pixels, pixels, True
+        )
+
+
+class BlockWave:
+    params = [SAMPLING_RATES, DURATIONS]
+    param_names = ["sampling_rate", "duration"]
+
+    def time_blockWave(self, sampling_rate, duration):
+        wave = wavegenerator.blockWave(sampling_rate, 100, 0, 5, 0.5)
+        wavegenerator.repeatWave(wave, 100 * duration)
+
+    def peakmem_blockWave(self, sampling_rate, duration):
+        wave = wavegenerator.blockWave(sampling_rate, 100, 0, 5, 0.5)
+        wavegenerator.repeatWave(wave, 100 * duration)
+
+
+class GenerateAO:
+    params = [SAMPLING_RATES, DURATIONS]
+    param_names = ["sampling_rate", "duration"]
+
+    def time_generate_AO_for640(self, sampling_rate, duration):
+        # 1000 stepped cycles, duration seconds in total.
+        wavegenerator.generate_AO_for640(
+            sampling_rate, 1000, 0, duration, 50, 1, 0, 1, 0, 0.001, 1000
+        ).generate()
+
+    def peakmem_generate_AO_for640(self, sampling_rate, duration):
+        wavegenerator.generate_AO_for640(
+            sampling_rate, 1000, 0, duration, 50, 1, 0, 1, 0, 0.001, 1000
+        ).generate()
+
+    def time_generate_AO(self, sampling_rate, duration):
+        # One second periods, control pulses at every period.
+        wavegenerator.generate_AO(
+            sampling_rate, 10, 0, 1000, 50, duration - 1, 0, 1, 0, 1, 1, 0.5, 2
+        ).generate()
+
+    def peakmem_generate_AO(self, sampling_rate, duration):
+        wavegenerator.generate_AO(
+            sampling_rate, 10, 0, 1000, 50, duration - 1, 0, 1, 0, 1, 1, 0.5, 2
+        ).generate()
+
+
+class GenerateDigitalWaveform:
+    params = [SAMPLING_RATES, DURATIONS]
+    param_names = ["sampling_rate", "duration"]
+
+    def time_generate(self, sampling_rate, duration):
+        wavegenerator.generate_digital_waveform(
+            sampling_rate, 1000, 0, duration * 1000, 50, 1, 0
+        ).generate()
+
+    def peakmem_generate(self, sampling_rate, duration):
+        wavegenerator.generate_digital_waveform(
+            sampling_rate, 1000, 0, duration * 1000, 50, 1, 0
+        ).generate()
+
+    def time_generate_edges(self, sampling_rate, duration):
+        wavegenerator.generate_digital_waveform(
+            sampling_rate, 1000, 0, duration * 1000, 50, 1, 0
+        ).generate_edges()
+
+    def peakmem_generate_edges(self, sampling_rate, duration):
+        wavegenerator.generate_digital_waveform(
+            sampling_rate, 1000, 0, duration * 1000, 50, 1, 0
+        ).generate_edges()
+
+
+class OrganizeWaveforms:
+    params = [SAMPLING_RATES, DURATIONS]
+    param_names = ["sampling_rate", "duration"]
+
+    def setup(self, sampling_rate, duration):
+        self.waveform_data_dict = make_protocol(sampling_rate, duration)
+        self.digital_channels = ["cameratrigger", "LED"]
+
+    def time_organize_waveforms(self, sampling_rate, duration):
+        organize_waveforms(self.waveform_data_dict, self.digital_channels)
+
+    def peakmem_organize_waveforms(self, sampling_rate, duration):
+        organize_waveforms(self.waveform_data_dict, self.digital_channels)
+
+
+class CompileWaveforms:
+    params = [SAMPLING_RATES, DURATIONS]
+    param_names = ["sampling_rate", "duration"]
+
+    def setup(self, sampling_rate, duration):
+        self.channel_LUT = NiDaqChannels().look_up_table
+        self.analog_array, self.digital_edges = organize_waveforms(
+            make_protocol(sampling_rate, duration), ["cameratrigger", "LED"]
+        )
+        self.digital_array = self.digital_edges.to_structured_array()
+        self.cache = WaveformCache()
+        self.cache.get(self.analog_array, self.digital_edges, self.channel_LUT)
+
+    def time_compile_dense_digital(self, sampling_rate, duration):
+        compile_waveforms(self.analog_array, self.digital_array, self.channel_LUT)
+
+    def peakmem_compile_dense_digital(self, sampling_rate, duration):
+        compile_waveforms(self.analog_array, self.digital_array, self.channel_LUT)
+
+    def time_compile_edge_digital(self, sampling_rate, duration):
+        compile_waveforms(self.analog_array, self.digital_edges, self.channel_LUT)
+
+    def peakmem_compile_edge_digital(self, sampling_rate, duration):
+        compile_waveforms(self.analog_array, self.digital_edges, self.channel_LUT)
+
+    def time_cache_hit(self, sampling_rate, duration):
+        # What runWaveforms does when the same package is sent again.
+        self.cache.get(self.analog_array, self.digital_edges, self.channel_LUT)
+
+
+# =============================================================================
+#     Runner without asv
+# =============================================================================
+
+BENCHMARK_CLASSES = [
+    WaveRecPic,
+    BlockWave,
+    GenerateAO,
+    GenerateDigitalWaveform,
+    OrganizeWaveforms,
+    CompileWaveforms,
+]
+
+
+def run_benchmark(benchmark, method_name, param_values, repeat=3):
+    """
+    Run one benchmark method.
+
+    Returns
+    -------
+    float
+        Best wall time in s for time_* methods, peak traced memory in bytes
+        for peakmem_* methods.
+
+    """
+    method = getattr(benchmark, method_name)
+
+    if method_name.startswith("peakmem_"):
+        gc.collect()
+        tracemalloc.start()
+        method(*param_values)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return peak
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        method(*param_values)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def run_all(quick=False, name_filter=None):
+    results = []
+    for benchmark_class in BENCHMARK_CLASSES:
+        grids = benchmark_class.params
+        if quick:
+            grids = [grid[:1] for grid in grids]
+
+        method_names = [
+            name
+            for name in dir(benchmark_class)
+            if name.startswith("time_") or name.startswith("peakmem_")
+        ]
+
+        for param_values in itertools.product(*grids):
+            benchmark = benchmark_class()
+            if hasattr(benchmark, "setup"):
+                benchmark.setup(*param_values)
+
+            for method_name in method_names:
+                full_name = benchmark_class.__name__ + "." + method_name
+                if name_filter is not None and name_filter not in full_name:
+                    continue
+                value = run_benchmark(benchmark, method_name, param_values)
+                parameters = ", ".join(
+                    "{}={}".format(name, value)
+                    for name, value in zip(benchmark_class.param_names, param_values)
+                )
+                if method_name.startswith("peakmem_"):
+                    text = "{:10.1f} MB".format(value / 1024 ** 2)
+                else:
+                    text = "{:10.2f} ms".format(value * 1000)
+                print("{:<55} {:<35} {}".format(full_name, parameters, text))
+                results.append((full_name, param_values, value))
+
+            del benchmark
+            gc.collect()
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument(
+        "--quick", action="store_true", help="only the smallest parameters"
+    )
+    parser.add_argument("--filter", default=None, help="only names containing this")
+    arguments = parser.parse_args()
+
+    run_all(quick=arguments.quick, name_filter=arguments.filter)
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""
+The tests run on the simulated NI-daq backend (NIDAQ.simulated_nidaqmx), so
+they don't need a rig:
+    python -m pytest tests
+"""
+
+import os
+import sys
+
+# Never drive the hardware from the tests, also when the rig's environment
+# selects the nidaqmx backend.
+os.environ["GEVIDAQ_DAQ_BACKEND"] = "simulated"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from NIDAQ import simulated_nidaqmx
+from NIDAQ.constants import NiDaqChannels
+
+
+@pytest.fixture
+def simulated_system():
+    """
+    The simulated devices, running 50 times faster than real time, with Vp
+    following patchAO without noise. Everything is reset afterwards.
+    """
+    system = simulated_nidaqmx.system
+    time_scale = system.time_scale
+    channel_LUT = NiDaqChannels().look_up_table
+
+    system.time_scale = 50.0
+    system.set_loopback(
+        channel_LUT["Vp"],
+        simulated_nidaqmx.VoltageFollowerLoopback(channel_LUT["patchAO"], noise=0),
+    )
+    yield system
+
+    system.time_scale = time_scale
+    system.set_default_loopbacks(channel_LUT)
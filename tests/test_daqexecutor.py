@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+from concurrent.futures import CancelledError
+
+import numpy as np
+import pytest
+
+from NIDAQ.DAQoperator import DAQmission
+from NIDAQ.daqexecutor import DAQExecutor, FINISHED, CANCELLED
+
+SAMPLING_RATE = 50000
+
+
+def patch_package(number_of_samples, amplitude=1.0):
+    """
+    Sine on patchAO, recorded back on Vp.
+    """
+    waveform = amplitude * np.sin(np.arange(number_of_samples) / 700.0)
+    analog_signals = np.zeros(
+        1,
+        dtype=[("Waveform", float, (number_of_samples,)), ("Sepcification", "U20")],
+    )
+    analog_signals[0] = (waveform, "patchAO")
+    run_arguments = dict(
+        clock_source="DAQ",
+        sampling_rate=SAMPLING_RATE,
+        analog_signals=analog_signals,
+        digital_signals={},
+        readin_channels=["Vp"],
+    )
+    return waveform, run_arguments
+
+
+@pytest.fixture
+def executor(simulated_system):
+    executor = DAQExecutor()
+    yield executor
+    executor.shutdown()
+
+
+def test_runs_in_submission_order(executor):
+    futures = []
+    waveforms = []
+    for amplitude in (1.0, 2.0, 3.0):
+        waveform, run_arguments = patch_package(20000 + int(amplitude), amplitude)
+        waveforms.append(waveform)
+        futures.append(executor.submit(DAQmission(), run_arguments))
+
+    finished = []
+    for future in futures:
+        future.add_done_callback(lambda future: finished.append(future))
+
+    for future, waveform in zip(futures, waveforms):
+        np.testing.assert_allclose(future.result(timeout=60)[0], waveform)
+        assert future.state == FINISHED
+        assert future.progress() == 1.0
+    assert finished == futures
+
+
+def test_result_is_a_copy_of_the_mission_buffer(executor):
+    mission = DAQmission()
+    waveform, run_arguments = patch_package(10000)
+
+    first = executor.submit(mission, run_arguments).result(timeout=60)
+    expected = first.copy()
+    # The next run of the same mission fills its buffers again.
+    executor.submit(mission, patch_package(10000, 2.0)[1]).result(timeout=60)
+
+    assert first is not mission.get_raw_data()
+    np.testing.assert_array_equal(first, expected)
+
+
+def test_cancel_pending_run(executor):
+    _, long_run = patch_package(500000)
+    running = executor.submit(DAQmission(), long_run)
+    pending = executor.submit(DAQmission(), long_run)
+
+    assert pending.cancel() == True
+    assert pending.cancelled()
+    running.cancel()
+    with pytest.raises(CancelledError):
+        running.result(timeout=60)
+    with pytest.raises(CancelledError):
+        pending.result(timeout=60)
+
+
+def test_cancel_running_acquisition(executor):
+    _, run_arguments = patch_package(2500000)
+    future = executor.submit(DAQmission(), run_arguments)
+    while not future.running():
+        time.sleep(0.01)
+
+    start_time = time.perf_counter()
+    assert future.cancel() == True
+    with pytest.raises(CancelledError):
+        future.result(timeout=60)
+    assert future.state == CANCELLED
+    # 50 s simulated, 1 s at the simulation speed, stopped well before.
+    assert time.perf_counter() - start_time < 0.5
+
+
+def test_cancel_right_before_the_acquisition_starts(executor):
+    mission = DAQmission()
+    run_waveforms = mission.runWaveforms
+    about_to_run = threading.Event()
+
+    def delayed_run_waveforms(**run_arguments):
+        about_to_run.set()
+        time.sleep(0.2)
+        return run_waveforms(**run_arguments)
+
+    mission.runWaveforms = delayed_run_waveforms
+    future = executor.submit(mission, patch_package(10000)[1])
+    about_to_run.wait(timeout=60)
+    future.cancel()
+
+    with pytest.raises(CancelledError):
+        future.result(timeout=60)
+    assert future.state == CANCELLED
+
+
+def test_errors_end_up_in_the_future(executor):
+    _, run_arguments = patch_package(10000)
+    run_arguments["readin_channels"] = ["Vp"]
+    run_arguments["channel_rates"] = {"Vp": 3000}
+
+    future = executor.submit(DAQmission(), run_arguments)
+
+    assert isinstance(future.exception(timeout=60), ValueError)
+    with pytest.raises(ValueError):
+        future.result()
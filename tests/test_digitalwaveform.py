@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+from NIDAQ.constants import NiDaqChannels
+from NIDAQ.digitalwaveform import (
+    DigitalEdgeWaveform,
+    DigitalEdgeWaveforms,
+    load_waveforms_file,
+)
+from NIDAQ.waveformcompiler import compile_waveforms
+
+
+def dense_port(digital_array, line_numbers):
+    # The way the port waveform is packed from full bool arrays.
+    port = np.zeros(digital_array["Waveform"].shape[1], dtype=np.uint32)
+    for waveform, line_number in zip(digital_array["Waveform"], line_numbers):
+        port |= waveform.astype(np.uint32) << np.uint32(line_number)
+    return port
+
+
+def random_lines(seed, number_of_lines=4, length=5000):
+    rng = np.random.default_rng(seed)
+    lines = []
+    for _ in range(number_of_lines):
+        edges = np.unique(rng.integers(1, length, size=rng.integers(0, 40)))
+        lines.append(DigitalEdgeWaveform(length, edges, rng.random() < 0.5))
+    # Toggles of several lines on the same sample.
+    lines.append(DigitalEdgeWaveform(length, lines[0].edges, True))
+    return lines
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_pack_port_matches_structured_array(seed):
+    lines = random_lines(seed)
+    line_numbers = [0, 3, 7, 12, 31]
+    waveforms = DigitalEdgeWaveforms(lines, ["line"] * len(lines))
+
+    np.testing.assert_array_equal(
+        waveforms.pack_port(line_numbers),
+        dense_port(waveforms.to_structured_array(), line_numbers),
+    )
+
+
+def test_pack_port_without_edges():
+    waveforms = DigitalEdgeWaveforms(
+        [DigitalEdgeWaveform(10, (), True), DigitalEdgeWaveform(10)],
+        ["LED", "cameratrigger"],
+    )
+    port = waveforms.pack_port([2, 4])
+
+    assert port.dtype == np.uint32
+    np.testing.assert_array_equal(port, np.full(10, 4, dtype=np.uint32))
+
+
+def test_structured_array_round_trip():
+    lines = random_lines(7)
+    specifications = ["cameratrigger", "blankingall", "LED", "DMD_trigger", "PMT"]
+    waveforms = DigitalEdgeWaveforms(lines, specifications)
+
+    digital_array = waveforms.to_structured_array()
+    round_trip = DigitalEdgeWaveforms.from_structured_array(digital_array)
+
+    assert round_trip.specifications == specifications
+    assert round_trip.waveforms == lines
+    for i, line in enumerate(lines):
+        np.testing.assert_array_equal(waveforms["Waveform"][i], line.to_array())
+        np.testing.assert_array_equal(
+            DigitalEdgeWaveform.from_array(line.to_array()).edges, line.edges
+        )
+
+
+def test_lines_of_different_length_are_refused():
+    with pytest.raises(ValueError):
+        DigitalEdgeWaveforms(
+            [DigitalEdgeWaveform(10), DigitalEdgeWaveform(11)], ["LED", "PMT"]
+        )
+
+
+def test_resize_and_append():
+    line = DigitalEdgeWaveform.from_runs([False, True, False], [3, 2, 5])
+    dense = line.to_array()
+
+    np.testing.assert_array_equal(line.resized(4).to_array(), dense[:4])
+    np.testing.assert_array_equal(
+        line.resized(14).to_array(), np.append(dense, np.zeros(4, dtype=bool))
+    )
+
+    other = DigitalEdgeWaveform.from_array([True, True, False])
+    np.testing.assert_array_equal(
+        line.append(other).to_array(), np.append(dense, other.to_array())
+    )
+
+
+def test_compiled_edge_lists_match_structured_array():
+    channel_LUT = NiDaqChannels().look_up_table
+    length = 4000
+    lines = random_lines(3, number_of_lines=3, length=length)[:3]
+    specifications = ["cameratrigger", "blankingall", "LED"]
+    edge_waveforms = DigitalEdgeWaveforms(lines, specifications)
+
+    analog_signals = np.zeros(
+        1, dtype=[("Waveform", float, (length,)), ("Sepcification", "U20")]
+    )
+    analog_signals[0] = (np.linspace(0, 1, length), "galvosx")
+
+    from_edges = compile_waveforms(analog_signals, edge_waveforms, channel_LUT)
+    from_array = compile_waveforms(
+        analog_signals, edge_waveforms.to_structured_array(), channel_LUT
+    )
+
+    np.testing.assert_array_equal(
+        from_edges.Digital_samples, from_array.Digital_samples
+    )
+
+
+def test_saved_edge_lists_load_as_structured_array(tmp_path):
+    lines = random_lines(11, number_of_lines=2, length=1000)[:2]
+    waveforms = DigitalEdgeWaveforms(lines, ["LED", "cameratrigger"])
+    file_path = str(tmp_path / "waveforms.npy")
+    waveforms.save(file_path)
+
+    loaded = DigitalEdgeWaveforms.load(file_path)
+    assert loaded.waveforms == lines
+
+    for record, line in zip(load_waveforms_file(file_path), lines):
+        np.testing.assert_array_equal(record["Waveform"], line.to_array())
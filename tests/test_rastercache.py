@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+import os
+
+import numpy as np
+
+from NIDAQ.rastercache import RasterCache
+from NIDAQ.wavegenerator import waveRecPic
+
+RASTER_SETTINGS = dict(
+    sampleRate=100000,
+    imAngle=0,
+    voltXMin=-2,
+    voltXMax=2,
+    voltYMin=-2,
+    voltYMax=2,
+    xPixels=64,
+    yPixels=32,
+    sawtooth=True,
+)
+
+
+def test_raster_matches_waveRecPic():
+    raster = RasterCache(directory=None).get(**RASTER_SETTINGS)
+    samples_X, samples_Y = waveRecPic(**RASTER_SETTINGS)
+
+    np.testing.assert_array_equal(raster.samples_X, samples_X)
+    np.testing.assert_array_equal(raster.samples_Y, samples_Y)
+    assert raster.frame_sample_number == len(samples_X)
+    assert raster.line_sample_number * 32 == len(samples_X)
+
+    galvo_samples = raster.galvo_samples(3)
+    assert galvo_samples.shape == (2, 3 * len(samples_X))
+    # The repeated frames are kept for the next scan.
+    assert raster.galvo_samples(3) is galvo_samples
+
+
+def test_memory_hits_and_eviction():
+    cache = RasterCache(maxsize=2, directory=None)
+    raster = cache.get(**RASTER_SETTINGS)
+
+    assert cache.get(**RASTER_SETTINGS) is raster
+    assert (cache.memory_hits, cache.misses) == (1, 1)
+
+    cache.get(**dict(RASTER_SETTINGS, xPixels=32))
+    cache.get(**dict(RASTER_SETTINGS, voltXMax=3))
+    assert len(cache) == 2
+    assert cache.get(**RASTER_SETTINGS) is not raster
+    assert cache.misses == 4
+
+
+def test_disk_store_survives_a_new_cache(tmp_path):
+    directory = str(tmp_path)
+    raster = RasterCache(directory=directory).get(**RASTER_SETTINGS)
+
+    cache = RasterCache(directory=directory)
+    loaded = cache.get(**RASTER_SETTINGS)
+
+    assert (cache.disk_hits, cache.misses) == (1, 0)
+    assert isinstance(loaded.samples, np.memmap)
+    np.testing.assert_array_equal(loaded.samples, raster.samples)
+
+    cache.clear(disk=True)
+    assert len(cache) == 0
+    assert os.listdir(directory) == []
+
+
+def test_unreadable_file_is_generated_again(tmp_path):
+    directory = str(tmp_path)
+    cache = RasterCache(directory=directory)
+    key = cache.raster_key(*RASTER_SETTINGS.values())
+    with open(os.path.join(directory, "raster_" + key + ".npy"), "wb") as file:
+        file.write(b"not a raster")
+
+    raster = cache.get(**RASTER_SETTINGS)
+
+    assert cache.misses == 1
+    np.testing.assert_array_equal(raster.samples_X, waveRecPic(**RASTER_SETTINGS)[0])
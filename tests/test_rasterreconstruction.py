@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+from NIDAQ.rastercache import RasterWaveforms
+from NIDAQ.rasterreconstruction import RasterReconstruction
+
+LINE_SAMPLES = 12
+Y_PIXELS = 5
+AVERAGE_NUMBER = 3
+FRAME_SAMPLES = LINE_SAMPLES * Y_PIXELS
+
+
+def index_array(image_number, offset=7, gap=11):
+    # Like WaveformGenerator's PMT_data_index_array_repeated: 0 for the
+    # offset and gap samples, i + 1 for the samples of image i.
+    parts = [np.zeros(offset, dtype=int)]
+    for i in range(image_number):
+        parts.append(np.full(FRAME_SAMPLES * AVERAGE_NUMBER, i + 1))
+        parts.append(np.zeros(gap, dtype=int))
+    return np.concatenate(parts)
+
+
+def reference_images(data, index_array, image_number):
+    # The way the waveform widget reconstructed the images before.
+    images = []
+    for i in range(image_number):
+        samples = data[np.where(index_array == i + 1)]
+        average = np.mean(samples.reshape(AVERAGE_NUMBER, -1), axis=0)
+        images.append(average.reshape(Y_PIXELS, LINE_SAMPLES))
+    return np.array(images)
+
+
+def test_index_array_layout_matches_reference():
+    indices = index_array(4)
+    data = np.random.default_rng(0).standard_normal(len(indices) + 1)
+
+    reconstruction = RasterReconstruction.from_index_array(
+        indices, LINE_SAMPLES, Y_PIXELS, AVERAGE_NUMBER
+    )
+
+    assert reconstruction.image_number == 4
+    assert reconstruction.image_stride == FRAME_SAMPLES * AVERAGE_NUMBER + 11
+    np.testing.assert_allclose(
+        reconstruction.reconstruct(data), reference_images(data, indices, 4)
+    )
+
+
+def test_raster_layout_matches_index_array():
+    raster = RasterWaveforms(np.zeros((2, FRAME_SAMPLES)), LINE_SAMPLES, Y_PIXELS)
+    from_raster = RasterReconstruction.from_raster(
+        raster, AVERAGE_NUMBER, repeat_number=4, offset_samples=7, gap_samples=11
+    )
+    from_indices = RasterReconstruction.from_index_array(
+        index_array(4), LINE_SAMPLES, Y_PIXELS, AVERAGE_NUMBER
+    )
+
+    np.testing.assert_array_equal(from_raster.image_starts, from_indices.image_starts)
+
+
+def test_unevenly_spaced_images():
+    image_starts = [0, 200, 500]
+    data = np.random.default_rng(1).standard_normal(700)
+    reconstruction = RasterReconstruction(
+        LINE_SAMPLES, Y_PIXELS, AVERAGE_NUMBER, image_starts
+    )
+
+    assert reconstruction.image_stride is None
+    images = reconstruction.reconstruct(data)
+    for index, start in enumerate(image_starts):
+        frames = data[start : start + FRAME_SAMPLES * AVERAGE_NUMBER]
+        expected = frames.reshape(AVERAGE_NUMBER, Y_PIXELS, LINE_SAMPLES).mean(axis=0)
+        np.testing.assert_allclose(images[index], expected)
+        np.testing.assert_allclose(
+            reconstruction.reconstruct_image(data, index), expected
+        )
+
+
+def test_channels_polarity_and_x_slice():
+    indices = index_array(2)
+    data = np.random.default_rng(2).standard_normal((2, len(indices)))
+    reconstruction = RasterReconstruction.from_index_array(
+        indices,
+        LINE_SAMPLES,
+        Y_PIXELS,
+        AVERAGE_NUMBER,
+        x_slice=slice(2, 10),
+        polarity=-1,
+    )
+
+    images = reconstruction.reconstruct(data)
+
+    assert images.shape == (2, 2, Y_PIXELS, 8)
+    for channel in range(2):
+        expected = -reference_images(data[channel], indices, 2)[..., 2:10]
+        np.testing.assert_allclose(images[channel], expected)
+
+
+def test_line_averaging():
+    data = np.random.default_rng(3).standard_normal(FRAME_SAMPLES * 2)
+    reconstruction = RasterReconstruction(
+        LINE_SAMPLES, Y_PIXELS, line_average_number=2
+    )
+
+    expected = data.reshape(Y_PIXELS, 2, LINE_SAMPLES).mean(axis=1)
+    np.testing.assert_allclose(reconstruction.reconstruct(data)[0], expected)
+
+
+def test_bidirectional_lines_are_read_backwards():
+    # Each line scans 8 pixels and turns around in 4 samples. The signal
+    # lags 2 samples behind the command.
+    x_pixels, phase_offset = 8, 2
+    image = np.arange(Y_PIXELS * x_pixels, dtype=float).reshape(Y_PIXELS, x_pixels)
+    lines = []
+    for line_number, line in enumerate(image):
+        if line_number % 2 == 1:
+            line = line[::-1]
+        lines.append(np.concatenate((line, np.full(4, -1.0))))
+    data = np.concatenate([np.full(phase_offset, -1.0)] + lines + [np.zeros(4)])
+
+    reconstruction = RasterReconstruction(
+        LINE_SAMPLES,
+        Y_PIXELS,
+        bidirectional=True,
+        xPixels=x_pixels,
+        phase_offset=phase_offset,
+    )
+
+    np.testing.assert_array_equal(reconstruction.reconstruct_image(data), image)
+
+
+def test_layout_errors():
+    with pytest.raises(ValueError):
+        RasterReconstruction(LINE_SAMPLES, Y_PIXELS, image_starts=[0]).reconstruct(
+            np.zeros(FRAME_SAMPLES - 1)
+        )
+    with pytest.raises(ValueError):
+        # Image runs of two frames, not three.
+        RasterReconstruction.from_index_array(
+            np.repeat([0, 1, 0], [5, FRAME_SAMPLES * 2, 5]),
+            LINE_SAMPLES,
+            Y_PIXELS,
+            AVERAGE_NUMBER,
+        )
+    with pytest.raises(ValueError):
+        RasterReconstruction(
+            LINE_SAMPLES, Y_PIXELS, bidirectional=True, xPixels=8, phase_offset=5
+        )
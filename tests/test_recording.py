@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+from NIDAQ.recording import (
+    LEGACY_HEADER_LENGTH,
+    RECORDING_FILE_EXTENSION,
+    RecordingFile,
+    RecordingWriter,
+    is_recording_file,
+    load_recorded_channel,
+)
+
+
+@pytest.fixture
+def recording_path(tmp_path):
+    """
+    PMT at 1 kHz in 10 chunks written out of order, Vp at 100 Hz as raw
+    counts with scaling coefficients.
+    """
+    file_path = str(tmp_path / ("run" + RECORDING_FILE_EXTENSION))
+    writer = RecordingWriter(
+        file_path,
+        ["PMT", "Vp"],
+        [1000, 100],
+        [1000, 100],
+        dtype=["float64", "int16"],
+        scaling_coeff={"Vp": [0.5, 0.01]},
+        metadata={"clock_source": "DAQ"},
+    )
+    pmt = np.arange(1000, dtype=np.float64)
+    for start in range(900, -1, -100):
+        writer.write("PMT", pmt[start : start + 100], start_index=start)
+    writer.write("Vp", np.arange(100, dtype=np.int16))
+    writer.close(metadata={"finish_time": "now"})
+    return file_path
+
+
+def test_header_and_whole_channels(recording_path):
+    assert is_recording_file(recording_path)
+
+    with RecordingFile(recording_path) as recording:
+        assert "PMT" in recording and "Ip" not in recording
+        assert recording.sampling_rate("Vp") == 100
+        assert recording.duration("PMT") == 1.0
+        assert recording.header["metadata"] == {
+            "clock_source": "DAQ",
+            "finish_time": "now",
+        }
+        # The PMT is stored as recorded, the polarity is applied on reading.
+        np.testing.assert_array_equal(recording.raw("PMT"), np.arange(1000))
+        np.testing.assert_array_equal(recording["PMT"], -np.arange(1000))
+        np.testing.assert_allclose(recording["Vp"], 0.5 + 0.01 * np.arange(100))
+
+
+def test_time_range_reads(recording_path):
+    with RecordingFile(recording_path) as recording:
+        np.testing.assert_array_equal(
+            recording.channel("PMT", start_time=0.25, stop_time=0.5),
+            -np.arange(250, 500),
+        )
+        np.testing.assert_array_equal(
+            recording.time_axis("PMT", start_time=0.25, stop_time=0.5),
+            np.arange(250, 500) / 1000,
+        )
+        # The same time range of the slower channel.
+        np.testing.assert_allclose(
+            recording.channel("Vp", start_time=0.25, stop_time=0.5),
+            0.5 + 0.01 * np.arange(25, 50),
+        )
+        # Ranges are clipped to the recording.
+        assert recording.sample_range("PMT", -1.0, 0.0015) == (0, 2)
+        assert recording.sample_range("PMT", 0.9995, 5.0) == (1000, 1000)
+        assert recording.sample_range("PMT", 0.5, 0.25) == (500, 500)
+
+
+def test_writes_outside_the_channel_are_refused(tmp_path):
+    writer = RecordingWriter(
+        str(tmp_path / ("short" + RECORDING_FILE_EXTENSION)), ["Vp"], [100], [10]
+    )
+    with pytest.raises(ValueError):
+        writer.write("Vp", np.zeros(5), start_index=6)
+    writer.close()
+
+
+def test_load_recorded_channel_from_recording_file(recording_path):
+    data, sampling_rate = load_recorded_channel(recording_path, "Vp")
+
+    assert sampling_rate == 100
+    np.testing.assert_allclose(data, 0.5 + 0.01 * np.arange(100))
+
+
+def test_load_recorded_channel_from_legacy_npy(tmp_path):
+    # Old Vp and Ip files: sampling rate, four scaling coefficients, samples.
+    samples = np.linspace(-0.07, 0.03, 50)
+    file_path = str(tmp_path / "Vp2020-01-01_12-00-00.npy")
+    np.save(file_path, np.concatenate(([25000.0, 0, 1, 0, 0], samples)))
+    assert LEGACY_HEADER_LENGTH == 5
+    assert not is_recording_file(file_path)
+
+    data, sampling_rate = load_recorded_channel(file_path, "Vp")
+
+    assert sampling_rate == 25000.0
+    np.testing.assert_array_equal(data, samples)
+
+
+@pytest.mark.parametrize("unscaled", [False, True])
+def test_saved_run_reads_back_in_volts(simulated_system, tmp_path, unscaled):
+    from NIDAQ.DAQoperator import DAQmission
+
+    waveform = np.sin(np.arange(20000) / 300.0)
+    analog_signals = np.zeros(
+        1, dtype=[("Waveform", float, (20000,)), ("Sepcification", "U20")]
+    )
+    analog_signals[0] = (waveform, "patchAO")
+    mission = DAQmission()
+    mission.runWaveforms(
+        "DAQ", 50000, analog_signals, {}, ["Vp"], unscaled=unscaled
+    )
+
+    file_path = mission.save_as_binary(str(tmp_path))
+    data, sampling_rate = load_recorded_channel(file_path, "Vp")
+
+    assert sampling_rate == 50000
+    np.testing.assert_allclose(data, waveform, atol=1e-3)
+    with RecordingFile(file_path) as recording:
+        assert recording.header["metadata"]["unscaled"] == unscaled
+        assert recording.header["waveforms"][0]["specification"] == "patchAO"
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+from NIDAQ.DAQoperator import DAQmission
+from NIDAQ.staticoutput import default_static_output
+from NIDAQ.taskpool import DAQTaskPool, release_pools
+
+SAMPLING_RATE = 10000
+LENGTH = 5000
+
+
+def package(amplitude=1.0):
+    """
+    A ramp on patchAO (Dev2, recorded back on Vp), the galvo x (Dev1) and the
+    LED line on /Dev1/port0.
+    """
+    ramp = amplitude * np.linspace(0, 1, LENGTH)
+    analog_signals = np.zeros(
+        2, dtype=[("Waveform", float, (LENGTH,)), ("Sepcification", "U20")]
+    )
+    analog_signals[0] = (ramp, "patchAO")
+    analog_signals[1] = (ramp / 2, "galvosx")
+    digital_signals = np.zeros(
+        1, dtype=[("Waveform", bool, (LENGTH,)), ("Sepcification", "U20")]
+    )
+    digital_signals[0] = (np.arange(LENGTH) % 100 < 50, "LED")
+    return ramp, analog_signals, digital_signals
+
+
+@pytest.fixture
+def pool(simulated_system):
+    pool = DAQTaskPool(verbose=False)
+    yield pool
+    pool.close()
+    default_static_output.release()
+
+
+def run(mission, pool, analog_signals, digital_signals):
+    mission.runWaveforms(
+        "DAQ", SAMPLING_RATE, analog_signals, digital_signals, ["Vp"], task_pool=pool
+    )
+    return mission.get_raw_data()[0].copy()
+
+
+def test_pooled_runs_match_unpooled_runs(pool):
+    ramp, analog_signals, digital_signals = package()
+    mission = DAQmission()
+
+    mission.runWaveforms("DAQ", SAMPLING_RATE, analog_signals, digital_signals, ["Vp"])
+    unpooled = mission.get_raw_data()[0].copy()
+
+    # Dev2 has no start trigger in the pool either, it is started again for
+    # every run and follows the read-in clock each time.
+    for _ in range(3):
+        np.testing.assert_allclose(
+            run(mission, pool, analog_signals, digital_signals), unpooled
+        )
+    np.testing.assert_allclose(unpooled, ramp)
+
+
+def test_tasks_and_buffers_are_reused(pool):
+    ramp, analog_signals, digital_signals = package()
+    mission = DAQmission()
+
+    run(mission, pool, analog_signals, digital_signals)
+    run(mission, pool, analog_signals, digital_signals)
+    first, second = pool.latency_reports
+
+    assert first["reconfigured"] == True
+    assert sorted(first["rewritten"]) == ["analog_dev1", "analog_dev2", "digital"]
+    assert second["reconfigured"] == False
+    assert second["rewritten"] == []
+
+    # A new package only rewrites the buffers.
+    doubled, analog_signals, digital_signals = package(amplitude=2.0)
+    np.testing.assert_allclose(
+        run(mission, pool, analog_signals, digital_signals), doubled
+    )
+    assert pool.latency_reports[-1]["reconfigured"] == False
+    assert "analog_dev2" in pool.latency_reports[-1]["rewritten"]
+
+    summary = pool.latency_summary()
+    assert (summary["runs"], summary["cold_runs"], summary["reused_runs"]) == (3, 1, 2)
+
+
+def test_single_value_writes_release_idle_pools(pool):
+    _, analog_signals, digital_signals = package()
+    mission = DAQmission()
+    run(mission, pool, analog_signals, digital_signals)
+    assert "Dev1/port0" in pool.physical_channels()
+
+    # The pool only holds Dev1/port0, Dev1/ao0, Dev2/ao2 and the read-in.
+    default_static_output.write_analog("Dev1/ao3", 0.0)
+    assert pool.tasks != {}
+
+    default_static_output.write_digital("Dev1/port0/line4", True)
+    assert pool.tasks == {}
+
+    # The next run sets the tasks up again.
+    ramp, analog_signals, digital_signals = package()
+    np.testing.assert_allclose(
+        run(mission, pool, analog_signals, digital_signals), ramp
+    )
+
+
+def test_release_pools_by_channel(pool):
+    _, analog_signals, digital_signals = package()
+    run(DAQmission(), pool, analog_signals, digital_signals)
+
+    release_pools("Dev2/ao0")
+    assert pool.tasks != {}
+    release_pools("/Dev2/ao1:2")
+    assert pool.tasks == {}
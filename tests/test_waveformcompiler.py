@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+from NIDAQ.constants import NiDaqChannels
+from NIDAQ.waveformcompiler import (
+    WaveformCache,
+    compile_waveforms,
+    find_common_period,
+    waveform_package_key,
+)
+
+CHANNEL_LUT = NiDaqChannels().look_up_table
+
+
+def package(length=6000, period=None, amplitude=1.0):
+    if period is None:
+        galvo = np.linspace(0, amplitude, length)
+    else:
+        galvo = amplitude * np.tile(np.linspace(0, 1, period), length // period)
+    analog_signals = np.zeros(
+        2, dtype=[("Waveform", float, (length,)), ("Sepcification", "U20")]
+    )
+    analog_signals[0] = (galvo, "galvosx")
+    analog_signals[1] = (np.zeros(length), "patchAO")
+    digital_signals = np.zeros(
+        1, dtype=[("Waveform", bool, (length,)), ("Sepcification", "U20")]
+    )
+    digital_signals[0] = (np.arange(length) % 1500 < 100, "cameratrigger")
+    return analog_signals, digital_signals
+
+
+def test_same_content_hits_the_cache():
+    cache = WaveformCache()
+    compiled = cache.get(*package(), CHANNEL_LUT)
+    # A new package with the same content, like at every screening coordinate.
+    again = cache.get(*package(), CHANNEL_LUT)
+
+    assert again is compiled
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert compiled.key in cache
+
+    cache.get(*package(amplitude=2.0), CHANNEL_LUT)
+    assert (cache.hits, cache.misses) == (1, 2)
+    assert len(cache) == 2
+
+
+def test_least_recently_used_package_is_dropped():
+    cache = WaveformCache(maxsize=2)
+    first = cache.get(*package(amplitude=1.0), CHANNEL_LUT)
+    second = cache.get(*package(amplitude=2.0), CHANNEL_LUT)
+    cache.get(*package(amplitude=1.0), CHANNEL_LUT)
+    cache.get(*package(amplitude=3.0), CHANNEL_LUT)
+
+    assert first.key in cache
+    assert second.key not in cache
+    assert len(cache) == 2
+
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_size_limit_keeps_the_newest_package():
+    cache = WaveformCache(max_bytes=1)
+    compiled = cache.get(*package(), CHANNEL_LUT)
+
+    assert len(cache) == 1 and compiled.key in cache
+
+
+def test_key_follows_content_and_channels():
+    analog_signals, digital_signals = package()
+    key = waveform_package_key(analog_signals, digital_signals, CHANNEL_LUT)
+
+    changed = analog_signals.copy()
+    changed["Waveform"][0, 100] += 1e-9
+    assert waveform_package_key(changed, digital_signals, CHANNEL_LUT) != key
+
+    channel_LUT = dict(CHANNEL_LUT, galvosx="Dev1/ao3")
+    assert waveform_package_key(analog_signals, digital_signals, channel_LUT) != key
+
+
+def test_compiled_buffers():
+    analog_signals, digital_signals = package()
+    compiled = compile_waveforms(analog_signals, digital_signals, CHANNEL_LUT)
+
+    assert compiled.Dev1_analog_channel_list == [CHANNEL_LUT["galvosx"]]
+    assert compiled.Dev2_analog_channel_list == [CHANNEL_LUT["patchAO"]]
+    assert compiled.Dev1_analog_samples.flags["C_CONTIGUOUS"]
+    np.testing.assert_array_equal(
+        compiled.Dev1_analog_samples[0], analog_signals["Waveform"][0]
+    )
+
+    line = CHANNEL_LUT["cameratrigger"]
+    line_number = int(line[line.index("line") + 4 :])
+    np.testing.assert_array_equal(
+        compiled.Digital_samples[0],
+        digital_signals["Waveform"][0].astype(np.uint32) << line_number,
+    )
+    assert compiled.Period_length is None
+
+
+def test_periodic_package_keeps_one_period():
+    analog_signals, digital_signals = package(period=1500)
+    compiled = compile_waveforms(analog_signals, digital_signals, CHANNEL_LUT)
+
+    assert compiled.Period_length == 1500
+    assert compiled.Waveforms_length == 6000
+    assert compiled.Dev1_analog_samples.shape == (1, 1500)
+    assert compiled.Digital_samples.shape == (1, 1500)
+
+
+def test_find_common_period():
+    period = np.sin(np.arange(2000) / 50.0)
+    assert find_common_period([np.tile(period, 5)[np.newaxis]]) == 2000
+    assert find_common_period([np.arange(10000.0)[np.newaxis]]) is None
+    # Short periods are regenerated in blocks of at least 1000 samples.
+    assert find_common_period([np.tile(period[:10], 1000)[np.newaxis]]) == 1000
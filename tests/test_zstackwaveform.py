@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+from GalvoWidget.zstackwaveform import ZStackWaveforms
+from NIDAQ.DAQoperator import DAQmission
+from NIDAQ.constants import NiDaqChannels
+from NIDAQ.rastercache import RasterCache
+from NIDAQ.simulated_nidaqmx import PMTLoopback
+
+SAMPLING_RATE = 100000
+Z_POSITIONS = np.linspace(1.0, 1.01, 4)
+
+
+@pytest.fixture(scope="module")
+def raster():
+    return RasterCache(directory=None).get(
+        sampleRate=SAMPLING_RATE,
+        imAngle=0,
+        voltXMin=-2,
+        voltXMax=2,
+        voltYMin=-2,
+        voltYMax=2,
+        xPixels=40,
+        yPixels=40,
+        sawtooth=True,
+    )
+
+
+def make_stack(raster, mode):
+    return ZStackWaveforms(
+        raster,
+        SAMPLING_RATE,
+        Z_POSITIONS,
+        average_number=2,
+        mode=mode,
+        settle_time=0.002,
+        volt_per_mm=100.0,
+        offset_volt=1.0,
+    )
+
+
+@pytest.mark.parametrize("mode", ["staircase", "trigger"])
+def test_planes_are_separated_by_the_settle_time(raster, mode):
+    stack = make_stack(raster, mode)
+    plane_samples = 2 * raster.frame_sample_number
+
+    assert stack.settle_sample_number == 200
+    np.testing.assert_array_equal(
+        stack.plane_starts, 200 + np.arange(4) * (plane_samples + 200)
+    )
+    assert stack.total_sample_number == stack.plane_starts[-1] + plane_samples
+    assert stack.galvo_samples.shape == (2, stack.total_sample_number)
+
+    # The frames of each plane, the galvos held at the start in between.
+    for start in stack.plane_starts:
+        np.testing.assert_array_equal(
+            stack.galvo_samples[:, start : start + plane_samples],
+            raster.galvo_samples(2),
+        )
+        np.testing.assert_array_equal(
+            stack.galvo_samples[:, start - 200 : start],
+            np.repeat(raster.samples[:, :1], 200, axis=1),
+        )
+
+
+def test_staircase_steps_at_the_settle_time(raster):
+    stack = make_stack(raster, "staircase")
+    plane_volts = 1.0 + 100.0 * (Z_POSITIONS - Z_POSITIONS[0])
+
+    for plane, start in enumerate(stack.plane_starts):
+        settle_start = start - stack.settle_sample_number
+        np.testing.assert_allclose(
+            stack.objective_samples[settle_start : start + 1], plane_volts[plane]
+        )
+    assert stack.digital_signals() == {}
+    assert list(stack.analog_signals()["Sepcification"]) == [
+        "galvosx",
+        "galvosy",
+        "objectiveAO",
+    ]
+
+
+def test_ramp_has_no_gaps(raster):
+    stack = make_stack(raster, "ramp")
+    plane_samples = 2 * raster.frame_sample_number
+    centres = stack.plane_starts + plane_samples / 2
+
+    assert stack.gap_sample_number == 0
+    assert stack.total_sample_number == 200 + 4 * plane_samples
+    sample_index = np.arange(stack.total_sample_number)
+    np.testing.assert_allclose(
+        np.interp(centres, sample_index, stack.objective_samples),
+        1.0 + 100.0 * (Z_POSITIONS - Z_POSITIONS[0]),
+    )
+    # Held at the start of the ramp while the objective settles.
+    assert np.all(stack.objective_samples[:200] == stack.objective_samples[200])
+
+
+def test_trigger_pulses_before_each_next_plane(raster):
+    stack = make_stack(raster, "trigger")
+    trigger = stack.digital_signals()
+
+    assert list(trigger["Sepcification"]) == ["objectivetrigger"]
+    assert "objectiveAO" not in stack.analog_signals()["Sepcification"]
+    settle_starts = stack.plane_starts[1:] - stack.settle_sample_number
+    np.testing.assert_array_equal(
+        trigger.waveforms[0].edges,
+        np.column_stack((settle_starts, settle_starts + 10)).ravel(),
+    )
+
+
+def test_unknown_mode_is_refused(raster):
+    with pytest.raises(ValueError):
+        ZStackWaveforms(raster, SAMPLING_RATE, Z_POSITIONS, mode="spiral")
+
+
+@pytest.mark.parametrize("mode", ["staircase", "ramp", "trigger"])
+def test_stack_in_one_run(simulated_system, raster, mode):
+    # A sample that doesn't depend on the focus, so all planes are the same.
+    channel_LUT = NiDaqChannels().look_up_table
+    sample = np.add.outer(np.arange(200.0), np.arange(200.0)) / 400
+    for channel, image in (("PMT", sample), ("PMT2", sample[::-1])):
+        simulated_system.set_loopback(
+            channel_LUT[channel],
+            PMTLoopback(
+                channel_LUT["galvosx"], channel_LUT["galvosy"], image=image, noise=0
+            ),
+        )
+
+    stack = make_stack(raster, mode)
+    mission = DAQmission()
+    mission.runWaveforms(
+        "DAQ",
+        SAMPLING_RATE,
+        stack.analog_signals(),
+        stack.digital_signals(),
+        ["PMT", "PMT2"],
+    )
+    data = mission.get_scaled_data()
+
+    planes = stack.reconstruction(polarity=-1).reconstruct(data)
+
+    assert planes.shape == (2, 4, 40, raster.line_sample_number)
+    assert not np.allclose(planes[0, 0], planes[1, 0])
+    for channel_planes in planes:
+        assert np.std(channel_planes[0]) > 0
+        for plane in channel_planes[1:]:
+            np.testing.assert_allclose(plane, channel_planes[0])